@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Availability, Appointment, AppointmentResource, Break
+from .models import Availability, Appointment, AppointmentChange, AppointmentResource, Break
 
 
 @admin.register(Availability)
@@ -77,6 +77,9 @@ class BreakAdmin(admin.ModelAdmin):
         ('Дополнительно', {
             'fields': ('note', 'is_recurring')
         }),
+        ('Повторение', {
+            'fields': ('recurrence_weekdays', 'recurrence_until', 'recurrence_exceptions')
+        }),
         ('Мета', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -84,3 +87,11 @@ class BreakAdmin(admin.ModelAdmin):
     )
     readonly_fields = ['created_at', 'updated_at']
 
+
+
+@admin.register(AppointmentChange)
+class AppointmentChangeAdmin(admin.ModelAdmin):
+    list_display = ['branch', 'seq', 'event_type', 'appointment_id', 'created_at']
+    list_filter = ['branch', 'event_type']
+    search_fields = ['appointment_id']
+    readonly_fields = ['branch', 'seq', 'appointment_id', 'event_type', 'data', 'created_at']
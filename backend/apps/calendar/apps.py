@@ -5,4 +5,7 @@ class CalendarConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.calendar'
     verbose_name = 'Calendar'
+    
+    def ready(self):
+        import apps.calendar.signals  # noqa
 
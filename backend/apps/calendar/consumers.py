@@ -75,6 +75,15 @@ class CalendarConsumer(AsyncWebsocketConsumer):
         """
         await self.send(text_data=json.dumps(event['data']))
     
+    async def appointments_changed(self, event):
+        """
+        Send a batch of appointment events (one message per transaction)
+        """
+        await self.send(text_data=json.dumps({
+            'type': 'appointments_changed',
+            'events': event['events']
+        }))
+    
     @database_sync_to_async
     def check_branch_access(self):
         """
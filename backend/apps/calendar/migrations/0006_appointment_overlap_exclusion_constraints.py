@@ -0,0 +1,94 @@
+# Generated manually: DB-level protection against double booking
+#
+# Migration state does not know about Appointment.employee/room (they were
+# created outside of migrations), so the constraint SQL is written by hand
+# and the Django constraints are only added to the state.
+#
+# Existing overlapping active appointments must be resolved before applying.
+
+import apps.calendar.models
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+EMPLOYEE_CONSTRAINT_SQL = """
+ALTER TABLE appointments ADD CONSTRAINT appointments_employee_no_overlap
+EXCLUDE USING gist (
+    TSTZRANGE(start_datetime, end_datetime, '[)') WITH &&,
+    employee_id WITH =
+) WHERE (NOT (status IN ('canceled', 'no_show')));
+"""
+
+ROOM_CONSTRAINT_SQL = """
+ALTER TABLE appointments ADD CONSTRAINT appointments_room_no_overlap
+EXCLUDE USING gist (
+    TSTZRANGE(start_datetime, end_datetime, '[)') WITH &&,
+    room_id WITH =
+) WHERE (room_id IS NOT NULL AND NOT (status IN ('canceled', 'no_show')));
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("calendar", "0005_fix_appointment_resource_fields"),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    EMPLOYEE_CONSTRAINT_SQL,
+                    reverse_sql="ALTER TABLE appointments DROP CONSTRAINT appointments_employee_no_overlap;",
+                ),
+                migrations.RunSQL(
+                    ROOM_CONSTRAINT_SQL,
+                    reverse_sql="ALTER TABLE appointments DROP CONSTRAINT appointments_room_no_overlap;",
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name="appointment",
+                    constraint=django.contrib.postgres.constraints.ExclusionConstraint(
+                        condition=models.Q(("status__in", ["canceled", "no_show"]), _negated=True),
+                        expressions=[
+                            (
+                                apps.calendar.models.TsTzRange(
+                                    "start_datetime",
+                                    "end_datetime",
+                                    django.contrib.postgres.fields.ranges.RangeBoundary(),
+                                ),
+                                "&&",
+                            ),
+                            ("employee", "="),
+                        ],
+                        name="appointments_employee_no_overlap",
+                    ),
+                ),
+                migrations.AddConstraint(
+                    model_name="appointment",
+                    constraint=django.contrib.postgres.constraints.ExclusionConstraint(
+                        condition=models.Q(
+                            ("room__isnull", False),
+                            models.Q(("status__in", ["canceled", "no_show"]), _negated=True),
+                        ),
+                        expressions=[
+                            (
+                                apps.calendar.models.TsTzRange(
+                                    "start_datetime",
+                                    "end_datetime",
+                                    django.contrib.postgres.fields.ranges.RangeBoundary(),
+                                ),
+                                "&&",
+                            ),
+                            ("room", "="),
+                        ],
+                        name="appointments_room_no_overlap",
+                    ),
+                ),
+            ],
+        ),
+    ]
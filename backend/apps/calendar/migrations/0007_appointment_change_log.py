@@ -0,0 +1,46 @@
+# Generated manually: per-branch appointment change log for calendar delta sync
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('org', '0001_initial'),
+        ('calendar', '0006_appointment_overlap_exclusion_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarChangeSequence',
+            fields=[
+                ('branch', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='calendar_sequence', serialize=False, to='org.branch')),
+                ('last_seq', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Calendar Change Sequence',
+                'verbose_name_plural': 'Calendar Change Sequences',
+                'db_table': 'calendar_change_sequences',
+            },
+        ),
+        migrations.CreateModel(
+            name='AppointmentChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('appointment_id', models.BigIntegerField()),
+                ('event_type', models.CharField(max_length=50)),
+                ('data', models.JSONField(blank=True, help_text='Appointment snapshot, empty for deletes', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_changes', to='org.branch')),
+            ],
+            options={
+                'verbose_name': 'Appointment Change',
+                'verbose_name_plural': 'Appointment Changes',
+                'db_table': 'appointment_changes',
+                'ordering': ['branch', 'seq'],
+                'unique_together': {('branch', 'seq')},
+            },
+        ),
+    ]
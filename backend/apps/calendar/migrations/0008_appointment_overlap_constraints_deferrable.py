@@ -0,0 +1,105 @@
+# Generated manually: make the overlap exclusion constraints DEFERRABLE
+#
+# Non-deferrable exclusion constraints are checked row by row, so a single
+# UPDATE shifting several appointments of one doctor (bulk move) fails on
+# intermediate states. DEFERRABLE INITIALLY IMMEDIATE constraints are
+# checked at the end of each statement. PostgreSQL cannot ALTER an
+# exclusion constraint, so both are recreated.
+
+import apps.calendar.models
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.db import migrations, models
+
+
+def constraint_sql(name, resource, where, deferrable):
+    return f"""
+ALTER TABLE appointments DROP CONSTRAINT {name};
+ALTER TABLE appointments ADD CONSTRAINT {name}
+EXCLUDE USING gist (
+    TSTZRANGE(start_datetime, end_datetime, '[)') WITH &&,
+    {resource} WITH =
+) WHERE ({where}){' DEFERRABLE INITIALLY IMMEDIATE' if deferrable else ''};
+"""
+
+
+EMPLOYEE = (
+    'appointments_employee_no_overlap',
+    'employee_id',
+    "NOT (status IN ('canceled', 'no_show'))",
+)
+ROOM = (
+    'appointments_room_no_overlap',
+    'room_id',
+    "room_id IS NOT NULL AND NOT (status IN ('canceled', 'no_show'))",
+)
+
+
+def exclusion_constraint(name, resource, condition):
+    return django.contrib.postgres.constraints.ExclusionConstraint(
+        condition=condition,
+        deferrable=models.Deferrable.IMMEDIATE,
+        expressions=[
+            (
+                apps.calendar.models.TsTzRange(
+                    "start_datetime",
+                    "end_datetime",
+                    django.contrib.postgres.fields.ranges.RangeBoundary(),
+                ),
+                "&&",
+            ),
+            (resource, "="),
+        ],
+        name=name,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("calendar", "0007_appointment_change_log"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    constraint_sql(*EMPLOYEE, deferrable=True),
+                    reverse_sql=constraint_sql(*EMPLOYEE, deferrable=False),
+                ),
+                migrations.RunSQL(
+                    constraint_sql(*ROOM, deferrable=True),
+                    reverse_sql=constraint_sql(*ROOM, deferrable=False),
+                ),
+            ],
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name="appointment",
+                    name="appointments_employee_no_overlap",
+                ),
+                migrations.RemoveConstraint(
+                    model_name="appointment",
+                    name="appointments_room_no_overlap",
+                ),
+                migrations.AddConstraint(
+                    model_name="appointment",
+                    constraint=exclusion_constraint(
+                        "appointments_employee_no_overlap",
+                        "employee",
+                        models.Q(("status__in", ["canceled", "no_show"]), _negated=True),
+                    ),
+                ),
+                migrations.AddConstraint(
+                    model_name="appointment",
+                    constraint=exclusion_constraint(
+                        "appointments_room_no_overlap",
+                        "room",
+                        models.Q(
+                            ("room__isnull", False),
+                            models.Q(("status__in", ["canceled", "no_show"]), _negated=True),
+                        ),
+                    ),
+                ),
+            ],
+        ),
+    ]
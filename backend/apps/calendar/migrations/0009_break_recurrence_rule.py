@@ -0,0 +1,102 @@
+# Generated manually: store recurring breaks as one row per series
+#
+# Legacy recurring breaks were copied into one row per day. Runs of
+# consecutive days with the same employee, type, time and note are
+# collapsed into a single row: date = first day, recurrence_until = last.
+
+from datetime import timedelta
+from itertools import groupby
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+SERIES_FIELDS = ('employee_id', 'break_type', 'start_time', 'end_time', 'note')
+
+# Days materialized for open-ended series when migrating backwards
+LEGACY_DAYS = 30
+
+
+def collapse_recurring_breaks(apps, schema_editor):
+    Break = apps.get_model('calendar', 'Break')
+
+    rows = Break.objects.filter(is_recurring=True).order_by(
+        *SERIES_FIELDS, 'date', 'id'
+    ).values_list('id', 'date', *SERIES_FIELDS)
+
+    redundant_ids = []
+    for _, group in groupby(rows.iterator(), key=lambda row: row[2:]):
+        run = []
+        for row in group:
+            if run and row[1] - run[-1][1] > timedelta(days=1):
+                redundant_ids.extend(_collapse(Break, run))
+                run = []
+            if run and row[1] == run[-1][1]:
+                # Duplicate day
+                redundant_ids.append(row[0])
+                continue
+            run.append(row)
+        redundant_ids.extend(_collapse(Break, run))
+
+    for offset in range(0, len(redundant_ids), 1000):
+        Break.objects.filter(id__in=redundant_ids[offset:offset + 1000]).delete()
+
+
+def _collapse(Break, run):
+    """Keep the first row of a run of consecutive days, return the rest"""
+    Break.objects.filter(id=run[0][0]).update(recurrence_until=run[-1][1])
+    return [row[0] for row in run[1:]]
+
+
+def expand_recurring_breaks(apps, schema_editor):
+    Break = apps.get_model('calendar', 'Break')
+
+    new_rows = []
+    for series in Break.objects.filter(is_recurring=True).iterator():
+        until = series.recurrence_until or series.date + timedelta(days=LEGACY_DAYS)
+        day = series.date + timedelta(days=1)
+        while day <= until:
+            weekday_ok = not series.recurrence_weekdays or day.weekday() in series.recurrence_weekdays
+            if weekday_ok and day not in series.recurrence_exceptions:
+                new_rows.append(Break(
+                    employee_id=series.employee_id,
+                    break_type=series.break_type,
+                    date=day,
+                    start_time=series.start_time,
+                    end_time=series.end_time,
+                    note=series.note,
+                    is_recurring=True
+                ))
+            day += timedelta(days=1)
+
+    Break.objects.bulk_create(new_rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0008_appointment_overlap_constraints_deferrable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='break',
+            name='recurrence_weekdays',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, help_text='Дни недели (0=Пн, 6=Вс); пусто - каждый день', size=None),
+        ),
+        migrations.AddField(
+            model_name='break',
+            name='recurrence_until',
+            field=models.DateField(blank=True, help_text='Последний день повторения; пусто - бессрочно', null=True),
+        ),
+        migrations.AddField(
+            model_name='break',
+            name='recurrence_exceptions',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.DateField(), blank=True, default=list, help_text='Даты, в которые перерыва нет', size=None),
+        ),
+        migrations.AddIndex(
+            model_name='break',
+            index=models.Index(condition=models.Q(('is_recurring', True)), fields=['employee', 'recurrence_until'], name='breaks_recurring_idx'),
+        ),
+        migrations.RunPython(collapse_recurring_breaks, expand_recurring_breaks),
+    ]
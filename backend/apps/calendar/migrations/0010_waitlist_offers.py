@@ -0,0 +1,48 @@
+# Generated manually: waitlist slot offers and partial indexes for the matcher
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('org', '0001_initial'),
+        ('staff', '0001_initial'),
+        ('calendar', '0009_break_recurrence_rule'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='waitlist',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['employee', '-priority', 'created_at'], name='waitlist_waiting_employee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlist',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['-priority', 'created_at'], name='waitlist_waiting_rank_idx'),
+        ),
+        migrations.CreateModel(
+            name='WaitlistOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_datetime', models.DateTimeField()),
+                ('end_datetime', models.DateTimeField()),
+                ('released_appointment_id', models.BigIntegerField(blank=True, null=True)),
+                ('rank', models.IntegerField(default=0, help_text='Место в очереди на этот слот (0 = первый)')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает ответа'), ('accepted', 'Принято'), ('declined', 'Отклонено'), ('expired', 'Истекло')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_offers', to='org.branch')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_offers', to='staff.employee')),
+                ('waitlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offers', to='calendar.waitlist')),
+            ],
+            options={
+                'verbose_name': 'Waitlist Offer',
+                'verbose_name_plural': 'Waitlist Offers',
+                'db_table': 'waitlist_offers',
+                'ordering': ['start_datetime', 'rank'],
+                'unique_together': {('waitlist', 'employee', 'start_datetime')},
+                'indexes': [models.Index(fields=['branch', 'status', 'start_datetime'], name='waitlist_of_branch__5f5240_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated manually: covering index for the occupancy heatmap
+#
+# Migration state does not know about Appointment.employee/room, so the
+# index SQL is written by hand and the Django index is only added to the state.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0010_waitlist_offers'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE INDEX appointments_occupancy_idx ON appointments '
+                    '(branch_id, start_datetime) INCLUDE (employee_id, room_id, end_datetime, status);',
+                    reverse_sql='DROP INDEX appointments_occupancy_idx;',
+                ),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='appointment',
+                    index=models.Index(fields=['branch', 'start_datetime'], include=['employee', 'room', 'end_datetime', 'status'], name='appointments_occupancy_idx'),
+                ),
+            ],
+        ),
+    ]
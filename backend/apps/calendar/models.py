@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Deferrable, Func, Q
 from django.core.exceptions import ValidationError
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import ArrayField, DateTimeRangeField, RangeBoundary, RangeOperators
 from apps.org.models import Branch, Room
 from apps.staff.models import Employee
 from apps.patients.models import Patient
@@ -52,9 +55,21 @@ class Availability(models.Model):
             raise ValidationError('Time from must be before time to')
 
 
+class TsTzRange(Func):
+    """
+    tstzrange(start, end, '[)') for exclusion constraints
+    """
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
 class Appointment(models.Model):
     """
     Appointment/Booking model
+    
+    Overlaps of active appointments for the same employee or room are
+    rejected by PostgreSQL exclusion constraints (btree_gist); save()
+    translates violations into ValidationError.
     """
     STATUS_CHOICES = [
         ('draft', 'Черновик'),
@@ -66,6 +81,15 @@ class Appointment(models.Model):
         ('canceled', 'Отменено'),
     ]
     
+    EMPLOYEE_OVERLAP_CONSTRAINT = 'appointments_employee_no_overlap'
+    ROOM_OVERLAP_CONSTRAINT = 'appointments_room_no_overlap'
+    
+    # constraint name -> (error code, message)
+    OVERLAP_ERRORS = {
+        EMPLOYEE_OVERLAP_CONSTRAINT: ('employee_overlap', 'Employee has overlapping appointments'),
+        ROOM_OVERLAP_CONSTRAINT: ('room_overlap', 'Room is already booked for this time'),
+    }
+    
     branch = models.ForeignKey(
         Branch,
         on_delete=models.CASCADE,
@@ -123,15 +147,69 @@ class Appointment(models.Model):
             models.Index(fields=['employee', 'start_datetime']),
             models.Index(fields=['patient', 'start_datetime']),
             models.Index(fields=['status', 'start_datetime']),
+            # Index-only scans for the occupancy heatmap aggregates
+            models.Index(
+                fields=['branch', 'start_datetime'],
+                include=['employee', 'room', 'end_datetime', 'status'],
+                name='appointments_occupancy_idx'
+            ),
+        ]
+        constraints = [
+            ExclusionConstraint(
+                name='appointments_employee_no_overlap',
+                expressions=[
+                    (TsTzRange('start_datetime', 'end_datetime', RangeBoundary()), RangeOperators.OVERLAPS),
+                    ('employee', RangeOperators.EQUAL),
+                ],
+                condition=~Q(status__in=['canceled', 'no_show']),
+                # Checked at statement end, so bulk updates may shift rows past each other
+                deferrable=Deferrable.IMMEDIATE,
+            ),
+            ExclusionConstraint(
+                name='appointments_room_no_overlap',
+                expressions=[
+                    (TsTzRange('start_datetime', 'end_datetime', RangeBoundary()), RangeOperators.OVERLAPS),
+                    ('room', RangeOperators.EQUAL),
+                ],
+                condition=Q(room__isnull=False) & ~Q(status__in=['canceled', 'no_show']),
+                # Checked at statement end, so bulk updates may shift rows past each other
+                deferrable=Deferrable.IMMEDIATE,
+            ),
         ]
     
     def __str__(self):
         return f"{self.patient.full_name} - {self.employee.full_name} ({self.start_datetime})"
     
+    def save(self, *args, **kwargs):
+        # Savepoint keeps the outer transaction usable after a violation
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError as exc:
+            error = self.overlap_error(exc)
+            if error is None:
+                raise
+            code, message = error
+            raise ValidationError(message, code=code) from exc
+    
+    @classmethod
+    def overlap_error(cls, exc):
+        """
+        Return (code, message) if IntegrityError is an overlap constraint violation
+        """
+        diag = getattr(exc.__cause__, 'diag', None)
+        constraint_name = getattr(diag, 'constraint_name', None) or str(exc)
+        for name, error in cls.OVERLAP_ERRORS.items():
+            if name in constraint_name:
+                return error
+        return None
+    
     def clean(self):
         if self.start_datetime >= self.end_datetime:
             raise ValidationError('Start time must be before end time')
         
+        # Overlaps are enforced by the database; these checks only give
+        # admin forms a friendly error before save
         # Check for overlapping appointments for the same employee
         overlapping = Appointment.objects.filter(
             employee=self.employee,
@@ -279,12 +357,73 @@ class Waitlist(models.Model):
         indexes = [
             models.Index(fields=['patient', 'status']),
             models.Index(fields=['status', 'preferred_date']),
+            # Ranked lookups of waiting entries by the slot matcher
+            models.Index(
+                fields=['employee', '-priority', 'created_at'],
+                condition=Q(status='waiting'),
+                name='waitlist_waiting_employee_idx'
+            ),
+            models.Index(
+                fields=['-priority', 'created_at'],
+                condition=Q(status='waiting'),
+                name='waitlist_waiting_rank_idx'
+            ),
         ]
     
     def __str__(self):
         return f"{self.patient.full_name} - {self.get_status_display()}"
 
 
+class WaitlistOffer(models.Model):
+    """
+    Freed slot offered to a waitlist entry by the matcher
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает ответа'),
+        ('accepted', 'Принято'),
+        ('declined', 'Отклонено'),
+        ('expired', 'Истекло'),
+    ]
+    
+    waitlist = models.ForeignKey(
+        Waitlist,
+        on_delete=models.CASCADE,
+        related_name='offers'
+    )
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        related_name='waitlist_offers'
+    )
+    employee = models.ForeignKey(
+        Employee,
+        on_delete=models.CASCADE,
+        related_name='waitlist_offers'
+    )
+    start_datetime = models.DateTimeField()
+    end_datetime = models.DateTimeField()
+    # Plain id: the released appointment may be deleted
+    released_appointment_id = models.BigIntegerField(null=True, blank=True)
+    rank = models.IntegerField(default=0, help_text='Место в очереди на этот слот (0 = первый)')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'waitlist_offers'
+        verbose_name = 'Waitlist Offer'
+        verbose_name_plural = 'Waitlist Offers'
+        ordering = ['start_datetime', 'rank']
+        unique_together = ['waitlist', 'employee', 'start_datetime']
+        indexes = [
+            models.Index(fields=['branch', 'status', 'start_datetime']),
+        ]
+    
+    def __str__(self):
+        return f"{self.waitlist.patient.full_name} - {self.start_datetime} ({self.get_status_display()})"
+
+
 class Break(models.Model):
     """
     Employee breaks in schedule (lunch, meeting, etc.)
@@ -311,8 +450,25 @@ class Break(models.Model):
     # Details
     note = models.TextField(blank=True, help_text='Примечание к перерыву')
     
-    # Recurring break
+    # Recurring break: one row per series, date is the first occurrence
     is_recurring = models.BooleanField(default=False, help_text='Повторяется каждый день')
+    recurrence_weekdays = ArrayField(
+        models.IntegerField(),
+        default=list,
+        blank=True,
+        help_text='Дни недели (0=Пн, 6=Вс); пусто - каждый день'
+    )
+    recurrence_until = models.DateField(
+        null=True,
+        blank=True,
+        help_text='Последний день повторения; пусто - бессрочно'
+    )
+    recurrence_exceptions = ArrayField(
+        models.DateField(),
+        default=list,
+        blank=True,
+        help_text='Даты, в которые перерыва нет'
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -325,6 +481,11 @@ class Break(models.Model):
         indexes = [
             models.Index(fields=['employee', 'date']),
             models.Index(fields=['date', 'start_time']),
+            models.Index(
+                fields=['employee', 'recurrence_until'],
+                condition=Q(is_recurring=True),
+                name='breaks_recurring_idx'
+            ),
         ]
     
     def __str__(self):
@@ -334,13 +495,60 @@ class Break(models.Model):
         if self.start_time >= self.end_time:
             raise ValidationError('Start time must be before end time')
         
-        # Check for overlapping breaks for the same employee on the same date
-        overlapping = Break.objects.filter(
-            employee=self.employee,
-            date=self.date,
-            start_time__lt=self.end_time,
-            end_time__gt=self.start_time
-        ).exclude(id=self.id)
+        # Check for overlapping breaks over the whole recurring series
+        from apps.calendar.services import breaks
         
-        if overlapping.exists():
-            raise ValidationError('Employee has overlapping breaks on this date')
\ No newline at end of file
+        overlap = breaks.overlap_date(self, Break.objects.filter(employee=self.employee).exclude(id=self.id))
+        if overlap:
+            raise ValidationError(f'Employee has overlapping breaks on {overlap.isoformat()}')
+
+
+class CalendarChangeSequence(models.Model):
+    """
+    Last issued calendar change sequence number per branch
+    """
+    branch = models.OneToOneField(
+        Branch,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='calendar_sequence'
+    )
+    last_seq = models.BigIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'calendar_change_sequences'
+        verbose_name = 'Calendar Change Sequence'
+        verbose_name_plural = 'Calendar Change Sequences'
+    
+    def __str__(self):
+        return f"{self.branch.name} - {self.last_seq}"
+
+
+class AppointmentChange(models.Model):
+    """
+    Per-branch log of appointment mutations for calendar delta sync
+    
+    seq is contiguous within a branch, so clients can detect missed
+    WebSocket events and fetch only the gap.
+    """
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        related_name='appointment_changes'
+    )
+    seq = models.BigIntegerField()
+    # Plain id: the appointment may already be deleted
+    appointment_id = models.BigIntegerField()
+    event_type = models.CharField(max_length=50)
+    data = models.JSONField(null=True, blank=True, help_text='Appointment snapshot, empty for deletes')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        db_table = 'appointment_changes'
+        verbose_name = 'Appointment Change'
+        verbose_name_plural = 'Appointment Changes'
+        ordering = ['branch', 'seq']
+        unique_together = ['branch', 'seq']
+    
+    def __str__(self):
+        return f"{self.branch_id}#{self.seq} {self.event_type} ({self.appointment_id})"
@@ -1,5 +1,7 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from .models import Availability, Appointment, AppointmentResource, Waitlist, Break
+from .models import Availability, Appointment, AppointmentResource, Waitlist, WaitlistOffer, Break
+from apps.core.serializers import SparseFieldsetMixin
 from apps.staff.serializers import EmployeeListSerializer
 from apps.patients.serializers import PatientListSerializer
 from datetime import datetime, timedelta
@@ -48,6 +50,12 @@ class AppointmentSerializer(serializers.ModelSerializer):
     duration_minutes = serializers.IntegerField(read_only=True)
     color = serializers.CharField(read_only=True)
     allocated_resources = AppointmentResourceSerializer(many=True, read_only=True)
+    # Resources to allocate (replaces current allocations on update)
+    resource_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True,
+        required=False
+    )
     
     # Visit information
     has_visit = serializers.SerializerMethodField()
@@ -62,7 +70,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'start_datetime', 'end_datetime', 'duration_minutes',
             'status', 'status_display', 'is_primary', 'is_urgent',
             'note', 'cancellation_reason', 'color',
-            'allocated_resources',
+            'allocated_resources', 'resource_ids',
             'has_visit', 'visit_id', 'visit_status',
             'created_by', 'created_at', 'updated_at'
         ]
@@ -84,55 +92,85 @@ class AppointmentSerializer(serializers.ModelSerializer):
         """
         Validate appointment times and conflicts
         """
-        start = attrs.get('start_datetime')
-        end = attrs.get('end_datetime')
-        employee = attrs.get('employee')
-        room = attrs.get('room')
+        # A partial update is checked against the stored other end
+        start = attrs.get('start_datetime', getattr(self.instance, 'start_datetime', None))
+        end = attrs.get('end_datetime', getattr(self.instance, 'end_datetime', None))
         
         # Validate times
         if start and end and start >= end:
             raise serializers.ValidationError('Start time must be before end time')
         
-        # Check employee conflicts
-        if employee and start and end:
-            instance_id = self.instance.id if self.instance else None
-            overlapping = Appointment.objects.filter(
-                employee=employee,
-                start_datetime__lt=end,
-                end_datetime__gt=start
-            ).exclude(status__in=['canceled', 'no_show'])
-            
-            if instance_id:
-                overlapping = overlapping.exclude(id=instance_id)
-            
-            if overlapping.exists():
-                raise serializers.ValidationError(
-                    'Employee has overlapping appointments at this time'
-                )
+        # Employee/room overlaps are enforced by database exclusion
+        # constraints on save, see create() and update()
         
-        # Check room conflicts
-        if room and start and end:
-            instance_id = self.instance.id if self.instance else None
-            overlapping = Appointment.objects.filter(
-                room=room,
-                start_datetime__lt=end,
-                end_datetime__gt=start
-            ).exclude(status__in=['canceled', 'no_show'])
-            
-            if instance_id:
-                overlapping = overlapping.exclude(id=instance_id)
+        # Resources: one capacity pass for all requested and allocated resources
+        resource_ids = attrs.get('resource_ids')
+        if resource_ids is None and self.instance and ('start_datetime' in attrs or 'end_datetime' in attrs):
+            resource_ids = list(self.instance.allocated_resources.values_list('resource_id', flat=True))
+        
+        if resource_ids:
+            from .services import capacity
             
-            if overlapping.exists():
-                raise serializers.ValidationError(
-                    'Room is already booked at this time'
-                )
+            conflicts = capacity.booking_conflicts(
+                start, end,
+                resource_ids=resource_ids,
+                exclude_appointment_id=self.instance.id if self.instance else None
+            )
+            if conflicts:
+                raise serializers.ValidationError({
+                    'resource_ids': [
+                        f"Resource {conflict['id']} is already booked at this time"
+                        for conflict in conflicts
+                    ]
+                })
         
         return attrs
+    
+    # Overlap constraint error code -> API message
+    OVERLAP_MESSAGES = {
+        'employee_overlap': 'Employee has overlapping appointments at this time',
+        'room_overlap': 'Room is already booked at this time',
+    }
+    
+    def _save_translating_overlaps(self, save, *args):
+        try:
+            return save(*args)
+        except DjangoValidationError as exc:
+            message = self.OVERLAP_MESSAGES.get(exc.code)
+            if message is None:
+                raise
+            raise serializers.ValidationError(message, code=exc.code)
+    
+    def create(self, validated_data):
+        resource_ids = validated_data.pop('resource_ids', None)
+        appointment = self._save_translating_overlaps(super().create, validated_data)
+        self._allocate_resources(appointment, resource_ids)
+        return appointment
+    
+    def update(self, instance, validated_data):
+        resource_ids = validated_data.pop('resource_ids', None)
+        appointment = self._save_translating_overlaps(super().update, instance, validated_data)
+        self._allocate_resources(appointment, resource_ids)
+        return appointment
+    
+    def _allocate_resources(self, appointment, resource_ids):
+        if resource_ids is None:
+            return
+        
+        appointment.allocated_resources.exclude(resource_id__in=resource_ids).delete()
+        existing = set(appointment.allocated_resources.values_list('resource_id', flat=True))
+        AppointmentResource.objects.bulk_create([
+            AppointmentResource(appointment=appointment, resource_id=resource_id)
+            for resource_id in dict.fromkeys(resource_ids)
+            if resource_id not in existing
+        ])
 
 
-class AppointmentListSerializer(serializers.ModelSerializer):
+class AppointmentListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Simplified appointment serializer for calendar views
+    
+    Supports ?fields= to return only some of the fields.
     """
     employee_name = serializers.CharField(source='employee.full_name', read_only=True)
     patient_name = serializers.CharField(source='patient.full_name', read_only=True)
@@ -185,6 +223,56 @@ class AppointmentMoveSerializer(serializers.Serializer):
         return attrs
 
 
+class AppointmentBulkSerializer(serializers.Serializer):
+    """
+    Base serializer for bulk appointment operations
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        min_length=1,
+        max_length=500
+    )
+    
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
+class AppointmentBulkMoveSerializer(AppointmentBulkSerializer):
+    """
+    Shift appointments by offset_minutes and/or reassign them to another employee
+    """
+    offset_minutes = serializers.IntegerField(required=False, default=0)
+    employee_id = serializers.IntegerField(required=False)
+    
+    def validate_employee_id(self, value):
+        from apps.staff.models import Employee
+        
+        if not Employee.objects.filter(id=value).exists():
+            raise serializers.ValidationError('Employee not found')
+        return value
+    
+    def validate(self, attrs):
+        if not attrs['offset_minutes'] and not attrs.get('employee_id'):
+            raise serializers.ValidationError('offset_minutes or employee_id is required')
+        
+        return attrs
+
+
+class AppointmentBulkStatusSerializer(AppointmentBulkSerializer):
+    """
+    Set one status on many appointments
+    """
+    status = serializers.ChoiceField(choices=Appointment.STATUS_CHOICES)
+    cancellation_reason = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class AppointmentBulkCancelSerializer(AppointmentBulkSerializer):
+    """
+    Cancel many appointments with one reason
+    """
+    cancellation_reason = serializers.CharField(required=False, allow_blank=True, default='')
+
+
 class WaitlistSerializer(serializers.ModelSerializer):
     """
     Waitlist serializer for patient waiting list (Sprint 2)
@@ -211,18 +299,47 @@ class WaitlistSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
+class WaitlistOfferSerializer(serializers.ModelSerializer):
+    """
+    Freed slot offered to a waitlist entry
+    """
+    patient = serializers.IntegerField(source='waitlist.patient_id', read_only=True)
+    patient_name = serializers.CharField(source='waitlist.patient.full_name', read_only=True)
+    patient_phone = serializers.CharField(source='waitlist.patient.phone', read_only=True)
+    employee_name = serializers.CharField(source='employee.full_name', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = WaitlistOffer
+        fields = [
+            'id', 'waitlist', 'patient', 'patient_name', 'patient_phone',
+            'branch', 'employee', 'employee_name', 'start_datetime', 'end_datetime',
+            'released_appointment_id', 'rank', 'status', 'status_display',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
 class BreakSerializer(serializers.ModelSerializer):
     """
     Break serializer for employee breaks/lunch/meetings
+    
+    A recurring break is stored once; list responses with a date range
+    contain its occurrences (same id, occurrence date).
     """
     employee_name = serializers.CharField(source='employee.full_name', read_only=True)
     break_type_display = serializers.CharField(source='get_break_type_display', read_only=True)
+    recurrence_weekdays = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=6),
+        required=False
+    )
     
     class Meta:
         model = Break
         fields = [
             'id', 'employee', 'employee_name', 'break_type', 'break_type_display',
             'date', 'start_time', 'end_time', 'note', 'is_recurring',
+            'recurrence_weekdays', 'recurrence_until', 'recurrence_exceptions',
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
@@ -231,71 +348,39 @@ class BreakSerializer(serializers.ModelSerializer):
         """
         Validate break times and conflicts
         """
+        from .services import breaks
+        
         start_time = attrs.get('start_time')
         end_time = attrs.get('end_time')
-        employee = attrs.get('employee')
         date = attrs.get('date')
+        recurrence_until = attrs.get('recurrence_until')
         
         # Validate times
         if start_time and end_time and start_time >= end_time:
             raise serializers.ValidationError('Start time must be before end time')
         
-        # Check for overlapping breaks
-        if employee and date and start_time and end_time:
-            instance_id = self.instance.id if self.instance else None
-            overlapping = Break.objects.filter(
-                employee=employee,
-                date=date,
-                start_time__lt=end_time,
-                end_time__gt=start_time
-            )
-            
-            if instance_id:
-                overlapping = overlapping.exclude(id=instance_id)
+        if date and recurrence_until and recurrence_until < date:
+            raise serializers.ValidationError('recurrence_until must not be before date')
+        
+        # Check for overlapping breaks (one-off and recurring) over the whole series
+        fields = ['employee', 'date', 'start_time', 'end_time', 'is_recurring',
+                  'recurrence_weekdays', 'recurrence_until', 'recurrence_exceptions']
+        proposed = Break(**{
+            field: attrs[field] if field in attrs else getattr(self.instance, field)
+            for field in fields
+            if field in attrs or self.instance
+        })
+        
+        if proposed.employee_id and proposed.date and proposed.start_time and proposed.end_time:
+            others = Break.objects.filter(employee=proposed.employee_id)
+            if self.instance:
+                others = others.exclude(id=self.instance.id)
             
-            if overlapping.exists():
+            overlap = breaks.overlap_date(proposed, others)
+            if overlap:
                 raise serializers.ValidationError(
-                    'Employee has overlapping breaks on this date'
+                    f'Employee has overlapping breaks on {overlap.isoformat()}'
                 )
         
         return attrs
-    
-    def create(self, validated_data):
-        """
-        Create break(s) - if recurring, create for multiple days
-        """
-        is_recurring = validated_data.pop('is_recurring', False)
-        
-        # Create the main break
-        break_obj = Break.objects.create(is_recurring=is_recurring, **validated_data)
-        
-        # If recurring, create for next 30 days
-        if is_recurring:
-            base_date = validated_data['date']
-            employee = validated_data['employee']
-            start_time = validated_data['start_time']
-            end_time = validated_data['end_time']
-            break_type = validated_data['break_type']
-            note = validated_data.get('note', '')
-            
-            for i in range(1, 31):
-                future_date = base_date + timedelta(days=i)
-                # Check if break doesn't exist on this date
-                if not Break.objects.filter(
-                    employee=employee,
-                    date=future_date,
-                    start_time=start_time,
-                    end_time=end_time
-                ).exists():
-                    Break.objects.create(
-                        employee=employee,
-                        break_type=break_type,
-                        date=future_date,
-                        start_time=start_time,
-                        end_time=end_time,
-                        note=note,
-                        is_recurring=True
-                    )
-        
-        return break_obj
 
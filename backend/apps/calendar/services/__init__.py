@@ -0,0 +1,3 @@
+"""
+Calendar services
+"""
@@ -0,0 +1,124 @@
+"""
+Recurring break expansion
+
+A recurring break is one row: date is the first occurrence, optionally
+limited to recurrence_weekdays, ending at recurrence_until (open-ended
+when empty) and skipping recurrence_exceptions. Occurrences are expanded
+in memory only for the requested window.
+"""
+import copy
+from datetime import date, timedelta
+
+from django.db.models import Q
+
+
+def in_range(queryset, date_from, date_to):
+    """
+    Filter breaks having at least one possible occurrence in [date_from, date_to]
+    """
+    return queryset.filter(
+        Q(is_recurring=False, date__gte=date_from, date__lte=date_to) |
+        (
+            Q(is_recurring=True, date__lte=date_to) &
+            (Q(recurrence_until__isnull=True) | Q(recurrence_until__gte=date_from))
+        )
+    )
+
+
+def occurrence_dates(start_date, is_recurring, weekdays, until, exceptions, date_from, date_to):
+    """
+    Dates of a break (given by its fields) within [date_from, date_to]
+    """
+    if not is_recurring:
+        return [start_date] if date_from <= start_date <= date_to else []
+
+    first = max(start_date, date_from)
+    last = min(until, date_to) if until else date_to
+    weekdays = set(weekdays or [])
+    exceptions = set(exceptions or [])
+
+    dates = []
+    day = first
+    while day <= last:
+        if (not weekdays or day.weekday() in weekdays) and day not in exceptions:
+            dates.append(day)
+        day += timedelta(days=1)
+    return dates
+
+
+def occurs_on(break_obj, day):
+    return bool(occurrence_dates(
+        break_obj.date, break_obj.is_recurring, break_obj.recurrence_weekdays,
+        break_obj.recurrence_until, break_obj.recurrence_exceptions, day, day
+    ))
+
+
+def shared_date(first, second):
+    """
+    First date both breaks occur on, None when they never do
+
+    Past the last exception of either series both repeat weekly, so open
+    ended series are only walked for one more week after it.
+    """
+    if not first.is_recurring:
+        return first.date if occurs_on(second, first.date) else None
+    if not second.is_recurring:
+        return second.date if occurs_on(first, second.date) else None
+
+    date_from = max(first.date, second.date)
+    horizon = max([date_from, *first.recurrence_exceptions, *second.recurrence_exceptions]) + timedelta(days=6)
+    date_to = min(day for day in (first.recurrence_until, second.recurrence_until, horizon) if day)
+
+    for day in occurrence_dates(
+        first.date, True, first.recurrence_weekdays, first.recurrence_until,
+        first.recurrence_exceptions, date_from, date_to
+    ):
+        if occurs_on(second, day):
+            return day
+    return None
+
+
+def overlap_date(break_obj, others):
+    """
+    First date break_obj overlaps one of others (a Break queryset), or None
+
+    Recurring breaks are checked over the whole series, against one-off
+    breaks on any of its dates and series starting later.
+    """
+    if break_obj.is_recurring:
+        last = break_obj.recurrence_until or date.max
+    else:
+        last = break_obj.date
+
+    candidates = in_range(
+        others.filter(start_time__lt=break_obj.end_time, end_time__gt=break_obj.start_time),
+        break_obj.date,
+        last
+    )
+    dates = [day for day in (shared_date(break_obj, other) for other in candidates) if day]
+    return min(dates, default=None)
+
+
+def expand(break_objs, date_from, date_to):
+    """
+    One Break instance per occurrence in the window, ordered by date and time
+
+    Occurrences of a recurring break are unsaved copies of it with date set
+    to the occurrence date; id still points to the stored series.
+    """
+    occurrences = []
+    for break_obj in break_objs:
+        dates = occurrence_dates(
+            break_obj.date, break_obj.is_recurring, break_obj.recurrence_weekdays,
+            break_obj.recurrence_until, break_obj.recurrence_exceptions, date_from, date_to
+        )
+        for day in dates:
+            if day == break_obj.date:
+                occurrences.append(break_obj)
+                continue
+            occurrence = copy.copy(break_obj)
+            occurrence.date = day
+            occurrences.append(occurrence)
+
+    occurrences.sort(key=lambda b: (b.date, b.start_time))
+    return occurrences
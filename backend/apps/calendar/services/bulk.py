@@ -0,0 +1,216 @@
+"""
+Bulk appointment operations
+
+Changes are applied to in-memory instances first, checked for employee and
+room overlaps in one set-based pass (one query for the surrounding
+appointments, then a sorted sweep per resource), checked against the
+capacity timeline of their allocated resources, and written with a single
+bulk_update. Visits, cache invalidation, one batched calendar event and a
+patient stats refresh (bulk_update sends no post_save) follow in the same
+transaction.
+"""
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.calendar.models import Appointment, AppointmentResource
+from apps.calendar.services import capacity, events, schedule_cache
+from apps.calendar.services.slots import INACTIVE_STATUSES
+from apps.patients import stats as patient_stats
+
+
+# Upper bound for one bulk request
+MAX_APPOINTMENTS = 500
+
+# Statuses that get a Visit, same as AppointmentViewSet.perform_update
+VISIT_STATUSES = ['in_progress', 'done']
+
+
+def find_conflicts(appointments):
+    """
+    Return overlaps of changed appointments with each other and the rest
+
+    Each conflict is a dict with appointment id, conflicting id and
+    code (employee_overlap / room_overlap).
+    """
+    active = [a for a in appointments if a.status not in INACTIVE_STATUSES]
+    if not active:
+        return []
+
+    changed_ids = {a.id for a in appointments}
+    employee_ids = {a.employee_id for a in active}
+    room_ids = {a.room_id for a in active if a.room_id}
+
+    resource_filter = Q(employee_id__in=employee_ids)
+    if room_ids:
+        resource_filter |= Q(room_id__in=room_ids)
+
+    others = Appointment.objects.filter(
+        resource_filter,
+        start_datetime__lt=max(a.end_datetime for a in active),
+        end_datetime__gt=min(a.start_datetime for a in active)
+    ).exclude(
+        id__in=changed_ids
+    ).exclude(
+        status__in=INACTIVE_STATUSES
+    ).values_list('id', 'employee_id', 'room_id', 'start_datetime', 'end_datetime')
+
+    intervals = [
+        (a.id, a.employee_id, a.room_id, a.start_datetime, a.end_datetime) for a in active
+    ] + list(others)
+
+    by_resource = defaultdict(list)
+    for appointment_id, employee_id, room_id, start, end in intervals:
+        if employee_id in employee_ids:
+            by_resource[('employee', employee_id)].append((start, end, appointment_id))
+        if room_id in room_ids:
+            by_resource[('room', room_id)].append((start, end, appointment_id))
+
+    conflicts = []
+    for (kind, _), items in by_resource.items():
+        items.sort()
+        # Interval ending last among those seen so far
+        last_end, last_id = None, None
+        for start, end, appointment_id in items:
+            if last_end is not None and start < last_end:
+                if appointment_id in changed_ids or last_id in changed_ids:
+                    changed, other = (appointment_id, last_id) if appointment_id in changed_ids else (last_id, appointment_id)
+                    conflicts.append({
+                        'appointment': changed,
+                        'conflicts_with': other,
+                        'code': f'{kind}_overlap'
+                    })
+            if last_end is None or end > last_end:
+                last_end, last_id = end, appointment_id
+
+    return conflicts
+
+
+def resource_conflicts(appointments):
+    """
+    Return allocated resources booked twice after the changes
+
+    One capacity timeline over the span of the batch holds the other
+    bookings of its resources; each changed appointment is checked against
+    it and then added, so the batch cannot double-book among itself either.
+    Each conflict is a dict with appointment id, resource id and code.
+    """
+    active = {a.id: a for a in appointments if a.status not in INACTIVE_STATUSES}
+    allocations = defaultdict(list)
+    for appointment_id, resource_id in AppointmentResource.objects.filter(
+        appointment_id__in=active
+    ).values_list('appointment_id', 'resource_id'):
+        allocations[appointment_id].append(resource_id)
+    if not allocations:
+        return []
+
+    booked = [active[appointment_id] for appointment_id in allocations]
+    timeline = capacity.load_timeline(
+        min(a.start_datetime for a in booked),
+        max(a.end_datetime for a in booked),
+        room_ids=[],
+        resource_ids={resource_id for ids in allocations.values() for resource_id in ids},
+        exclude_appointment_ids=[a.id for a in appointments]
+    )
+
+    conflicts = []
+    for appointment in sorted(booked, key=lambda a: (a.start_datetime, a.id)):
+        for resource_id in allocations[appointment.id]:
+            key = (capacity.RESOURCE, resource_id)
+            if timeline.collides(key, appointment.start_datetime, appointment.end_datetime):
+                conflicts.append({
+                    'appointment': appointment.id,
+                    'resource': resource_id,
+                    'code': 'resource_overlap'
+                })
+            timeline.add(key, appointment.start_datetime, appointment.end_datetime)
+
+    return conflicts
+
+
+def apply(appointments, fields, event_type, previous=None, user=None):
+    """
+    Save changed appointments in one transaction and announce them
+
+    previous maps appointment id to its (branch_id, start_datetime) before
+    the change. Raises ValidationError with the conflicts when the changes
+    overlap other appointments or double-book a resource.
+    """
+    conflicts = find_conflicts(appointments)
+    if conflicts:
+        raise ValidationError(
+            'Appointments overlap other appointments',
+            code='bulk_overlap',
+            params={'conflicts': conflicts}
+        )
+
+    conflicts = resource_conflicts(appointments)
+    if conflicts:
+        raise ValidationError(
+            'Resource is already booked at this time',
+            code='bulk_resource_overlap',
+            params={'conflicts': conflicts}
+        )
+
+    previous = previous or {}
+    now = timezone.now()
+    for appointment in appointments:
+        appointment.updated_at = now
+
+    with transaction.atomic(), events.batch():
+        try:
+            # Savepoint so a concurrent booking surfaces as ValidationError
+            with transaction.atomic():
+                Appointment.objects.bulk_update(appointments, fields + ['updated_at'])
+        except IntegrityError as exc:
+            error = Appointment.overlap_error(exc)
+            if error is None:
+                raise
+            code, message = error
+            raise ValidationError(message, code=code) from exc
+
+        if 'status' in fields:
+            create_visits(appointments, user)
+
+        for appointment in appointments:
+            schedule_cache.invalidate_appointment(appointment, previous.get(appointment.id))
+            events.publish(appointment, event_type)
+
+        patient_stats.refresh_on_commit({appointment.patient_id for appointment in appointments})
+
+
+def create_visits(appointments, user=None):
+    """
+    Bulk create the Visits perform_update would create one by one
+    """
+    from apps.visits.models import Visit
+
+    candidates = [a for a in appointments if a.status in VISIT_STATUSES]
+    if not candidates:
+        return []
+
+    existing = set(
+        Visit.objects.filter(
+            appointment__in=candidates
+        ).values_list('appointment_id', flat=True)
+    )
+    now = timezone.now()
+    visits = Visit.objects.bulk_create([
+        Visit(
+            appointment=appointment,
+            status='in_progress' if appointment.status == 'in_progress' else 'completed',
+            is_patient_arrived=True,
+            arrived_at=now,
+            comment=f'Визит создан автоматически из записи #{appointment.id}',
+            created_by=user if user is not None and user.is_authenticated else None
+        )
+        for appointment in candidates
+        if appointment.id not in existing
+    ])
+    # Serializers check hasattr(appointment, 'visit')
+    for visit in visits:
+        visit.appointment.visit = visit
+    return visits
@@ -0,0 +1,187 @@
+"""
+Room and resource capacity planning
+
+Occupancy of every room and resource over a time window is kept as a
+bitmap with one bit per minute (Python int), filled in one pass over the
+bookings loaded with two queries. Overlaps become AND operations and
+utilization a popcount, so checking a booking against any number of
+rooms/resources costs O(window) bit operations instead of a query each.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from apps.calendar.models import Appointment, AppointmentResource
+from apps.calendar.services.slots import INACTIVE_STATUSES
+
+
+ROOM = 'room'
+RESOURCE = 'resource'
+
+DEFAULT_BUCKET_MINUTES = 15
+
+
+class Timeline:
+    """
+    Minute bitmaps of (kind, id) keys over [start, end)
+
+    occupied has a bit set for every minute a key is booked; conflicts
+    for every minute it is booked more than once.
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.size = int((end - start).total_seconds() // 60)
+        self.occupied = defaultdict(int)
+        self.conflicts = defaultdict(int)
+
+    def mask(self, start, end):
+        """Bits of [start, end) clipped to the window; partial minutes count as busy"""
+        first = max(0, int((start - self.start).total_seconds() // 60))
+        last = min(self.size, -int(-(end - self.start).total_seconds() // 60))
+        if last <= first:
+            return 0
+        return ((1 << (last - first)) - 1) << first
+
+    def add(self, key, start, end):
+        bits = self.mask(start, end)
+        self.conflicts[key] |= self.occupied[key] & bits
+        self.occupied[key] |= bits
+
+    def collides(self, key, start, end):
+        return bool(self.occupied.get(key, 0) & self.mask(start, end))
+
+    def busy_minutes(self, key, first=0, last=None):
+        last = self.size if last is None else last
+        window = ((1 << (last - first)) - 1) << first
+        return (self.occupied.get(key, 0) & window).bit_count()
+
+    def conflict_minutes(self, key, first=0, last=None):
+        last = self.size if last is None else last
+        window = ((1 << (last - first)) - 1) << first
+        return (self.conflicts.get(key, 0) & window).bit_count()
+
+
+def load_timeline(start, end, branch_id=None, room_ids=None, resource_ids=None, exclude_appointment_id=None,
+                  exclude_appointment_ids=()):
+    """
+    Timeline filled with active bookings overlapping [start, end)
+
+    Rooms/resources are limited to the given ids, or to the branch when
+    ids are not given. Two queries in total.
+    """
+    timeline = Timeline(start, end)
+
+    appointments = Appointment.objects.filter(
+        start_datetime__lt=end,
+        end_datetime__gt=start,
+        room__isnull=False
+    ).exclude(status__in=INACTIVE_STATUSES)
+    allocations = AppointmentResource.objects.filter(
+        appointment__start_datetime__lt=end,
+        appointment__end_datetime__gt=start
+    ).exclude(appointment__status__in=INACTIVE_STATUSES)
+
+    excluded = set(exclude_appointment_ids)
+    if exclude_appointment_id:
+        excluded.add(exclude_appointment_id)
+    if excluded:
+        appointments = appointments.exclude(id__in=excluded)
+        allocations = allocations.exclude(appointment_id__in=excluded)
+
+    if room_ids is not None:
+        appointments = appointments.filter(room_id__in=room_ids) if room_ids else appointments.none()
+    elif branch_id is not None:
+        appointments = appointments.filter(room__branch_id=branch_id)
+
+    if resource_ids is not None:
+        allocations = allocations.filter(resource_id__in=resource_ids) if resource_ids else allocations.none()
+    elif branch_id is not None:
+        allocations = allocations.filter(resource__branch_id=branch_id)
+
+    for room_id, booking_start, booking_end in appointments.values_list(
+        'room_id', 'start_datetime', 'end_datetime'
+    ):
+        timeline.add((ROOM, room_id), booking_start, booking_end)
+
+    for resource_id, booking_start, booking_end in allocations.values_list(
+        'resource_id', 'appointment__start_datetime', 'appointment__end_datetime'
+    ):
+        timeline.add((RESOURCE, resource_id), booking_start, booking_end)
+
+    return timeline
+
+
+def booking_conflicts(start, end, room_id=None, resource_ids=(), exclude_appointment_id=None):
+    """
+    Rooms/resources already booked during [start, end)
+
+    Returns a list of {'kind', 'id'} dicts, empty when the booking fits.
+    """
+    resource_ids = list(resource_ids)
+    if not room_id and not resource_ids:
+        return []
+
+    timeline = load_timeline(
+        start, end,
+        room_ids=[room_id] if room_id else [],
+        resource_ids=resource_ids,
+        exclude_appointment_id=exclude_appointment_id
+    )
+    keys = ([(ROOM, room_id)] if room_id else []) + [(RESOURCE, resource_id) for resource_id in resource_ids]
+    return [
+        {'kind': kind, 'id': key_id}
+        for kind, key_id in keys
+        if timeline.collides((kind, key_id), start, end)
+    ]
+
+
+def day_plan(branch, day, bucket_minutes=DEFAULT_BUCKET_MINUTES):
+    """
+    Utilization of the branch rooms and resources over its working hours
+
+    Each row has busy minutes per bucket, utilization percent and the
+    buckets where the room/resource is double booked.
+    """
+    from apps.org.models import Resource, Room
+
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, branch.work_hours_from), tz)
+    end = timezone.make_aware(datetime.combine(day, branch.work_hours_to), tz)
+    timeline = load_timeline(start, end, branch_id=branch.id)
+
+    bucket_bounds = [
+        (first, min(first + bucket_minutes, timeline.size))
+        for first in range(0, timeline.size, bucket_minutes)
+    ]
+
+    def row(kind, obj):
+        key = (kind, obj.id)
+        busy = timeline.busy_minutes(key)
+        return {
+            'id': obj.id,
+            'name': obj.name,
+            'busy_minutes': [timeline.busy_minutes(key, first, last) for first, last in bucket_bounds],
+            'utilization': round(100 * busy / timeline.size, 1) if timeline.size else 0,
+            'conflict_buckets': [
+                index for index, (first, last) in enumerate(bucket_bounds)
+                if timeline.conflict_minutes(key, first, last)
+            ],
+        }
+
+    rooms = Room.objects.filter(branch=branch, is_active=True)
+    resources = Resource.objects.filter(branch=branch, is_active=True)
+
+    return {
+        'branch': branch.id,
+        'date': day.isoformat(),
+        'bucket_minutes': bucket_minutes,
+        'buckets': [
+            timezone.localtime(start + timedelta(minutes=first), tz).strftime('%H:%M')
+            for first, _ in bucket_bounds
+        ],
+        'rooms': [row(ROOM, room) for room in rooms],
+        'resources': [row(RESOURCE, resource) for resource in resources],
+    }
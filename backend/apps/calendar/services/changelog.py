@@ -0,0 +1,86 @@
+"""
+Calendar change log for delta sync of reconnecting clients
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.calendar.models import AppointmentChange, CalendarChangeSequence
+
+
+# How long changes are kept; older clients must do a full reload
+RETENTION_DAYS = 7
+
+
+def record_change(branch_id, appointment_id, event_type, data=None):
+    """
+    Append a change to the branch log and return its sequence number
+    """
+    return record_changes(branch_id, [(appointment_id, event_type, data)])[0]
+
+
+def record_changes(branch_id, entries):
+    """
+    Append (appointment_id, event_type, data) entries to the branch log
+    
+    Takes the branch counter lock once and returns the sequence numbers
+    in entry order.
+    """
+    with transaction.atomic():
+        # Row lock serializes writers of the same branch only
+        sequence, _ = CalendarChangeSequence.objects.select_for_update().get_or_create(
+            branch_id=branch_id
+        )
+        first_seq = sequence.last_seq + 1
+        sequence.last_seq += len(entries)
+        sequence.save(update_fields=['last_seq'])
+        
+        AppointmentChange.objects.bulk_create([
+            AppointmentChange(
+                branch_id=branch_id,
+                seq=first_seq + offset,
+                appointment_id=appointment_id,
+                event_type=event_type,
+                data=data
+            )
+            for offset, (appointment_id, event_type, data) in enumerate(entries)
+        ])
+    
+    return list(range(first_seq, sequence.last_seq + 1))
+
+
+def last_seq(branch_id):
+    return CalendarChangeSequence.objects.filter(
+        branch_id=branch_id
+    ).values_list('last_seq', flat=True).first() or 0
+
+
+def changes_since(branch_id, since_seq, limit):
+    """
+    Return (changes, last_seq, reset, has_more) for a branch
+    
+    reset is True when the client cannot catch up from the log (changes
+    were pruned or since_seq is ahead of the server) and must reload.
+    """
+    current = last_seq(branch_id)
+    changes = list(
+        AppointmentChange.objects.filter(
+            branch_id=branch_id,
+            seq__gt=since_seq
+        ).order_by('seq')[:limit + 1]
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    
+    reset = since_seq > current or (
+        since_seq < current and (not changes or changes[0].seq != since_seq + 1)
+    )
+    
+    return changes, current, reset, has_more
+
+
+def prune(older_than_days=RETENTION_DAYS):
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    deleted, _ = AppointmentChange.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,144 @@
+"""
+Calendar WebSocket event publisher
+
+Events published inside ``batch()`` are coalesced per appointment, get
+their change log sequence numbers in one pass and are sent to the branch
+groups after the transaction commits, from a background thread, so the
+channel layer round trip is not part of request latency.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from apps.calendar.services import changelog
+
+
+logger = logging.getLogger(__name__)
+
+CREATED = 'appointment_created'
+DELETED = 'appointment_deleted'
+BATCH_MESSAGE_TYPE = 'appointments_changed'
+
+_local = threading.local()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='calendar-events')
+
+
+def group_name(branch_id):
+    return f'calendar_branch_{branch_id}'
+
+
+def _merge(previous, event_type):
+    """Resulting event type of two events of the same appointment"""
+    if event_type == DELETED:
+        return DELETED
+    if previous == CREATED:
+        return CREATED
+    return event_type
+
+
+class EventBatch:
+    """
+    Pending events of one batch keyed by (branch_id, appointment_id)
+    """
+    
+    def __init__(self):
+        # dict keeps first-publish order
+        self.pending = {}
+    
+    def add(self, branch_id, appointment_id, event_type, appointment=None):
+        key = (branch_id, appointment_id)
+        if key in self.pending:
+            previous_type, previous_appointment = self.pending[key]
+            event_type = _merge(previous_type, event_type)
+            appointment = appointment or previous_appointment
+        self.pending[key] = (event_type, appointment)
+    
+    def flush(self):
+        """
+        Record changes and schedule one group message per branch
+        """
+        from apps.calendar.serializers import AppointmentListSerializer
+        
+        by_branch = {}
+        for (branch_id, appointment_id), (event_type, appointment) in self.pending.items():
+            by_branch.setdefault(branch_id, []).append((appointment_id, event_type, appointment))
+        self.pending = {}
+        
+        messages = []
+        for branch_id, items in by_branch.items():
+            entries = [
+                (
+                    appointment_id,
+                    event_type,
+                    None if event_type == DELETED else AppointmentListSerializer(appointment).data
+                )
+                for appointment_id, event_type, appointment in items
+            ]
+            seqs = changelog.record_changes(branch_id, entries)
+            
+            events = []
+            for seq, (appointment_id, event_type, data) in zip(seqs, entries):
+                if event_type == DELETED:
+                    events.append({'type': event_type, 'seq': seq, 'appointment_id': appointment_id})
+                else:
+                    events.append({'type': event_type, 'seq': seq, 'appointment': data})
+            
+            if len(events) == 1:
+                message = {'type': 'appointment_event', 'data': events[0]}
+            else:
+                message = {'type': BATCH_MESSAGE_TYPE, 'events': events}
+            messages.append((group_name(branch_id), message))
+        
+        if messages:
+            transaction.on_commit(lambda: _dispatch(messages))
+
+
+@contextmanager
+def batch():
+    """
+    Collect events of the enclosed block; nested batches join the outer one
+    """
+    current = getattr(_local, 'batch', None)
+    if current is not None:
+        yield current
+        return
+    
+    current = _local.batch = EventBatch()
+    try:
+        yield current
+    finally:
+        _local.batch = None
+    # Not reached when the block raised: its events are dropped
+    current.flush()
+
+
+def publish(appointment, event_type):
+    with batch() as current:
+        current.add(appointment.branch_id, appointment.id, event_type, appointment)
+
+
+def publish_deleted(branch_id, appointment_id):
+    with batch() as current:
+        current.add(branch_id, appointment_id, DELETED)
+
+
+def _dispatch(messages):
+    _executor.submit(_send, messages)
+
+
+def _send(messages):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    
+    group_send = async_to_sync(channel_layer.group_send)
+    for group, message in messages:
+        try:
+            group_send(group, message)
+        except Exception:
+            logger.exception('Failed to send calendar event to %s', group)
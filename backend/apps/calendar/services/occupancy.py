@@ -0,0 +1,183 @@
+"""
+Occupancy heatmap: booked, no-show and available minutes per day
+
+Booked minutes are summed in one grouped query per request over the
+covering appointments_occupancy_idx index. Aggregates of closed days
+(before today) are cached per (branch, group, day), so a year-long heatmap
+only aggregates the days missing from the cache. Capacity comes from the
+weekly Availability template and is expanded per day in Python.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db.models import DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.calendar.models import Appointment, Availability
+from apps.calendar.services.slots import INACTIVE_STATUSES
+
+
+KEY_PREFIX = 'calendar:occupancy'
+DAY_TTL = 60 * 60 * 24 * 30  # seconds
+
+EMPLOYEE = 'employee'
+ROOM = 'room'
+GROUPS = (EMPLOYEE, ROOM)
+
+MAX_DAYS = 400
+
+
+def day_key(branch_id, group, day):
+    return f'{KEY_PREFIX}:{branch_id}:{group}:{day.isoformat()}'
+
+
+def day_keys(branch_id, day):
+    return [day_key(branch_id, group, day) for group in GROUPS]
+
+
+def _minutes(duration):
+    return int(duration.total_seconds() // 60) if duration else 0
+
+
+def _aggregate(branch_id, group, days):
+    """
+    {day: {id: [booked, no_show]}} for the given days, one query
+
+    Appointments are counted on the local day they start.
+    """
+    day_from, day_to = min(days), max(days)
+    tz = timezone.get_current_timezone()
+    key_field = f'{group}_id'
+    duration = ExpressionWrapper(F('end_datetime') - F('start_datetime'), output_field=DurationField())
+
+    rows = Appointment.objects.filter(
+        branch_id=branch_id,
+        start_datetime__gte=timezone.make_aware(datetime.combine(day_from, time.min), tz),
+        start_datetime__lt=timezone.make_aware(datetime.combine(day_to + timedelta(days=1), time.min), tz),
+        **{f'{key_field}__isnull': False}
+    ).exclude(
+        status='canceled'
+    ).annotate(
+        day=TruncDate('start_datetime', tzinfo=tz)
+    ).values(key_field, 'day').annotate(
+        booked=Sum(duration, filter=~Q(status__in=INACTIVE_STATUSES)),
+        no_show=Sum(duration, filter=Q(status='no_show'))
+    ).order_by()
+
+    wanted = set(days)
+    by_day = {day: {} for day in days}
+    for row in rows:
+        if row['day'] in wanted:
+            by_day[row['day']][row[key_field]] = [_minutes(row['booked']), _minutes(row['no_show'])]
+    return by_day
+
+
+def day_totals(branch_id, group, days):
+    """
+    Booked/no-show minutes per key for each day, closed days from cache
+    """
+    today = timezone.localdate()
+    closed = [day for day in days if day < today]
+    keys = {day_key(branch_id, group, day): day for day in closed}
+    cached = cache.get_many(list(keys))
+
+    totals = {keys[key]: value for key, value in cached.items()}
+    missing = [day for day in days if day not in totals]
+
+    if missing:
+        built = _aggregate(branch_id, group, missing)
+        cache.set_many(
+            {day_key(branch_id, group, day): value for day, value in built.items() if day < today},
+            timeout=DAY_TTL
+        )
+        totals.update(built)
+
+    return totals
+
+
+def _capacity(branch_id, group, ids):
+    """
+    {id: {weekday: minutes}} from active availabilities
+
+    Employee availabilities bound to a room of another branch are skipped.
+    """
+    key_field = f'{group}_id'
+    availabilities = Availability.objects.filter(
+        is_active=True,
+        **{f'{key_field}__in': ids}
+    )
+    if group == EMPLOYEE:
+        availabilities = availabilities.filter(Q(room__isnull=True) | Q(room__branch_id=branch_id))
+
+    capacity = defaultdict(lambda: defaultdict(int))
+    for key_id, weekday, time_from, time_to in availabilities.values_list(
+        key_field, 'weekday', 'time_from', 'time_to'
+    ):
+        capacity[key_id][weekday] += (time_to.hour * 60 + time_to.minute) - (time_from.hour * 60 + time_from.minute)
+    return capacity
+
+
+def _names(branch_id, group, ids):
+    from apps.org.models import Room
+    from apps.staff.models import Employee
+
+    if group == EMPLOYEE:
+        assigned = Employee.objects.filter(
+            branch_assignments__branch_id=branch_id, is_active=True
+        ).values_list('id', flat=True)
+        employees = Employee.objects.filter(Q(id__in=ids) | Q(id__in=assigned))
+        return {employee.id: employee.full_name for employee in employees.order_by('last_name', 'first_name')}
+
+    rooms = Room.objects.filter(Q(id__in=ids) | Q(branch_id=branch_id, is_active=True))
+    return dict(rooms.values_list('id', 'name'))
+
+
+def heatmap(branch_id, date_from, date_to, group=EMPLOYEE, ids=None):
+    """
+    Per-day occupancy of the branch employees or rooms
+
+    Each row has per-day lists aligned with 'days': booked, no_show,
+    capacity and available (capacity minus booked, not below zero)
+    minutes, plus totals over the range. ids limits the rows.
+    """
+    days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    totals = day_totals(branch_id, group, days)
+
+    seen = {key_id for day in days for key_id in totals[day]}
+    names = _names(branch_id, group, seen)
+    if ids is not None:
+        names = {key_id: name for key_id, name in names.items() if key_id in ids}
+    capacity = _capacity(branch_id, group, list(names))
+
+    rows = []
+    for key_id, name in names.items():
+        booked = [totals[day].get(key_id, (0, 0))[0] for day in days]
+        no_show = [totals[day].get(key_id, (0, 0))[1] for day in days]
+        day_capacity = [capacity[key_id][day.weekday()] for day in days]
+        available = [max(cap - minutes, 0) for cap, minutes in zip(day_capacity, booked)]
+        rows.append({
+            'id': key_id,
+            'name': name,
+            'booked': booked,
+            'no_show': no_show,
+            'capacity': day_capacity,
+            'available': available,
+            'totals': {
+                'booked': sum(booked),
+                'no_show': sum(no_show),
+                'capacity': sum(day_capacity),
+                'available': sum(available),
+                'utilization': round(100 * sum(booked) / sum(day_capacity), 1) if sum(day_capacity) else None,
+            },
+        })
+
+    return {
+        'branch': branch_id,
+        'group_by': group,
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        'days': [day.isoformat() for day in days],
+        'rows': rows,
+    }
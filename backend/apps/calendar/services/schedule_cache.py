@@ -0,0 +1,200 @@
+"""
+Per-(branch, day) schedule snapshots for the calendar grid
+
+Snapshots hold AppointmentListSerializer output for every appointment that
+starts on the given local day, together with a content hash used as ETag.
+Every (branch, day) has a version that is part of the snapshot key.
+Invalidation bumps it, both at once and again on commit, instead of
+deleting the snapshot: a snapshot built from data read before the change
+is written under the old version and never served. Versions are bumped by
+the appointment mutation paths in AppointmentViewSet, by visit changes and
+by patient name/phone edits, which alter fields of the snapshot; the TTL
+only bounds how long a snapshot could survive a missed invalidation.
+"""
+import hashlib
+import json
+import time as clock
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from apps.calendar.models import Appointment
+from apps.calendar.services import occupancy
+
+
+KEY_PREFIX = 'calendar:schedule'
+HITS_KEY = f'{KEY_PREFIX}:stats:hits'
+MISSES_KEY = f'{KEY_PREFIX}:stats:misses'
+SNAPSHOT_TTL = 60 * 15  # seconds
+
+
+def snapshot_key(branch_id, day, version):
+    return f'{KEY_PREFIX}:{branch_id}:{day.isoformat()}:{version}'
+
+
+def version_key(branch_id, day):
+    return f'{KEY_PREFIX}:version:{branch_id}:{day.isoformat()}'
+
+
+def _initial_version():
+    # Above any version an evicted key could have reached, so snapshots
+    # written under it are not served again
+    return clock.time_ns() // 1000
+
+
+def _versions(branch_id, days):
+    """
+    Current version of each day, created when missing
+    """
+    keys = {version_key(branch_id, day): day for day in days}
+    versions = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+    for key, day in keys.items():
+        if day not in versions:
+            initial = _initial_version()
+            versions[day] = initial if cache.add(key, initial, timeout=None) else cache.get(key, initial)
+    return versions
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Never read, nothing cached under it
+            pass
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _incr(key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Counter expired or never set
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+def _build(branch_id, days):
+    """
+    Build snapshots for the given days with a single query
+    """
+    from apps.calendar.serializers import AppointmentListSerializer
+
+    appointments = Appointment.objects.filter(
+        branch_id=branch_id,
+        start_datetime__gte=day_start(min(days)),
+        start_datetime__lt=day_start(max(days) + timedelta(days=1))
+    ).select_related('employee', 'patient', 'visit').order_by('start_datetime', 'id')
+
+    by_day = {day: [] for day in days}
+    for appointment in appointments:
+        day = timezone.localdate(appointment.start_datetime)
+        if day in by_day:
+            by_day[day].append(appointment)
+
+    snapshots = {}
+    for day, day_appointments in by_day.items():
+        payload = json.dumps(
+            AppointmentListSerializer(day_appointments, many=True).data,
+            cls=DjangoJSONEncoder
+        )
+        snapshots[day] = {
+            'etag': hashlib.sha1(payload.encode()).hexdigest(),
+            # JSON round trip keeps the cached value free of serializer objects
+            'appointments': json.loads(payload),
+        }
+    return snapshots
+
+
+def get_snapshots(branch_id, days):
+    """
+    Return {day: {'etag': ..., 'appointments': [...]}} for the given days
+
+    Built snapshots are stored under the versions read before the build.
+    """
+    versions = _versions(branch_id, days)
+    keys = {snapshot_key(branch_id, day, versions[day]): day for day in days}
+    cached = cache.get_many(list(keys))
+
+    snapshots = {keys[key]: value for key, value in cached.items()}
+    missing = [day for day in days if day not in snapshots]
+
+    if missing:
+        built = _build(branch_id, missing)
+        cache.set_many(
+            {snapshot_key(branch_id, day, versions[day]): snapshot for day, snapshot in built.items()},
+            timeout=SNAPSHOT_TTL
+        )
+        snapshots.update(built)
+
+    _incr(HITS_KEY, len(days) - len(missing))
+    _incr(MISSES_KEY, len(missing))
+
+    return snapshots
+
+
+def combined_etag(snapshots):
+    digest = hashlib.sha1(
+        '|'.join(f'{day.isoformat()}:{snapshots[day]["etag"]}' for day in sorted(snapshots)).encode()
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def invalidate_appointment(appointment, previous=None):
+    """
+    Drop snapshots touched by an appointment change
+
+    previous is the (branch_id, start_datetime) pair before the change, so
+    moves to another day or branch clear both snapshots. Cached occupancy
+    totals of the same days are dropped too.
+    """
+    targets = {(appointment.branch_id, timezone.localdate(appointment.start_datetime))}
+    if previous:
+        branch_id, start_datetime = previous
+        targets.add((branch_id, timezone.localdate(start_datetime)))
+    invalidate_days(targets)
+
+
+def invalidate_days(targets):
+    """
+    Drop snapshots and occupancy totals of (branch_id, day) pairs
+
+    Done again on commit: a snapshot built between the change and the
+    commit still holds the old rows.
+    """
+    versions = [version_key(branch_id, day) for branch_id, day in targets]
+    totals = [key for branch_id, day in targets for key in occupancy.day_keys(branch_id, day)]
+
+    def invalidate():
+        _bump(versions)
+        cache.delete_many(totals)
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def invalidate_patient(patient_id):
+    """
+    Drop snapshots of every day the patient has appointments on
+    """
+    invalidate_days({
+        (branch_id, timezone.localdate(start_datetime))
+        for branch_id, start_datetime in Appointment.objects.filter(
+            patient_id=patient_id
+        ).values_list('branch_id', 'start_datetime')
+    })
+
+
+def stats():
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+    }
@@ -0,0 +1,157 @@
+"""
+Waitlist matching for released appointment slots
+
+When an appointment is cancelled, marked no_show or deleted, its slot is
+matched against waiting entries with one ranked, index-backed query per
+slot (partial indexes on status='waiting'), and the best entries get
+WaitlistOffer rows created in bulk.
+"""
+from datetime import datetime, time
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from apps.calendar.models import Waitlist, WaitlistOffer
+from apps.calendar.services.slots import INACTIVE_STATUSES
+
+
+# Offers created per released slot
+MAX_OFFERS_PER_SLOT = 3
+
+# Local time bounds of Waitlist.TIME_WINDOW_CHOICES
+TIME_WINDOWS = {
+    'morning': (time(9), time(12)),
+    'afternoon': (time(12), time(17)),
+    'evening': (time(17), time(20)),
+}
+
+
+def released_slot(appointment):
+    """
+    JSON-serializable description of the slot an appointment occupied
+    """
+    return {
+        'appointment_id': appointment.id,
+        'patient_id': appointment.patient_id,
+        'branch_id': appointment.branch_id,
+        'organization_id': appointment.branch.organization_id,
+        'employee_id': appointment.employee_id,
+        'start': appointment.start_datetime.isoformat(),
+        'end': appointment.end_datetime.isoformat(),
+    }
+
+
+def on_slots_released(appointments, previous_statuses=None):
+    """
+    Schedule matching for appointments whose slot became free
+
+    previous_statuses maps appointment id to the status before the change;
+    appointments that were already inactive or are in the past are skipped.
+    Matching runs in a Celery task after commit.
+    """
+    from apps.calendar.tasks import match_released_slots
+
+    previous_statuses = previous_statuses or {}
+    now = timezone.now()
+    slots = [
+        released_slot(appointment)
+        for appointment in appointments
+        if appointment.start_datetime > now
+        and previous_statuses.get(appointment.id) not in INACTIVE_STATUSES
+    ]
+    if slots:
+        transaction.on_commit(lambda: match_released_slots.delay(slots))
+    return slots
+
+
+def time_windows(start, end):
+    """Waitlist time windows a slot fits into"""
+    start_time = timezone.localtime(start).time()
+    end_time = timezone.localtime(end).time()
+    windows = ['any']
+    for name, (window_start, window_end) in TIME_WINDOWS.items():
+        if window_start <= start_time and end_time <= window_end:
+            windows.append(name)
+    return windows
+
+
+def candidates(slot, exclude_ids=(), limit=MAX_OFFERS_PER_SLOT):
+    """
+    Best waiting entries for a slot, ranked by priority and age
+    """
+    from apps.patients.models import Patient
+    from apps.staff.models import EmployeeService
+
+    start = datetime.fromisoformat(slot['start'])
+    end = datetime.fromisoformat(slot['end'])
+    day = timezone.localdate(start)
+    duration_minutes = (end - start).total_seconds() / 60
+
+    employee_services = EmployeeService.objects.filter(
+        employee_id=slot['employee_id']
+    ).values('service_id')
+    in_organization = Patient.organizations.through.objects.filter(
+        patient_id=OuterRef('patient_id'),
+        organization_id=slot['organization_id']
+    )
+    already_offered = WaitlistOffer.objects.filter(
+        waitlist_id=OuterRef('pk'),
+        employee_id=slot['employee_id'],
+        start_datetime=start
+    )
+
+    return list(
+        Waitlist.objects.filter(
+            status='waiting',
+            time_window__in=time_windows(start, end)
+        ).filter(
+            # Wanted this doctor, or any doctor who provides the service
+            Q(employee_id=slot['employee_id']) |
+            Q(employee__isnull=True) & (Q(service__isnull=True) | Q(service_id__in=employee_services))
+        ).filter(
+            Q(service__isnull=True) | Q(service__default_duration__lte=duration_minutes)
+        ).filter(
+            Q(preferred_date=day) |
+            Q(preferred_date__isnull=True) &
+            (Q(preferred_period_start__isnull=True) | Q(preferred_period_start__lte=day)) &
+            (Q(preferred_period_end__isnull=True) | Q(preferred_period_end__gte=day))
+        ).filter(
+            Exists(in_organization)
+        ).exclude(
+            Exists(already_offered)
+        ).exclude(
+            patient_id=slot.get('patient_id')
+        ).exclude(
+            id__in=list(exclude_ids)
+        ).order_by('-priority', 'created_at').values_list('id', flat=True)[:limit]
+    )
+
+
+def match_slots(slots, per_slot=MAX_OFFERS_PER_SLOT):
+    """
+    Create offers for released slots; returns the created offers
+
+    An entry gets at most one offer per call, so a burst of cancellations
+    spreads over the waitlist instead of offering every slot to the same
+    patients.
+    """
+    offered_ids = set()
+    offers = []
+    for slot in slots:
+        entry_ids = candidates(slot, exclude_ids=offered_ids, limit=per_slot)
+        offered_ids.update(entry_ids)
+        offers.extend(
+            WaitlistOffer(
+                waitlist_id=entry_id,
+                branch_id=slot['branch_id'],
+                employee_id=slot['employee_id'],
+                start_datetime=datetime.fromisoformat(slot['start']),
+                end_datetime=datetime.fromisoformat(slot['end']),
+                released_appointment_id=slot['appointment_id'],
+                rank=rank
+            )
+            for rank, entry_id in enumerate(entry_ids)
+        )
+
+    return WaitlistOffer.objects.bulk_create(offers, ignore_conflicts=True)
@@ -0,0 +1,41 @@
+"""
+Calendar signals
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from apps.calendar.models import Appointment
+from apps.calendar.services import schedule_cache
+
+
+@receiver(post_save, sender='visits.Visit')
+@receiver(post_delete, sender='visits.Visit')
+def invalidate_schedule_on_visit_change(sender, instance, **kwargs):
+    """
+    Visit fields are part of the schedule snapshot of its appointment
+    """
+    try:
+        appointment = instance.appointment
+    except Appointment.DoesNotExist:
+        return
+    schedule_cache.invalidate_appointment(appointment)
+
+
+@receiver(pre_save, sender='patients.Patient')
+def check_patient_schedule_fields(sender, instance, update_fields=None, **kwargs):
+    """
+    Remember whether the name or phone shown in schedule snapshots changes
+    """
+    from apps.patients.search import SOURCE_FIELDS
+
+    instance._schedule_fields_changed = False
+    if instance._state.adding or (update_fields is not None and not set(update_fields) & set(SOURCE_FIELDS)):
+        return
+    stored = sender.objects.filter(pk=instance.pk).values_list(*SOURCE_FIELDS).first()
+    instance._schedule_fields_changed = stored != tuple(getattr(instance, field) for field in SOURCE_FIELDS)
+
+
+@receiver(post_save, sender='patients.Patient')
+def invalidate_schedule_on_patient_change(sender, instance, created, **kwargs):
+    if getattr(instance, '_schedule_fields_changed', False):
+        schedule_cache.invalidate_patient(instance.pk)
@@ -0,0 +1,26 @@
+"""
+Celery tasks for calendar module
+"""
+from celery import shared_task
+
+
+@shared_task
+def prune_appointment_changes():
+    """
+    Remove calendar change log entries past the delta sync retention
+    """
+    from .services.changelog import prune
+    
+    deleted = prune()
+    return {'deleted': deleted}
+
+
+@shared_task
+def match_released_slots(slots):
+    """
+    Offer slots freed by cancellations to matching waitlist entries
+    """
+    from .services.waitlist import match_slots
+    
+    offers = match_slots(slots)
+    return {'slots': len(slots), 'offers': len(offers)}
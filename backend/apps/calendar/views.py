@@ -1,21 +1,29 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
 from django.utils import timezone
-from datetime import datetime, timedelta
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from datetime import date as date_type, datetime, timedelta
+from apps.core.pagination import KeysetPagination
 from apps.core.permissions import IsBranchMember, IsBranchAdmin
-from .models import Availability, Appointment, AppointmentResource, Waitlist, Break
+from .models import Availability, Appointment, AppointmentResource, Waitlist, WaitlistOffer, Break
+from .services import breaks, bulk, capacity, changelog, events, occupancy, schedule_cache, waitlist
+from .services.slots import INACTIVE_STATUSES, SlotEngine
 from .serializers import (
     AvailabilitySerializer,
     AppointmentSerializer,
     AppointmentListSerializer,
     AppointmentMoveSerializer,
+    AppointmentBulkMoveSerializer,
+    AppointmentBulkStatusSerializer,
+    AppointmentBulkCancelSerializer,
     AppointmentResourceSerializer,
     WaitlistSerializer,
+    WaitlistOfferSerializer,
     BreakSerializer
 )
 
@@ -54,6 +62,15 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     # permission_classes = [IsAuthenticated, IsBranchMember]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['employee', 'patient', 'branch', 'room', 'status']
+    # Keyset pages on (start_datetime, id), no COUNT(*)
+    pagination_class = KeysetPagination
+    
+    # Limits for the multi-employee slot search
+    AVAILABLE_SLOTS_MAX_DAYS = 31
+    AVAILABLE_SLOTS_MAX_LIMIT = 100
+    # Longest range served by the cached schedule endpoint
+    SCHEDULE_MAX_DAYS = 31
+    CHANGES_MAX_LIMIT = 1000
     
     def get_queryset(self):
         # TODO: Enable organization filtering in production
@@ -84,6 +101,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 start_datetime__date=today
             )
         
+        if self.action == 'list':
+            # AppointmentListSerializer reads visit, not allocated resources
+            return queryset.select_related('employee', 'patient', 'room', 'branch', 'visit')
+        
         return queryset.select_related(
             'employee', 'patient', 'room', 'branch'
         ).prefetch_related('allocated_resources')
@@ -95,12 +116,14 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         appointment = serializer.save(created_by=self.request.user)
+        schedule_cache.invalidate_appointment(appointment)
         
         # Send WebSocket notification
-        self.send_websocket_event(appointment, 'appointment_created')
+        events.publish(appointment, 'appointment_created')
     
     def perform_update(self, serializer):
         old_status = serializer.instance.status if serializer.instance else None
+        previous = (serializer.instance.branch_id, serializer.instance.start_datetime)
         appointment = serializer.save()
         
         # Auto-create Visit when appointment status changes to done or in_progress
@@ -119,19 +142,21 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                     }
                 )
         
+        schedule_cache.invalidate_appointment(appointment, previous)
+        
         # Send WebSocket notification
-        self.send_websocket_event(appointment, 'appointment_updated')
+        events.publish(appointment, 'appointment_updated')
     
     def perform_destroy(self, instance):
         branch_id = instance.branch_id
         appointment_id = instance.id
+        # Taken before delete() clears the id
+        waitlist.on_slots_released([instance], {instance.id: instance.status})
         instance.delete()
+        schedule_cache.invalidate_appointment(instance)
         
         # Send WebSocket notification
-        self.send_websocket_event_raw(branch_id, {
-            'type': 'appointment_deleted',
-            'appointment_id': appointment_id
-        })
+        events.publish_deleted(branch_id, appointment_id)
     
     @action(detail=True, methods=['post'])
     def move(self, request, pk=None):
@@ -149,6 +174,8 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 serializer.validated_data['start_datetime'] + duration
             )
         
+        previous = (appointment.branch_id, appointment.start_datetime)
+        
         # Update appointment
         appointment.start_datetime = serializer.validated_data['start_datetime']
         appointment.end_datetime = serializer.validated_data['end_datetime']
@@ -159,12 +186,32 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if serializer.validated_data.get('room_id'):
             appointment.room_id = serializer.validated_data['room_id']
         
-        # Validate conflicts
-        appointment.clean()
-        appointment.save()
+        # Allocated resources must be free at the new time
+        resource_conflicts = capacity.booking_conflicts(
+            appointment.start_datetime,
+            appointment.end_datetime,
+            resource_ids=appointment.allocated_resources.values_list('resource_id', flat=True),
+            exclude_appointment_id=appointment.id
+        )
+        if resource_conflicts:
+            return Response(
+                {'error': 'Resource is already booked at this time', 'details': {'conflicts': resource_conflicts}},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Employee/room conflicts are rejected by the database overlap constraints
+        try:
+            appointment.save()
+        except DjangoValidationError as exc:
+            return Response(
+                {'error': exc.messages[0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        schedule_cache.invalidate_appointment(appointment, previous)
         
         # Send WebSocket notification
-        self.send_websocket_event(appointment, 'appointment_moved')
+        events.publish(appointment, 'appointment_moved')
         
         return Response(AppointmentSerializer(appointment).data)
     
@@ -182,19 +229,142 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        old_status = appointment.status
         appointment.status = new_status
         
         # Set cancellation reason if canceled
         if new_status == 'canceled':
             appointment.cancellation_reason = request.data.get('cancellation_reason', '')
         
-        appointment.save()
+        # Re-activating a canceled appointment may hit the overlap constraints
+        try:
+            appointment.save()
+        except DjangoValidationError as exc:
+            return Response(
+                {'error': exc.messages[0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        schedule_cache.invalidate_appointment(appointment)
+        
+        if new_status in INACTIVE_STATUSES:
+            waitlist.on_slots_released([appointment], {appointment.id: old_status})
         
         # Send WebSocket notification
-        self.send_websocket_event(appointment, 'appointment_status_changed')
+        events.publish(appointment, 'appointment_status_changed')
         
         return Response(AppointmentSerializer(appointment).data)
     
+    @action(detail=False, methods=['post'])
+    def bulk_move(self, request):
+        """
+        Shift appointments by offset_minutes and/or reassign them to employee_id
+        """
+        serializer = AppointmentBulkMoveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        appointments, error = self._bulk_appointments(serializer.validated_data['ids'])
+        if error:
+            return error
+        
+        offset = timedelta(minutes=serializer.validated_data['offset_minutes'])
+        employee_id = serializer.validated_data.get('employee_id')
+        previous = {}
+        
+        for appointment in appointments:
+            previous[appointment.id] = (appointment.branch_id, appointment.start_datetime)
+            appointment.start_datetime += offset
+            appointment.end_datetime += offset
+            if employee_id:
+                appointment.employee_id = employee_id
+        
+        return self._bulk_apply(
+            appointments, ['start_datetime', 'end_datetime', 'employee'],
+            'appointment_moved', previous
+        )
+    
+    @action(detail=False, methods=['post'])
+    def bulk_status(self, request):
+        """
+        Change status of many appointments
+        """
+        serializer = AppointmentBulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        return self._bulk_set_status(
+            serializer.validated_data['ids'],
+            serializer.validated_data['status'],
+            serializer.validated_data['cancellation_reason']
+        )
+    
+    @action(detail=False, methods=['post'])
+    def bulk_cancel(self, request):
+        """
+        Cancel many appointments with one reason
+        """
+        serializer = AppointmentBulkCancelSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        return self._bulk_set_status(
+            serializer.validated_data['ids'],
+            'canceled',
+            serializer.validated_data['cancellation_reason']
+        )
+    
+    def _bulk_set_status(self, ids, new_status, cancellation_reason):
+        appointments, error = self._bulk_appointments(ids)
+        if error:
+            return error
+        
+        fields = ['status']
+        previous_statuses = {}
+        for appointment in appointments:
+            previous_statuses[appointment.id] = appointment.status
+            appointment.status = new_status
+        
+        if new_status == 'canceled':
+            fields.append('cancellation_reason')
+            for appointment in appointments:
+                appointment.cancellation_reason = cancellation_reason
+        
+        response = self._bulk_apply(appointments, fields, 'appointment_status_changed')
+        
+        if response.status_code == status.HTTP_200_OK and new_status in INACTIVE_STATUSES:
+            waitlist.on_slots_released(appointments, previous_statuses)
+        
+        return response
+    
+    def _bulk_appointments(self, ids):
+        """
+        Load appointments for a bulk operation; error response if some are missing
+        """
+        appointments = list(
+            Appointment.objects.filter(id__in=ids).select_related(
+                'employee', 'patient', 'branch', 'visit'
+            )
+        )
+        missing = set(ids) - {appointment.id for appointment in appointments}
+        if missing:
+            return None, Response(
+                {'error': 'Appointments not found', 'details': {'missing': sorted(missing)}},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return appointments, None
+    
+    def _bulk_apply(self, appointments, fields, event_type, previous=None):
+        try:
+            bulk.apply(appointments, fields, event_type, previous, user=self.request.user)
+        except DjangoValidationError as exc:
+            return Response(
+                {'error': exc.messages[0], 'details': {'conflicts': (exc.params or {}).get('conflicts', [])}},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'updated': len(appointments),
+            'appointments': AppointmentListSerializer(appointments, many=True).data
+        })
+    
     @action(detail=False, methods=['get'])
     def conflicts(self, request):
         """
@@ -354,82 +524,279 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if not employee.show_in_schedule or employee.employment_status != 'active':
             return Response({'slots': []})
         
-        # Get slot step (individual or default)
-        slot_step_minutes = employee.online_slot_step_minutes or 30  # default 30 min
-        
         # Parse date
         target_date = datetime.fromisoformat(date).date()
-        weekday = target_date.weekday()
         
-        # Get employee availability for this weekday
-        availabilities = Availability.objects.filter(
-            employee=employee,
-            weekday=weekday,
+        # Availabilities, breaks and appointments are loaded in bulk
+        engine = SlotEngine([employee], target_date)
+        
+        slots = [
+            {
+                'start': slot_start.isoformat(),
+                'end': slot_end.isoformat(),
+                'available': True
+            }
+            for slot_start, slot_end in engine.free_slots(employee.id, target_date)
+        ]
+        
+        return Response({'slots': slots})
+    
+    @action(detail=False, methods=['get'])
+    def available_slots(self, request):
+        """
+        Earliest free slots across all schedulable employees of a branch
+        
+        Query params: branch (required), date_from, date_to, service,
+        position, limit, offset. Results are ordered by start time and
+        paginated with limit/offset.
+        """
+        from itertools import islice
+        from apps.staff.models import Employee
+        from apps.services.models import Service
+        
+        branch_id = request.query_params.get('branch')
+        if not branch_id:
+            return Response(
+                {'error': 'branch is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            date_from = request.query_params.get('date_from')
+            date_from = datetime.fromisoformat(date_from).date() if date_from else timezone.localdate()
+            date_to = request.query_params.get('date_to')
+            date_to = datetime.fromisoformat(date_to).date() if date_to else date_from + timedelta(days=6)
+            limit = min(int(request.query_params.get('limit', 20)), self.AVAILABLE_SLOTS_MAX_LIMIT)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response(
+                {'error': 'Invalid date or pagination parameters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if limit < 1:
+            return Response(
+                {'error': 'limit must be at least 1'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if date_to < date_from or (date_to - date_from).days >= self.AVAILABLE_SLOTS_MAX_DAYS:
+            return Response(
+                {'error': f'Date range must be between 1 and {self.AVAILABLE_SLOTS_MAX_DAYS} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        employees = Employee.objects.filter(
+            organization=request.user.organization,
+            branch_assignments__branch_id=branch_id,
+            show_in_schedule=True,
+            employment_status='active',
             is_active=True
         )
         
-        if not availabilities.exists():
-            return Response({'slots': []})
+        position_id = request.query_params.get('position')
+        if position_id:
+            employees = employees.filter(position_id=position_id)
+        
+        duration_minutes = None
+        service_id = request.query_params.get('service')
+        if service_id:
+            employees = employees.filter(service_assignments__service_id=service_id)
+            duration_minutes = Service.objects.filter(id=service_id).values_list(
+                'default_duration', flat=True
+            ).first()
+        
+        engine = SlotEngine(
+            employees.distinct(),
+            date_from,
+            date_to,
+            duration_minutes=duration_minutes
+        )
         
-        # Generate time slots
-        slots = []
-        for availability in availabilities:
-            current_time = datetime.combine(target_date, availability.time_from)
-            end_time = datetime.combine(target_date, availability.time_to)
-            
-            while current_time < end_time:
-                slot_end = current_time + timedelta(minutes=slot_step_minutes)
-                
-                # Check if slot is not already booked
-                conflicts = Appointment.objects.filter(
-                    employee=employee,
-                    start_datetime__lt=timezone.make_aware(slot_end),
-                    end_datetime__gt=timezone.make_aware(current_time)
-                ).exclude(status__in=['canceled', 'no_show']).exists()
-                
-                if not conflicts:
-                    slots.append({
-                        'start': current_time.isoformat(),
-                        'end': slot_end.isoformat(),
-                        'available': True
-                    })
-                
-                current_time = slot_end
+        # Fetch one extra slot to know whether there is a next page
+        page = list(islice(engine.iter_earliest(), offset, offset + limit + 1))
+        has_next = len(page) > limit
         
-        return Response({'slots': slots})
+        results = [
+            {
+                'employee': employee_id,
+                'employee_name': engine.employees[employee_id].full_name,
+                'start': slot_start.isoformat(),
+                'end': slot_end.isoformat()
+            }
+            for slot_start, slot_end, employee_id in page[:limit]
+        ]
+        
+        return Response({
+            'results': results,
+            'next_offset': offset + limit if has_next else None
+        })
     
-    def send_websocket_event(self, appointment, event_type):
+    @action(detail=False, methods=['get'])
+    def schedule(self, request):
         """
-        Send WebSocket event for appointment changes
+        Cached calendar grid for a branch, grouped by day
+
+        Query params: branch (required), date_from (YYYY-MM-DD, default
+        today), date_to (default date_from). Supports If-None-Match: when
+        none of the days changed the response is 304 Not Modified.
         """
-        channel_layer = get_channel_layer()
-        group_name = f'calendar_branch_{appointment.branch_id}'
+        branch_id = request.query_params.get('branch')
+        if not branch_id:
+            return Response(
+                {'error': 'branch is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            branch_id = int(branch_id)
+            date_from = request.query_params.get('date_from')
+            date_from = date_type.fromisoformat(date_from) if date_from else timezone.localdate()
+            date_to = request.query_params.get('date_to')
+            date_to = date_type.fromisoformat(date_to) if date_to else date_from
+        except ValueError:
+            return Response(
+                {'error': 'Invalid branch or date, expected YYYY-MM-DD dates'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        async_to_sync(channel_layer.group_send)(
-            group_name,
+        if date_to < date_from or (date_to - date_from).days >= self.SCHEDULE_MAX_DAYS:
+            return Response(
+                {'error': f'Date range must be between 1 and {self.SCHEDULE_MAX_DAYS} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+        snapshots = schedule_cache.get_snapshots(branch_id, days)
+        etag = schedule_cache.combined_etag(snapshots)
+        
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        
+        return Response(
             {
-                'type': 'appointment_event',
-                'data': {
-                    'type': event_type,
-                    'appointment': AppointmentListSerializer(appointment).data
+                'branch': branch_id,
+                'days': {
+                    day.isoformat(): snapshots[day]['appointments'] for day in days
                 }
-            }
+            },
+            headers={'ETag': etag}
         )
     
-    def send_websocket_event_raw(self, branch_id, data):
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Calendar changes of a branch after a known sequence number
+
+        Query params: branch (required), since_seq (default 0), limit.
+        When reset is true the log cannot fill the gap and the client
+        should reload the calendar, then continue from last_seq.
         """
-        Send raw WebSocket event
+        try:
+            branch_id = int(request.query_params['branch'])
+            since_seq = int(request.query_params.get('since_seq', 0))
+            limit = min(int(request.query_params.get('limit', 500)), self.CHANGES_MAX_LIMIT)
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'branch is required; branch, since_seq and limit must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        changes, last_seq, reset, has_more = changelog.changes_since(branch_id, since_seq, limit)
+        
+        return Response({
+            'branch': branch_id,
+            'last_seq': last_seq,
+            'reset': reset,
+            'has_more': has_more,
+            'changes': [] if reset else [
+                {
+                    'seq': change.seq,
+                    'type': change.event_type,
+                    'appointment_id': change.appointment_id,
+                    'appointment': change.data,
+                    'created_at': change.created_at
+                }
+                for change in changes
+            ]
+        })
+    
+    @action(detail=False, methods=['get'])
+    def capacity(self, request):
         """
-        channel_layer = get_channel_layer()
-        group_name = f'calendar_branch_{branch_id}'
+        Room and resource utilization of a branch for one day
         
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                'type': 'appointment_event',
-                'data': data
-            }
-        )
+        Query params: branch (required), date (YYYY-MM-DD, default today),
+        bucket (minutes, default 15). Buckets cover the branch working hours.
+        """
+        from apps.org.models import Branch
+        
+        try:
+            branch = Branch.objects.get(id=int(request.query_params['branch']))
+            day = request.query_params.get('date')
+            day = date_type.fromisoformat(day) if day else timezone.localdate()
+            bucket_minutes = int(request.query_params.get('bucket', capacity.DEFAULT_BUCKET_MINUTES))
+        except (KeyError, ValueError, Branch.DoesNotExist):
+            return Response(
+                {'error': 'Valid branch is required; date must be YYYY-MM-DD, bucket an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not 5 <= bucket_minutes <= 240:
+            return Response(
+                {'error': 'bucket must be between 5 and 240 minutes'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(capacity.day_plan(branch, day, bucket_minutes))
+    
+    @action(detail=False, methods=['get'])
+    def occupancy(self, request):
+        """
+        Heatmap of booked/no-show/available minutes per employee or room and day
+        
+        Query params: branch (required), date_from, date_to (YYYY-MM-DD,
+        default the current month), group_by (employee or room, default
+        employee), ids (comma separated employee/room ids).
+        """
+        try:
+            branch_id = int(request.query_params['branch'])
+            today = timezone.localdate()
+            date_from = request.query_params.get('date_from')
+            date_from = date_type.fromisoformat(date_from) if date_from else today.replace(day=1)
+            date_to = request.query_params.get('date_to')
+            date_to = date_type.fromisoformat(date_to) if date_to else (
+                (date_from.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            )
+            ids = request.query_params.get('ids')
+            ids = {int(value) for value in ids.split(',') if value} if ids else None
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'branch is required; dates must be YYYY-MM-DD, ids comma separated integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        group = request.query_params.get('group_by', occupancy.EMPLOYEE)
+        if group not in occupancy.GROUPS:
+            return Response(
+                {'error': f'group_by must be one of: {", ".join(occupancy.GROUPS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if date_to < date_from or (date_to - date_from).days >= occupancy.MAX_DAYS:
+            return Response(
+                {'error': f'Date range must be between 1 and {occupancy.MAX_DAYS} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(occupancy.heatmap(branch_id, date_from, date_to, group, ids))
+    
+    @action(detail=False, methods=['get'])
+    def schedule_stats(self, request):
+        """
+        Schedule snapshot cache hit/miss counters
+        """
+        return Response(schedule_cache.stats())
 
 
 class AppointmentResourceViewSet(viewsets.ModelViewSet):
@@ -452,6 +819,20 @@ class AppointmentResourceViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(appointment_id=appointment_id)
         
         return queryset.select_related('appointment', 'resource')
+    
+    def perform_create(self, serializer):
+        appointment = serializer.validated_data['appointment']
+        resource = serializer.validated_data['resource']
+        
+        if capacity.booking_conflicts(
+            appointment.start_datetime,
+            appointment.end_datetime,
+            resource_ids=[resource.id],
+            exclude_appointment_id=appointment.id
+        ):
+            raise ValidationError({'resource': 'Resource is already booked at this time'})
+        
+        serializer.save()
 
 
 class WaitlistViewSet(viewsets.ModelViewSet):
@@ -490,6 +871,30 @@ class WaitlistViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(waitlist_entry)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def offers(self, request):
+        """
+        Slots offered to waitlist entries after cancellations
+        
+        Query params: branch, status (default pending)
+        """
+        offers = WaitlistOffer.objects.filter(
+            waitlist__in=self.get_queryset(),
+            status=request.query_params.get('status', 'pending')
+        )
+        
+        branch_id = request.query_params.get('branch')
+        if branch_id:
+            offers = offers.filter(branch_id=branch_id)
+        
+        offers = offers.select_related('waitlist__patient', 'employee')
+        
+        page = self.paginate_queryset(offers)
+        if page is not None:
+            return self.get_paginated_response(WaitlistOfferSerializer(page, many=True).data)
+        
+        return Response(WaitlistOfferSerializer(offers, many=True).data)
 
 
 class BreakViewSet(viewsets.ModelViewSet):
@@ -502,6 +907,8 @@ class BreakViewSet(viewsets.ModelViewSet):
     # permission_classes = [IsAuthenticated, IsBranchMember]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['employee', 'date', 'break_type', 'is_recurring']
+    # Longest window recurring breaks are expanded over
+    LIST_MAX_DAYS = 366
     
     def get_queryset(self):
         # TODO: Enable organization filtering in production
@@ -513,17 +920,89 @@ class BreakViewSet(viewsets.ModelViewSet):
         if employee_id:
             queryset = queryset.filter(employee_id=employee_id)
         
-        # Filter by date range
+        # Filter by date range; recurring series are matched by their bounds
+        try:
+            date_from, date_to = self._date_range()
+        except ValueError:
+            raise ValidationError({'error': 'Invalid date format. Use YYYY-MM-DD'})
+        
+        if date_from and date_to:
+            queryset = breaks.in_range(queryset, date_from, date_to)
+        elif date_from:
+            queryset = queryset.filter(
+                Q(date__gte=date_from) |
+                Q(is_recurring=True) & (Q(recurrence_until__isnull=True) | Q(recurrence_until__gte=date_from))
+            )
+        elif date_to:
+            queryset = queryset.filter(date__lte=date_to)
+        
+        return queryset.select_related('employee')
+    
+    def _date_range(self):
         date_from = self.request.query_params.get('date_from')
         date_to = self.request.query_params.get('date_to')
+        return (
+            date_type.fromisoformat(date_from) if date_from else None,
+            date_type.fromisoformat(date_to) if date_to else None
+        )
+    
+    def list(self, request, *args, **kwargs):
+        """
+        List breaks; with date_from and date_to recurring breaks are
+        expanded into their occurrences within the range
+        """
+        try:
+            date_from, date_to = self._date_range()
+        except ValueError:
+            return Response(
+                {'error': 'Invalid date format. Use YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        if date_from:
-            queryset = queryset.filter(date__gte=date_from)
+        if not (date_from and date_to):
+            return super().list(request, *args, **kwargs)
         
-        if date_to:
-            queryset = queryset.filter(date__lte=date_to)
+        if date_to < date_from or (date_to - date_from).days >= self.LIST_MAX_DAYS:
+            return Response(
+                {'error': f'Date range must be between 1 and {self.LIST_MAX_DAYS} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return queryset.select_related('employee')
+        queryset = self.filter_queryset(self.get_queryset())
+        occurrences = breaks.expand(queryset, date_from, date_to)
+        
+        page = self.paginate_queryset(occurrences)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        
+        return Response(self.get_serializer(occurrences, many=True).data)
+    
+    @action(detail=True, methods=['post'])
+    def skip_date(self, request, pk=None):
+        """
+        Remove one occurrence of a recurring break
+        """
+        break_obj = self.get_object()
+        
+        try:
+            skipped = date_type.fromisoformat(request.data.get('date', ''))
+        except ValueError:
+            return Response(
+                {'error': 'date is required (YYYY-MM-DD)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not break_obj.is_recurring:
+            return Response(
+                {'error': 'Break is not recurring'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if skipped not in break_obj.recurrence_exceptions:
+            break_obj.recurrence_exceptions = sorted(break_obj.recurrence_exceptions + [skipped])
+            break_obj.save(update_fields=['recurrence_exceptions', 'updated_at'])
+        
+        return Response(self.get_serializer(break_obj).data)
     
     @action(detail=False, methods=['delete'])
     def delete_recurring(self, request):
@@ -551,6 +1030,7 @@ class BreakViewSet(viewsets.ModelViewSet):
         if break_type:
             filters['break_type'] = break_type
         
+        # Each series is one row
         deleted_count, _ = Break.objects.filter(**filters).delete()
         
         return Response({
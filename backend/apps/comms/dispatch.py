@@ -0,0 +1,507 @@
+"""
+Concurrent, rate-limited SMS dispatch
+
+Workers claim due reminder jobs and pending campaign recipients with
+SELECT ... FOR UPDATE SKIP LOCKED and mark them `sending`, so any number
+of Celery workers drain the queue side by side without sending a message
+twice. A claim still `sending` after SMS_DISPATCH_CLAIM_TIMEOUT minutes
+(the worker died) is claimed again.
+
+A claimed batch is sent from a thread pool keeping up to
+SMS_DISPATCH_CONCURRENCY provider requests in flight. Every request takes
+a token from its provider's RateLimiter first; the tokens are counted in
+the cache (Redis), so the limit holds across workers. A message that
+would wait for a token past the dispatch deadline is put back unsent.
+Database work stays in the calling thread: opt-out and antispam checks
+run once per batch, results are written in bulk as they come in.
+
+Sent and failed requests and provider latency are counted per provider
+and minute in the cache, see provider_metrics().
+"""
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Campaign, CampaignRecipient, ContactLog, Message, Reminder, ReminderJob
+from .providers import SendResult, get_sms_provider
+from .utils import apply_placeholders_to_message, hash_message_body
+
+logger = logging.getLogger(__name__)
+
+# Reminder types sent regardless of marketing opt-in
+TRANSACTIONAL_TYPES = ('PREBOOK_CREATE', 'PREBOOK_UPDATE', 'PREBOOK_CANCEL', 'ONLINE_CONFIRM')
+MAX_ATTEMPTS = 5
+ANTISPAM_HOURS = 24
+ANTISPAM_ERROR = 'Antispam: same message sent recently'
+# A dispatch task stops taking tokens after this many seconds (beat runs every minute)
+TASK_SECONDS = 50
+# Results are written every FLUSH_SIZE sent messages
+FLUSH_SIZE = 50
+METRICS_TTL = 2 * 60 * 60
+
+COUNTS = ('claimed', 'sent', 'failed', 'skipped', 'deferred')
+JOB_FIELDS = ['status', 'provider_msg_id', 'error', 'attempts', 'updated_at']
+RECIPIENT_FIELDS = ['status', 'provider_msg_id', 'error', 'cost', 'sent_at', 'claimed_at']
+
+
+def _incr(key, delta, timeout):
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Expired between add and incr
+        cache.add(key, delta, timeout=timeout)
+        return delta
+
+
+class RateLimiter:
+    """
+    Token bucket per provider account, shared by all workers through the cache
+
+    Time is cut into ticks of at least a second holding `capacity` tokens,
+    capacity / tick being the provider rate. reserve() takes a token from
+    the first tick that has one left.
+    """
+
+    def __init__(self, key, rate_per_min):
+        self.key = key
+        self.capacity = max(1, -(-rate_per_min // 60))
+        self.tick = 60 * self.capacity / max(1, rate_per_min)
+
+    def reserve(self, max_wait=None, now=None):
+        """
+        Take a token, return the seconds until it may be used, or None
+        (taking nothing) if that is more than max_wait seconds away
+        """
+        now = time.time() if now is None else now
+        hint_key = f'sms-rate:{self.key}:next'
+        tick = max(int(now // self.tick), cache.get(hint_key) or 0)
+        while True:
+            wait = max(0.0, tick * self.tick - now)
+            if max_wait is not None and wait > max_wait:
+                return None
+            taken = _incr(f'sms-rate:{self.key}:{tick}', 1, int(wait + self.tick) + 60)
+            if taken <= self.capacity:
+                if taken == self.capacity:
+                    # Later reservations start from the next tick
+                    cache.set(hint_key, tick + 1, timeout=int(wait + self.tick) + 60)
+                return wait
+            tick += 1
+
+    def acquire(self, max_wait=None):
+        """Wait for a token, return False if it is more than max_wait seconds away"""
+        wait = self.reserve(max_wait)
+        if wait is None:
+            return False
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+def provider_key(provider):
+    """Rate limit and metrics key; providers sharing an account share the limit"""
+    account = hashlib.sha256(provider.api_key.encode('utf-8')).hexdigest()[:16]
+    return f'{type(provider).__name__}:{account}'
+
+
+def record(key, success, latency, now=None):
+    """Count a provider request in the metrics of its minute"""
+    minute = int((time.time() if now is None else now) // 60)
+    _incr(f'sms-metrics:{key}:{minute}:{"sent" if success else "failed"}', 1, METRICS_TTL)
+    _incr(f'sms-metrics:{key}:{minute}:latency_ms', int(latency * 1000), METRICS_TTL)
+
+
+def provider_metrics(provider, minutes=5, now=None):
+    """Sent, failed and average latency per minute over the last `minutes` minutes"""
+    key = provider_key(provider)
+    current = int((time.time() if now is None else now) // 60)
+    names = ('sent', 'failed', 'latency_ms')
+    window = range(current - minutes + 1, current + 1)
+    values = cache.get_many([f'sms-metrics:{key}:{minute}:{name}' for minute in window for name in names])
+
+    rows = []
+    for minute in window:
+        sent, failed, latency = (values.get(f'sms-metrics:{key}:{minute}:{name}', 0) for name in names)
+        rows.append({
+            'minute': datetime.fromtimestamp(minute * 60, tz=dt_timezone.utc).isoformat(),
+            'sent': sent,
+            'failed': failed,
+            'avg_latency_ms': round(latency / (sent + failed)) if sent + failed else None,
+        })
+    requests = sum(row['sent'] + row['failed'] for row in rows)
+    latency = sum(values.get(f'sms-metrics:{key}:{minute}:latency_ms', 0) for minute in window)
+    return {
+        'provider': type(provider).__name__,
+        'rate_limit_per_min': provider.rate_limit_per_min,
+        'sent': sum(row['sent'] for row in rows),
+        'failed': sum(row['failed'] for row in rows),
+        'per_minute': round(requests / minutes, 1),
+        'avg_latency_ms': round(latency / requests) if requests else None,
+        'minutes': rows,
+    }
+
+
+class Outgoing:
+    """A claimed message of a batch and its send result"""
+
+    def __init__(self, item, patient, provider, sender, phone, body):
+        self.item = item
+        self.patient = patient
+        self.provider = provider
+        self.key = provider_key(provider)
+        self.sender = sender
+        self.phone = phone
+        self.body = body
+        self.body_hash = hash_message_body(body)
+        # None until sent; stays None if no token was free before the deadline
+        self.result = None
+        self.sent_at = None
+
+
+def _send(outgoing, limiter, deadline):
+    if not limiter.acquire(max_wait=deadline - time.time()):
+        return outgoing
+    started = time.monotonic()
+    try:
+        result = outgoing.provider.send(sender=outgoing.sender, phone=outgoing.phone, body=outgoing.body)
+    except Exception as e:
+        logger.error(f"Provider error sending to {outgoing.phone}: {e}")
+        result = SendResult(success=False, message_id='', cost=Decimal('0'), error=str(e))
+    record(outgoing.key, result.success, time.monotonic() - started)
+    outgoing.result = result
+    outgoing.sent_at = timezone.now()
+    return outgoing
+
+
+def send_all(outgoing, deadline, concurrency=None):
+    """
+    Send from a thread pool, yield every Outgoing as it completes
+
+    Only provider requests run in the threads.
+    """
+    limiters = {}
+    for item in outgoing:
+        if item.key not in limiters:
+            limiters[item.key] = RateLimiter(item.key, item.provider.rate_limit_per_min)
+    workers = min(concurrency or settings.SMS_DISPATCH_CONCURRENCY, len(outgoing)) or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sms-dispatch') as pool:
+        futures = [pool.submit(_send, item, limiters[item.key], deadline) for item in outgoing]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def claim(queryset, limit, **claim_fields):
+    """
+    Lock up to `limit` rows of queryset, skipping rows locked by other
+    workers, mark them `sending`; return their ids
+    """
+    with transaction.atomic():
+        ids = list(queryset.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+        queryset.model.objects.filter(id__in=ids).update(status='sending', **claim_fields)
+    return ids
+
+
+def drop_recently_sent(outgoing, now):
+    """
+    Split outgoing into messages to send and messages the patient got
+    within ANTISPAM_HOURS (or twice in the batch); one query per batch
+    """
+    if not outgoing:
+        return [], []
+    sent = set(ContactLog.objects.filter(
+        patient_id__in={item.patient.id for item in outgoing},
+        body_hash__in={item.body_hash for item in outgoing},
+        created_at__gte=now - timedelta(hours=ANTISPAM_HOURS)
+    ).values_list('patient_id', 'body_hash'))
+
+    send, spam = [], []
+    for item in outgoing:
+        pair = (item.patient.id, item.body_hash)
+        if pair in sent:
+            spam.append(item)
+        else:
+            sent.add(pair)
+            send.append(item)
+    return send, spam
+
+
+def _records(item, organization, channel, context, **log_fields):
+    """Message and ContactLog of a sent Outgoing"""
+    result = item.result
+    status = 'sent' if result.success else 'failed'
+    message = Message(
+        organization=organization,
+        patient=item.patient,
+        channel=channel,
+        body=item.body,
+        sender=item.sender,
+        context=context,
+        status=status,
+        cost=result.cost,
+        provider_msg_id=result.message_id if result.success else '',
+        error=result.error,
+        sent_at=item.sent_at if result.success else None
+    )
+    log = ContactLog(
+        organization=organization,
+        patient=item.patient,
+        channel=channel,
+        body_hash=item.body_hash,
+        status=status,
+        message=message,
+        **log_fields
+    )
+    return message, log
+
+
+def _deadline(seconds):
+    return time.time() + (TASK_SECONDS if seconds is None else seconds)
+
+
+# ==================== Reminders ====================
+
+
+def _save_reminder_results(done, counts):
+    messages, logs, sent = [], [], {}
+    jobs = [item.item for item in done]
+    for item in done:
+        job = item.item
+        job.updated_at = timezone.now()
+        if item.result is None:
+            # No token before the deadline, next run sends it
+            job.status = 'queued'
+            counts['deferred'] += 1
+            continue
+        reminder, result = job.reminder, item.result
+        message, log = _records(
+            item, reminder.organization, reminder.channel,
+            {'source': 'reminder', 'source_id': str(reminder.id), 'job_id': str(job.id)},
+            related_visit=job.visit
+        )
+        messages.append(message)
+        logs.append(log)
+        job.status = 'sent' if result.success else 'failed'
+        job.provider_msg_id = message.provider_msg_id
+        job.error = result.error
+        job.attempts += 1
+        if result.success:
+            sent[reminder.id] = sent.get(reminder.id, 0) + 1
+            counts['sent'] += 1
+        else:
+            counts['failed'] += 1
+
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        ContactLog.objects.bulk_create(logs)
+        ReminderJob.objects.bulk_update(jobs, JOB_FIELDS)
+        for reminder_id, count in sent.items():
+            Reminder.objects.filter(id=reminder_id).update(sent_count=F('sent_count') + count)
+
+
+def dispatch_reminders(limit=None, concurrency=None, seconds=None, now=None):
+    """
+    Claim and send one batch of due reminder jobs, return counts
+
+    Nothing is sent after `seconds` (TASK_SECONDS by default).
+    """
+    deadline = _deadline(seconds)
+    now = now or timezone.now()
+    stale = now - timedelta(minutes=settings.SMS_DISPATCH_CLAIM_TIMEOUT)
+    due = ReminderJob.objects.filter(
+        Q(status='queued', scheduled_at__lte=now) | Q(status='sending', updated_at__lt=stale)
+    )
+    ids = claim(due, limit or settings.SMS_DISPATCH_BATCH_SIZE, updated_at=now)
+    counts = dict.fromkeys(COUNTS, 0)
+    counts['claimed'] = len(ids)
+    if not ids:
+        return counts
+
+    jobs = ReminderJob.objects.filter(id__in=ids).select_related(
+        'reminder__organization', 'patient', 'visit', 'appointment'
+    )
+    providers = {}
+    outgoing, finished = [], []
+    for job in jobs:
+        reminder = job.reminder
+        if not reminder.enabled:
+            job.status, job.error = 'skipped', 'Reminder disabled'
+        elif not job.patient.is_marketing_opt_in and reminder.type not in TRANSACTIONAL_TYPES:
+            job.status, job.error = 'skipped', 'Patient opted out'
+        else:
+            try:
+                body = apply_placeholders_to_message(reminder.body, job.patient, visit=job.visit, appointment=job.appointment)
+            except Exception as e:
+                logger.error(f"Error preparing job {job.id}: {e}")
+                job.attempts += 1
+                if job.attempts >= MAX_ATTEMPTS:
+                    job.status, job.error = 'failed', f"Max attempts reached: {str(e)}"
+                else:
+                    job.status = 'queued'
+                finished.append(job)
+                continue
+            organization = reminder.organization
+            if organization.id not in providers:
+                providers[organization.id] = get_sms_provider(organization)
+            outgoing.append(Outgoing(job, job.patient, providers[organization.id], organization.name[:20], job.patient.phone, body))
+            continue
+        counts['skipped'] += 1
+        finished.append(job)
+
+    outgoing, spam = drop_recently_sent(outgoing, now)
+    for item in spam:
+        item.item.status, item.item.error = 'skipped', ANTISPAM_ERROR
+        finished.append(item.item)
+    counts['skipped'] += len(spam)
+    for job in finished:
+        job.updated_at = timezone.now()
+    ReminderJob.objects.bulk_update(finished, JOB_FIELDS)
+
+    for done in _chunked(send_all(outgoing, deadline, concurrency), FLUSH_SIZE):
+        _save_reminder_results(done, counts)
+    logger.info(f"Dispatched reminder jobs: {counts}")
+    return counts
+
+
+def drain_reminders(limit=None, concurrency=None, seconds=None):
+    """Dispatch batches of due reminder jobs until none are left or time is up"""
+    limit = limit or settings.SMS_DISPATCH_BATCH_SIZE
+    deadline = _deadline(seconds)
+    totals = dict.fromkeys(COUNTS, 0)
+    while True:
+        counts = dispatch_reminders(limit, concurrency, seconds=deadline - time.time())
+        for name, value in counts.items():
+            totals[name] += value
+        if counts['claimed'] < limit or counts['deferred'] or time.time() >= deadline:
+            return totals
+
+
+# ==================== Campaigns ====================
+
+
+def _save_campaign_results(campaign, done, counts):
+    messages, logs = [], []
+    recipients = [item.item for item in done]
+    sent = failed = 0
+    cost = Decimal('0')
+    for item in done:
+        recipient, result = item.item, item.result
+        if result is None:
+            recipient.status = 'pending'
+            counts['deferred'] += 1
+            continue
+        message, log = _records(
+            item, campaign.organization, campaign.channel,
+            {'source': 'campaign', 'source_id': str(campaign.id), 'recipient_id': str(recipient.id)}
+        )
+        messages.append(message)
+        logs.append(log)
+        recipient.status = 'sent' if result.success else 'failed'
+        recipient.provider_msg_id = message.provider_msg_id
+        recipient.error = result.error
+        recipient.cost = result.cost
+        recipient.sent_at = message.sent_at
+        if result.success:
+            sent += 1
+            cost += result.cost
+        else:
+            failed += 1
+
+    counts['sent'] += sent
+    counts['failed'] += failed
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        ContactLog.objects.bulk_create(logs)
+        CampaignRecipient.objects.bulk_update(recipients, RECIPIENT_FIELDS)
+        Campaign.objects.filter(id=campaign.id).update(
+            sent_count=F('sent_count') + sent,
+            failed_count=F('failed_count') + failed,
+            total_cost=F('total_cost') + cost
+        )
+
+
+def dispatch_campaign(campaign, template_body, limit=None, concurrency=None, seconds=None, now=None):
+    """
+    Claim and send one batch of a campaign's pending recipients, return counts
+
+    Nothing is sent after `seconds` (TASK_SECONDS by default).
+    """
+    deadline = _deadline(seconds)
+    now = now or timezone.now()
+    stale = now - timedelta(minutes=settings.SMS_DISPATCH_CLAIM_TIMEOUT)
+    due = CampaignRecipient.objects.filter(campaign=campaign).filter(
+        Q(status='pending') | Q(status='sending', claimed_at__lt=stale)
+    )
+    ids = claim(due, limit or settings.SMS_DISPATCH_BATCH_SIZE, claimed_at=now)
+    counts = dict.fromkeys(COUNTS, 0)
+    counts['claimed'] = len(ids)
+    if not ids:
+        return counts
+
+    provider = get_sms_provider(campaign.organization)
+    outgoing, finished = [], []
+    failed = 0
+    for recipient in CampaignRecipient.objects.filter(id__in=ids).select_related('patient'):
+        if not recipient.patient.is_marketing_opt_in:
+            recipient.status = 'opted_out'
+            counts['skipped'] += 1
+            finished.append(recipient)
+            continue
+        try:
+            body = apply_placeholders_to_message(template_body, recipient.patient)
+        except Exception as e:
+            logger.error(f"Error preparing recipient {recipient.id}: {e}")
+            recipient.status, recipient.error = 'failed', str(e)
+            failed += 1
+            finished.append(recipient)
+            continue
+        outgoing.append(Outgoing(recipient, recipient.patient, provider, campaign.sender_name, recipient.phone, body))
+
+    outgoing, spam = drop_recently_sent(outgoing, now)
+    for item in spam:
+        item.item.status, item.item.error = 'skipped', ANTISPAM_ERROR
+        finished.append(item.item)
+    counts['skipped'] += len(spam)
+    counts['failed'] += failed
+    with transaction.atomic():
+        CampaignRecipient.objects.bulk_update(finished, RECIPIENT_FIELDS)
+        if failed:
+            Campaign.objects.filter(id=campaign.id).update(failed_count=F('failed_count') + failed)
+
+    for done in _chunked(send_all(outgoing, deadline, concurrency), FLUSH_SIZE):
+        _save_campaign_results(campaign, done, counts)
+    logger.info(f"Dispatched campaign {campaign.id}: {counts}")
+    return counts
+
+
+def drain_campaign(campaign, template_body, limit=None, concurrency=None, seconds=None):
+    """
+    Dispatch batches of a running campaign until none are left, it is
+    paused or time is up; counts include the recipients `remaining`
+    """
+    limit = limit or settings.SMS_DISPATCH_BATCH_SIZE
+    deadline = _deadline(seconds)
+    totals = dict.fromkeys(COUNTS, 0)
+    while Campaign.objects.filter(id=campaign.id, status__in=['running', 'scheduled']).exists():
+        counts = dispatch_campaign(campaign, template_body, limit, concurrency, seconds=deadline - time.time())
+        for name, value in counts.items():
+            totals[name] += value
+        if counts['claimed'] < limit or counts['deferred'] or time.time() >= deadline:
+            break
+    totals['remaining'] = CampaignRecipient.objects.filter(campaign=campaign, status__in=['pending', 'sending']).count()
+    return totals
@@ -0,0 +1,41 @@
+"""
+Management command to generate scheduled reminder jobs
+
+Runs the same set-based generator as the nightly Celery task
+(see apps.comms.reminder_jobs). With --dry-run it only reports how
+many jobs would be created.
+
+Usage:
+    python manage.py generate_reminder_jobs [--dry-run]
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from apps.comms import reminder_jobs
+
+
+class Command(BaseCommand):
+    help = 'Generate AFTER_VISIT and BIRTHDAY reminder jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the jobs without creating them',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be saved'))
+        
+        started = time.monotonic()
+        counts = reminder_jobs.generate(dry_run=options['dry_run'])
+        
+        self.stdout.write('\n' + '=' * 60)
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {sum(counts.values())} reminder jobs in {time.monotonic() - started:.1f}s'
+        ))
+        for reminder_type, count in counts.items():
+            self.stdout.write(f'  {reminder_type}: {count}')
+        self.stdout.write('=' * 60)
@@ -0,0 +1,65 @@
+# Generated manually: unique generated reminder jobs per event
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+BATCH_SIZE = 2000
+
+
+def fill_event_date(apps, schema_editor):
+    """
+    Set event_date on AFTER_VISIT and BIRTHDAY jobs generated before the
+    field existed, so the generator does not create them again: the visit
+    day, or the day the job was created shifted by offset_days. Of jobs
+    clashing on (reminder, patient, event_date) the oldest gets the date.
+    """
+    ReminderJob = apps.get_model('comms', 'ReminderJob')
+    db_alias = schema_editor.connection.alias
+    jobs = ReminderJob.objects.using(db_alias).filter(
+        reminder__type__in=['AFTER_VISIT', 'BIRTHDAY'], event_date__isnull=True
+    ).select_related('reminder', 'visit__appointment').order_by('created_at', 'id')
+
+    seen = set()
+    batch = []
+    for job in jobs.iterator(chunk_size=BATCH_SIZE):
+        offset = timedelta(days=job.reminder.offset_days)
+        if job.reminder.type == 'BIRTHDAY':
+            event_date = timezone.localdate(job.created_at) + offset
+        elif job.visit_id and job.visit.appointment_id:
+            event_date = timezone.localdate(job.visit.appointment.start_datetime)
+        else:
+            event_date = timezone.localdate(job.created_at) - offset
+        key = (job.reminder_id, job.patient_id, event_date)
+        if key in seen:
+            continue
+        seen.add(key)
+        job.event_date = event_date
+        batch.append(job)
+        if len(batch) >= BATCH_SIZE:
+            ReminderJob.objects.using(db_alias).bulk_update(batch, ['event_date'])
+            batch = []
+    if batch:
+        ReminderJob.objects.using(db_alias).bulk_update(batch, ['event_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comms', '0004_add_patient_contact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminderjob',
+            name='event_date',
+            field=models.DateField(blank=True, help_text='Visit date or birthday the job was generated for (see apps.comms.reminder_jobs)', null=True),
+        ),
+        migrations.RunPython(fill_event_date, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reminderjob',
+            constraint=models.UniqueConstraint(fields=('reminder', 'patient', 'event_date'), name='reminder_jobs_unique_event'),
+        ),
+    ]
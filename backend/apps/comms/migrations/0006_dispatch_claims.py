@@ -0,0 +1,28 @@
+# Generated manually: dispatch workers claim reminder jobs and campaign recipients
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comms', '0005_reminderjob_event_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaignrecipient',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, help_text='Claimed by a dispatch worker (see apps.comms.dispatch)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='campaignrecipient',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('failed', 'Failed'), ('opted_out', 'Opted Out')], default='pending', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='reminderjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='queued', max_length=20),
+        ),
+    ]
@@ -169,6 +169,7 @@ class CampaignRecipient(models.Model):
     """Campaign recipient (materialized list)"""
     STATUS_CHOICES = [
         ('pending', 'Pending'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('delivered', 'Delivered'),
         ('failed', 'Failed'),
@@ -185,6 +186,7 @@ class CampaignRecipient(models.Model):
     cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     sent_at = models.DateTimeField(null=True, blank=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True, help_text='Claimed by a dispatch worker (see apps.comms.dispatch)')
     
     class Meta:
         db_table = 'campaign_recipients'
@@ -274,6 +276,7 @@ class ReminderJob(models.Model):
     """Reminder job queue"""
     STATUS_CHOICES = [
         ('queued', 'Queued'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('delivered', 'Delivered'),
         ('failed', 'Failed'),
@@ -287,6 +290,11 @@ class ReminderJob(models.Model):
     appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True)
     
     scheduled_at = models.DateTimeField(help_text='Scheduled send time')
+    event_date = models.DateField(
+        null=True,
+        blank=True,
+        help_text='Visit date or birthday the job was generated for (see apps.comms.reminder_jobs)'
+    )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
     provider_msg_id = models.CharField(max_length=200, blank=True)
     error = models.TextField(blank=True)
@@ -303,6 +311,13 @@ class ReminderJob(models.Model):
             models.Index(fields=['scheduled_at', 'status']),
             models.Index(fields=['patient']),
         ]
+        constraints = [
+            # One generated job per reminder, patient and event
+            models.UniqueConstraint(
+                fields=['reminder', 'patient', 'event_date'],
+                name='reminder_jobs_unique_event'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.reminder.name} -> {self.patient.full_name} ({self.get_status_display()})"
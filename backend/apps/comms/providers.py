@@ -1,4 +1,6 @@
 import logging
+import random
+import uuid
 from typing import Protocol, NamedTuple
 from decimal import Decimal
 import time
@@ -55,13 +57,19 @@ class SmsProvider(Protocol):
 
 
 class MockSMSProvider:
-    """Mock SMS provider for development"""
+    """
+    Mock SMS provider for development
+    latency (seconds per request) and failure_rate simulate a real gateway
+    """
     
-    def __init__(self, api_key: str = '', api_secret: str = '', rate_limit: int = 30, price: Decimal = Decimal('15.0')):
+    def __init__(self, api_key: str = '', api_secret: str = '', rate_limit: int = 30, price: Decimal = Decimal('15.0'),
+                 latency: float = 0, failure_rate: float = 0.1):
         self.api_key = api_key
         self.api_secret = api_secret
         self._rate_limit = rate_limit
         self._price = price
+        self.latency = latency
+        self.failure_rate = failure_rate
         # Simulate delivery status storage
         self._deliveries = {}
     
@@ -80,11 +88,13 @@ class MockSMSProvider:
         segments = self.calculate_segments(body, is_cyrillic)
         cost = self._price * segments
         
-        message_id = f'mock_{int(time.time())}_{hash(phone + body) % 1000000}'
+        message_id = f'mock_{uuid.uuid4().hex}'
         
-        # Simulate delivery (90% success rate)
-        import random
-        success = random.random() > 0.1
+        if self.latency:
+            time.sleep(self.latency)
+        
+        # Simulate delivery (90% success rate by default)
+        success = random.random() >= self.failure_rate
         
         if success:
             # Store for status check
@@ -118,7 +128,6 @@ class MockSMSProvider:
             return DeliveryStatus(status='failed', error='Message not found')
         
         # Simulate gradual delivery
-        import random
         if delivery['status'] == 'sent' and random.random() > 0.3:
             delivery['status'] = 'delivered'
             delivery['delivered_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
@@ -343,7 +352,9 @@ def get_sms_provider(organization=None) -> MockSMSProvider:
                         api_key=provider_config.api_key,
                         api_secret=provider_config.api_secret,
                         rate_limit=provider_config.rate_limit_per_min,
-                        price=provider_config.price_per_sms
+                        price=provider_config.price_per_sms,
+                        latency=getattr(settings, 'SMS_MOCK_LATENCY', 0),
+                        failure_rate=getattr(settings, 'SMS_MOCK_FAILURE_RATE', 0.1)
                     )
         except Exception as e:
             logger.warning(f"Failed to load provider config: {e}")
@@ -352,11 +363,21 @@ def get_sms_provider(organization=None) -> MockSMSProvider:
     provider_type = getattr(settings, 'SMS_PROVIDER', 'mock')
     
     if provider_type == 'mock':
-        return MockSMSProvider()
+        return MockSMSProvider(
+            rate_limit=getattr(settings, 'SMS_RATE_LIMIT_PER_MIN', 30),
+            latency=getattr(settings, 'SMS_MOCK_LATENCY', 0),
+            failure_rate=getattr(settings, 'SMS_MOCK_FAILURE_RATE', 0.1)
+        )
     elif provider_type == 'beesms':
-        return BeeSMSProvider(api_key=getattr(settings, 'SMS_API_KEY', ''))
+        return BeeSMSProvider(
+            api_key=getattr(settings, 'SMS_API_KEY', ''),
+            rate_limit=getattr(settings, 'SMS_RATE_LIMIT_PER_MIN', 30)
+        )
     elif provider_type == 'altel':
-        return AltelSMSProvider(api_key=getattr(settings, 'SMS_API_KEY', ''))
+        return AltelSMSProvider(
+            api_key=getattr(settings, 'SMS_API_KEY', ''),
+            rate_limit=getattr(settings, 'SMS_RATE_LIMIT_PER_MIN', 30)
+        )
     else:
         logger.warning(f"Unknown provider type '{provider_type}', falling back to mock")
         return MockSMSProvider()
@@ -0,0 +1,164 @@
+"""
+Set-based generation of scheduled reminder jobs
+
+Every enabled AFTER_VISIT and BIRTHDAY reminder costs one
+INSERT ... SELECT, whatever the number of visits: the candidates are
+joined from visits (or patients) of the reminder's organization, with an
+anti-join against the jobs already generated for the same event. The
+send time only depends on the reminder, so quiet hours are applied once
+per reminder. The unique (reminder, patient, event_date) constraint lets
+a repeated or concurrent run insert nothing twice.
+"""
+from calendar import isleap
+from datetime import datetime, time, timedelta
+
+from django.db import connection
+from django.db.models import BigIntegerField, Exists, OuterRef, Q, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from apps.patients.models import Patient
+from apps.visits.models import Visit
+from .models import Reminder, ReminderJob
+
+
+INSERT_FIELDS = (
+    'id', 'reminder', 'event_date', 'scheduled_at', 'created_at', 'updated_at',
+    'patient', 'visit', 'status', 'provider_msg_id', 'error', 'attempts',
+)
+INSERT_SQL = (
+    'INSERT INTO {table} ({columns}) '
+    "SELECT gen_random_uuid(), %s, %s, %s, %s, %s, c.patient_id, c.visit_id, 'queued', '', '', 0 "
+    'FROM ({candidates}) AS c (patient_id, visit_id) '
+    'ON CONFLICT DO NOTHING'
+)
+
+# Quiet hours, local time: nothing is sent from QUIET_START to QUIET_END
+QUIET_START = time(22, 0)
+QUIET_END = time(8, 0)
+# Hour a job falling into quiet hours is moved to
+RESUME_HOUR = {
+    'AFTER_VISIT': 8,
+    'BIRTHDAY': 9,
+}
+
+
+def after_quiet_hours(scheduled_at, hour=8):
+    """scheduled_at, or the next `hour` o'clock if it falls into quiet hours"""
+    local = timezone.localtime(scheduled_at)
+    if QUIET_END <= local.time() < QUIET_START:
+        return scheduled_at
+    moved = local.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if local.time() >= QUIET_START:
+        moved += timedelta(days=1)
+    return moved
+
+
+def _day_range(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def after_visit_candidates(reminder, today):
+    """
+    (patient_id, visit_id) of the first visit of every opted-in patient
+    on the day offset_days ago
+    """
+    day = today - timedelta(days=reminder.offset_days)
+    start, end = _day_range(day)
+    generated = ReminderJob.objects.filter(
+        reminder=reminder,
+        patient=OuterRef('appointment__patient'),
+        event_date=day
+    )
+    candidates = (
+        Visit.objects
+        .filter(
+            appointment__branch__organization_id=reminder.organization_id,
+            appointment__start_datetime__gte=start,
+            appointment__start_datetime__lt=end,
+            appointment__patient__is_active=True,
+            appointment__patient__is_marketing_opt_in=True,
+        )
+        .exclude(status='canceled')
+        .filter(~Exists(generated))
+        .order_by('appointment__patient_id', 'appointment__start_datetime')
+        .distinct('appointment__patient_id')
+        .values_list('appointment__patient_id', 'id')
+    )
+    return day, candidates
+
+
+def birthday_candidates(reminder, today):
+    """
+    (patient_id, None) of opted-in patients with a birthday in
+    offset_days; February 29 birthdays fall on February 28 in other years
+    """
+    day = today + timedelta(days=reminder.offset_days)
+    birthdays = Q(birth_date__month=day.month, birth_date__day=day.day)
+    if (day.month, day.day) == (2, 28) and not isleap(day.year):
+        birthdays |= Q(birth_date__month=2, birth_date__day=29)
+    generated = ReminderJob.objects.filter(reminder=reminder, patient=OuterRef('pk'), event_date=day)
+    candidates = (
+        Patient.objects
+        .filter(
+            birthdays,
+            organizations=reminder.organization_id,
+            is_active=True,
+            is_marketing_opt_in=True,
+        )
+        .filter(~Exists(generated))
+        .order_by()
+        .values_list('id', Cast(Value(None), BigIntegerField()))
+    )
+    return day, candidates
+
+
+CANDIDATES = {
+    'AFTER_VISIT': after_visit_candidates,
+    'BIRTHDAY': birthday_candidates,
+}
+
+
+def insert_jobs(reminder, event_date, scheduled_at, candidates):
+    """
+    Insert a queued job for every candidate in one INSERT ... SELECT,
+    return the number inserted
+
+    Candidates that already got a job (a concurrent run) are skipped by
+    the unique constraint.
+    """
+    opts = ReminderJob._meta
+    quote = connection.ops.quote_name
+    columns = [opts.get_field(name).column for name in INSERT_FIELDS]
+    select_sql, select_params = candidates.query.sql_with_params()
+    now = timezone.now()
+    sql = INSERT_SQL.format(
+        table=quote(opts.db_table),
+        columns=', '.join(quote(column) for column in columns),
+        candidates=select_sql,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [reminder.id, event_date, scheduled_at, now, now, *select_params])
+        return cursor.rowcount
+
+
+def generate(now=None, dry_run=False):
+    """
+    Generate the jobs of all enabled scheduled reminders, return the
+    number of jobs per reminder type
+
+    With dry_run the candidates are only counted.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    counts = dict.fromkeys(CANDIDATES, 0)
+
+    for reminder in Reminder.objects.filter(enabled=True, type__in=CANDIDATES).order_by('created_at'):
+        event_date, candidates = CANDIDATES[reminder.type](reminder, today)
+        if dry_run:
+            counts[reminder.type] += candidates.count()
+            continue
+        scheduled_at = after_quiet_hours(now + timedelta(hours=reminder.offset_hours), RESUME_HOUR[reminder.type])
+        counts[reminder.type] += insert_jobs(reminder, event_date, scheduled_at, candidates)
+    return counts
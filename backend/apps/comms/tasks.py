@@ -26,220 +26,31 @@ def is_quiet_hours(dt=None):
         return quiet_start <= local_time < quiet_end
 
 
-def apply_placeholders(body, patient, visit=None, appointment=None):
-    """Apply placeholders to message body (wrapper for utils function)"""
-    from .utils import apply_placeholders_to_message
-    return apply_placeholders_to_message(body, patient, visit, appointment)
-
-
-def check_antispam(patient, body_hash, window_hours=24):
-    """Check if same message was sent to patient within window"""
-    from .models import ContactLog
-    
-    cutoff = timezone.now() - timedelta(hours=window_hours)
-    return ContactLog.objects.filter(
-        patient=patient,
-        body_hash=body_hash,
-        created_at__gte=cutoff
-    ).exists()
-
-
 # ==================== Marketing Tasks ====================
 
 
 @shared_task
-def generate_reminder_jobs():
-    """Generate reminder jobs for AFTER_VISIT, BIRTHDAY, BONUS_* reminders (runs daily at 01:00)"""
-    from .models import Reminder, ReminderJob
-    from apps.patients.models import Patient
-    from apps.visits.models import Visit
-    
-    now = timezone.now()
-    today = now.date()
-    
-    # AFTER_VISIT reminders
-    after_visit_reminders = Reminder.objects.filter(
-        enabled=True,
-        type='AFTER_VISIT'
-    )
-    
-    for reminder in after_visit_reminders:
-        # Find visits from N days ago
-        target_date = today - timedelta(days=reminder.offset_days)
-        
-        visits = Visit.objects.filter(
-            date=target_date,
-            patient__is_marketing_opt_in=True
-        ).select_related('patient')
-        
-        for visit in visits:
-            # Check if job already exists
-            if not ReminderJob.objects.filter(reminder=reminder, visit=visit).exists():
-                scheduled_at = now + timedelta(hours=reminder.offset_hours)
-                
-                # Adjust for quiet hours
-                if is_quiet_hours(scheduled_at):
-                    scheduled_at = scheduled_at.replace(hour=8, minute=0, second=0, microsecond=0)
-                    if scheduled_at < now:
-                        scheduled_at += timedelta(days=1)
-                
-                ReminderJob.objects.create(
-                    reminder=reminder,
-                    patient=visit.patient,
-                    visit=visit,
-                    scheduled_at=scheduled_at,
-                    status='queued'
-                )
-                logger.info(f"Created AFTER_VISIT job for patient {visit.patient.id}")
+def generate_reminder_jobs(dry_run=False):
+    """Generate reminder jobs for AFTER_VISIT and BIRTHDAY reminders (runs daily at 01:00)"""
+    from .reminder_jobs import generate
     
-    # BIRTHDAY reminders
-    birthday_reminders = Reminder.objects.filter(
-        enabled=True,
-        type='BIRTHDAY'
-    )
-    
-    for reminder in birthday_reminders:
-        # Find patients with birthday today + offset_days
-        target_date = today + timedelta(days=reminder.offset_days)
-        
-        patients = Patient.objects.filter(
-            is_marketing_opt_in=True,
-            birth_date__month=target_date.month,
-            birth_date__day=target_date.day
-        )
-        
-        for patient in patients:
-            # Check if job already exists for this year
-            if not ReminderJob.objects.filter(
-                reminder=reminder,
-                patient=patient,
-                scheduled_at__year=now.year
-            ).exists():
-                scheduled_at = now + timedelta(hours=reminder.offset_hours)
-                
-                # Adjust for quiet hours
-                if is_quiet_hours(scheduled_at):
-                    scheduled_at = scheduled_at.replace(hour=9, minute=0, second=0, microsecond=0)
-                
-                ReminderJob.objects.create(
-                    reminder=reminder,
-                    patient=patient,
-                    scheduled_at=scheduled_at,
-                    status='queued'
-                )
-                logger.info(f"Created BIRTHDAY job for patient {patient.id}")
-    
-    logger.info(f"Reminder job generation completed")
+    counts = generate(dry_run=dry_run)
+    logger.info(f"Reminder job generation completed: {counts}")
+    return counts
 
 
 @shared_task
 def process_reminder_queue():
-    """Process queued reminder jobs (runs every minute)"""
-    from .models import ReminderJob, Message, ContactLog
-    from .providers import get_sms_provider
-    
-    now = timezone.now()
-    
-    # Get jobs ready to send
-    jobs = ReminderJob.objects.filter(
-        status='queued',
-        scheduled_at__lte=now
-    ).select_related('reminder', 'patient').prefetch_related('patient__organizations')[:100]  # Batch limit
+    """
+    Send due reminder jobs (runs every minute)
+    Overlapping runs and several workers share the queue, see apps.comms.dispatch
+    """
+    from .dispatch import drain_reminders
     
-    for job in jobs:
-        try:
-            # Check if reminder is still enabled
-            if not job.reminder.enabled:
-                job.status = 'skipped'
-                job.error = 'Reminder disabled'
-                job.save()
-                continue
-            
-            # Check opt-in
-            if not job.patient.is_marketing_opt_in:
-                # Allow transactional messages (PREBOOK_*, ONLINE_CONFIRM)
-                if job.reminder.type not in ['PREBOOK_CREATE', 'PREBOOK_UPDATE', 'PREBOOK_CANCEL', 'ONLINE_CONFIRM']:
-                    job.status = 'skipped'
-                    job.error = 'Patient opted out'
-                    job.save()
-                    continue
-            
-            # Apply placeholders
-            body = apply_placeholders(
-                job.reminder.body,
-                job.patient,
-                visit=job.visit,
-                appointment=job.appointment
-            )
-            
-            # Check antispam
-            body_hash = hashlib.sha256(body.encode('utf-8')).hexdigest()
-            if check_antispam(job.patient, body_hash, window_hours=24):
-                job.status = 'skipped'
-                job.error = 'Antispam: same message sent recently'
-                job.save()
-                logger.warning(f"Skipped job {job.id} due to antispam")
-                continue
-            
-            # Send message
-            provider = get_sms_provider(job.patient.organization)
-            result = provider.send(
-                sender=job.patient.organization.name[:20] if hasattr(job.patient.organization, 'name') else 'CLINIC',
-                phone=job.patient.phone,
-                body=body
-            )
-            
-            # Create message record
-            message = Message.objects.create(
-                organization=job.patient.organization,
-                patient=job.patient,
-                channel=job.reminder.channel,
-                body=body,
-                sender=job.patient.organization.name[:20] if hasattr(job.patient.organization, 'name') else 'CLINIC',
-                context={
-                    'source': 'reminder',
-                    'source_id': str(job.reminder.id),
-                    'job_id': str(job.id)
-                },
-                status='sent' if result.success else 'failed',
-                cost=result.cost,
-                provider_msg_id=result.message_id if result.success else '',
-                error=result.error,
-                sent_at=now if result.success else None
-            )
-            
-            # Create contact log
-            ContactLog.objects.create(
-                organization=job.patient.organization,
-                patient=job.patient,
-                channel=job.reminder.channel,
-                body_hash=body_hash,
-                status='sent' if result.success else 'failed',
-                related_visit=job.visit,
-                message=message
-            )
-            
-            # Update job
-            job.status = 'sent' if result.success else 'failed'
-            job.provider_msg_id = result.message_id if result.success else ''
-            job.error = result.error
-            job.attempts += 1
-            job.save()
-            
-            # Update reminder stats
-            if result.success:
-                job.reminder.sent_count += 1
-                job.reminder.save(update_fields=['sent_count'])
-            
-            logger.info(f"Processed job {job.id}: {'success' if result.success else 'failed'}")
-            
-        except Exception as e:
-            logger.error(f"Error processing job {job.id}: {e}")
-            job.attempts += 1
-            if job.attempts >= 5:
-                job.status = 'failed'
-                job.error = f"Max attempts reached: {str(e)}"
-            job.save()
+    counts = drain_reminders()
+    if counts['claimed']:
+        logger.info(f"Reminder queue processed: {counts}")
+    return counts
 
 
 @shared_task
@@ -519,15 +330,15 @@ def run_scheduled_campaigns():
 @shared_task
 def send_campaign_batch(campaign_id):
     """
-    Send a batch of messages for a campaign
-    Respects rate limits and opt-in/out rules
+    Send the pending recipients of a campaign
+    Sends for up to a minute within the provider rate limit, then continues
+    in a new task; respects opt-in/out rules
     """
-    from .models import Campaign, CampaignRecipient, Message, ContactLog
-    from .providers import get_sms_provider
-    from .utils import apply_placeholders_to_message, hash_message_body
+    from .models import Campaign
+    from .dispatch import drain_campaign
     
     try:
-        campaign = Campaign.objects.get(id=campaign_id)
+        campaign = Campaign.objects.select_related('organization').get(id=campaign_id)
     except Campaign.DoesNotExist:
         logger.error(f"Campaign {campaign_id} not found")
         return
@@ -537,149 +348,26 @@ def send_campaign_batch(campaign_id):
         logger.info(f"Campaign {campaign_id} is {campaign.status}, skipping batch")
         return
     
-    # Get provider and rate limit
-    provider = get_sms_provider(campaign.organization)
-    rate_limit = provider.rate_limit_per_min
-    
-    # Get pending recipients (limit by rate)
-    recipients = CampaignRecipient.objects.filter(
-        campaign=campaign,
-        status='pending'
-    ).select_related('patient')[:rate_limit]
-    
-    if not recipients:
-        # No more pending recipients - campaign finished
-        campaign.status = 'finished'
-        campaign.save()
-        logger.info(f"Campaign {campaign_id} finished")
-        return
-    
     # Get message template
     try:
-        template = campaign.message_template
-        template_body = template.body
-    except:
+        template_body = campaign.message_template.body
+    except Exception:
         logger.error(f"Campaign {campaign_id} has no message template")
         campaign.status = 'failed'
         campaign.save()
         return
     
-    sent_count = 0
-    failed_count = 0
-    total_cost = 0
+    counts = drain_campaign(campaign, template_body)
     
-    for recipient in recipients:
-        try:
-            # Skip if patient opted out
-            if not recipient.patient.is_marketing_opt_in:
-                recipient.status = 'opted_out'
-                recipient.save()
-                continue
-            
-            # Apply placeholders
-            body = apply_placeholders_to_message(
-                template_body,
-                recipient.patient
-            )
-            
-            # Check antispam
-            body_hash = hash_message_body(body)
-            if check_antispam(recipient.patient, body_hash, window_hours=24):
-                recipient.status = 'skipped'
-                recipient.error = 'Antispam: same message sent recently'
-                recipient.save()
-                logger.warning(f"Skipped recipient {recipient.id} due to antispam")
-                continue
-            
-            # Send message
-            result = provider.send(
-                sender=campaign.sender_name,
-                phone=recipient.phone,
-                body=body
-            )
-            
-            # Create message record
-            message = Message.objects.create(
-                organization=campaign.organization,
-                patient=recipient.patient,
-                channel=campaign.channel,
-                body=body,
-                sender=campaign.sender_name,
-                context={
-                    'source': 'campaign',
-                    'source_id': str(campaign.id),
-                    'recipient_id': str(recipient.id)
-                },
-                status='sent' if result.success else 'failed',
-                cost=result.cost,
-                provider_msg_id=result.message_id if result.success else '',
-                error=result.error,
-                sent_at=timezone.now() if result.success else None
-            )
-            
-            # Create contact log
-            ContactLog.objects.create(
-                organization=campaign.organization,
-                patient=recipient.patient,
-                channel=campaign.channel,
-                body_hash=body_hash,
-                status='sent' if result.success else 'failed',
-                message=message
-            )
-            
-            # Update recipient
-            recipient.status = 'sent' if result.success else 'failed'
-            recipient.provider_msg_id = result.message_id if result.success else ''
-            recipient.error = result.error
-            recipient.cost = result.cost
-            recipient.sent_at = timezone.now() if result.success else None
-            recipient.save()
-            
-            if result.success:
-                sent_count += 1
-                total_cost += float(result.cost)
-            else:
-                failed_count += 1
-            
-            logger.info(f"Sent to {recipient.phone}: {'success' if result.success else 'failed'}")
-            
-        except Exception as e:
-            logger.error(f"Error sending to recipient {recipient.id}: {e}")
-            recipient.status = 'failed'
-            recipient.error = str(e)
-            recipient.save()
-            failed_count += 1
-    
-    # Update campaign stats
-    campaign.sent_count += sent_count
-    campaign.failed_count += failed_count
-    campaign.total_cost += total_cost
-    campaign.save()
-    
-    # Schedule next batch if there are more recipients
-    remaining = CampaignRecipient.objects.filter(
-        campaign=campaign,
-        status='pending'
-    ).count()
-    
-    if remaining > 0 and campaign.status == 'running':
-        # Schedule next batch after 1 minute (to respect rate limits)
-        send_campaign_batch.apply_async(
-            args=[str(campaign.id)],
-            countdown=60
-        )
-        logger.info(f"Scheduled next batch for campaign {campaign_id} ({remaining} remaining)")
+    if counts['remaining']:
+        # Recipients claimed by another worker are finished within the
+        # claim timeout; check back later instead of spinning
+        countdown = 0 if counts['claimed'] else 30
+        send_campaign_batch.apply_async(args=[str(campaign.id)], countdown=countdown)
+        logger.info(f"Continuing campaign {campaign_id} ({counts['remaining']} remaining)")
     else:
-        # Campaign finished
-        if campaign.status == 'running':
-            campaign.status = 'finished'
-            campaign.save()
-        logger.info(f"Campaign {campaign_id} completed: {sent_count} sent, {failed_count} failed")
+        Campaign.objects.filter(id=campaign.id, status='running').update(status='finished')
+        logger.info(f"Campaign {campaign_id} completed: {counts['sent']} sent, {counts['failed']} failed")
     
-    return {
-        'sent': sent_count,
-        'failed': failed_count,
-        'cost': total_cost,
-        'remaining': remaining
-    }
+    return counts
 
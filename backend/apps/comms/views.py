@@ -81,6 +81,19 @@ class SmsProviderViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         return SmsProviderModel.objects.filter(organization=self.request.user.organization)
+    
+    @action(detail=False, methods=['get'])
+    def metrics(self, request):
+        """Dispatch throughput of the organization's active provider (?minutes=5, up to 120)"""
+        from .dispatch import provider_metrics
+        
+        try:
+            minutes = min(max(int(request.query_params.get('minutes', 5)), 1), 120)
+        except ValueError:
+            return Response({'error': 'minutes must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        provider = get_sms_provider(request.user.organization)
+        return Response(provider_metrics(provider, minutes))
 
 
 class CampaignViewSet(viewsets.ModelViewSet):
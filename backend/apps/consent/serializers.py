@@ -7,7 +7,7 @@ from django.utils import timezone
 from django.conf import settings
 from .models import AccessRequest, ConsentToken, AccessGrant, AuditLog
 from apps.patients.models import Patient
-from apps.patients.utils.encryption import hash_iin, mask_iin
+from apps.patients.utils.encryption import hash_iin
 
 
 class PatientSearchSerializer(serializers.Serializer):
@@ -57,8 +57,7 @@ class PatientSearchResultSerializer(serializers.Serializer):
     
     def get_iin_masked(self, obj):
         """Return masked IIN"""
-        iin = obj.iin_decrypted
-        return mask_iin(iin) if iin else ''
+        return obj.iin_masked
 
 
 class AccessRequestSerializer(serializers.ModelSerializer):
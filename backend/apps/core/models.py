@@ -1,3 +1,4 @@
+import uuid
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 import pyotp
@@ -81,3 +82,55 @@ class UserBranchAccess(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.branch.name}"
 
+
+class Blob(models.Model):
+    """
+    Uploaded file content stored once per SHA-256 (see apps.core.uploads)
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100, blank=True)
+    file = models.FileField(max_length=255)
+    thumbnail = models.FileField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'blobs'
+        verbose_name = 'Blob'
+        verbose_name_plural = 'Blobs'
+    
+    def __str__(self):
+        return self.sha256
+
+
+class UploadSession(models.Model):
+    """
+    Resumable chunked upload in progress (see apps.core.uploads)
+    """
+    STATUS_CHOICES = [
+        ('uploading', 'Загружается'),
+        ('complete', 'Завершена'),
+        ('aborted', 'Отменена'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.BigIntegerField(help_text='Declared file size, bytes')
+    received = models.BigIntegerField(default=0, help_text='Bytes received so far')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    blob = models.ForeignKey(Blob, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'upload_sessions'
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
@@ -0,0 +1,91 @@
+"""
+Pagination classes
+"""
+import base64
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset (cursor) pagination on (ordering field, id)
+    
+    Each page is one indexed range query: no COUNT(*) and no OFFSET, so
+    the cost does not grow with the page number. The cursor is the
+    (value, id) of the last row of the previous page.
+    
+    Response: {"next": "<url or null>", "results": [...]}
+    """
+    ordering_field = 'start_datetime'
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        
+        queryset = queryset.order_by(self.ordering_field, 'id')
+        
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(queryset.model, cursor)
+            queryset = queryset.filter(
+                Q(**{f'{self.ordering_field}__gt': value}) |
+                Q(**{self.ordering_field: value, 'id__gt': pk})
+            )
+        
+        # One extra row tells whether there is a next page
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+    
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+    
+    def decode_cursor(self, model, cursor):
+        try:
+            decoded = base64.urlsafe_b64decode(cursor.encode()).decode()
+            value, pk = decoded.rsplit('|', 1)
+            field = model._meta.get_field(self.ordering_field)
+            return field.to_python(value), int(pk)
+        except (ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+    
+    def encode_cursor(self, row):
+        value = getattr(row, self.ordering_field)
+        value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        return base64.urlsafe_b64encode(f'{value}|{row.pk}'.encode()).decode()
+    
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+    
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data
+        })
+    
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
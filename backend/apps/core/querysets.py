@@ -0,0 +1,68 @@
+"""
+Queryset shapes per viewset action
+
+A shape says which columns and relations an action serializes: only()
+fields, select_related() and prefetch_related() lookups (strings or
+Prefetch objects). Shapes are registered per model and action, so list
+endpoints can load a few columns while detail endpoints keep the full
+prefetch. Actions without a shape of their own use the model default
+(action None), and querysets of unregistered models are left as they are.
+
+    register(Patient, ['list', 'quick_search'], only=[...])
+    register(Patient, None, prefetch=['organizations', ...])
+
+    queryset = apply(queryset, self.action)
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Shape:
+    only: tuple = ()
+    select_related: tuple = ()
+    prefetch: tuple = ()
+
+    def apply(self, queryset):
+        if self.only:
+            queryset = queryset.only(*self.only)
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.prefetch)
+        return queryset
+
+
+_registry = {}
+
+
+def register(model, actions, only=(), select_related=(), prefetch=()):
+    """
+    Declare the shape of a model for one action, a list of actions or
+    the default (None)
+    """
+    if actions is None or isinstance(actions, str):
+        actions = [actions]
+    shape = Shape(tuple(only), tuple(select_related), tuple(prefetch))
+    for action in actions:
+        _registry[(model._meta.label, action)] = shape
+    return shape
+
+
+def get_shape(model, action=None):
+    label = model._meta.label
+    return _registry.get((label, action)) or _registry.get((label, None))
+
+
+def apply(queryset, action=None):
+    shape = get_shape(queryset.model, action)
+    return shape.apply(queryset) if shape else queryset
+
+
+class ShapedQuerysetMixin:
+    """
+    Viewset mixin shaping get_queryset() by the registered shape of the
+    current action
+    """
+
+    def get_queryset(self):
+        return apply(super().get_queryset(), self.action)
@@ -7,6 +7,24 @@ import io
 import base64
 
 
+class SparseFieldsetMixin:
+    """
+    Serialize only the fields listed in ?fields=a,b,c (id is always kept)
+    """
+    fields_query_param = 'fields'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = request.query_params.get(self.fields_query_param) if request else None
+        if not requested:
+            return
+        
+        allowed = {name.strip() for name in requested.split(',')} | {'id'}
+        for name in set(self.fields) - allowed:
+            self.fields.pop(name)
+
+
 class OrganizationMinimalSerializer(serializers.Serializer):
     """
     Minimal organization serializer for user response
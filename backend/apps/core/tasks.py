@@ -0,0 +1,39 @@
+"""
+Celery tasks for core module
+"""
+import logging
+
+from celery import shared_task
+
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def make_blob_thumbnail(blob_id):
+    """
+    Thumbnail of an uploaded image or DICOM file
+    """
+    from .models import Blob
+    from .uploads import make_thumbnail
+    
+    blob = Blob.objects.filter(id=blob_id).first()
+    if blob is None or blob.thumbnail:
+        return {'blob_id': blob_id, 'thumbnail': bool(blob and blob.thumbnail)}
+    try:
+        created = make_thumbnail(blob)
+    except Exception as e:
+        # Damaged or unsupported file: the upload stays without a thumbnail
+        logger.warning(f"Thumbnail of blob {blob_id} failed: {e}")
+        created = False
+    return {'blob_id': blob_id, 'thumbnail': created}
+
+
+@shared_task
+def cleanup_upload_sessions():
+    """
+    Abort expired chunked uploads and remove their staging files
+    """
+    from .uploads import cleanup_expired
+    
+    return {'aborted': cleanup_expired()}
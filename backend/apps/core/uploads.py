@@ -0,0 +1,463 @@
+"""
+Resumable chunked uploads with content-addressed storage
+
+The client opens an UploadSession with the file name and size, PUTs the
+bytes in order (Content-Range: bytes start-end/total) and completes the
+session. After a dropped connection it reads `received` from the
+session and continues from that offset.
+
+Chunks are streamed to a staging file in CHUNKED_UPLOAD_DIR and never
+held in memory whole. The SHA-256 of the file is updated chunk by chunk
+in the worker that received them; a worker that missed chunks hashes
+the rest of the staged file once on complete. The content is stored
+once per hash as a Blob in the default storage (MEDIA_ROOT, or S3/MinIO
+with USE_S3): an identical upload reuses the existing Blob and its
+staging file is dropped. Hashing and storing run before the transaction
+that completes the session and links the Blob, so a failed link leaves
+the Blob on the session for a retry. Thumbnails are made by a Celery task.
+"""
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .models import Blob, UploadSession
+
+
+READ_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (256, 256)
+# Sessions whose running hash is kept in this process
+MAX_HASHERS = 256
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+UPLOAD_ID = r'(?P<upload_id>[0-9a-f-]{36})'
+
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Request that does not fit the upload session"""
+
+    def __init__(self, message, status=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+class StagedFile(File):
+    """Staging file; FileSystemStorage moves it instead of copying"""
+
+    def __init__(self, file, path):
+        super().__init__(file, name=os.path.basename(path))
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def staging_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{session.id}.part')
+
+
+def blob_name(digest, filename):
+    extension = os.path.splitext(filename)[1].lower()[:10]
+    return f'blobs/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _take_hasher(session_id, offset):
+    """Running hash of the first `offset` bytes, None if this process lacks it"""
+    with _hashers_lock:
+        entry = _hashers.pop(session_id, None)
+    if entry and entry[0] == offset:
+        return entry[1]
+    if offset == 0:
+        return hashlib.sha256()
+    return None
+
+
+def _keep_hasher(session_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[session_id] = (offset, hasher)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _drop_hasher(session_id):
+    with _hashers_lock:
+        _hashers.pop(session_id, None)
+
+
+def get_session(session_id, user, lock=False):
+    queryset = UploadSession.objects.filter(created_by=user)
+    if lock:
+        queryset = queryset.select_for_update()
+    try:
+        return queryset.get(id=session_id)
+    except UploadSession.DoesNotExist:
+        raise UploadError('Загрузка не найдена', status=status.HTTP_404_NOT_FOUND)
+
+
+def _check_uploading(session):
+    if session.status != 'uploading':
+        raise UploadError(f'Загрузка уже {session.get_status_display().lower()}', status=status.HTTP_409_CONFLICT)
+
+
+def start(user, filename, size, content_type=''):
+    """Open an upload session with an empty staging file"""
+    filename = os.path.basename(filename or '')
+    if not filename:
+        raise UploadError('Укажите имя файла')
+    if size < 1:
+        raise UploadError('Пустой файл')
+    if size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        raise UploadError(
+            f'Файл больше {settings.CHUNKED_UPLOAD_MAX_SIZE} байт',
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+
+    session = UploadSession.objects.create(
+        created_by=user,
+        filename=filename[:255],
+        content_type=(content_type or mimetypes.guess_type(filename)[0] or '')[:100],
+        size=size,
+    )
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(staging_path(session), 'wb').close()
+    return session
+
+
+def parse_content_range(header, size):
+    """(start, end) of a `bytes start-end/total` header, end exclusive"""
+    match = CONTENT_RANGE.match((header or '').strip())
+    if not match:
+        raise UploadError('Нужен заголовок Content-Range: bytes start-end/total')
+    start, last, total = (int(value) for value in match.groups())
+    if total != size:
+        raise UploadError(f'Размер файла {total} не совпадает с заявленным {size}')
+    if last < start or last >= size:
+        raise UploadError('Неверный диапазон Content-Range')
+    if last - start + 1 > settings.CHUNKED_UPLOAD_CHUNK_SIZE:
+        raise UploadError(
+            f'Часть больше {settings.CHUNKED_UPLOAD_CHUNK_SIZE} байт',
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    return start, last + 1
+
+
+def append(session_id, user, stream, content_range, checksum=None):
+    """
+    Write one chunk read from stream at its offset
+
+    Chunks come in order: a chunk that was already received (a retry) is
+    accepted without writing, one past `received` is refused. With
+    checksum (SHA-256 of the chunk) a damaged chunk is discarded.
+    """
+    with transaction.atomic():
+        session = get_session(session_id, user, lock=True)
+        _check_uploading(session)
+        start, end = parse_content_range(content_range, session.size)
+        if end <= session.received:
+            return session
+        if start != session.received:
+            raise UploadError(f'Ожидается часть с байта {session.received}', status=status.HTTP_409_CONFLICT)
+
+        path = staging_path(session)
+        if not os.path.exists(path):
+            raise UploadError('Файл загрузки потерян, начните загрузку заново', status=status.HTTP_409_CONFLICT)
+        length = end - start
+        hasher = _take_hasher(session.id, start)
+        chunk_hasher = hashlib.sha256()
+        written = 0
+        with open(path, 'r+b') as staged:
+            staged.seek(start)
+            while stream is not None and written < length:
+                data = stream.read(min(READ_SIZE, length - written))
+                if not data:
+                    break
+                staged.write(data)
+                chunk_hasher.update(data)
+                if hasher is not None:
+                    hasher.update(data)
+                written += len(data)
+
+            error = None
+            if written != length:
+                error = f'Получено {written} из {length} байт части'
+            elif checksum and checksum.lower() != chunk_hasher.hexdigest():
+                error = 'Контрольная сумма части не совпадает'
+            if error:
+                staged.truncate(start)
+                raise UploadError(error)
+            staged.truncate(end)
+
+        session.received = end
+        session.save(update_fields=['received', 'updated_at'])
+    if hasher is not None:
+        _keep_hasher(session.id, end, hasher)
+    return session
+
+
+def _digest(session, path):
+    """SHA-256 of the staged file, resuming the running hash if kept"""
+    with _hashers_lock:
+        entry = _hashers.pop(session.id, None)
+    offset, hasher = entry if entry and entry[0] <= session.size else (0, hashlib.sha256())
+    with open(path, 'rb') as staged:
+        staged.seek(offset)
+        for block in iter(lambda: staged.read(READ_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def store(path, digest, size, filename, content_type=''):
+    """
+    Blob of the staged file and whether it was created; the staging
+    file is consumed either way
+    """
+    blob = Blob.objects.filter(sha256=digest).first()
+    if blob:
+        _remove(path)
+        return blob, False
+
+    with open(path, 'rb') as staged:
+        name = default_storage.save(blob_name(digest, filename), StagedFile(staged, path))
+    try:
+        with transaction.atomic():
+            blob = Blob.objects.create(
+                sha256=digest,
+                size=size,
+                content_type=content_type,
+                file=name,
+            )
+    except IntegrityError:
+        # The same content was completed concurrently
+        default_storage.delete(name)
+        blob, created = Blob.objects.get(sha256=digest), False
+    else:
+        created = True
+    _remove(path)
+    return blob, created
+
+
+def stage(session_id, user, sha256=None):
+    """
+    Hash and store the received file of a session: its Blob, created or
+    reused, and whether it was created
+
+    Runs before the locked transaction of complete(). The Blob is kept on
+    the session, so a complete that fails later is retried without the
+    staging file, which is consumed here.
+    """
+    session = get_session(session_id, user)
+    _check_uploading(session)
+    if session.blob_id:
+        blob = session.blob
+        if sha256 and sha256.lower() != blob.sha256:
+            raise UploadError('Контрольная сумма файла не совпадает')
+        return blob, False
+    if session.received != session.size:
+        raise UploadError(f'Получено {session.received} из {session.size} байт', status=status.HTTP_409_CONFLICT)
+    path = staging_path(session)
+    if not os.path.exists(path):
+        raise UploadError('Файл загрузки потерян, начните загрузку заново', status=status.HTTP_409_CONFLICT)
+
+    digest = _digest(session, path)
+    if sha256 and sha256.lower() != digest:
+        raise UploadError('Контрольная сумма файла не совпадает')
+    blob, created = store(path, digest, session.size, session.filename, session.content_type)
+    UploadSession.objects.filter(id=session.id).update(blob=blob, updated_at=timezone.now())
+    return blob, created
+
+
+def complete(session_id, user, blob):
+    """
+    Mark the session complete with the Blob from stage()
+
+    Call inside a transaction together with whatever links the Blob.
+    """
+    session = get_session(session_id, user, lock=True)
+    _check_uploading(session)
+    session.status = 'complete'
+    session.blob = blob
+    session.save(update_fields=['status', 'blob', 'updated_at'])
+
+
+def abort(session_id, user):
+    with transaction.atomic():
+        session = get_session(session_id, user, lock=True)
+        _check_uploading(session)
+        session.status = 'aborted'
+        session.save(update_fields=['status', 'updated_at'])
+    _drop_hasher(session.id)
+    _remove(staging_path(session))
+
+
+def cleanup_expired():
+    """Abort sessions idle for CHUNKED_UPLOAD_EXPIRE_HOURS, remove their staging files"""
+    cutoff = timezone.now() - timedelta(hours=settings.CHUNKED_UPLOAD_EXPIRE_HOURS)
+    expired = list(UploadSession.objects.filter(status='uploading', updated_at__lt=cutoff))
+    for session in expired:
+        _drop_hasher(session.id)
+        _remove(staging_path(session))
+    UploadSession.objects.filter(id__in=[session.id for session in expired]).update(status='aborted')
+    return len(expired)
+
+
+def is_dicom(blob):
+    return blob.content_type == 'application/dicom' or blob.file.name.lower().endswith('.dcm')
+
+
+def needs_thumbnail(blob):
+    return blob.content_type.startswith('image/') or is_dicom(blob)
+
+
+def _open_image(fileobj, blob):
+    from PIL import Image
+
+    if not is_dicom(blob):
+        image = Image.open(fileobj)
+        # JPEG decodes at a reduced scale
+        image.draft('RGB', THUMBNAIL_SIZE)
+        return image
+
+    try:
+        import pydicom
+    except ImportError:
+        return None
+    pixels = pydicom.dcmread(fileobj).pixel_array
+    if pixels.ndim > 2 and pixels.shape[-1] not in (3, 4):
+        pixels = pixels[0]
+    pixels = pixels.astype('float64')
+    pixels -= pixels.min()
+    if pixels.max():
+        pixels *= 255.0 / pixels.max()
+    return Image.fromarray(pixels.astype('uint8'))
+
+
+def make_thumbnail(blob):
+    """Save a JPEG thumbnail of an image or DICOM Blob, False if unsupported"""
+    with blob.file.open('rb') as fileobj:
+        image = _open_image(fileobj, blob)
+        if image is None:
+            return False
+        image.thumbnail(THUMBNAIL_SIZE)
+        image = image.convert('RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    name = default_storage.save(f'blobs/thumbnails/{blob.sha256}.jpg', ContentFile(buffer.getvalue()))
+    blob.thumbnail = name
+    Blob.objects.filter(id=blob.id).update(thumbnail=name)
+    return True
+
+
+def session_data(session):
+    return {
+        'id': str(session.id),
+        'filename': session.filename,
+        'content_type': session.content_type,
+        'size': session.size,
+        'received': session.received,
+        'status': session.status,
+        'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+    }
+
+
+def thumbnail_url(obj, request=None):
+    """Thumbnail URL of a file model with a blob, for serializers"""
+    if not obj.blob_id or not obj.blob.thumbnail:
+        return None
+    url = obj.blob.thumbnail.url
+    return request.build_absolute_uri(url) if request else url
+
+
+class ChunkedUploadMixin:
+    """
+    Resumable upload actions for a file ViewSet
+
+    POST   uploads/                   {"filename", "size", "content_type"}
+    GET    uploads/{id}/              session, resume from `received`
+    PUT    uploads/{id}/              raw chunk, Content-Range: bytes start-end/total
+    DELETE uploads/{id}/              abort
+    POST   uploads/{id}/complete/     the serializer fields without `file`,
+                                      optional sha256 of the whole file
+
+    complete creates the ViewSet's object with its file pointing at the
+    Blob content.
+    """
+    upload_actions = ('upload_start', 'upload', 'upload_complete')
+
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def upload_start(self, request):
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({'error': 'size должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            session = start(request.user, request.data.get('filename'), size, request.data.get('content_type'))
+        except UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        return Response(session_data(session), status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get', 'put', 'delete'], url_path=f'uploads/{UPLOAD_ID}')
+    def upload(self, request, upload_id=None):
+        try:
+            if request.method == 'PUT':
+                session = append(
+                    upload_id, request.user, request.stream,
+                    request.headers.get('Content-Range'), request.headers.get('X-Chunk-SHA256')
+                )
+            elif request.method == 'DELETE':
+                abort(upload_id, request.user)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            else:
+                session = get_session(upload_id, request.user)
+        except UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        return Response(session_data(session))
+
+    @action(detail=False, methods=['post'], url_path=f'uploads/{UPLOAD_ID}/complete')
+    def upload_complete(self, request, upload_id=None):
+        serializer = self.get_serializer(data=request.data)
+        serializer.fields['file'].required = False
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            blob, created = stage(upload_id, request.user, request.data.get('sha256'))
+            with transaction.atomic():
+                complete(upload_id, request.user, blob)
+                self.perform_upload_complete(serializer, blob)
+        except UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+
+        # Also after a retried complete whose first attempt created the Blob
+        if needs_thumbnail(blob) and not blob.thumbnail:
+            from .tasks import make_blob_thumbnail
+            transaction.on_commit(lambda: make_blob_thumbnail.delay(blob.id))
+        data = dict(serializer.data)
+        data['deduplicated'] = not created
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def perform_upload_complete(self, serializer, blob):
+        serializer.save(file=blob.file.name, blob=blob, uploaded_by=self.request.user)
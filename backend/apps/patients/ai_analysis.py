@@ -0,0 +1,229 @@
+"""
+Asynchronous, cached AI patient analysis
+
+The analysis is generated by a Celery job (apps.patients.tasks) instead of
+the request thread. Jobs and results are keyed by a fingerprint of the
+patient id, the normalized patient data, the model and the prompt
+version, and carry the patient id checked by the status endpoint: a repeat
+request on unchanged data is answered from the result cache, and clicks
+while a job is running join that job. Only ids go through the broker, the
+worker loads the patient again and drops jobs whose data has changed. Jobs of one organization share a
+small number of concurrent model calls (AI_ANALYSIS_MAX_CONCURRENT).
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.utils import timezone
+
+from apps.core import querysets
+
+from .ai_service import get_ai_service
+from .models import Patient, PatientDiagnosis, PatientDisease
+
+
+# The payload reads diseases and diagnoses with their ICD codes
+querysets.register(
+    Patient, ['ai_analysis'],
+    prefetch=[
+        models.Prefetch('diseases', queryset=PatientDisease.objects.select_related('icd_code')),
+        models.Prefetch('diagnoses', queryset=PatientDiagnosis.objects.select_related('icd_code')),
+    ]
+)
+
+
+KEY_PREFIX = 'patients:ai'
+RESULT_TTL = 60 * 60 * 24 * 7  # seconds
+JOB_TTL = 60 * 60
+SLOT_TTL = 60 * 5  # a crashed worker frees its slot after this
+
+# Bump when _build_analysis_prompt changes, so old results are not served
+PROMPT_VERSION = 1
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def result_key(fingerprint):
+    return f'{KEY_PREFIX}:result:{fingerprint}'
+
+
+def job_key(fingerprint):
+    return f'{KEY_PREFIX}:job:{fingerprint}'
+
+
+def slot_key(organization_id, number):
+    return f'{KEY_PREFIX}:slot:{organization_id}:{number}'
+
+
+def build_patient_data(patient):
+    """
+    Payload of the analysis prompt
+
+    Diseases and diagnoses are read from the prefetched relations with
+    their ICD codes (see the ai_analysis queryset shape).
+    """
+    return {
+        'full_name': patient.full_name,
+        'age': patient.age,
+        'sex': patient.sex,
+        'sex_display': patient.get_sex_display(),
+        'medical_history': patient.medical_history or '',
+        'allergies': patient.allergies or '',
+        'notes': patient.notes or '',
+        'blood_type': getattr(patient, 'blood_type', ''),
+        'rh_factor': getattr(patient, 'rh_factor', ''),
+        'disability_group': getattr(patient, 'disability_group', ''),
+        'disability_notes': getattr(patient, 'disability_notes', ''),
+        'diseases': [
+            {
+                'name': disease.diagnosis,
+                'icd_code': disease.icd_code.code if disease.icd_code else 'N/A',
+                'notes': disease.notes or '',
+                'diagnosed_date': disease.start_date.isoformat() if disease.start_date else None,
+            }
+            for disease in patient.diseases.all()
+        ],
+        'diagnoses': [
+            {
+                'diagnosis_text': diagnosis.diagnosis,
+                'icd_code': diagnosis.icd_code.code if diagnosis.icd_code else 'N/A',
+                'notes': '',
+                'date': diagnosis.date.isoformat() if diagnosis.date else None,
+            }
+            for diagnosis in patient.diagnoses.all()
+        ],
+    }
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        # Order of diseases/diagnoses does not change the analysis
+        return sorted((_normalize(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+    return value
+
+
+def fingerprint(patient_data, model_name, patient_id=None):
+    payload = json.dumps(
+        {
+            'patient': patient_id, 'data': _normalize(patient_data),
+            'model': model_name, 'prompt': PROMPT_VERSION,
+        },
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_job(job_id):
+    """
+    Job state: {'status', 'patient_id', ...} with the analysis once done,
+    None for unknown or expired jobs
+    """
+    job = cache.get(job_key(job_id))
+    if job is None:
+        result = cache.get(result_key(job_id))
+        return {'status': DONE, **result} if result else None
+    if job['status'] == DONE:
+        result = cache.get(result_key(job_id))
+        if result is None:
+            return None
+        return {**job, **result}
+    return job
+
+
+def request_analysis(patient, organization_id=None, refresh=False):
+    """
+    Cached analysis or a queued job for the patient
+
+    Returns the job state with 'job_id' and 'cached'.
+    """
+    from .tasks import run_patient_analysis
+
+    service = get_ai_service()
+    patient_data = build_patient_data(patient)
+    job_id = fingerprint(patient_data, service.model_name, patient.id)
+
+    if refresh:
+        cache.delete_many([result_key(job_id), job_key(job_id)])
+    else:
+        result = cache.get(result_key(job_id))
+        if result is not None:
+            return {'job_id': job_id, 'status': DONE, 'cached': True, 'patient_id': patient.id, **result}
+        job = cache.get(job_key(job_id))
+        if job and job['status'] in (FAILED, DONE):
+            # Failed, or done with the result already evicted: queue again
+            cache.delete(job_key(job_id))
+
+    job = {'status': PENDING, 'patient_id': patient.id, 'queued_at': timezone.now().isoformat()}
+    # Only the first request for the same data queues a job
+    if cache.add(job_key(job_id), job, timeout=JOB_TTL):
+        run_patient_analysis.delay(job_id, patient.id, organization_id)
+    return {'job_id': job_id, 'cached': False, **(get_job(job_id) or job)}
+
+
+def acquire_slot(organization_id, job_id):
+    """
+    Take one of the organization's concurrent model call slots
+
+    Every slot is a key of its own held by the job, so a slot expires
+    SLOT_TTL after it was taken whatever the other jobs do. Returns the
+    slot key, None when all slots are taken.
+    """
+    for number in range(settings.AI_ANALYSIS_MAX_CONCURRENT):
+        key = slot_key(organization_id, number)
+        if cache.add(key, job_id, timeout=SLOT_TTL):
+            return key
+    return None
+
+
+def release_slot(key, job_id):
+    # An expired slot may already belong to another job
+    if cache.get(key) == job_id:
+        cache.delete(key)
+
+
+def fail(job_id, error):
+    job = cache.get(job_key(job_id)) or {}
+    cache.set(job_key(job_id), {**job, 'status': FAILED, 'error': error}, timeout=JOB_TTL)
+
+
+def run(job_id, patient_id):
+    """
+    Generate and cache the analysis of a job (called by the Celery task
+    holding a slot)
+    """
+    patient = querysets.apply(Patient.objects.filter(id=patient_id), 'ai_analysis').first()
+    if patient is None:
+        fail(job_id, 'Пациент не найден')
+        return False
+    service = get_ai_service()
+    patient_data = build_patient_data(patient)
+    if fingerprint(patient_data, service.model_name, patient.id) != job_id:
+        # Changed since the job was queued, a new request gets a new job
+        fail(job_id, 'Данные пациента изменились, запросите анализ снова')
+        return False
+
+    job = cache.get(job_key(job_id)) or {}
+    job['patient_id'] = patient.id
+    cache.set(job_key(job_id), {**job, 'status': RUNNING}, timeout=JOB_TTL)
+
+    result = service.generate_patient_analysis(patient_data)
+    if result['success']:
+        cache.set(result_key(job_id), {
+            'patient_id': patient.id,
+            'analysis': result['analysis'],
+            'model': result.get('model'),
+            'generated_at': timezone.now().isoformat(),
+        }, timeout=RESULT_TTL)
+        cache.set(job_key(job_id), {**job, 'status': DONE}, timeout=JOB_TTL)
+    else:
+        fail(job_id, result['error'])
+    return result['success']
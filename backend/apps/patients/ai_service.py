@@ -4,6 +4,7 @@ AI Service for Patient Analysis using Google Gemini
 import logging
 from typing import Dict, Any, Optional
 from django.conf import settings
+from django.utils.module_loading import import_string
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +18,7 @@ except ImportError:
 
 class PatientAIService:
     """Service for AI-powered patient analysis using Google Gemini"""
+    model_name = 'gemini-2.5-flash'
     
     def __init__(self):
         self.api_key = settings.GEMINI_API_KEY
@@ -33,7 +35,7 @@ class PatientAIService:
         try:
             genai.configure(api_key=self.api_key)
             # Using stable model version available in API
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
+            self.model = genai.GenerativeModel(self.model_name)
         except Exception as e:
             logger.error(f"Failed to initialize Gemini AI: {e}")
     
@@ -69,7 +71,7 @@ class PatientAIService:
                 'success': True,
                 'error': None,
                 'analysis': response.text,
-                'model': 'gemini-2.5-flash'
+                'model': self.model_name
             }
             
         except Exception as e:
@@ -195,7 +197,7 @@ class PatientAIService:
                 'success': True,
                 'error': None,
                 'suggestions': response.text,
-                'model': 'gemini-2.5-flash'
+                'model': self.model_name
             }
             
         except Exception as e:
@@ -207,14 +209,59 @@ class PatientAIService:
             }
 
 
-# Singleton instance
-_ai_service_instance = None
+class StubAIService(PatientAIService):
+    """
+    Local stand-in model for tests and development without an API key
+
+    Returns a deterministic analysis of the prompt, so equal patient data
+    gives equal output.
+    """
+    model_name = 'stub'
+    
+    def __init__(self):
+        self.api_key = None
+        self.model = None
+        self.calls = 0
+    
+    def is_available(self) -> bool:
+        return True
+    
+    def generate_patient_analysis(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls += 1
+        prompt = self._build_analysis_prompt(patient_data)
+        return {
+            'success': True,
+            'error': None,
+            'analysis': (
+                f"Stub analysis of {patient_data.get('full_name', '')}: "
+                f"{len(patient_data.get('diseases', []))} diseases, "
+                f"{len(patient_data.get('diagnoses', []))} diagnoses, "
+                f"prompt {len(prompt)} chars"
+            ),
+            'model': self.model_name
+        }
+    
+    def generate_diagnosis_suggestion(self, symptoms: str, patient_context: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls += 1
+        return {
+            'success': True,
+            'error': None,
+            'suggestions': f'Stub suggestions for: {symptoms}',
+            'model': self.model_name
+        }
+
+
+# One instance per configured backend
+_ai_service_instances = {}
 
 
 def get_ai_service() -> PatientAIService:
-    """Get singleton instance of AI service"""
-    global _ai_service_instance
-    if _ai_service_instance is None:
-        _ai_service_instance = PatientAIService()
-    return _ai_service_instance
+    """
+    Get the AI service instance of the AI_SERVICE_BACKEND setting
+    (dotted path, PatientAIService by default)
+    """
+    backend = getattr(settings, 'AI_SERVICE_BACKEND', 'apps.patients.ai_service.PatientAIService')
+    if backend not in _ai_service_instances:
+        _ai_service_instances[backend] = import_string(backend)()
+    return _ai_service_instances[backend]
 
@@ -5,4 +5,6 @@ class PatientsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.patients'
     verbose_name = 'Patients'
-
+    
+    def ready(self):
+        import apps.patients.signals  # noqa
@@ -0,0 +1,474 @@
+"""
+Streaming patient import from CSV/XLSX files
+
+The file is read row by row and processed in chunks. Each chunk is
+validated (IIN via validators.validate_iin, phones normalized), its IINs
+are hashed and encrypted with one crypto context, the organization's
+existing patients are looked up with one query and matched through key
+sets (the merge engine criteria: same IIN, or same phone, birth date and
+first name), and new patients are inserted together with their
+organization links by one INSERT ... SELECT FROM unnest() per chunk.
+
+Rows that are not imported go to the report with their line number and
+the reason, IINs masked to the last 4 digits. Every chunk is its own transaction; after an interrupted
+import the same file can be imported again, rows already in the
+organization are skipped as existing.
+"""
+import csv
+import io
+import itertools
+import os
+import re
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection
+from django.db.models import Q
+
+from .models import Patient
+from .search import build_search_text
+from .utils.encryption import encrypt_many, hash_many, iin_last4
+from .utils.phone import normalize_phone
+from .validators import validate_iin
+
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# Patient field -> accepted header names (lowercase)
+COLUMNS = {
+    'last_name': ('last_name', 'фамилия', 'surname'),
+    'first_name': ('first_name', 'имя', 'name'),
+    'middle_name': ('middle_name', 'отчество', 'patronymic'),
+    'birth_date': ('birth_date', 'дата рождения', 'birthdate', 'date_of_birth'),
+    'sex': ('sex', 'пол', 'gender'),
+    'phone': ('phone', 'телефон', 'mobile'),
+    'iin': ('iin', 'иин'),
+    'email': ('email', 'e-mail', 'почта'),
+    'address': ('address', 'адрес'),
+    'allergies': ('allergies', 'аллергии'),
+    'notes': ('notes', 'примечания', 'комментарий'),
+}
+REQUIRED_COLUMNS = ('last_name', 'first_name')
+NAME_MAX_LENGTH = 100
+PHONE_MAX_LENGTH = 20
+
+# Patient columns filled from the file, the others get the model defaults
+IMPORT_FIELDS = (
+    'last_name', 'first_name', 'middle_name', 'birth_date', 'sex', 'phone', 'phone_normalized',
+    'email', 'address', 'allergies', 'notes', 'iin', 'iin_enc', 'iin_hash', 'iin_last4', 'search_text',
+)
+INSERT_SQL = (
+    'WITH created AS ('
+    'INSERT INTO {table} ({columns}) '
+    'SELECT {values} FROM unnest({arrays}) AS v({names}) RETURNING id'
+    ') '
+    'INSERT INTO {link_table} ({link_patient}, {link_organization}) SELECT id, %s FROM created'
+)
+
+DATE_FORMATS = ('%d.%m.%Y', '%Y-%m-%d', '%d/%m/%Y', '%d.%m.%y')
+SEX_VALUES = {
+    'm': 'M', 'м': 'M', 'муж': 'M', 'мужской': 'M', 'male': 'M',
+    'f': 'F', 'ж': 'F', 'жен': 'F', 'женский': 'F', 'female': 'F',
+}
+
+
+class ImportFileError(ValueError):
+    """The file cannot be imported at all (format, encoding, header)"""
+
+
+def open_rows(fileobj, filename):
+    """
+    Header and a lazy iterator over the value rows of a file
+
+    fileobj is opened in binary mode. CSV is read as UTF-8 (with or
+    without BOM) with ';' or ',' delimiters, XLSX from the active sheet.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        import openpyxl
+
+        try:
+            workbook = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+        except Exception as e:
+            raise ImportFileError(f'Не удалось открыть XLSX: {e}')
+        rows = workbook.active.iter_rows(values_only=True)
+    elif extension == '.csv':
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+        try:
+            first = text.readline()
+        except UnicodeDecodeError:
+            raise ImportFileError('CSV должен быть в кодировке UTF-8')
+        delimiter = ';' if first.count(';') > first.count(',') else ','
+        rows = itertools.chain(
+            csv.reader([first], delimiter=delimiter), csv.reader(text, delimiter=delimiter)
+        )
+    else:
+        raise ImportFileError('Поддерживаются файлы .csv и .xlsx')
+
+    header = next(rows, None)
+    if not header:
+        raise ImportFileError('Файл пуст')
+    return list(header), rows
+
+
+def map_columns(header):
+    """Patient field -> column index; ImportFileError without required columns"""
+    names = {}
+    for index, name in enumerate(header):
+        names.setdefault(str(name or '').strip().lower().replace('ё', 'е'), index)
+
+    columns = {}
+    for field, aliases in COLUMNS.items():
+        index = next((names[alias] for alias in aliases if alias in names), None)
+        if index is not None:
+            columns[field] = index
+
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        raise ImportFileError(f'Нет обязательных колонок: {", ".join(missing)}')
+    return columns
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Phones and IINs typed as numbers in Excel
+        value = int(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    return str(value).strip()
+
+
+def mask_iin(value):
+    """IIN for the report: only the last 4 digits are shown"""
+    iin = re.sub(r'[\s\-]', '', value)
+    if len(iin) <= 4:
+        return '*' * len(iin)
+    return '*' * (len(iin) - 4) + iin[-4:]
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def parse_row(values, columns):
+    """
+    Patient fields of a row and the list of its errors
+
+    Birth date and sex are taken from the IIN when the columns are empty.
+    A row needs a phone or an IIN to be matched against existing patients.
+    """
+    raw = {field: values[index] if index < len(values) else None for field, index in columns.items()}
+    data = {field: _text(value) for field, value in raw.items()}
+    errors = []
+
+    for field in ('last_name', 'first_name', 'middle_name'):
+        value = data.get(field, '')
+        if field in REQUIRED_COLUMNS and not value:
+            errors.append(f'Не заполнено поле {field}')
+        elif len(value) > NAME_MAX_LENGTH:
+            errors.append(f'{field} длиннее {NAME_MAX_LENGTH} символов')
+
+    iin = re.sub(r'[\s\-]', '', data.get('iin', ''))
+    if iin and isinstance(raw.get('iin'), (int, float)):
+        # Leading zeros are lost in numeric cells (born in 2000-2009)
+        iin = iin.zfill(12)
+    iin_info = validate_iin(iin) if iin else None
+    if iin_info and not iin_info['valid']:
+        errors.append(f'ИИН: {iin_info["error"]}')
+        iin_info = None
+    data['iin'] = iin
+
+    birth_date = None
+    if data.get('birth_date'):
+        birth_date = parse_date(raw['birth_date'] if isinstance(raw['birth_date'], date) else data['birth_date'])
+        if birth_date is None:
+            errors.append(f'Неверная дата рождения: {data["birth_date"]}')
+    elif iin_info:
+        birth_date = iin_info['birth_date']
+    else:
+        errors.append('Не указана дата рождения')
+    data['birth_date'] = birth_date
+
+    sex = data.get('sex', '')
+    if sex:
+        data['sex'] = SEX_VALUES.get(sex.lower().rstrip('.'))
+        if data['sex'] is None:
+            errors.append(f'Неверный пол: {sex}')
+    elif iin_info:
+        data['sex'] = iin_info['sex']
+    else:
+        errors.append('Не указан пол')
+
+    phone = data.get('phone', '')
+    data['phone_normalized'] = normalize_phone(phone)
+    if phone and (not data['phone_normalized'] or len(phone) > PHONE_MAX_LENGTH):
+        errors.append(f'Неверный телефон: {phone}')
+    if not phone and not iin:
+        errors.append('Нужен телефон или ИИН')
+
+    if data.get('email'):
+        try:
+            validate_email(data['email'])
+        except ValidationError:
+            errors.append(f'Неверный email: {data["email"]}')
+
+    return data, errors
+
+
+def row_keys(iin_hash, phone_normalized, birth_date, first_name):
+    """Duplicate keys of a patient, the merge engine criteria"""
+    keys = []
+    if iin_hash:
+        keys.append(('iin', iin_hash))
+    if phone_normalized:
+        keys.append(('phone', phone_normalized, birth_date, first_name.lower()))
+    return keys
+
+
+def _existing_keys(organization, iin_hashes, phones):
+    """Duplicate key -> id of the organization's patients, one query"""
+    found = Patient.objects.filter(organizations=organization).filter(
+        Q(iin_hash__in=[value for value in iin_hashes if value])
+        | Q(phone_normalized__in=[value for value in phones if value])
+    ).values_list('id', 'iin_hash', 'phone_normalized', 'birth_date', 'first_name')
+
+    existing = {}
+    for patient_id, *fields in found:
+        for key in row_keys(*fields):
+            existing.setdefault(key, patient_id)
+    return existing
+
+
+def _row(data, iin_hash, iin_enc):
+    """IMPORT_FIELDS values of a new patient"""
+    row = {
+        'last_name': data['last_name'],
+        'first_name': data['first_name'],
+        'middle_name': data.get('middle_name', ''),
+        'birth_date': data['birth_date'],
+        'sex': data['sex'],
+        'phone': data.get('phone', ''),
+        'phone_normalized': data['phone_normalized'],
+        'email': data.get('email', ''),
+        'address': data.get('address', ''),
+        'allergies': data.get('allergies', ''),
+        'notes': data.get('notes', ''),
+        'iin': data['iin'],
+        'iin_enc': iin_enc or '',
+        'iin_hash': iin_hash or '',
+        'iin_last4': iin_last4(data['iin']),
+    }
+    # Patient.save is not called; build_search_text only reads attributes
+    row['search_text'] = build_search_text(SimpleNamespace(**row))
+    return row
+
+
+def insert_patients(rows, organization_id):
+    """
+    Insert patients with their organization links in one statement
+
+    rows are dicts of IMPORT_FIELDS, the other columns get the model
+    defaults. bulk_create prepares every value of every row on its own,
+    which took most of the import time; here each column is sent as one
+    array and the defaults once.
+    """
+    opts = Patient._meta
+    quote = connection.ops.quote_name
+    template = Patient()
+
+    columns, values, params = [], [], []
+    for field in opts.concrete_fields:
+        if field.primary_key or field.name in IMPORT_FIELDS:
+            continue
+        columns.append(quote(field.column))
+        values.append(f'%s::{field.db_type(connection)}')
+        params.append(field.get_db_prep_save(field.pre_save(template, add=True), connection))
+
+    arrays = []
+    for name in IMPORT_FIELDS:
+        field = opts.get_field(name)
+        columns.append(quote(field.column))
+        values.append(f'v.{quote(field.column)}')
+        arrays.append(f'%s::{field.db_type(connection)}[]')
+        params.append([row[name] for row in rows])
+
+    link = Patient.organizations.through._meta
+    sql = INSERT_SQL.format(
+        table=quote(opts.db_table),
+        columns=', '.join(columns),
+        values=', '.join(values),
+        arrays=', '.join(arrays),
+        names=', '.join(quote(opts.get_field(name).column) for name in IMPORT_FIELDS),
+        link_table=quote(link.db_table),
+        link_patient=quote(link.get_field('patient').column),
+        link_organization=quote(link.get_field('organization').column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, organization_id])
+    return len(rows)
+
+
+class Importer:
+    """
+    Import of one file into an organization
+
+    counts: total, created, existing (already in the organization),
+    duplicates (repeated earlier in the file) and errors.
+    """
+
+    def __init__(self, organization, report=None, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, progress=None):
+        self.organization = organization
+        self.report = report
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.progress = progress
+        self.counts = {'total': 0, 'created': 0, 'existing': 0, 'duplicates': 0, 'errors': 0}
+        # Duplicate key -> line of the first row with it
+        self.seen = {}
+        self.writer = None
+        self.iin_column = None
+
+    def run(self, fileobj, filename):
+        header, rows = open_rows(fileobj, filename)
+        columns = map_columns(header)
+        self.iin_column = columns.get('iin')
+        if self.report is not None:
+            self.writer = csv.writer(self.report)
+            self.writer.writerow(['line', 'error', *(_text(name) for name in header)])
+
+        chunk = []
+        try:
+            for line, values in enumerate(rows, start=2):
+                if not any(_text(value) for value in values):
+                    continue
+                self.counts['total'] += 1
+                data, errors = parse_row(values, columns)
+                if errors:
+                    self.counts['errors'] += 1
+                    self.skip(line, values, '; '.join(errors))
+                    continue
+                chunk.append((line, values, data))
+                if len(chunk) >= self.chunk_size:
+                    self.import_chunk(chunk)
+                    chunk = []
+        except UnicodeDecodeError:
+            raise ImportFileError('CSV должен быть в кодировке UTF-8')
+        except csv.Error as e:
+            raise ImportFileError(f'Ошибка чтения CSV: {e}')
+        if chunk:
+            self.import_chunk(chunk)
+        return self.counts
+
+    def skip(self, line, values, reason):
+        if self.writer is not None:
+            values = [_text(value) for value in values]
+            if self.iin_column is not None and self.iin_column < len(values):
+                values[self.iin_column] = mask_iin(values[self.iin_column])
+            self.writer.writerow([line, reason, *values])
+
+    def import_chunk(self, chunk):
+        hashes = hash_many([data['iin'] for _, _, data in chunk])
+        existing = _existing_keys(
+            self.organization, set(hashes), {data['phone_normalized'] for _, _, data in chunk}
+        )
+
+        new = []
+        for (line, values, data), iin_hash in zip(chunk, hashes):
+            keys = row_keys(iin_hash, data['phone_normalized'], data['birth_date'], data['first_name'])
+            patient_id = next((existing[key] for key in keys if key in existing), None)
+            if patient_id:
+                self.counts['existing'] += 1
+                self.skip(line, values, f'Пациент уже есть в организации (#{patient_id})')
+                continue
+            first_line = next((self.seen[key] for key in keys if key in self.seen), None)
+            if first_line:
+                self.counts['duplicates'] += 1
+                self.skip(line, values, f'Повтор строки {first_line}')
+                continue
+            for key in keys:
+                self.seen[key] = line
+            new.append((data, iin_hash))
+
+        if new and not self.dry_run:
+            tokens = encrypt_many([data['iin'] for data, _ in new])
+            insert_patients(
+                [_row(data, iin_hash, token) for (data, iin_hash), token in zip(new, tokens)],
+                self.organization.id
+            )
+        self.counts['created'] += len(new)
+
+        if self.progress:
+            self.progress(self.counts)
+
+
+def import_file(fileobj, filename, organization, **options):
+    """Import a CSV/XLSX file into the organization, returns the counts"""
+    return Importer(organization, **options).run(fileobj, filename)
+
+
+def run_job(job):
+    """
+    Run a PatientImport job: import its file, save the counts, the status
+    and the report of skipped rows
+
+    The uploaded file is deleted once the job finishes, it holds plain IINs.
+    """
+    from django.core.files.base import ContentFile
+    from django.utils import timezone
+
+    from .models import PatientImport
+
+    def save_counts(counts):
+        PatientImport.objects.filter(id=job.id).update(**_job_counts(counts))
+
+    job.status = 'running'
+    job.save(update_fields=['status'])
+
+    report = io.StringIO()
+    importer = Importer(job.organization, report=report, progress=save_counts)
+    try:
+        with job.file.open('rb') as fileobj:
+            importer.run(fileobj, job.file.name)
+    except ImportFileError as e:
+        job.status = 'failed'
+        job.error = str(e)
+    except Exception:
+        job.status = 'failed'
+        job.error = 'Внутренняя ошибка импорта'
+        raise
+    else:
+        job.status = 'done'
+    finally:
+        for field, value in _job_counts(importer.counts).items():
+            setattr(job, field, value)
+        job.finished_at = timezone.now()
+        if importer.counts['total'] > importer.counts['created']:
+            job.report.save(
+                f'import_{job.id}_report.csv', ContentFile(report.getvalue().encode('utf-8-sig')), save=False
+            )
+        job.file.delete(save=False)
+        job.save()
+    return job
+
+
+def _job_counts(counts):
+    return {
+        'total_rows': counts['total'],
+        'created_count': counts['created'],
+        'existing_count': counts['existing'],
+        'duplicate_count': counts['duplicates'],
+        'error_count': counts['errors'],
+    }
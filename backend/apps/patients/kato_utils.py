@@ -1,48 +1,195 @@
 """
 KATO (Kazakhstan Administrative Territorial Objects) utilities
+
+The KATO fixture is compiled once per process into a KATOIndex: code ->
+item and parent -> children dicts, and a prefix trie of name tokens for
+autocomplete. Names are indexed as transliterated Latin tokens (see
+apps.patients.search.name_tokens), so Russian, Kazakh and Latin spellings
+meet. `python manage.py compile_kato` saves the compiled index next to the
+fixture; it is used instead of parsing the JSON while the fixture is
+unchanged.
 """
+import hashlib
 import json
-import os
+import logging
+import pickle
 from pathlib import Path
 
+from .search import name_tokens
+
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_PATH = Path(__file__).parent / 'fixtures' / 'kato.json'
+INDEX_PATH = FIXTURE_PATH.with_suffix('.idx')
+# Bump when the KATOIndex layout changes, old compiled files are rebuilt
+INDEX_VERSION = 1
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Trie node key holding the ids of the items below it
+_IDS = ''
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class KATOIndex:
+    """
+    KATO items compiled for O(1) code/children lookups and O(prefix)
+    name autocomplete
+    """
+    
+    def __init__(self, items):
+        self.items = list(items)
+        self.by_code = {item['code']: item for item in self.items}
+        self.children = {}
+        for item in self.items:
+            self.children.setdefault(item.get('parent'), []).append(item)
+        
+        # Trie of name tokens; every node lists the items below it once,
+        # regions first, then by name
+        self.tokens = []
+        for item in self.items:
+            tokens = name_tokens(item.get('name', ''))
+            if item.get('name_kk'):
+                tokens += name_tokens(item['name_kk'])
+            self.tokens.append(tuple(dict.fromkeys(tokens)))
+        ranked = sorted(
+            range(len(self.items)), key=lambda i: (self.items[i].get('level') or 0, self.items[i].get('name', ''))
+        )
+        self.trie = {}
+        for index in ranked:
+            for token in self.tokens[index]:
+                node = self.trie
+                for char in token:
+                    node = node.setdefault(char, {})
+                    ids = node.setdefault(_IDS, [])
+                    if not ids or ids[-1] != index:
+                        ids.append(index)
+    
+    def get(self, code):
+        return self.by_code.get(code)
+    
+    def get_children(self, parent_code):
+        return self.children.get(parent_code, [])
+    
+    def autocomplete(self, query, limit=DEFAULT_LIMIT, parent=None, level=None):
+        """
+        Items whose name has a word starting with every query word
+        
+        The trie is walked with the longest query word, the other words
+        filter its items. parent and level narrow the results.
+        """
+        words = name_tokens(query)
+        if not words:
+            return []
+        longest = max(words, key=len)
+        words.remove(longest)
+        
+        node = self.trie
+        for char in longest:
+            node = node.get(char)
+            if node is None:
+                return []
+        
+        results = []
+        for index in node[_IDS]:
+            item = self.items[index]
+            if parent is not None and item.get('parent') != parent:
+                continue
+            if level is not None and item.get('level') != level:
+                continue
+            if any(not any(token.startswith(word) for token in self.tokens[index]) for word in words):
+                continue
+            results.append(item)
+            if len(results) >= limit:
+                break
+        return results
+    
+    def save(self, path, source_digest):
+        """Write the compiled index, tagged with the fixture digest"""
+        with open(path, 'wb') as f:
+            pickle.dump(
+                {'version': INDEX_VERSION, 'source': source_digest, 'index': self},
+                f, protocol=pickle.HIGHEST_PROTOCOL
+            )
+    
+    @classmethod
+    def load(cls, path, source_digest):
+        """Compiled index from path, None when missing or stale"""
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f'Could not read compiled KATO index {path}: {e}')
+            return None
+        if data.get('version') != INDEX_VERSION or data.get('source') != source_digest:
+            return None
+        return data['index']
+
+
+def load_index(fixture_path=FIXTURE_PATH, index_path=INDEX_PATH):
+    """KATOIndex of the fixture, from the compiled file when it is up to date"""
+    try:
+        raw = Path(fixture_path).read_bytes()
+    except FileNotFoundError:
+        return KATOIndex([])
+    if index_path is not None:
+        index = KATOIndex.load(index_path, _digest(raw))
+        if index is not None:
+            return index
+    return KATOIndex(json.loads(raw))
+
+
+def compile_index(fixture_path=FIXTURE_PATH, index_path=INDEX_PATH):
+    """Build the index of the fixture and save it to index_path"""
+    raw = Path(fixture_path).read_bytes()
+    index = KATOIndex(json.loads(raw))
+    index.save(index_path, _digest(raw))
+    return index
+
 
 class KATOHelper:
     """Helper class for working with KATO addresses"""
     
-    _kato_data = None
+    _index = None
+    
+    @classmethod
+    def get_index(cls):
+        """Compiled KATO index, loaded once per process"""
+        if cls._index is None:
+            cls._index = load_index()
+        return cls._index
     
     @classmethod
     def load_kato_data(cls):
-        """Load KATO data from fixture file"""
-        if cls._kato_data is None:
-            fixture_path = Path(__file__).parent / 'fixtures' / 'kato.json'
-            if fixture_path.exists():
-                with open(fixture_path, 'r', encoding='utf-8') as f:
-                    cls._kato_data = json.load(f)
-            else:
-                cls._kato_data = []
-        return cls._kato_data
+        """All KATO items in fixture order"""
+        return cls.get_index().items
     
     @classmethod
     def get_regions(cls):
         """Get all regions (level 1)"""
-        data = cls.load_kato_data()
-        return [item for item in data if item.get('level') == 1]
+        return [item for item in cls.get_index().get_children(None) if item.get('level') == 1]
     
     @classmethod
     def get_districts(cls, parent_code):
         """Get districts for a specific region/city"""
-        data = cls.load_kato_data()
-        return [item for item in data if item.get('parent') == parent_code]
+        return list(cls.get_index().get_children(parent_code))
     
     @classmethod
     def get_by_code(cls, code):
         """Get KATO item by code"""
-        data = cls.load_kato_data()
-        for item in data:
-            if item.get('code') == code:
-                return item
-        return None
+        return cls.get_index().get(code)
+    
+    @classmethod
+    def autocomplete(cls, query, limit=DEFAULT_LIMIT, parent=None, level=None):
+        """KATO items matching a name prefix (Russian, Kazakh or Latin)"""
+        return cls.get_index().autocomplete(query, limit=limit, parent=parent, level=level)
     
     @classmethod
     def format_address(cls, kato_address):
@@ -0,0 +1,71 @@
+"""
+Management command to fill phone_normalized for existing patients and phones
+
+Rows are processed in primary key order in batches, each batch written
+with one bulk_update, so the command can be stopped and started again.
+
+Usage:
+    python manage.py backfill_phone_normalized [--batch-size 5000] [--dry-run]
+"""
+from django.core.management.base import BaseCommand
+from apps.patients.models import Patient, PatientPhone
+from apps.patients.utils.phone import normalize_phone
+
+
+class Command(BaseCommand):
+    help = 'Fill phone_normalized (E.164) for patients and additional phones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per bulk update (default: 5000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count rows that would change without saving',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        
+        if dry_run:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be saved'))
+        
+        for model in (Patient, PatientPhone):
+            updated, unparsable = self.backfill(model, batch_size, dry_run)
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: {updated} updated, {unparsable} not full numbers'
+            ))
+
+    def backfill(self, model, batch_size, dry_run):
+        """
+        Normalize rows with a phone and an empty phone_normalized
+        """
+        queryset = model.objects.filter(phone_normalized='').exclude(phone='').order_by('pk')
+        updated = unparsable = 0
+        last_pk = 0
+        
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).only('pk', 'phone')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            
+            changed = []
+            for row in batch:
+                row.phone_normalized = normalize_phone(row.phone)
+                if row.phone_normalized:
+                    changed.append(row)
+                else:
+                    unparsable += 1
+            
+            if changed and not dry_run:
+                model.objects.bulk_update(changed, ['phone_normalized'])
+            updated += len(changed)
+            self.stdout.write(f'{model._meta.verbose_name_plural}: up to #{last_pk}, {updated} updated')
+        
+        return updated, unparsable
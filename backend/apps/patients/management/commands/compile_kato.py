@@ -0,0 +1,46 @@
+"""
+Management command to compile the KATO fixture
+
+Saves the compiled KATO index (code/children lookups and the name trie)
+next to fixtures/kato.json, so processes load it instead of parsing and
+indexing the JSON. A stale index (the fixture changed) is ignored and
+rebuilt in memory, run the command again after updating the fixture.
+
+Usage:
+    python manage.py compile_kato
+"""
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.patients import kato_utils
+
+
+class Command(BaseCommand):
+    help = 'Compile the KATO fixture into a prebuilt index file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fixture',
+            default=str(kato_utils.FIXTURE_PATH),
+            help='KATO JSON fixture (default: apps/patients/fixtures/kato.json)',
+        )
+        parser.add_argument(
+            '--output',
+            help='Index file (default: the fixture path with .idx)',
+        )
+
+    def handle(self, *args, **options):
+        output = options['output'] or str(Path(options['fixture']).with_suffix('.idx'))
+        
+        started = time.monotonic()
+        try:
+            index = kato_utils.compile_index(options['fixture'], output)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        
+        self.stdout.write('\n' + '=' * 60)
+        self.stdout.write(self.style.SUCCESS(
+            f'Compiled {len(index.items)} KATO items into {output} in {time.monotonic() - started:.2f}s'
+        ))
+        self.stdout.write('=' * 60)
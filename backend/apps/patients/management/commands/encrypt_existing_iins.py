@@ -1,89 +1,237 @@
 """
 Management command to encrypt existing plain IINs
 
+Patients are processed in primary key order in batches: each batch is
+read with one keyset query, encrypted with the bulk helpers and written
+with one bulk_update. Progress and the shard's id range are checkpointed
+to a JSON file, so an interrupted run continues where it stopped. Several
+processes can run side by side on disjoint id shards.
+
+--rotate re-encrypts iin_enc with the current IIN_ENCRYPTION_KEY (old
+keys from IIN_ENCRYPTION_OLD_KEYS must still be configured) and fills
+iin_last4 on the way.
+
 Usage:
     python manage.py encrypt_existing_iins [--dry-run]
+    python manage.py encrypt_existing_iins --batch-size 2000 --max-rate 5000
+    python manage.py encrypt_existing_iins --shard 0 --shards 4   # one of 4 workers
+    python manage.py encrypt_existing_iins --rotate
 """
-from django.core.management.base import BaseCommand
-from django.db import transaction
+import json
+import time
+from pathlib import Path
+
+from cryptography.fernet import InvalidToken
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
 from apps.patients.models import Patient
-from apps.patients.utils.encryption import encrypt_iin, hash_iin
+from apps.patients.utils.encryption import encrypt_many, get_crypto, hash_many, iin_last4
 
 
 class Command(BaseCommand):
-    help = 'Encrypt existing plain IINs for all patients'
+    help = 'Encrypt existing plain IINs (or re-encrypt with the current key) in batches'
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--dry-run',
             action='store_true',
-            help='Show what would be encrypted without actually encrypting',
+            help='Count patients that would be processed without saving',
+        )
+        parser.add_argument(
+            '--rotate',
+            action='store_true',
+            help='Re-encrypt existing iin_enc with the current key',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Patients per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--max-rate',
+            type=int,
+            default=0,
+            help='Upper bound of patients per second to protect the primary (default: unlimited)',
+        )
+        parser.add_argument(
+            '--shard',
+            type=int,
+            default=0,
+            help='Id shard processed by this worker, 0-based (default: 0)',
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=1,
+            help='Number of id shards / parallel workers (default: 1)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Checkpoint file (default: logs/encrypt_iins_<mode>_<shard>of<shards>.json)',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and start from the beginning of the shard',
         )
 
     def handle(self, *args, **options):
-        dry_run = options['dry_run']
+        shard, shards = options['shard'], options['shards']
+        if shards < 1 or not 0 <= shard < shards:
+            raise CommandError('--shard must be between 0 and --shards - 1')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
         
-        if dry_run:
+        mode = 'rotate' if options['rotate'] else 'encrypt'
+        queryset = self.get_queryset(mode)
+        
+        if options['dry_run']:
+            first_id, last_id = self.shard_bounds(shard, shards)
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be saved'))
+            count = queryset.filter(id__gte=first_id, id__lte=last_id).count() if first_id else 0
+            self.stdout.write(f'Would {mode} {count} patients in shard {shard + 1}/{shards}')
+            return
         
-        # Find patients with plain IIN but no encrypted IIN
-        patients_to_encrypt = Patient.objects.filter(
-            iin__isnull=False
-        ).exclude(
-            iin=''
-        ).filter(
-            iin_enc=''
+        checkpoint_path = Path(
+            options['checkpoint'] or
+            Path(settings.LOGS_DIR) / f'encrypt_iins_{mode}_{shard}of{shards}.json'
         )
+        state = {'last_id': 0, 'processed': 0, 'errors': 0, 'done': False}
+        if checkpoint_path.exists() and not options['restart']:
+            state.update(json.loads(checkpoint_path.read_text()))
+            if state['done']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Shard {shard + 1}/{shards} already finished ({checkpoint_path}), use --restart to run again'
+                ))
+                return
+            self.stdout.write(f'Resuming after patient #{state["last_id"]} ({checkpoint_path})')
         
-        total_count = patients_to_encrypt.count()
-        self.stdout.write(f'Found {total_count} patients with plain IINs to encrypt')
+        # Bounds are fixed when the shard starts: patients added later would
+        # move them, leaving ids between the old and new bounds unprocessed
+        if 'shard' not in state:
+            first_id, last_id = self.shard_bounds(shard, shards)
+            state['shard'] = {'first_id': first_id, 'last_id': last_id}
+            if first_id is not None:
+                checkpoint_path.write_text(json.dumps(state))
+        first_id, last_id = state['shard']['first_id'], state['shard']['last_id']
         
-        if total_count == 0:
-            self.stdout.write(self.style.SUCCESS('No patients need encryption'))
+        if first_id is None:
+            self.stdout.write(self.style.SUCCESS('No patients'))
             return
         
-        encrypted_count = 0
-        error_count = 0
+        crypto = get_crypto()
+        self.stdout.write(
+            f'Mode: {mode}, key {crypto.key_id}, shard {shard + 1}/{shards} (ids {first_id}..{last_id})'
+        )
         
-        for patient in patients_to_encrypt:
-            try:
-                plain_iin = patient.iin
-                
-                if dry_run:
-                    self.stdout.write(
-                        f'Would encrypt IIN for patient #{patient.id}: {patient.full_name}'
-                    )
-                else:
-                    # Encrypt and hash
-                    patient.iin_enc = encrypt_iin(plain_iin)
-                    patient.iin_hash = hash_iin(plain_iin)
-                    patient.save(update_fields=['iin_enc', 'iin_hash'])
-                    
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'✓ Encrypted IIN for patient #{patient.id}: {patient.full_name}'
-                        )
-                    )
-                
-                encrypted_count += 1
-                
-            except Exception as e:
-                error_count += 1
+        started = time.monotonic()
+        processed_this_run = 0
+        last_report = started
+        cursor = max(state['last_id'], first_id - 1)
+        
+        while True:
+            rows = list(
+                queryset.filter(id__gt=cursor, id__lte=last_id)
+                .order_by('id')
+                .values_list('id', 'iin', 'iin_enc', 'iin_last4')[:options['batch_size']]
+            )
+            if not rows:
+                break
+        
+            patients, errors = (self.rotate_batch if mode == 'rotate' else self.encrypt_batch)(rows, crypto)
+            if patients:
+                Patient.objects.bulk_update(patients, ['iin_enc', 'iin_hash', 'iin_last4'])
+        
+            cursor = rows[-1][0]
+            processed_this_run += len(patients)
+            state.update(
+                last_id=cursor,
+                processed=state['processed'] + len(patients),
+                errors=state['errors'] + errors
+            )
+            checkpoint_path.write_text(json.dumps(state))
+        
+            elapsed = time.monotonic() - started
+            if options['max_rate']:
+                # Sleep until the run is back under the allowed rate
+                ahead = processed_this_run / options['max_rate'] - elapsed
+                if ahead > 0:
+                    time.sleep(ahead)
+                    elapsed += ahead
+        
+            if time.monotonic() - last_report >= 5:
+                last_report = time.monotonic()
                 self.stdout.write(
-                    self.style.ERROR(
-                        f'✗ Failed to encrypt IIN for patient #{patient.id}: {e}'
-                    )
+                    f'#{cursor}: {state["processed"]} done, {state["errors"]} errors, '
+                    f'{processed_this_run / elapsed:.0f} patients/s'
                 )
         
+        state['done'] = True
+        checkpoint_path.write_text(json.dumps(state))
+        elapsed = time.monotonic() - started
+        
         # Summary
         self.stdout.write('\n' + '=' * 60)
-        if dry_run:
-            self.stdout.write(self.style.WARNING(f'DRY RUN: Would encrypt {encrypted_count} patients'))
-        else:
-            self.stdout.write(self.style.SUCCESS(f'Successfully encrypted {encrypted_count} patients'))
-        
-        if error_count > 0:
-            self.stdout.write(self.style.ERROR(f'Errors: {error_count} patients'))
-        
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {state["processed"]} patients ({processed_this_run} in this run, '
+            f'{processed_this_run / elapsed if elapsed else 0:.0f} patients/s)'
+        ))
+        if state['errors']:
+            self.stdout.write(self.style.ERROR(f'Errors: {state["errors"]} patients'))
         self.stdout.write('=' * 60)
 
+    def get_queryset(self, mode):
+        if mode == 'rotate':
+            return Patient.objects.exclude(iin_enc='')
+        # Plain IIN but no encrypted IIN
+        return Patient.objects.exclude(iin='').filter(iin_enc='')
+
+    def shard_bounds(self, shard, shards):
+        """
+        Inclusive id range of a shard, contiguous slices of [min id, max id]
+        """
+        bounds = Patient.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            return None, None
+        span = bounds['last'] - bounds['first'] + 1
+        first = bounds['first'] + span * shard // shards
+        last = bounds['first'] + span * (shard + 1) // shards - 1
+        return first, last
+
+    def encrypt_batch(self, rows, crypto):
+        cleaned = []
+        errors = 0
+        for patient_id, iin, _, _ in rows:
+            iin = iin.replace(' ', '').replace('-', '')
+            if not iin:
+                # Legacy value made of separators only, nothing to encrypt
+                errors += 1
+                self.stdout.write(self.style.ERROR(f'✗ Skipping patient #{patient_id}: IIN has no digits'))
+                continue
+            cleaned.append((patient_id, iin))
+
+        plain = [iin for _, iin in cleaned]
+        patients = [
+            Patient(id=patient_id, iin_enc=token, iin_hash=iin_hash, iin_last4=iin_last4(iin))
+            for (patient_id, iin), token, iin_hash in zip(cleaned, encrypt_many(plain), hash_many(plain))
+        ]
+        return patients, errors
+
+    def rotate_batch(self, rows, crypto):
+        decrypted = []
+        errors = 0
+        for patient_id, _, token, _ in rows:
+            try:
+                decrypted.append((patient_id, crypto.decrypt(token)))
+            except InvalidToken:
+                errors += 1
+                self.stdout.write(self.style.ERROR(f'✗ Cannot decrypt IIN of patient #{patient_id} with known keys'))
+        
+        plain = [iin for _, iin in decrypted]
+        patients = [
+            Patient(id=patient_id, iin_enc=token, iin_hash=iin_hash, iin_last4=iin_last4(iin))
+            for (patient_id, iin), token, iin_hash in zip(decrypted, encrypt_many(plain), hash_many(plain))
+        ]
+        return patients, errors
@@ -0,0 +1,90 @@
+"""
+Management command to import patients from a CSV/XLSX file
+
+The file is streamed and imported in chunks (see apps.patients.importer).
+Rows that were not imported are written to the report with the reason.
+Running the command again on the same file skips the rows already
+imported.
+
+Usage:
+    python manage.py import_patients patients.xlsx --organization 1
+    python manage.py import_patients patients.csv --organization 1 --report errors.csv [--dry-run]
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.org.models import Organization
+from apps.patients import importer
+
+
+class Command(BaseCommand):
+    help = 'Import patients from a CSV or XLSX file into an organization'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file')
+        parser.add_argument(
+            '--organization',
+            type=int,
+            required=True,
+            help='Organization the patients are imported into',
+        )
+        parser.add_argument(
+            '--report',
+            help='Write skipped rows with the reason to this CSV file',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=importer.DEFAULT_CHUNK_SIZE,
+            help=f'Rows per insert transaction (default: {importer.DEFAULT_CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate and check duplicates without saving',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        try:
+            organization = Organization.objects.get(id=options['organization'])
+        except Organization.DoesNotExist:
+            raise CommandError(f'Organization {options["organization"]} not found')
+        
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be saved'))
+        
+        started = time.monotonic()
+        last_report = [started]
+        
+        def progress(counts):
+            now = time.monotonic()
+            if now - last_report[0] >= 5:
+                last_report[0] = now
+                self.stdout.write(f'{counts["total"]} rows, {counts["total"] / (now - started):.0f} rows/s')
+        
+        report = open(options['report'], 'w', encoding='utf-8-sig', newline='') if options['report'] else None
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                counts = importer.import_file(
+                    fileobj, options['path'], organization,
+                    report=report, chunk_size=options['chunk_size'],
+                    dry_run=options['dry_run'], progress=progress,
+                )
+        except (OSError, importer.ImportFileError) as e:
+            raise CommandError(str(e))
+        finally:
+            if report:
+                report.close()
+        
+        self.stdout.write('\n' + '=' * 60)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {counts["created"]} of {counts["total"]} rows in {time.monotonic() - started:.1f}s'
+        ))
+        self.stdout.write(f'  Already in organization: {counts["existing"]}')
+        self.stdout.write(f'  Repeated in file: {counts["duplicates"]}')
+        self.stdout.write(f'  Invalid: {counts["errors"]}')
+        if options['report']:
+            self.stdout.write(f'  Report: {options["report"]}')
+        self.stdout.write('=' * 60)
@@ -0,0 +1,116 @@
+"""
+Management command to merge duplicate patients
+
+Duplicate clusters (same IIN hash, or same normalized phone, birth date
+and first name) are found with grouped queries and merged in batches, one
+transaction per batch. A failed batch is rolled back and logged, the other
+batches still run; running the command again picks up the clusters that
+are still left. Clusters with two different IINs are only reported.
+
+Usage:
+    python manage.py merge_duplicate_patients --dry-run
+    python manage.py merge_duplicate_patients [--by iin] [--organization 1] [--batch-size 500]
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.patients import merge
+from apps.patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Find duplicate patients and merge them into one record per cluster'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--by',
+            choices=merge.CRITERIA,
+            action='append',
+            help='Duplicate criterion, repeatable (default: iin and phone)',
+        )
+        parser.add_argument(
+            '--organization',
+            type=int,
+            help='Only patients of this organization',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=merge.DEFAULT_BATCH_SIZE,
+            help=f'Clusters per transaction (default: {merge.DEFAULT_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Merge at most this many clusters',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show clusters and the rows that would move without merging',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        
+        queryset = Patient.objects.all()
+        if options['organization']:
+            queryset = queryset.filter(organizations=options['organization'])
+        
+        started = time.monotonic()
+        clusters = merge.find_clusters(queryset, criteria=options['by'] or merge.CRITERIA)
+        if options['limit']:
+            clusters = clusters[:options['limit']]
+        conflicts = merge.iin_conflicts(clusters)
+        conflicting = [ids for ids in clusters if ids[0] in conflicts]
+        clusters = [ids for ids in clusters if ids[0] not in conflicts]
+        duplicates = sum(len(ids) - 1 for ids in clusters)
+        self.stdout.write(
+            f'Found {len(clusters)} clusters with {duplicates} duplicates in {time.monotonic() - started:.1f}s'
+        )
+        if conflicting:
+            self.stdout.write(self.style.WARNING(
+                f'Skipping {len(conflicting)} clusters with different IINs, review them manually:'
+            ))
+            for ids in conflicting[:20]:
+                self.stdout.write(f'  {ids}')
+        if not clusters:
+            return
+        
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be saved'))
+            for item in merge.preview(clusters[:20]):
+                moves = ', '.join(f'{name}: {count}' for name, count in sorted(item['moves'].items())) or 'no rows'
+                self.stdout.write(
+                    f'#{item["survivor"]} {item["survivor_name"]} <- {item["duplicates"]} ({moves})'
+                )
+            if len(clusters) > 20:
+                self.stdout.write(f'... and {len(clusters) - 20} more clusters')
+            return
+        
+        started = time.monotonic()
+        last_report = [started]
+        
+        def progress(done, total, result):
+            now = time.monotonic()
+            if now - last_report[0] >= 5 or done == total:
+                last_report[0] = now
+                self.stdout.write(
+                    f'{done}/{total} clusters, {done / (now - started):.0f} clusters/s'
+                )
+        
+        result = merge.merge_all(clusters, batch_size=options['batch_size'], progress=progress)
+        
+        self.stdout.write('\n' + '=' * 60)
+        self.stdout.write(self.style.SUCCESS(
+            f'Merged {result["merged"]} duplicates into {result["clusters"]} patients '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
+        for name, count in sorted(result['moved'].items()):
+            self.stdout.write(f'  {name}: {count} rows moved')
+        if result['failed']:
+            self.stdout.write(self.style.ERROR(
+                f'{result["failed"]} clusters failed and were rolled back, see the log'
+            ))
+        self.stdout.write('=' * 60)
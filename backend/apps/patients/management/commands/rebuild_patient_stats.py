@@ -0,0 +1,54 @@
+"""
+Management command to rebuild the patient_stats rollup
+
+Patients are processed in primary key order in batches; each batch costs
+four grouped queries and one upsert, so the command can be stopped and
+started again. Run it once after deploying the rollup; afterwards rows are
+kept up to date by signals.
+
+Usage:
+    python manage.py rebuild_patient_stats [--batch-size 2000]
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.patients import stats
+from apps.patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Recompute patient statistics (visits, revenue, last/next visit) in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Patients per batch (default: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        
+        started = time.monotonic()
+        processed = 0
+        last_id = 0
+        
+        while True:
+            ids = list(
+                Patient.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            stats.refresh(ids)
+            last_id = ids[-1]
+            processed += len(ids)
+        
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt stats of {processed} patients in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,446 @@
+"""
+Patient merge engine
+
+Duplicates are found in bulk with grouped queries over indexed columns:
+patients sharing an iin_hash, or a normalized phone together with birth
+date and first name (a shared family phone alone is not a duplicate).
+Overlapping groups are joined into clusters; the survivor of a cluster is
+the patient with a verified IIN, then any IIN, then the oldest record.
+A cluster holding two different IINs (joined through phone matches) is
+never merged, it is reported for manual review instead.
+
+A batch of clusters is merged in one transaction with one set-based
+UPDATE ... FROM unnest() per table referencing patients, whatever the
+batch size: appointments (and with them visits and invoices), files,
+consent and audit rows, Telegram links, comms and so on. The survivor
+takes over blank identity fields, balances are summed, medical notes are
+combined, and duplicates are deleted.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import connection, models, transaction
+from django.db.models import Count
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from apps.calendar.models import Appointment
+from apps.calendar.services import schedule_cache
+from apps.consent.models import AuditLog
+
+from . import stats
+from .models import Patient
+from .search import build_search_text
+
+logger = logging.getLogger(__name__)
+
+
+BY_IIN = 'iin'
+BY_PHONE = 'phone'
+CRITERIA = (BY_IIN, BY_PHONE)
+
+DEFAULT_BATCH_SIZE = 500
+
+# Field groups copied together from the first duplicate that has them
+# when the whole group is blank on the survivor
+FILL_FIELDS = (
+    ('middle_name',),
+    ('email',),
+    ('address',),
+    ('iin', 'iin_enc', 'iin_hash', 'iin_last4'),
+    ('documents',),
+    ('kato_address',),
+    ('osms_status', 'osms_category', 'osms_verified_at'),
+)
+# Distinct non-blank values of all records are kept, one per line
+COMBINE_FIELDS = ('allergies', 'medical_history', 'notes')
+
+UPDATE_SQL = (
+    'UPDATE {table} AS t SET {column} = m.survivor '
+    'FROM unnest(%s::bigint[], %s::bigint[]) AS m(duplicate, survivor) '
+    'WHERE t.{column} = m.duplicate'
+)
+DELETE_SQL = 'DELETE FROM {table} WHERE {column} = ANY(%s::bigint[])'
+ORGANIZATIONS_SQL = (
+    'INSERT INTO {table} ({patient}, {organization}) '
+    'SELECT DISTINCT m.survivor, t.{organization} FROM {table} AS t '
+    'JOIN unnest(%s::bigint[], %s::bigint[]) AS m(duplicate, survivor) ON t.{patient} = m.duplicate '
+    'ON CONFLICT DO NOTHING'
+)
+
+
+def _chunks(items, size=10000):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _groups(queryset, criterion):
+    """Id lists of patients sharing the criterion key, one grouped query"""
+    if criterion == BY_IIN:
+        queryset = queryset.exclude(iin_hash='').values('iin_hash')
+    else:
+        queryset = queryset.exclude(phone_normalized='').annotate(
+            first_name_key=Lower('first_name')
+        ).values('phone_normalized', 'birth_date', 'first_name_key')
+    return queryset.annotate(
+        ids=ArrayAgg('id', distinct=True), size=Count('id', distinct=True)
+    ).filter(size__gt=1).values_list('ids', flat=True).order_by()
+
+
+def find_clusters(queryset=None, criteria=CRITERIA):
+    """
+    Duplicate clusters among the queryset patients
+
+    Returns a list of id lists, the survivor first, ordered by survivor id.
+    """
+    queryset = Patient.objects.all() if queryset is None else queryset
+
+    # Union-find over all groups
+    parent = {}
+
+    def find(patient_id):
+        root = patient_id
+        while parent[root] != root:
+            root = parent[root]
+        while parent[patient_id] != root:
+            parent[patient_id], patient_id = root, parent[patient_id]
+        return root
+
+    for criterion in criteria:
+        for ids in _groups(queryset, criterion):
+            for patient_id in ids:
+                parent.setdefault(patient_id, patient_id)
+            root = find(ids[0])
+            for patient_id in ids[1:]:
+                other = find(patient_id)
+                if other != root:
+                    parent[other] = root
+
+    members = defaultdict(list)
+    for patient_id in parent:
+        members[find(patient_id)].append(patient_id)
+
+    # Survivor preference: verified IIN, any IIN, oldest record
+    preference = {}
+    for chunk in _chunks(list(parent)):
+        for patient_id, verified, iin_hash in Patient.objects.filter(id__in=chunk).values_list(
+            'id', 'iin_verified', 'iin_hash'
+        ):
+            preference[patient_id] = (not verified, not iin_hash, patient_id)
+
+    clusters = [sorted(ids, key=preference.__getitem__) for ids in members.values()]
+    clusters.sort(key=lambda ids: ids[0])
+    return clusters
+
+
+def iin_conflicts(clusters):
+    """Survivor ids of the clusters whose patients have more than one distinct IIN"""
+    cluster_of = {patient_id: ids[0] for ids in clusters for patient_id in ids}
+    hashes = defaultdict(set)
+    for chunk in _chunks(list(cluster_of)):
+        for patient_id, iin_hash in Patient.objects.filter(id__in=chunk).exclude(iin_hash='').values_list(
+            'id', 'iin_hash'
+        ):
+            hashes[cluster_of[patient_id]].add(iin_hash)
+    return {survivor_id for survivor_id, values in hashes.items() if len(values) > 1}
+
+
+def _relations():
+    """Reverse relations of Patient: (name, model, foreign key, one_to_one)"""
+    return [
+        (rel.get_accessor_name(), rel.related_model, rel.field, rel.one_to_one)
+        for rel in Patient._meta.related_objects
+        if not rel.many_to_many
+    ]
+
+
+def _mapping(clusters):
+    duplicates, survivors = [], []
+    for survivor, *cluster_duplicates in clusters:
+        duplicates.extend(cluster_duplicates)
+        survivors.extend([survivor] * len(cluster_duplicates))
+    return duplicates, survivors
+
+
+def preview(clusters):
+    """
+    Impact of merging the clusters: per cluster, rows moving to the survivor
+    by relation name. One grouped query per relation. Clusters with
+    different IINs are flagged with iin_conflict, merge() skips them.
+    """
+    conflicts = iin_conflicts(clusters)
+    duplicates, survivors = _mapping(clusters)
+    survivor_of = dict(zip(duplicates, survivors))
+    moves = defaultdict(lambda: defaultdict(int))
+
+    for name, model, field, _ in _relations():
+        for chunk in _chunks(duplicates):
+            rows = model._base_manager.filter(**{f'{field.attname}__in': chunk}).values(field.attname).annotate(
+                rows=Count('pk')
+            ).values_list(field.attname, 'rows').order_by()
+            for duplicate_id, count in rows:
+                moves[survivor_of[duplicate_id]][name] += count
+
+    names = {
+        patient_id: f'{last_name} {first_name}'
+        for patient_id, last_name, first_name in Patient.objects.filter(
+            id__in=[ids[0] for ids in clusters]
+        ).values_list('id', 'last_name', 'first_name')
+    }
+    return [
+        {
+            'survivor': ids[0],
+            'survivor_name': names.get(ids[0], ''),
+            'duplicates': ids[1:],
+            'moves': dict(moves[ids[0]]),
+            'iin_conflict': ids[0] in conflicts,
+        }
+        for ids in clusters
+    ]
+
+
+def _merge_fields(survivor, duplicates):
+    """Fold duplicate fields into the survivor, returns the changed field names"""
+    changed = set()
+
+    for group in FILL_FIELDS:
+        if any(getattr(survivor, field) for field in group):
+            continue
+        for duplicate in duplicates:
+            if any(getattr(duplicate, field) for field in group):
+                for field in group:
+                    setattr(survivor, field, getattr(duplicate, field))
+                changed.update(group)
+                break
+
+    for field in COMBINE_FIELDS:
+        values = []
+        for record in [survivor, *duplicates]:
+            value = (getattr(record, field) or '').strip()
+            if value and value not in values:
+                values.append(value)
+        combined = '\n'.join(values)
+        if combined != getattr(survivor, field):
+            setattr(survivor, field, combined)
+            changed.add(field)
+
+    balance = survivor.balance + sum((duplicate.balance for duplicate in duplicates), Decimal('0'))
+    if balance != survivor.balance:
+        survivor.balance = balance
+        changed.add('balance')
+
+    tags = list(survivor.tags or [])
+    for duplicate in duplicates:
+        tags.extend(tag for tag in duplicate.tags or [] if tag not in tags)
+    if tags != list(survivor.tags or []):
+        survivor.tags = tags
+        changed.add('tags')
+
+    if not survivor.iin_verified:
+        verified = next((duplicate for duplicate in duplicates if duplicate.iin_verified), None)
+        if verified and verified.iin_hash == survivor.iin_hash:
+            survivor.iin_verified = True
+            survivor.iin_verified_at = verified.iin_verified_at
+            changed |= {'iin_verified', 'iin_verified_at'}
+
+    if 'middle_name' in changed:
+        survivor.search_text = build_search_text(survivor)
+        changed.add('search_text')
+    return changed
+
+
+def _move_one_to_one(model, field, duplicates, survivors):
+    """
+    Keep one row per survivor: the survivor's own, else the first
+    duplicate's. Returns (moved, deleted) counts.
+    """
+    survivor_of = dict(zip(duplicates, survivors))
+    rows = model._base_manager.filter(
+        **{f'{field.attname}__in': duplicates + list(set(survivors))}
+    ).values_list('pk', field.attname).order_by(field.attname)
+
+    has_row = {patient_id for _, patient_id in rows if patient_id not in survivor_of}
+    move, delete = [], []
+    for pk, patient_id in rows:
+        if patient_id not in survivor_of:
+            continue
+        survivor = survivor_of[patient_id]
+        if survivor in has_row:
+            delete.append(pk)
+        else:
+            has_row.add(survivor)
+            move.append((pk, survivor))
+
+    if delete:
+        model._base_manager.filter(pk__in=delete).delete()
+    for pk, survivor in move:
+        model._base_manager.filter(pk=pk).update(**{field.attname: survivor})
+    return len(move), len(delete)
+
+
+def _unique_together(model, field):
+    """Unconditional unique field sets of the model that include the patient field"""
+    field_sets = [
+        tuple(constraint.fields) for constraint in model._meta.constraints
+        if isinstance(constraint, models.UniqueConstraint) and constraint.fields and constraint.condition is None
+    ]
+    field_sets += [tuple(fields) for fields in model._meta.unique_together]
+    return [fields for fields in field_sets if field.name in fields]
+
+
+def _drop_unique_clashes(model, field, duplicates, survivors):
+    """
+    Delete duplicate rows that would break a unique key once moved to the
+    survivor (e.g. the same birthday reminder job of both records). The
+    survivor's own row wins, then the first duplicate's. Returns the
+    number deleted.
+    """
+    survivor_of = dict(zip(duplicates, survivors))
+    rank = {patient_id: position for position, patient_id in enumerate(duplicates, start=1)}
+    delete = set()
+    for fields in _unique_together(model, field):
+        others = [model._meta.get_field(name).attname for name in fields if name != field.name]
+        rows = model._base_manager.filter(
+            **{f'{field.attname}__in': duplicates + list(set(survivors))}
+        ).values_list('pk', field.attname, *others)
+
+        kept = set()
+        for pk, patient_id, *values in sorted(rows, key=lambda row: rank.get(row[1], 0)):
+            if None in values:
+                # NULLs never clash
+                continue
+            key = (survivor_of.get(patient_id, patient_id), *values)
+            if key in kept:
+                delete.add(pk)
+            else:
+                kept.add(key)
+
+    if delete:
+        model._base_manager.filter(pk__in=delete).delete()
+    return len(delete)
+
+
+def merge(clusters, user=None):
+    """
+    Merge a batch of clusters in one transaction
+
+    Clusters with different IINs are left alone. Returns {'clusters',
+    'merged', 'moved': {relation: rows}, 'conflicts': [survivor ids]}.
+    """
+    conflicts = iin_conflicts(clusters)
+    clusters = [ids for ids in clusters if ids[0] not in conflicts]
+    duplicates, survivors = _mapping(clusters)
+    if not duplicates:
+        return {'clusters': 0, 'merged': 0, 'moved': {}, 'conflicts': sorted(conflicts)}
+    moved = defaultdict(int)
+
+    with transaction.atomic():
+        patients = Patient.objects.select_for_update().in_bulk(duplicates + list(set(survivors)))
+
+        # Calendar snapshots embed patient names and phones, drop the affected days
+        touched_days = {
+            (branch_id, timezone.localdate(start))
+            for branch_id, start in Appointment.objects.filter(patient_id__in=duplicates + list(set(survivors))).values_list(
+                'branch_id', 'start_datetime'
+            )
+        }
+
+        changed_patients, changed_fields = [], set()
+        for survivor_id, *cluster_duplicates in clusters:
+            survivor = patients[survivor_id]
+            changed = _merge_fields(survivor, [patients[patient_id] for patient_id in cluster_duplicates])
+            if changed:
+                changed_patients.append(survivor)
+                changed_fields |= changed
+        if changed_patients:
+            Patient.objects.bulk_update(changed_patients, sorted(changed_fields | {'updated_at'}))
+
+        with connection.cursor() as cursor:
+            for name, model, field, one_to_one in _relations():
+                if one_to_one:
+                    moved[name] += _move_one_to_one(model, field, duplicates, survivors)[0]
+                    continue
+                _drop_unique_clashes(model, field, duplicates, survivors)
+                cursor.execute(
+                    UPDATE_SQL.format(table=connection.ops.quote_name(model._meta.db_table), column=field.column),
+                    [duplicates, survivors]
+                )
+                moved[name] += cursor.rowcount
+
+            through = Patient.organizations.through._meta
+            cursor.execute(
+                ORGANIZATIONS_SQL.format(
+                    table=connection.ops.quote_name(through.db_table),
+                    patient=through.get_field('patient').column,
+                    organization=through.get_field('organization').column
+                ),
+                [duplicates, survivors]
+            )
+            moved['organizations'] += cursor.rowcount
+
+            # Nothing references the duplicates any more: plain deletes
+            # instead of the ORM collector; a leftover reference fails the
+            # (deferred) foreign key check and rolls the batch back
+            cursor.execute(
+                DELETE_SQL.format(
+                    table=connection.ops.quote_name(through.db_table), column=through.get_field('patient').column
+                ),
+                [duplicates]
+            )
+            cursor.execute(
+                DELETE_SQL.format(table=connection.ops.quote_name(Patient._meta.db_table), column='id'),
+                [duplicates]
+            )
+
+        AuditLog.objects.bulk_create([
+            AuditLog(
+                user=user,
+                organization=getattr(user, 'organization', None),
+                patient_id=survivor_id,
+                action='write',
+                object_type='Patient',
+                object_id=str(survivor_id),
+                details={'merged_patient_ids': cluster_duplicates}
+            )
+            for survivor_id, *cluster_duplicates in clusters
+            if cluster_duplicates
+        ])
+
+        stats.refresh_on_commit(set(survivors))
+        schedule_cache.invalidate_days(touched_days)
+
+    return {
+        'clusters': len([ids for ids in clusters if len(ids) > 1]),
+        'merged': len(duplicates),
+        'moved': {name: count for name, count in moved.items() if count},
+        'conflicts': sorted(conflicts),
+    }
+
+
+def merge_all(clusters, batch_size=DEFAULT_BATCH_SIZE, user=None, progress=None):
+    """
+    Merge clusters in batches, calling progress(done, total, result) after each
+
+    A failing batch is rolled back and logged, the next batches still run;
+    its clusters are counted in 'failed'.
+    """
+    total = {'clusters': 0, 'merged': 0, 'moved': defaultdict(int), 'conflicts': [], 'failed': 0}
+    for start in range(0, len(clusters), batch_size):
+        batch = clusters[start:start + batch_size]
+        try:
+            result = merge(batch, user=user)
+        except Exception as e:
+            logger.exception(f"Merging clusters {batch[0][0]}..{batch[-1][0]} failed: {e}")
+            total['failed'] += len(batch)
+            result = {'clusters': 0, 'merged': 0, 'moved': {}, 'conflicts': [], 'error': str(e)}
+        total['clusters'] += result['clusters']
+        total['merged'] += result['merged']
+        total['conflicts'] += result['conflicts']
+        for name, count in result['moved'].items():
+            total['moved'][name] += count
+        if progress:
+            progress(min(start + batch_size, len(clusters)), len(clusters), result)
+    total['moved'] = dict(total['moved'])
+    return total
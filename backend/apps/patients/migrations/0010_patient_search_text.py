@@ -0,0 +1,90 @@
+# Generated manually: normalized search_text with a pg_trgm GIN index
+
+import re
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+BATCH_SIZE = 2000
+
+# Frozen copy of apps.patients.search.build_search_text (and the phone
+# normalization it uses) as of this migration; later changes there must
+# not change what this migration writes
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'ә': 'a', 'ғ': 'g', 'қ': 'k', 'ң': 'n', 'ө': 'o', 'ұ': 'u', 'ү': 'u',
+    'һ': 'h', 'і': 'i',
+}
+NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def name_tokens(text):
+    latin = ''.join(TRANSLIT.get(char, char) for char in (text or '').lower())
+    return [token for token in NON_WORD.split(latin) if token and not token.isdigit()]
+
+
+def phone_digits(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) == 11 and digits.startswith('8'):
+        return '7' + digits[1:]
+    if len(digits) == 10:
+        return '7' + digits
+    return digits
+
+
+def build_search_text(patient):
+    tokens = []
+    for field in ('last_name', 'first_name', 'middle_name'):
+        tokens.extend(name_tokens(getattr(patient, field)))
+    digits = phone_digits(patient.phone)
+    if digits:
+        tokens.append(digits)
+    return ' '.join(tokens)
+
+
+def fill_search_text(apps, schema_editor):
+    """
+    Build search_text for existing patients in batches
+    """
+    Patient = apps.get_model('patients', 'Patient')
+    db_alias = schema_editor.connection.alias
+    patients = Patient.objects.using(db_alias).only(
+        'id', 'first_name', 'last_name', 'middle_name', 'phone'
+    ).order_by('id')
+
+    batch = []
+    for patient in patients.iterator(chunk_size=BATCH_SIZE):
+        patient.search_text = build_search_text(patient)
+        batch.append(patient)
+        if len(batch) >= BATCH_SIZE:
+            Patient.objects.using(db_alias).bulk_update(batch, ['search_text'])
+            batch = []
+    if batch:
+        Patient.objects.using(db_alias).bulk_update(batch, ['search_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0009_change_patient_organization_to_many'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='patient',
+            name='search_text',
+            field=models.TextField(blank=True, editable=False, help_text='Транслитерированное ФИО и цифры телефона для поиска'),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patient',
+            index=GinIndex(fields=['search_text'], opclasses=['gin_trgm_ops'], name='patients_search_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated manually: E.164 phone_normalized columns for indexed deduplication
+#
+# Existing rows are filled by `python manage.py backfill_phone_normalized`.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0010_patient_search_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='phone_normalized',
+            field=models.CharField(blank=True, editable=False, help_text='Телефон в формате E.164 для поиска дубликатов', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='patientphone',
+            name='phone_normalized',
+            field=models.CharField(blank=True, editable=False, help_text='Телефон в формате E.164 для поиска дубликатов', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['phone_normalized'], name='patients_phone_n_987526_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientphone',
+            index=models.Index(fields=['phone_normalized'], name='patient_pho_phone_n_dc628c_idx'),
+        ),
+    ]
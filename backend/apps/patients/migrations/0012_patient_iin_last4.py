@@ -0,0 +1,23 @@
+# Generated manually: last 4 IIN digits so masked display needs no decryption
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0011_phone_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='iin_last4',
+            field=models.CharField(blank=True, editable=False, help_text='Last 4 IIN digits for masked display', max_length=4),
+        ),
+        # Rows that only have iin_enc are filled when next saved or encrypted
+        migrations.RunSQL(
+            "UPDATE patients SET iin_last4 = RIGHT(REPLACE(REPLACE(iin, ' ', ''), '-', ''), 4) WHERE iin <> '';",
+            migrations.RunSQL.noop,
+        ),
+    ]
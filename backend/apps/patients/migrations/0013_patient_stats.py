@@ -0,0 +1,35 @@
+# Generated manually: precomputed patient statistics rollup
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0012_patient_iin_last4'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientStats',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='patients.patient')),
+                ('total_visits', models.PositiveIntegerField(default=0)),
+                ('total_revenue', models.DecimalField(decimal_places=2, default=0, help_text='Lifetime value', max_digits=14)),
+                ('average_check', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_visit_at', models.DateTimeField(blank=True, null=True)),
+                ('next_appointment_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Patient Stats',
+                'verbose_name_plural': 'Patient Stats',
+                'db_table': 'patient_stats',
+                'indexes': [
+                    models.Index(fields=['total_revenue'], name='patient_sta_total_r_869242_idx'),
+                    models.Index(fields=['last_visit_at'], name='patient_sta_last_vi_602480_idx'),
+                ],
+            },
+        ),
+    ]
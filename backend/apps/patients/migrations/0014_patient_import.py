@@ -0,0 +1,42 @@
+# Generated manually: bulk patient import jobs
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('org', '0001_initial'),
+        ('patients', '0013_patient_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/patients/%Y/%m/')),
+                ('report', models.FileField(blank=True, help_text='CSV с ошибками по строкам', upload_to='imports/patients/%Y/%m/')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершен'), ('failed', 'Ошибка')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('total_rows', models.PositiveIntegerField(default=0)),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('existing_count', models.PositiveIntegerField(default=0, help_text='Уже были в организации, пропущены')),
+                ('duplicate_count', models.PositiveIntegerField(default=0, help_text='Повторы внутри файла')),
+                ('error_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='patient_imports', to=settings.AUTH_USER_MODEL)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patient_imports', to='org.organization')),
+            ],
+            options={
+                'verbose_name': 'Patient Import',
+                'verbose_name_plural': 'Patient Imports',
+                'db_table': 'patient_imports',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated manually: chunked upload content of patient files
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_blob_uploadsession'),
+        ('patients', '0014_patient_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='Content of a chunked upload, shared by identical files', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='patient_files', to='core.blob'),
+        ),
+    ]
@@ -1,8 +1,10 @@
 from django.db import models
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.utils import timezone
 from apps.org.models import Organization
-from .utils.encryption import encrypt_iin, decrypt_iin, hash_iin, mask_iin
+from .utils.encryption import encrypt_iin, decrypt_iin, hash_iin, iin_last4, mask_iin
+from .utils.phone import normalize_phone
 
 
 class Patient(models.Model):
@@ -29,6 +31,12 @@ class Patient(models.Model):
     
     # Contacts
     phone = models.CharField(max_length=20, db_index=True)
+    phone_normalized = models.CharField(
+        max_length=16,
+        blank=True,
+        editable=False,
+        help_text='Телефон в формате E.164 для поиска дубликатов'
+    )
     email = models.EmailField(blank=True)
     address = models.TextField(blank=True)
     
@@ -36,6 +44,7 @@ class Patient(models.Model):
     iin = models.CharField(max_length=20, blank=True, db_index=True, help_text='ИИН (legacy, use iin_enc for new records)')
     iin_enc = models.TextField(blank=True, help_text='Encrypted IIN (AES-256 via Fernet)')
     iin_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text='SHA-256 hash of IIN for lookups')
+    iin_last4 = models.CharField(max_length=4, blank=True, editable=False, help_text='Last 4 IIN digits for masked display')
     iin_verified = models.BooleanField(default=False, help_text='ИИН верифицирован')
     iin_verified_at = models.DateTimeField(null=True, blank=True, help_text='Дата верификации ИИН')
     documents = models.JSONField(default=dict, blank=True, help_text='Документы (паспорт и т.д.)')
@@ -111,6 +120,13 @@ class Patient(models.Model):
     allergies = models.TextField(blank=True, help_text='Аллергии')
     medical_history = models.TextField(blank=True, help_text='Анамнез')
     
+    # Search (see apps.patients.search)
+    search_text = models.TextField(
+        blank=True,
+        editable=False,
+        help_text='Транслитерированное ФИО и цифры телефона для поиска'
+    )
+    
     # Meta
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -125,6 +141,8 @@ class Patient(models.Model):
             models.Index(fields=['phone']),
             models.Index(fields=['iin']),
             models.Index(fields=['iin_hash']),
+            models.Index(fields=['phone_normalized']),
+            GinIndex(fields=['search_text'], opclasses=['gin_trgm_ops'], name='patients_search_trgm_idx'),
         ]
     
     def __str__(self):
@@ -137,6 +155,21 @@ class Patient(models.Model):
         """
         return self.organizations.first()
     
+    @staticmethod
+    def phone_q(phone):
+        """
+        Q for patients whose main or additional phone equals phone
+
+        Exact match on the indexed phone_normalized columns; matches
+        nothing when phone is not a full number.
+        """
+        normalized = normalize_phone(phone)
+        if not normalized:
+            return models.Q(pk__in=[])
+        return models.Q(phone_normalized=normalized) | models.Q(models.Exists(
+            PatientPhone.objects.filter(patient=models.OuterRef('pk'), phone_normalized=normalized)
+        ))
+    
     def has_organization(self, organization):
         """
         Check if patient belongs to specific organization
@@ -177,7 +210,9 @@ class Patient(models.Model):
     
     @property
     def iin_masked(self):
-        """Get masked IIN for display"""
+        """Get masked IIN for display (decrypts only rows without iin_last4)"""
+        if self.iin_last4:
+            return '*' * 8 + self.iin_last4
         iin = self.iin_decrypted
         return mask_iin(iin) if iin else ''
     
@@ -195,23 +230,117 @@ class Patient(models.Model):
             # Encrypt and hash
             self.iin_enc = encrypt_iin(plain_iin)
             self.iin_hash = hash_iin(plain_iin)
+            self.iin_last4 = iin_last4(plain_iin)
             
             # Keep legacy field for backward compatibility (will be removed in Phase 4)
             self.iin = plain_iin
         else:
             self.iin_enc = ''
             self.iin_hash = ''
+            self.iin_last4 = ''
             self.iin = ''
     
     def save(self, *args, **kwargs):
-        """Override save to auto-encrypt IIN if needed"""
+        """Override save to auto-encrypt IIN and refresh phone_normalized/search_text"""
+        from .search import SOURCE_FIELDS, build_search_text
+        
         # If iin is set but iin_enc is not, encrypt it
         if self.iin and not self.iin_enc:
             self.set_iin(self.iin)
+        if self.iin and not self.iin_last4:
+            self.iin_last4 = iin_last4(self.iin)
+        
+        self.phone_normalized = normalize_phone(self.phone)
+        self.search_text = build_search_text(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if update_fields & set(SOURCE_FIELDS):
+                update_fields |= {'search_text', 'phone_normalized'}
+            if update_fields & {'iin', 'iin_enc', 'iin_hash'}:
+                update_fields.add('iin_last4')
+            kwargs['update_fields'] = update_fields
         
         super().save(*args, **kwargs)
 
 
+class PatientStats(models.Model):
+    """
+    Precomputed patient card statistics (see apps.patients.stats)
+    """
+    patient = models.OneToOneField(
+        Patient,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    total_visits = models.PositiveIntegerField(default=0)
+    total_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text='Lifetime value')
+    average_check = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_visit_at = models.DateTimeField(null=True, blank=True)
+    next_appointment_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'patient_stats'
+        verbose_name = 'Patient Stats'
+        verbose_name_plural = 'Patient Stats'
+        indexes = [
+            models.Index(fields=['total_revenue']),
+            models.Index(fields=['last_visit_at']),
+        ]
+    
+    def __str__(self):
+        return f"Stats of patient #{self.patient_id}"
+
+
+class PatientImport(models.Model):
+    """
+    Bulk patient import from a CSV/XLSX file (see apps.patients.importer)
+    """
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Завершен'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='patient_imports'
+    )
+    file = models.FileField(upload_to='imports/patients/%Y/%m/')
+    report = models.FileField(upload_to='imports/patients/%Y/%m/', blank=True, help_text='CSV с ошибками по строкам')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    
+    # Counters
+    total_rows = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    existing_count = models.PositiveIntegerField(default=0, help_text='Уже были в организации, пропущены')
+    duplicate_count = models.PositiveIntegerField(default=0, help_text='Повторы внутри файла')
+    error_count = models.PositiveIntegerField(default=0)
+    
+    created_by = models.ForeignKey(
+        'core.User',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='patient_imports'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'patient_imports'
+        verbose_name = 'Patient Import'
+        verbose_name_plural = 'Patient Imports'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Import #{self.id} ({self.status})"
+
+
 class Representative(models.Model):
     """
     Patient representative (for minors, elderly, etc.)
@@ -278,6 +407,12 @@ class PatientPhone(models.Model):
         related_name='additional_phones'
     )
     phone = models.CharField(max_length=20)
+    phone_normalized = models.CharField(
+        max_length=16,
+        blank=True,
+        editable=False,
+        help_text='Телефон в формате E.164 для поиска дубликатов'
+    )
     type = models.CharField(max_length=20, choices=PHONE_TYPES, default='mobile')
     note = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
@@ -287,9 +422,19 @@ class PatientPhone(models.Model):
         db_table = 'patient_phones'
         verbose_name = 'Patient Phone'
         verbose_name_plural = 'Patient Phones'
+        indexes = [
+            models.Index(fields=['phone_normalized']),
+        ]
     
     def __str__(self):
         return f"{self.phone} ({self.get_type_display()}) - {self.patient.full_name}"
+    
+    def save(self, *args, **kwargs):
+        self.phone_normalized = normalize_phone(self.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'phone_normalized'}
+        super().save(*args, **kwargs)
 
 
 class PatientSocialNetwork(models.Model):
@@ -450,6 +595,14 @@ class PatientFile(models.Model):
     file_type = models.CharField(max_length=20, choices=FILE_TYPES, default='other')
     title = models.CharField(max_length=200)
     file = models.FileField(upload_to='patients/%Y/%m/')
+    blob = models.ForeignKey(
+        'core.Blob',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='patient_files',
+        help_text='Content of a chunked upload, shared by identical files'
+    )
     description = models.TextField(blank=True)
     uploaded_by = models.ForeignKey(
         'core.User',
@@ -0,0 +1,128 @@
+"""
+Patient search
+
+Every patient keeps a normalized search_text: name tokens transliterated to
+Latin (so Cyrillic, Kazakh and Latin spellings meet) followed by the phone
+digits. It is indexed with pg_trgm (GIN, gin_trgm_ops), which serves both
+typo-tolerant word similarity for names and substring matches for phones.
+A full 12-digit query is looked up by iin_hash, plaintext IIN is never
+searched.
+"""
+import re
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Q, Value
+
+from .utils.encryption import hash_iin
+from .utils.phone import normalize_phone
+
+
+# Fields search_text is built from
+SOURCE_FIELDS = ('first_name', 'last_name', 'middle_name', 'phone')
+
+# Minimum word similarity for ranked (typo tolerant) search; the lazy
+# filter_queryset uses the pg_trgm default of 0.6
+TYPO_THRESHOLD = 0.35
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Digits typed before phone search kicks in
+MIN_PHONE_DIGITS = 3
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Kazakh
+    'ә': 'a', 'ғ': 'g', 'қ': 'k', 'ң': 'n', 'ө': 'o', 'ұ': 'u', 'ү': 'u',
+    'һ': 'h', 'і': 'i',
+}
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def transliterate(text):
+    return ''.join(TRANSLIT.get(char, char) for char in text.lower())
+
+
+def name_tokens(text):
+    """Latin lowercase tokens of a name or a query, digits dropped"""
+    return [token for token in _NON_WORD.split(transliterate(text or '')) if token and not token.isdigit()]
+
+
+def phone_digits(phone):
+    """Digits of a phone, full numbers in their normalized E.164 form"""
+    normalized = normalize_phone(phone)
+    return normalized[1:] if normalized else re.sub(r'\D', '', phone or '')
+
+
+def build_search_text(patient):
+    tokens = []
+    for field in ('last_name', 'first_name', 'middle_name'):
+        tokens.extend(name_tokens(getattr(patient, field)))
+    digits = phone_digits(patient.phone)
+    if digits:
+        tokens.append(digits)
+    return ' '.join(tokens)
+
+
+def _parse(query):
+    query = (query or '').strip()
+    return name_tokens(query), re.sub(r'\D', '', query)
+
+
+def filter_queryset(queryset, query):
+    """
+    Filter patients matching every name token and the typed digits
+
+    Lazy, so it can be combined with list ordering and pagination.
+    """
+    tokens, digits = _parse(query)
+
+    if len(digits) == 12 and not tokens:
+        # Full IIN (a phone has 11 digits)
+        return queryset.filter(Q(iin_hash=hash_iin(digits)) | Q(search_text__contains=digits))
+
+    if not tokens and len(digits) < MIN_PHONE_DIGITS:
+        return queryset.none()
+
+    for token in tokens:
+        queryset = queryset.filter(search_text__trigram_word_similar=token)
+    if len(digits) >= MIN_PHONE_DIGITS:
+        queryset = queryset.filter(search_text__contains=phone_digits(digits))
+    return queryset
+
+
+def ranked(queryset, query, limit=DEFAULT_LIMIT):
+    """
+    Best matching patients first, tolerating typos in names
+
+    Returns a list of patients annotated with rank (0..1).
+    """
+    tokens, _ = _parse(query)
+    queryset = filter_queryset(queryset, query)
+
+    if tokens:
+        similarities = [TrigramWordSimilarity(Value(token), F('search_text')) for token in tokens]
+        # Sum of per-token similarities, scaled to 0..1
+        rank = similarities[0]
+        for similarity in similarities[1:]:
+            rank = rank + similarity
+        queryset = queryset.annotate(rank=rank / len(tokens))
+    else:
+        queryset = queryset.annotate(rank=Value(1.0, output_field=FloatField()))
+
+    queryset = queryset.order_by('-rank', 'last_name', 'first_name', 'id')[:limit]
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Transaction scoped, so pooled connections keep the default
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                [str(TYPO_THRESHOLD)]
+            )
+        return list(queryset)
@@ -1,8 +1,9 @@
 from rest_framework import serializers
+from apps.core.uploads import thumbnail_url
 from .models import (
     Patient, Representative, PatientFile,
     PatientPhone, PatientSocialNetwork, PatientContactPerson,
-    PatientDisease, PatientDiagnosis, PatientDoseLoad, ConsentHistory
+    PatientDisease, PatientDiagnosis, PatientDoseLoad, ConsentHistory, PatientImport
 )
 from .validators import validate_iin
 
@@ -30,14 +31,18 @@ class PatientFileSerializer(serializers.ModelSerializer):
     """
     file_type_display = serializers.CharField(source='get_file_type_display', read_only=True)
     uploaded_by_name = serializers.CharField(source='uploaded_by.get_full_name', read_only=True)
+    thumbnail = serializers.SerializerMethodField()
     
     class Meta:
         model = PatientFile
         fields = [
             'id', 'patient', 'file_type', 'file_type_display', 'title',
-            'file', 'description', 'uploaded_by', 'uploaded_by_name', 'created_at'
+            'file', 'thumbnail', 'description', 'uploaded_by', 'uploaded_by_name', 'created_at'
         ]
         read_only_fields = ['id', 'created_at']
+    
+    def get_thumbnail(self, obj):
+        return thumbnail_url(obj, self.context.get('request'))
 
 
 class PatientPhoneSerializer(serializers.ModelSerializer):
@@ -187,52 +192,6 @@ class PatientSerializer(serializers.ModelSerializer):
         
         return data
     
-    def validate_phone(self, value):
-        """
-        Validate that phone is unique within organization
-        """
-        # Allow empty phone during development
-        if not value:
-            return value
-            
-        try:
-            organization = self.context['request'].user.organization
-        except (KeyError, AttributeError):
-            # If no user context (e.g., testing), skip validation
-            return value
-        
-        # Normalize phone (remove non-digits)
-        import re
-        normalized = re.sub(r'\D', '', value)
-        
-        # Skip validation if phone is too short
-        if len(normalized) < 10:
-            return value
-        
-        # Check for duplicates within the same organization
-        try:
-            query = Patient.objects.filter(
-                organizations=organization,
-                phone__iregex=f'[^0-9]*{normalized}[^0-9]*'
-            )
-            
-            # Exclude current patient in update
-            if self.instance:
-                query = query.exclude(pk=self.instance.pk)
-            
-            if query.exists():
-                existing = query.first()
-                raise serializers.ValidationError(
-                    f'Пациент с таким телефоном уже существует в вашей организации: {existing.full_name}'
-                )
-        except Exception as e:
-            # Log error but don't fail validation
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f'Phone validation error: {e}')
-        
-        return value
-    
     def get_osms_status_display(self, obj):
         """Safe getter for OSMS status display"""
         try:
@@ -308,12 +267,17 @@ class PatientListSerializer(serializers.ModelSerializer):
     """
     full_name = serializers.CharField(read_only=True)
     age = serializers.IntegerField(read_only=True)
+    lifetime_value = serializers.DecimalField(
+        source='stats.total_revenue', max_digits=14, decimal_places=2, read_only=True
+    )
+    last_visit_at = serializers.DateTimeField(source='stats.last_visit_at', read_only=True)
     
     class Meta:
         model = Patient
         fields = [
             'id', 'first_name', 'last_name', 'full_name',
-            'birth_date', 'age', 'phone', 'balance', 'is_active'
+            'birth_date', 'age', 'phone', 'balance', 'is_active',
+            'lifetime_value', 'last_visit_at'
         ]
 
 
@@ -328,3 +292,24 @@ class PatientSearchSerializer(serializers.Serializer):
         if not attrs.get('phone') and not attrs.get('iin'):
             raise serializers.ValidationError('Укажите телефон или ИИН')
         return attrs
+
+
+class PatientImportSerializer(serializers.ModelSerializer):
+    """
+    Bulk patient import job (the file is uploaded on create)
+    """
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = PatientImport
+        fields = [
+            'id', 'file', 'status', 'status_display', 'error', 'total_rows', 'created_count',
+            'existing_count', 'duplicate_count', 'error_count', 'report', 'created_by',
+            'created_at', 'finished_at'
+        ]
+        read_only_fields = [field for field in fields if field != 'file']
+    
+    def validate_file(self, value):
+        if not value.name.lower().endswith(('.csv', '.xlsx')):
+            raise serializers.ValidationError('Поддерживаются файлы .csv и .xlsx')
+        return value
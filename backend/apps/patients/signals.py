@@ -0,0 +1,43 @@
+"""
+Patient signals
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from apps.calendar.models import Appointment
+
+from . import stats
+
+
+@receiver(pre_save, sender='calendar.Appointment')
+def remember_appointment_patient(sender, instance, update_fields=None, **kwargs):
+    """
+    Remember the stored patient, whose stats change too when the
+    appointment moves to another patient
+    """
+    instance._stats_old_patient_id = None
+    if instance._state.adding or (update_fields is not None and 'patient' not in update_fields):
+        return
+    instance._stats_old_patient_id = sender.objects.filter(pk=instance.pk).values_list('patient_id', flat=True).first()
+
+
+@receiver(post_save, sender='calendar.Appointment')
+@receiver(post_delete, sender='calendar.Appointment')
+def refresh_stats_on_appointment_change(sender, instance, **kwargs):
+    stats.refresh_on_commit([instance.patient_id, getattr(instance, '_stats_old_patient_id', None)])
+
+
+@receiver(post_save, sender='billing.Invoice')
+@receiver(post_delete, sender='billing.Invoice')
+def refresh_stats_on_invoice_change(sender, instance, **kwargs):
+    stats.refresh_on_commit(
+        Appointment.objects.filter(visit__id=instance.visit_id).values_list('patient_id', flat=True)
+    )
+
+
+@receiver(post_save, sender='billing.Payment')
+@receiver(post_delete, sender='billing.Payment')
+def refresh_stats_on_payment_change(sender, instance, **kwargs):
+    stats.refresh_on_commit(
+        Appointment.objects.filter(visit__invoices__id=instance.invoice_id).values_list('patient_id', flat=True)
+    )
@@ -0,0 +1,115 @@
+"""
+Patient statistics rollup
+
+One patient_stats row per patient holds the numbers of the patient card
+(visits, revenue, average check, last visit, next appointment) and backs
+sorting/filtering the patient list by lifetime value and last visit.
+
+Rows are recomputed with grouped queries for a set of patients, four
+queries whatever the set size: after commit for the patient touched by an
+appointment, invoice or payment change (see signals), and in batches by
+the rebuild_patient_stats command.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from apps.billing.models import Invoice
+from apps.calendar.models import Appointment
+
+from .models import Patient, PatientStats
+
+
+DONE_STATUS = 'done'
+UPCOMING_STATUSES = ('booked', 'confirmed')
+PAID_STATUS = 'paid'
+
+UPDATE_FIELDS = ['total_visits', 'total_revenue', 'average_check', 'last_visit_at', 'next_appointment_at', 'updated_at']
+
+
+def compute(patient_ids):
+    """
+    Unsaved PatientStats of the existing patients among patient_ids
+    """
+    ids = list(Patient.objects.filter(id__in=patient_ids).values_list('id', flat=True))
+    if not ids:
+        return []
+
+    visits = {
+        patient_id: (total, last)
+        for patient_id, total, last in Appointment.objects.filter(
+            patient_id__in=ids, status=DONE_STATUS
+        ).values('patient_id').annotate(
+            total=Count('id'), last=Max('start_datetime')
+        ).values_list('patient_id', 'total', 'last').order_by()
+    }
+    upcoming = dict(
+        Appointment.objects.filter(
+            patient_id__in=ids, status__in=UPCOMING_STATUSES, start_datetime__gte=timezone.now()
+        ).values('patient_id').annotate(
+            next=Min('start_datetime')
+        ).values_list('patient_id', 'next').order_by()
+    )
+    revenue = dict(
+        Invoice.objects.filter(
+            visit__appointment__patient_id__in=ids, status=PAID_STATUS
+        ).values('visit__appointment__patient_id').annotate(
+            total=Sum('paid_amount')
+        ).values_list('visit__appointment__patient_id', 'total').order_by()
+    )
+
+    now = timezone.now()
+    rows = []
+    for patient_id in ids:
+        total_visits, last_visit_at = visits.get(patient_id, (0, None))
+        total_revenue = revenue.get(patient_id) or Decimal('0')
+        rows.append(PatientStats(
+            patient_id=patient_id,
+            total_visits=total_visits,
+            total_revenue=total_revenue,
+            average_check=(total_revenue / total_visits).quantize(Decimal('0.01')) if total_visits else Decimal('0'),
+            last_visit_at=last_visit_at,
+            next_appointment_at=upcoming.get(patient_id),
+            updated_at=now,
+        ))
+    return rows
+
+
+def refresh(patient_ids):
+    """
+    Recompute and upsert the stats rows of patient_ids
+    """
+    rows = compute(patient_ids)
+    if rows:
+        PatientStats.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['patient'],
+            update_fields=UPDATE_FIELDS
+        )
+    return rows
+
+
+def refresh_on_commit(patient_ids):
+    """
+    Refresh after the current transaction commits (immediately in autocommit)
+    """
+    patient_ids = {patient_id for patient_id in patient_ids if patient_id}
+    if patient_ids:
+        transaction.on_commit(lambda: refresh(patient_ids))
+
+
+def get_stats(patient):
+    """
+    Stats row of a patient, recomputed when missing or when the stored
+    next appointment is already in the past
+    """
+    try:
+        stats = patient.stats
+    except PatientStats.DoesNotExist:
+        stats = None
+    if stats is None or (stats.next_appointment_at and stats.next_appointment_at < timezone.now()):
+        stats = refresh([patient.id])[0]
+    return stats
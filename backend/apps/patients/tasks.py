@@ -0,0 +1,45 @@
+"""
+Celery tasks for patients module
+"""
+from celery import shared_task
+
+
+# Waiting for a free organization slot: retry every SLOT_RETRY_SECONDS,
+# give up after SLOT_MAX_RETRIES
+SLOT_RETRY_SECONDS = 5
+SLOT_MAX_RETRIES = 60
+
+
+@shared_task(bind=True, max_retries=SLOT_MAX_RETRIES)
+def run_patient_analysis(self, job_id, patient_id, organization_id=None):
+    """
+    Generate the AI analysis of a job within the organization's
+    concurrency limit
+    """
+    from .ai_analysis import acquire_slot, fail, release_slot, run
+    
+    slot = acquire_slot(organization_id, job_id)
+    if slot is None:
+        if self.request.retries >= self.max_retries:
+            fail(job_id, 'AI сервис перегружен, попробуйте позже')
+            return {'job_id': job_id, 'success': False}
+        raise self.retry(countdown=SLOT_RETRY_SECONDS)
+    
+    try:
+        success = run(job_id, patient_id)
+    finally:
+        release_slot(slot, job_id)
+    return {'job_id': job_id, 'success': success}
+
+
+@shared_task
+def run_patient_import(import_id):
+    """
+    Import the file of a PatientImport job
+    """
+    from .importer import run_job
+    from .models import PatientImport
+    
+    job = PatientImport.objects.select_related('organization').get(id=import_id)
+    run_job(job)
+    return {'import_id': import_id, 'status': job.status, 'created': job.created_count}
@@ -11,6 +11,8 @@ from .views import (
     PatientDiseaseViewSet,
     PatientDiagnosisViewSet,
     PatientDoseLoadViewSet,
+    PatientImportViewSet,
+    KATOViewSet,
 )
 
 # Import Sprint 2-5 ViewSets - migrations already applied (0006)
@@ -40,6 +42,8 @@ router.register('contact-persons', PatientContactPersonViewSet, basename='patien
 router.register('diseases', PatientDiseaseViewSet, basename='patient-disease')
 router.register('diagnoses', PatientDiagnosisViewSet, basename='patient-diagnosis')
 router.register('dose-loads', PatientDoseLoadViewSet, basename='patient-dose-load')
+router.register('imports', PatientImportViewSet, basename='patient-import')
+router.register('kato', KATOViewSet, basename='kato')
 
 # Sprint 3: Medical Examinations & Treatment Plans
 if EXTENDED_VIEWS_AVAILABLE:
@@ -1,7 +1,15 @@
 """
 Patient utilities
 """
-from .encryption import encrypt_iin, decrypt_iin, hash_iin, mask_iin
+from .encryption import (
+    encrypt_iin, decrypt_iin, hash_iin, mask_iin,
+    encrypt_many, decrypt_many, hash_many, iin_last4
+)
+from .phone import normalize_phone
 
-__all__ = ['encrypt_iin', 'decrypt_iin', 'hash_iin', 'mask_iin']
+__all__ = [
+    'encrypt_iin', 'decrypt_iin', 'hash_iin', 'mask_iin',
+    'encrypt_many', 'decrypt_many', 'hash_many', 'iin_last4',
+    'normalize_phone'
+]
 
@@ -3,12 +3,44 @@ IIN encryption utilities for multi-org patient consent system
 
 Uses AES-256 encryption via Fernet for secure IIN storage
 and SHA-256 hashing for fast lookups without decryption.
+
+Fernet instances are built once per process and key set (see
+get_crypto), so per-row encrypt/decrypt calls do not repeat the key
+setup. Old keys listed in IIN_ENCRYPTION_OLD_KEYS still decrypt, new
+tokens are always written with IIN_ENCRYPTION_KEY.
 """
 import hashlib
-import base64
-from typing import Optional
+import logging
+from functools import lru_cache
+from typing import Iterable, List, Optional
 from django.conf import settings
-from cryptography.fernet import Fernet, InvalidToken
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+
+logger = logging.getLogger(__name__)
+
+
+class CryptoContext:
+    """
+    Fernet/MultiFernet for one key set
+    
+    key_id identifies the current (encrypting) key without revealing it.
+    """
+    
+    def __init__(self, key: bytes, old_keys=()):
+        self.key_id = hashlib.sha256(key).hexdigest()[:8]
+        self.fernet = Fernet(key)
+        self.multi = MultiFernet([self.fernet] + [Fernet(old_key) for old_key in old_keys])
+    
+    def encrypt(self, value: str) -> str:
+        return self.fernet.encrypt(value.encode('utf-8')).decode('utf-8')
+    
+    def decrypt(self, token: str) -> str:
+        return self.multi.decrypt(token.encode('utf-8')).decode('utf-8')
+    
+    def rotate(self, token: str) -> str:
+        """Re-encrypt a token made with any known key with the current key"""
+        return self.multi.rotate(token.encode('utf-8')).decode('utf-8')
 
 
 def get_encryption_key() -> bytes:
@@ -19,16 +51,9 @@ def get_encryption_key() -> bytes:
     key = getattr(settings, 'IIN_ENCRYPTION_KEY', None)
     
     if not key:
-        # Development only - generate temporary key
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.warning(
-            'IIN_ENCRYPTION_KEY not set in settings. '
-            'Generating temporary key (development only).'
-        )
-        # Generate a new key and print it
-        key = Fernet.generate_key().decode('utf-8')
-        logger.warning(f'Generated key (add to .env): IIN_ENCRYPTION_KEY={key}')
+        # Development only - generate temporary key (kept for the process
+        # lifetime by _generated_key, so tokens stay readable)
+        key = _generated_key()
     
     if isinstance(key, str):
         key = key.encode('utf-8')
@@ -36,6 +61,54 @@ def get_encryption_key() -> bytes:
     return key
 
 
+@lru_cache(maxsize=1)
+def _generated_key() -> str:
+    logger.warning(
+        'IIN_ENCRYPTION_KEY not set in settings. '
+        'Generating temporary key (development only).'
+    )
+    key = Fernet.generate_key().decode('utf-8')
+    logger.warning(f'Generated key (add to .env): IIN_ENCRYPTION_KEY={key}')
+    return key
+
+
+def get_old_keys() -> tuple:
+    """
+    Previous keys from IIN_ENCRYPTION_OLD_KEYS (list or comma separated)
+    """
+    old_keys = getattr(settings, 'IIN_ENCRYPTION_OLD_KEYS', None) or ()
+    if isinstance(old_keys, str):
+        old_keys = old_keys.split(',')
+    
+    keys = []
+    for key in old_keys:
+        if isinstance(key, str):
+            key = key.strip().encode('utf-8')
+        if key:
+            keys.append(key)
+    return tuple(keys)
+
+
+@lru_cache(maxsize=8)
+def _context(key: bytes, old_keys: tuple) -> CryptoContext:
+    return CryptoContext(key, old_keys)
+
+
+def get_crypto() -> CryptoContext:
+    """
+    Crypto context for the current settings, cached per key set
+    """
+    return _context(get_encryption_key(), get_old_keys())
+
+
+def _clean(iin: str) -> str:
+    return iin.replace(' ', '').replace('-', '')
+
+
+def _hash(iin: str, salt: str) -> str:
+    return hashlib.sha256(f"{salt}{iin}{salt}".encode('utf-8')).hexdigest()
+
+
 def get_hash_salt() -> str:
     """
     Get salt for hashing from settings
@@ -57,16 +130,9 @@ def encrypt_iin(iin: str) -> Optional[str]:
     if not iin:
         return None
     
-    # Remove any whitespace or dashes
-    iin = iin.replace(' ', '').replace('-', '')
-    
     try:
-        fernet = Fernet(get_encryption_key())
-        encrypted = fernet.encrypt(iin.encode('utf-8'))
-        return encrypted.decode('utf-8')
+        return get_crypto().encrypt(_clean(iin))
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f'Failed to encrypt IIN: {e}')
         raise
 
@@ -85,17 +151,11 @@ def decrypt_iin(iin_enc: str) -> Optional[str]:
         return None
     
     try:
-        fernet = Fernet(get_encryption_key())
-        decrypted = fernet.decrypt(iin_enc.encode('utf-8'))
-        return decrypted.decode('utf-8')
+        return get_crypto().decrypt(iin_enc)
     except InvalidToken:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error('Invalid encryption token - IIN may be corrupted or key changed')
         return None
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f'Failed to decrypt IIN: {e}')
         return None
 
@@ -114,16 +174,7 @@ def hash_iin(iin: str) -> Optional[str]:
     if not iin:
         return None
     
-    # Remove any whitespace or dashes
-    iin = iin.replace(' ', '').replace('-', '')
-    
-    # Combine with salt
-    salt = get_hash_salt()
-    salted = f"{salt}{iin}{salt}"
-    
-    # Hash with SHA-256
-    hash_obj = hashlib.sha256(salted.encode('utf-8'))
-    return hash_obj.hexdigest()
+    return _hash(_clean(iin), get_hash_salt())
 
 
 def mask_iin(iin: str, show_last: int = 4) -> str:
@@ -169,3 +220,47 @@ def verify_iin_hash(iin: str, iin_hash: str) -> bool:
     computed_hash = hash_iin(iin)
     return computed_hash == iin_hash
 
+
+
+def encrypt_many(iins: Iterable[str]) -> List[Optional[str]]:
+    """
+    Encrypt IINs with one crypto context; None for empty values
+    """
+    crypto = get_crypto()
+    return [crypto.encrypt(_clean(iin)) if iin else None for iin in iins]
+
+
+def decrypt_many(tokens: Iterable[str]) -> List[Optional[str]]:
+    """
+    Decrypt tokens with one crypto context; None for empty or invalid ones
+    """
+    crypto = get_crypto()
+    result = []
+    invalid = 0
+    for token in tokens:
+        if not token:
+            result.append(None)
+            continue
+        try:
+            result.append(crypto.decrypt(token))
+        except InvalidToken:
+            invalid += 1
+            result.append(None)
+    if invalid:
+        logger.error(f'{invalid} invalid encryption tokens - IIN may be corrupted or key changed')
+    return result
+
+
+def hash_many(iins: Iterable[str]) -> List[Optional[str]]:
+    """
+    Hash IINs with one salt lookup; None for empty values
+    """
+    salt = get_hash_salt()
+    return [_hash(_clean(iin), salt) if iin else None for iin in iins]
+
+
+def iin_last4(iin: str) -> str:
+    """
+    Last 4 digits kept in clear for masked display
+    """
+    return _clean(iin)[-4:] if iin else ''
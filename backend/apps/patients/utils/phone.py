@@ -0,0 +1,30 @@
+"""
+Phone normalization
+
+Phones are stored as typed; phone_normalized keeps the canonical E.164
+form (+77011234567) used for exact, indexed duplicate lookups.
+"""
+import re
+
+
+# Kazakhstan
+DEFAULT_COUNTRY_CODE = '7'
+
+
+def normalize_phone(phone: str) -> str:
+    """
+    Canonical E.164 form of a phone, '' if it cannot be a full number
+    
+    Local forms are completed with the default country code:
+    8 701 123 45 67 and 701 123 45 67 both become +77011234567.
+    """
+    digits = re.sub(r'\D', '', phone or '')
+    
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = DEFAULT_COUNTRY_CODE + digits[1:]
+    elif len(digits) == 10:
+        digits = DEFAULT_COUNTRY_CODE + digits
+    
+    if not 11 <= len(digits) <= 15:
+        return ''
+    return f'+{digits}'
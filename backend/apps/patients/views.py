@@ -1,14 +1,19 @@
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db import models
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+from django.db import models, transaction
 from django.utils import timezone
-from apps.core.permissions import IsBranchMember, CanAccessPatient
+from apps.core import querysets
+from apps.core.permissions import IsBranchAdmin, IsBranchMember, CanAccessPatient
+from apps.core.uploads import ChunkedUploadMixin
 from .models import (
     Patient, Representative, PatientFile,
     PatientPhone, PatientSocialNetwork, PatientContactPerson,
-    PatientDisease, PatientDiagnosis, PatientDoseLoad
+    PatientDisease, PatientDiagnosis, PatientDoseLoad, PatientImport
 )
 from .serializers import (
     PatientSerializer,
@@ -21,7 +26,8 @@ from .serializers import (
     PatientContactPersonSerializer,
     PatientDiseaseSerializer,
     PatientDiagnosisSerializer,
-    PatientDoseLoadSerializer
+    PatientDoseLoadSerializer,
+    PatientImportSerializer
 )
 
 # Import Sprint 2-5 models and serializers - migrations already applied (0006)
@@ -41,8 +47,41 @@ try:
 except (ImportError, AttributeError):
     EXTENDED_MODELS_AVAILABLE = False
 
+from . import ai_analysis as patient_ai
+from . import kato_utils
+from . import merge as patient_merge
+from . import search as patient_search
+from . import stats as patient_stats
 from .validators import validate_iin
-import re
+
+
+# List rows only need the PatientListSerializer columns
+querysets.register(
+    Patient, ['list', 'quick_search'],
+    only=[
+        'id', 'first_name', 'last_name', 'middle_name', 'birth_date', 'phone', 'balance', 'is_active',
+        'stats__total_revenue', 'stats__last_visit_at'
+    ],
+    select_related=['stats']
+)
+# The patient card statistics come from the precomputed stats row
+querysets.register(Patient, 'statistics', select_related=['stats'])
+# Merge only needs the survivor id, the engine loads and locks the rows
+querysets.register(Patient, 'merge', only=['id'])
+# The ai_analysis shape is registered in ai_analysis, the worker loads it too
+querysets.register(Patient, 'ai_analysis_status', only=['id'])
+# Detail and write actions serialize the nested relations
+# Note: consent_history disabled until migrations are applied
+querysets.register(
+    Patient, None,
+    prefetch=[
+        'organizations',
+        'representatives', models.Prefetch('files', queryset=PatientFile.objects.select_related('blob')),
+        'additional_phones', 'social_networks',
+        'contact_persons', 'diseases', 'diagnoses', 'dose_loads'
+        # 'consent_history'  # Uncomment after migrations
+    ]
+)
 
 
 class PatientViewSet(viewsets.ModelViewSet):
@@ -70,24 +109,60 @@ class PatientViewSet(viewsets.ModelViewSet):
         if is_active is not None:
             queryset = queryset.filter(is_active=is_active.lower() == 'true')
         
-        # Search by name/phone/iin
+        # Search by name/phone/full IIN (trigram index on search_text)
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                models.Q(first_name__icontains=search) |
-                models.Q(last_name__icontains=search) |
-                models.Q(phone__icontains=search) |
-                models.Q(iin__icontains=search)
-            )
+            queryset = patient_search.filter_queryset(queryset, search)
         
-        # Prefetch related objects
-        # Note: consent_history disabled until migrations are applied
-        return queryset.prefetch_related(
-            'organizations',
-            'representatives', 'files', 'additional_phones', 'social_networks',
-            'contact_persons', 'diseases', 'diagnoses', 'dose_loads'
-            # 'consent_history'  # Uncomment after migrations
-        )
+        queryset = self.filter_by_stats(queryset)
+        
+        # Columns and prefetches the action serializes
+        return querysets.apply(queryset, self.action)
+    
+    # ?ordering= values served by the stats rollup; OrderingFilter ignores
+    # them since no serializer field has these names as its source
+    STATS_ORDERING = {
+        'lifetime_value': 'stats__total_revenue',
+        'last_visit': 'stats__last_visit_at',
+    }
+    
+    def filter_by_stats(self, queryset):
+        """
+        Filter and sort by lifetime value and last visit (patient_stats)
+        
+        Query params: min_lifetime_value, max_lifetime_value,
+        last_visit_after, last_visit_before (YYYY-MM-DD, inclusive),
+        ordering=[-]lifetime_value | [-]last_visit. Patients without
+        visits sort as the lowest values.
+        """
+        params = self.request.query_params
+        
+        for param, lookup in (('min_lifetime_value', 'gte'), ('max_lifetime_value', 'lte')):
+            if params.get(param):
+                try:
+                    value = Decimal(params[param])
+                except InvalidOperation:
+                    raise ValidationError({param: 'Must be a number'})
+                queryset = queryset.filter(**{f'stats__total_revenue__{lookup}': value})
+        
+        tz = timezone.get_current_timezone()
+        for param, lookup, shift in (('last_visit_after', 'gte', 0), ('last_visit_before', 'lt', 1)):
+            if params.get(param):
+                try:
+                    day = date.fromisoformat(params[param]) + timedelta(days=shift)
+                except ValueError:
+                    raise ValidationError({param: 'Use YYYY-MM-DD'})
+                bound = timezone.make_aware(datetime.combine(day, time.min), tz)
+                queryset = queryset.filter(**{f'stats__last_visit_at__{lookup}': bound})
+        
+        ordering = params.get('ordering', '')
+        field = self.STATS_ORDERING.get(ordering.lstrip('-'))
+        if field:
+            if ordering.startswith('-'):
+                queryset = queryset.order_by(models.F(field).desc(nulls_last=True), 'id')
+            else:
+                queryset = queryset.order_by(models.F(field).asc(nulls_first=True), 'id')
+        return queryset
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -97,6 +172,8 @@ class PatientViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action in ['retrieve', 'update', 'partial_update', 'destroy']:
             return [IsAuthenticated(), CanAccessPatient()]
+        if self.action in ['duplicates', 'merge']:
+            return [IsAuthenticated(), IsBranchAdmin()]
         return super().get_permissions()
     
     @action(detail=False, methods=['post'])
@@ -119,8 +196,7 @@ class PatientViewSet(viewsets.ModelViewSet):
             queryset = Patient.objects.none()
         
         if phone:
-            normalized = re.sub(r'\D', '', phone)
-            queryset = queryset.filter(phone__iregex=f'[^0-9]*{normalized}[^0-9]*')
+            queryset = queryset.filter(Patient.phone_q(phone))
         
         if iin:
             queryset = queryset.filter(iin=iin)
@@ -134,6 +210,100 @@ class PatientViewSet(viewsets.ModelViewSet):
             'patients': serializer.data
         })
     
+    @action(detail=False, methods=['get'], url_path='quick-search')
+    def quick_search(self, request):
+        """
+        Ranked, typo tolerant patient search for the registration desk
+        
+        Query params: q (name in Cyrillic or Latin, phone digits or full
+        IIN), limit (default 20, max 100).
+        """
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = min(int(request.query_params.get('limit', patient_search.DEFAULT_LIMIT)), patient_search.MAX_LIMIT)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not query:
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        user = request.user
+        if user.is_superuser:
+            queryset = Patient.objects.all()
+        elif user.organization:
+            queryset = Patient.objects.filter(organizations=user.organization)
+        else:
+            queryset = Patient.objects.none()
+        
+        patients = patient_search.ranked(querysets.apply(queryset, self.action), query, limit)
+        data = PatientListSerializer(patients, many=True).data
+        for item, patient in zip(data, patients):
+            item['rank'] = round(patient.rank, 3)
+        
+        return Response({'results': data})
+    
+    def organization_queryset(self):
+        user = self.request.user
+        if user.is_superuser:
+            return Patient.objects.all()
+        if user.organization:
+            return Patient.objects.filter(organizations=user.organization)
+        return Patient.objects.none()
+    
+    @action(detail=False, methods=['get'])
+    def duplicates(self, request):
+        """
+        Duplicate patient clusters with the rows a merge would move
+        
+        Query params: by (iin | phone, default both), limit (default 50,
+        max 500). Merge a cluster with POST /patients/{survivor}/merge/.
+        """
+        criteria = request.query_params.getlist('by') or patient_merge.CRITERIA
+        if set(criteria) - set(patient_merge.CRITERIA):
+            return Response({'error': 'by must be iin or phone'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 500)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        clusters = patient_merge.find_clusters(self.organization_queryset(), criteria=criteria)
+        return Response({
+            'count': len(clusters),
+            'results': patient_merge.preview(clusters[:limit]),
+        })
+    
+    @action(detail=True, methods=['post'])
+    def merge(self, request, pk=None):
+        """
+        Merge duplicate patients into this one
+        
+        Body: {"duplicates": [ids], "dry_run": false}. Appointments, files,
+        consents and all other patient rows move to this patient, the
+        duplicates are deleted. dry_run returns the preview only.
+        """
+        survivor = self.get_object()
+        duplicate_ids = request.data.get('duplicates')
+        if not isinstance(duplicate_ids, list) or not duplicate_ids:
+            return Response({'error': 'duplicates must be a non-empty list of patient ids'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            duplicate_ids = sorted({int(patient_id) for patient_id in duplicate_ids})
+        except (TypeError, ValueError):
+            return Response({'error': 'duplicates must be a non-empty list of patient ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if survivor.id in duplicate_ids:
+            return Response({'error': 'A patient cannot be merged into itself'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        found = set(self.organization_queryset().filter(id__in=duplicate_ids).values_list('id', flat=True))
+        missing = [patient_id for patient_id in duplicate_ids if patient_id not in found]
+        if missing:
+            return Response({'error': f'Patients not found: {missing}'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        cluster = [survivor.id, *duplicate_ids]
+        if patient_merge.iin_conflicts([cluster]):
+            return Response({'error': 'Patients with different IINs cannot be merged'}, status=status.HTTP_400_BAD_REQUEST)
+        if request.data.get('dry_run'):
+            return Response(patient_merge.preview([cluster])[0])
+        return Response(patient_merge.merge([cluster], user=request.user))
+    
     @action(detail=True, methods=['post'])
     def add_balance(self, request, pk=None):
         """
@@ -261,54 +431,38 @@ class PatientViewSet(viewsets.ModelViewSet):
         Get patient statistics (Sprint 4)
         Returns: total visits, revenue, average check, balance, etc.
         """
-        from decimal import Decimal
-        from apps.billing.models import Invoice
-        from apps.calendar.models import Appointment
-        
         patient = self.get_object()
-        
-        # Get all appointments
-        appointments = Appointment.objects.filter(patient=patient)
-        total_visits = appointments.filter(status='done').count()
-        
-        # Get all invoices
-        invoices = Invoice.objects.filter(
-            visit__appointment__patient=patient,
-            status='paid'
-        )
-        
-        total_revenue = sum(invoice.paid_amount for invoice in invoices) or Decimal('0')
-        average_check = total_revenue / total_visits if total_visits > 0 else Decimal('0')
-        
-        # Last visit and next appointment
-        last_visit = appointments.filter(status='done').order_by('-start_datetime').first()
-        next_appointment = appointments.filter(
-            status__in=['booked', 'confirmed'],
-            start_datetime__gte=timezone.now()
-        ).order_by('start_datetime').first()
+        stats = patient_stats.get_stats(patient)
         
         return Response({
-            'total_visits': total_visits,
-            'total_revenue': float(total_revenue),
-            'average_check': float(average_check),
+            'total_visits': stats.total_visits,
+            'total_revenue': float(stats.total_revenue),
+            'average_check': float(stats.average_check),
             'balance': float(patient.balance),
-            'last_visit_date': last_visit.start_datetime.date().isoformat() if last_visit else None,
-            'next_appointment': next_appointment.start_datetime.isoformat() if next_appointment else None,
+            'last_visit_date': (
+                timezone.localtime(stats.last_visit_at).date().isoformat()
+                if stats.last_visit_at else None
+            ),
+            'next_appointment': (
+                stats.next_appointment_at.isoformat() if stats.next_appointment_at else None
+            ),
         })
     
     @action(detail=True, methods=['post'], url_path='ai-analysis')
     def ai_analysis(self, request, pk=None):
         """
-        Generate AI-powered analysis for patient using Gemini AI
-        Returns: AI analysis of patient's medical data
+        AI-powered analysis of the patient's medical data
+        
+        Answers 200 with the analysis when it is cached for unchanged data,
+        otherwise queues a background job and answers 202 with its job_id;
+        poll GET ai-analysis/{job_id}/. Body: {"refresh": true} regenerates.
         """
         from .ai_service import get_ai_service
         
         patient = self.get_object()
-        ai_service = get_ai_service()
         
         # Check if AI service is available
-        if not ai_service.is_available():
+        if not get_ai_service().is_available():
             return Response(
                 {
                     'success': False,
@@ -318,50 +472,37 @@ class PatientViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
         
-        # Prepare patient data for analysis
-        patient_data = {
-            'full_name': patient.full_name,
-            'age': patient.age,
-            'sex': patient.sex,
-            'sex_display': patient.get_sex_display(),
-            'medical_history': patient.medical_history or '',
-            'allergies': patient.allergies or '',
-            'notes': patient.notes or '',
-            'blood_type': getattr(patient, 'blood_type', ''),
-            'rh_factor': getattr(patient, 'rh_factor', ''),
-            'disability_group': getattr(patient, 'disability_group', ''),
-            'disability_notes': getattr(patient, 'disability_notes', ''),
+        job = patient_ai.request_analysis(
+            patient,
+            organization_id=request.user.organization_id,
+            refresh=bool(request.data.get('refresh'))
+        )
+        return self.ai_job_response(job)
+    
+    @action(detail=True, methods=['get'], url_path=r'ai-analysis/(?P<job_id>[0-9a-f]{64})')
+    def ai_analysis_status(self, request, pk=None, job_id=None):
+        """
+        Status of an AI analysis job, with the analysis once done
+        """
+        patient = self.get_object()
+        job = patient_ai.get_job(job_id)
+        # Job ids of other patients are not found here
+        if job is None or job.get('patient_id') != patient.id:
+            return Response({'error': 'Job not found or expired'}, status=status.HTTP_404_NOT_FOUND)
+        return self.ai_job_response({'job_id': job_id, **job})
+    
+    def ai_job_response(self, job):
+        data = {
+            'success': job['status'] != patient_ai.FAILED,
+            'error': job.get('error'),
+            'analysis': job.get('analysis'),
+            **job,
         }
-        
-        # Add chronic diseases
-        diseases = []
-        for disease in patient.diseases.all():
-            diseases.append({
-                'name': disease.name,
-                'icd_code': disease.icd_code.code if disease.icd_code else 'N/A',
-                'notes': disease.notes or '',
-                'diagnosed_date': disease.diagnosed_date.isoformat() if disease.diagnosed_date else None
-            })
-        patient_data['diseases'] = diseases
-        
-        # Add diagnoses
-        diagnoses = []
-        for diagnosis in patient.diagnoses.all():
-            diagnoses.append({
-                'diagnosis_text': diagnosis.diagnosis_text,
-                'icd_code': diagnosis.icd_code.code if diagnosis.icd_code else 'N/A',
-                'notes': diagnosis.notes or '',
-                'date': diagnosis.date.isoformat() if diagnosis.date else None
-            })
-        patient_data['diagnoses'] = diagnoses
-        
-        # Generate AI analysis
-        result = ai_service.generate_patient_analysis(patient_data)
-        
-        if result['success']:
-            return Response(result, status=status.HTTP_200_OK)
-        else:
-            return Response(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if job['status'] == patient_ai.DONE:
+            return Response(data, status=status.HTTP_200_OK)
+        if job['status'] == patient_ai.FAILED:
+            return Response(data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=False, methods=['post'], url_path='send-verification')
     def send_verification(self, request):
@@ -510,7 +651,10 @@ class RepresentativeViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class PatientFileViewSet(viewsets.ModelViewSet):
+class PatientFileViewSet(ChunkedUploadMixin, viewsets.ModelViewSet):
+    """
+    Patient files; large files go through the chunked upload actions
+    """
     queryset = PatientFile.objects.all()
     serializer_class = PatientFileSerializer
     permission_classes = [IsAuthenticated, IsBranchMember]
@@ -521,7 +665,7 @@ class PatientFileViewSet(viewsets.ModelViewSet):
         queryset = PatientFile.objects.filter(patient__organizations=user.organization)
         if patient_id:
             queryset = queryset.filter(patient_id=patient_id)
-        return queryset
+        return queryset.select_related('blob')
     
     def perform_create(self, serializer):
         serializer.save(uploaded_by=self.request.user)
@@ -611,6 +755,76 @@ class PatientDoseLoadViewSet(viewsets.ModelViewSet):
         return queryset
 
 
+class PatientImportViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Bulk patient import from CSV/XLSX
+    
+    POST a multipart file to start an import; it runs in a Celery job, poll
+    the import for status and counts. The report lists skipped rows with
+    the reason.
+    """
+    queryset = PatientImport.objects.all()
+    serializer_class = PatientImportSerializer
+    permission_classes = [IsAuthenticated, IsBranchAdmin]
+    
+    def get_queryset(self):
+        return PatientImport.objects.filter(organization=self.request.user.organization)
+    
+    def perform_create(self, serializer):
+        from .tasks import run_patient_import
+        
+        if not self.request.user.organization:
+            raise ValidationError({'error': 'Пользователь не привязан к организации'})
+        job = serializer.save(organization=self.request.user.organization, created_by=self.request.user)
+        transaction.on_commit(lambda: run_patient_import.delay(job.id))
+
+
+class KATOViewSet(viewsets.ViewSet):
+    """
+    KATO address directory
+    
+    list: regions, or the children of ?parent=<code>; retrieve: item by
+    code; autocomplete: name prefix search.
+    """
+    permission_classes = [IsAuthenticated]
+    lookup_value_regex = r'\d+'
+    
+    def list(self, request):
+        parent = request.query_params.get('parent')
+        if parent:
+            return Response({'results': kato_utils.KATOHelper.get_districts(parent)})
+        return Response({'results': kato_utils.KATOHelper.get_regions()})
+    
+    def retrieve(self, request, pk=None):
+        item = kato_utils.KATOHelper.get_by_code(pk)
+        if item is None:
+            return Response({'error': 'KATO code not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(item)
+    
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        KATO items by name prefix for address inputs
+        
+        Query params: q (Russian, Kazakh or Latin, every word matches the
+        start of a name word), parent, level, limit (default 20, max 100).
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', kato_utils.DEFAULT_LIMIT)), kato_utils.MAX_LIMIT)
+            level = request.query_params.get('level')
+            level = int(level) if level else None
+        except ValueError:
+            return Response({'error': 'limit and level must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = kato_utils.KATOHelper.autocomplete(
+            query, limit=limit, parent=request.query_params.get('parent') or None, level=level
+        )
+        return Response({'results': results})
+
+
 # ============================================================================
 # SPRINT 2-5 VIEWSETS - Enabled after migrations 0006
 # ============================================================================
@@ -0,0 +1,20 @@
+# Generated manually: chunked upload content of visit files
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_blob_uploadsession'),
+        ('visits', '0003_add_sprint2_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visitfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='Content of a chunked upload, shared by identical files', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='visit_files', to='core.blob'),
+        ),
+    ]
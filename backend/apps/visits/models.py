@@ -179,6 +179,14 @@ class VisitFile(models.Model):
         related_name='files'
     )
     file = models.FileField(upload_to='visits/%Y/%m/')
+    blob = models.ForeignKey(
+        'core.Blob',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='visit_files',
+        help_text='Content of a chunked upload, shared by identical files'
+    )
     file_type = models.CharField(max_length=20, choices=FILE_TYPES, default='other')
     title = models.CharField(max_length=200, blank=True)
     description = models.TextField(blank=True)
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from apps.core.uploads import thumbnail_url
 from django.utils import timezone
 from .models import Visit, VisitService, VisitPrescription, VisitResource, VisitFile
 
@@ -37,14 +38,18 @@ class VisitFileSerializer(serializers.ModelSerializer):
     """Serializer for visit files"""
     file_type_display = serializers.CharField(source='get_file_type_display', read_only=True)
     uploaded_by_name = serializers.CharField(source='uploaded_by.get_full_name', read_only=True, allow_null=True)
+    thumbnail = serializers.SerializerMethodField()
     
     class Meta:
         model = VisitFile
         fields = [
-            'id', 'visit', 'file', 'file_type', 'file_type_display',
+            'id', 'visit', 'file', 'thumbnail', 'file_type', 'file_type_display',
             'title', 'description', 'uploaded_by', 'uploaded_by_name', 'created_at'
         ]
         read_only_fields = ['id', 'uploaded_by', 'created_at']
+    
+    def get_thumbnail(self, obj):
+        return thumbnail_url(obj, self.context.get('request'))
 
 
 class VisitSerializer(serializers.ModelSerializer):
@@ -91,7 +96,7 @@ class VisitSerializer(serializers.ModelSerializer):
         # Safely add files if relation exists
         if hasattr(instance, 'files'):
             try:
-                data['files'] = VisitFileSerializer(instance.files.all(), many=True).data
+                data['files'] = VisitFileSerializer(instance.files.select_related('blob'), many=True).data
             except:
                 data['files'] = []
         
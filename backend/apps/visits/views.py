@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated
 from django.template.loader import render_to_string
 from django.http import HttpResponse
 from apps.core.permissions import IsBranchMember, CanAccessVisit
+from apps.core.uploads import ChunkedUploadMixin
 from .models import Visit, VisitService, VisitPrescription, VisitResource, VisitFile
 from .serializers import (
     VisitSerializer,
@@ -199,8 +200,8 @@ class VisitResourceViewSet(viewsets.ModelViewSet):
         return []
 
 
-class VisitFileViewSet(viewsets.ModelViewSet):
-    """ViewSet for visit files"""
+class VisitFileViewSet(ChunkedUploadMixin, viewsets.ModelViewSet):
+    """ViewSet for visit files, large files go through the chunked upload actions"""
     queryset = VisitFile.objects.all()
     serializer_class = VisitFileSerializer
     # Temporarily disabled for development
@@ -211,9 +212,12 @@ class VisitFileViewSet(viewsets.ModelViewSet):
         queryset = VisitFile.objects.all()
         if visit_id:
             queryset = queryset.filter(visit_id=visit_id)
-        return queryset.select_related('uploaded_by')
+        return queryset.select_related('uploaded_by', 'blob')
     
     def get_permissions(self):
+        # Upload sessions belong to a user
+        if self.action in self.upload_actions:
+            return [IsAuthenticated()]
         return []
     
     def perform_create(self, serializer):
@@ -52,6 +52,16 @@ app.conf.beat_schedule = {
         'task': 'apps.comms.tasks.run_scheduled_campaigns',
         'schedule': crontab(minute='*/1'),  # Every minute
     },
+    # Calendar tasks
+    'prune-appointment-changes': {
+        'task': 'apps.calendar.tasks.prune_appointment_changes',
+        'schedule': crontab(hour='3', minute='0'),  # Daily at 3:00 AM
+    },
+    # Core tasks
+    'cleanup-upload-sessions': {
+        'task': 'apps.core.tasks.cleanup_upload_sessions',
+        'schedule': crontab(minute='30'),  # Hourly
+    },
     # Telegram Bot tasks - DISABLED (module not in container)
     # 'bot-send-appointment-reminders': {
     #     'task': 'apps.telegram_bot.tasks.send_appointment_reminders',
@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'rest_framework',
@@ -201,6 +202,16 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache (Redis when configured, local memory otherwise)
+REDIS_CACHE_URL = os.environ.get('REDIS_CACHE_URL', '')
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+
 # Celery Configuration
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -220,10 +231,31 @@ if USE_S3:
     AWS_DEFAULT_ACL = 'public-read'
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
+# Chunked uploads (apps.core.uploads): chunks are staged on local disk,
+# complete files go to the default storage (S3/MinIO with USE_S3).
+# Keep the staging directory on the MEDIA_ROOT filesystem so local
+# completes are a rename.
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR') or str(MEDIA_ROOT / 'uploads')
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_SIZE', str(2 * 1024 * 1024 * 1024)))
+CHUNKED_UPLOAD_EXPIRE_HOURS = int(os.environ.get('CHUNKED_UPLOAD_EXPIRE_HOURS', '24'))
+
 # SMS Provider Configuration
 SMS_PROVIDER = os.environ.get('SMS_PROVIDER', 'mock')
 SMS_API_KEY = os.environ.get('SMS_API_KEY', '')
 SMS_API_SECRET = os.environ.get('SMS_API_SECRET', '')
+SMS_RATE_LIMIT_PER_MIN = int(os.environ.get('SMS_RATE_LIMIT_PER_MIN', '30'))
+
+# SMS dispatch (apps.comms.dispatch): provider requests in flight per
+# worker, jobs claimed per batch, and minutes after which a claimed but
+# unfinished job (a dead worker) is claimed again. Keep the timeout above
+# the time a batch takes at the provider rate limit.
+SMS_DISPATCH_CONCURRENCY = int(os.environ.get('SMS_DISPATCH_CONCURRENCY', '20'))
+SMS_DISPATCH_BATCH_SIZE = int(os.environ.get('SMS_DISPATCH_BATCH_SIZE', '200'))
+SMS_DISPATCH_CLAIM_TIMEOUT = int(os.environ.get('SMS_DISPATCH_CLAIM_TIMEOUT', '15'))
+# Mock provider: seconds per request and share of failed sends
+SMS_MOCK_LATENCY = float(os.environ.get('SMS_MOCK_LATENCY', '0'))
+SMS_MOCK_FAILURE_RATE = float(os.environ.get('SMS_MOCK_FAILURE_RATE', '0.1'))
 
 # DRF Spectacular (OpenAPI)
 SPECTACULAR_SETTINGS = {
@@ -284,6 +316,8 @@ TELEGRAM_WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL', '')
 # IIN Encryption (AES-256 via Fernet)
 # Generate key: from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())
 IIN_ENCRYPTION_KEY = os.environ.get('IIN_ENCRYPTION_KEY', '')
+# Previous keys, comma separated: still decrypt, never used for new tokens
+IIN_ENCRYPTION_OLD_KEYS = os.environ.get('IIN_ENCRYPTION_OLD_KEYS', '')
 
 # IIN Hash Salt for SHA-256
 IIN_HASH_SALT = os.environ.get('IIN_HASH_SALT', 'change-this-salt-in-production')
@@ -299,3 +333,10 @@ CONSENT_RATE_LIMIT_PER_DAY = int(os.environ.get('CONSENT_RATE_LIMIT_PER_DAY', '3
 # Google Gemini API Key for AI-powered patient analysis
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
 
+# AI service class (dotted path); apps.patients.ai_service.StubAIService
+# serves tests and development without an API key
+AI_SERVICE_BACKEND = os.environ.get('AI_SERVICE_BACKEND', 'apps.patients.ai_service.PatientAIService')
+
+# Concurrent AI analysis jobs per organization
+AI_ANALYSIS_MAX_CONCURRENT = int(os.environ.get('AI_ANALYSIS_MAX_CONCURRENT', '2'))
+
@@ -59,7 +59,7 @@ def employee(db, organization):
         organization=organization,
         first_name='Test',
         last_name='Doctor',
-        position='Врач',
+        position_legacy='Врач',
         phone='+77011234567',
         hire_date=date(2023, 1, 1),
         color='#2196F3'
@@ -69,14 +69,15 @@ def employee(db, organization):
 @pytest.fixture
 def patient(db, organization):
     """Create test patient"""
-    return Patient.objects.create(
-        organization=organization,
+    patient = Patient.objects.create(
         first_name='Test',
         last_name='Patient',
         birth_date=date(1990, 1, 1),
         sex='M',
         phone='+77017654321'
     )
+    patient.organizations.add(organization)
+    return patient
 
 
 @pytest.fixture
@@ -0,0 +1,155 @@
+import pytest
+from datetime import date
+from django.core.cache import cache
+from apps.patients import ai_analysis
+from apps.patients.ai_service import get_ai_service
+from apps.patients.models import PatientDiagnosis, PatientDisease
+from apps.patients.tasks import run_patient_analysis
+from apps.services.models import ICDCode
+from config.celery import app as celery_app
+
+
+@pytest.fixture(autouse=True)
+def stub_backend(settings):
+    settings.AI_SERVICE_BACKEND = 'apps.patients.ai_service.StubAIService'
+    settings.AI_ANALYSIS_MAX_CONCURRENT = 2
+    cache.clear()
+    service = get_ai_service()
+    service.calls = 0
+    yield service
+    cache.clear()
+
+
+@pytest.fixture
+def eager():
+    celery_app.conf.task_always_eager = True
+    yield
+    celery_app.conf.task_always_eager = False
+
+
+def url(patient, suffix=''):
+    return f'/api/v1/patients/patients/{patient.id}/ai-analysis/{suffix}'
+
+
+@pytest.mark.django_db
+class TestAIAnalysis:
+    """Test asynchronous, cached AI patient analysis"""
+
+    def test_repeat_request_served_from_cache(self, authenticated_client, patient, stub_backend, eager):
+        icd = ICDCode.objects.create(code='I10', name='Hypertension')
+        PatientDisease.objects.create(patient=patient, start_date=date(2020, 1, 1), diagnosis='Гипертония', icd_code=icd)
+        PatientDiagnosis.objects.create(patient=patient, date=date(2024, 1, 1), diagnosis='ОРВИ')
+
+        first = authenticated_client.post(url(patient), format='json')
+        assert first.status_code == 200
+        assert first.data['cached'] is False
+        assert '1 diseases, 1 diagnoses' in first.data['analysis']
+
+        second = authenticated_client.post(url(patient), format='json')
+        assert second.status_code == 200
+        assert second.data['cached'] is True
+        assert second.data['analysis'] == first.data['analysis']
+        assert stub_backend.calls == 1
+
+        patient.allergies = 'Пенициллин'
+        patient.save()
+        third = authenticated_client.post(url(patient), format='json')
+        assert third.data['job_id'] != first.data['job_id']
+        assert stub_backend.calls == 2
+
+    def test_queued_job_and_status(self, authenticated_client, patient, stub_backend, monkeypatch):
+        queued = []
+        monkeypatch.setattr(run_patient_analysis, 'delay', lambda *args: queued.append(args))
+
+        response = authenticated_client.post(url(patient), format='json')
+        assert response.status_code == 202
+        assert response.data['status'] == 'pending'
+        job_id = response.data['job_id']
+
+        # Clicks while the job waits join it
+        assert authenticated_client.post(url(patient), format='json').data['job_id'] == job_id
+        assert len(queued) == 1
+        assert authenticated_client.get(url(patient, f'{job_id}/')).status_code == 202
+
+        run_patient_analysis.apply(args=queued[0])
+
+        response = authenticated_client.get(url(patient, f'{job_id}/'))
+        assert response.status_code == 200
+        assert response.data['status'] == 'done'
+        assert response.data['analysis'].startswith('Stub analysis')
+
+        assert authenticated_client.get(url(patient, f'{"0" * 64}/')).status_code == 404
+
+    def test_status_of_other_patients_job(self, authenticated_client, patient, organization, eager):
+        from apps.patients.models import Patient
+
+        other = Patient.objects.create(
+            first_name='Other', last_name='Patient', birth_date=date(1980, 1, 1), sex='M', phone='+77010000009'
+        )
+        other.organizations.add(organization)
+        job_id = authenticated_client.post(url(patient), format='json').data['job_id']
+
+        assert authenticated_client.get(url(patient, f'{job_id}/')).data['patient_id'] == patient.id
+        assert authenticated_client.get(url(other, f'{job_id}/')).status_code == 404
+
+    def test_organization_limit(self, settings, organization, patient):
+        settings.AI_ANALYSIS_MAX_CONCURRENT = 1
+        slot = ai_analysis.acquire_slot(organization.id, 'a')
+        assert slot
+        assert ai_analysis.acquire_slot(organization.id, 'b') is None
+        # Other organizations are not affected
+        assert ai_analysis.acquire_slot(organization.id + 1, 'b')
+
+        data = ai_analysis.build_patient_data(patient)
+        job_id = ai_analysis.fingerprint(data, 'stub', patient.id)
+        result = run_patient_analysis.apply(args=(job_id, patient.id, organization.id), retries=run_patient_analysis.max_retries)
+        assert result.get() == {'job_id': job_id, 'success': False}
+        assert ai_analysis.get_job(job_id)['status'] == 'failed'
+
+        ai_analysis.release_slot(slot, 'a')
+        assert run_patient_analysis.apply(args=(job_id, patient.id, organization.id)).get()['success']
+
+    def test_slot_released_by_its_job_only(self, organization):
+        first = ai_analysis.acquire_slot(organization.id, 'a')
+        second = ai_analysis.acquire_slot(organization.id, 'b')
+        assert first != second
+        assert ai_analysis.acquire_slot(organization.id, 'c') is None
+
+        # A job whose slot expired and was taken again frees nothing
+        cache.set(first, 'c')
+        ai_analysis.release_slot(first, 'a')
+        assert ai_analysis.acquire_slot(organization.id, 'd') is None
+
+        ai_analysis.release_slot(second, 'b')
+        assert ai_analysis.acquire_slot(organization.id, 'd') == second
+
+    def test_job_of_changed_data_is_dropped(self, authenticated_client, patient, stub_backend, monkeypatch):
+        queued = []
+        monkeypatch.setattr(run_patient_analysis, 'delay', lambda *args: queued.append(args))
+        job_id = authenticated_client.post(url(patient), format='json').data['job_id']
+        # Only ids are sent to the broker
+        assert queued[0][:2] == (job_id, patient.id)
+
+        patient.allergies = 'Пенициллин'
+        patient.save()
+        assert run_patient_analysis.apply(args=queued[0]).get()['success'] is False
+
+        assert stub_backend.calls == 0
+        response = authenticated_client.get(url(patient, f'{job_id}/'))
+        assert response.data['status'] == 'failed'
+
+
+def test_fingerprint_normalizes_payload():
+    data = {
+        'full_name': 'Иванов  Иван',
+        'notes': ' a\nb ',
+        'diseases': [{'name': 'A'}, {'name': 'B'}],
+    }
+    same = {
+        'diseases': [{'name': 'B'}, {'name': 'A'}],
+        'notes': 'a b',
+        'full_name': 'Иванов Иван',
+    }
+
+    assert ai_analysis.fingerprint(data, 'stub') == ai_analysis.fingerprint(same, 'stub')
+    assert ai_analysis.fingerprint(data, 'stub') != ai_analysis.fingerprint(data, 'gemini-2.5-flash')
@@ -0,0 +1,77 @@
+import pytest
+from datetime import date, datetime, time, timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.calendar.models import Appointment
+from apps.staff.models import Employee
+from apps.visits.models import Visit
+
+
+MONDAY = date(2030, 1, 7)
+URL = '/api/v1/calendar/appointments/'
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+def make_week(organization, branch, patient, per_day):
+    """per_day appointments for each of 7 days, every other one with a visit"""
+    doctors = Employee.objects.bulk_create([
+        Employee(organization=organization, first_name=f'D{i}', last_name='Doctor', phone='+77010000000')
+        for i in range(per_day)
+    ])
+    appointments = Appointment.objects.bulk_create([
+        Appointment(
+            branch=branch, employee=doctor, patient=patient,
+            start_datetime=aware(MONDAY + timedelta(days=day), 10),
+            end_datetime=aware(MONDAY + timedelta(days=day), 11),
+            status='done'
+        )
+        for day in range(7) for doctor in doctors
+    ])
+    Visit.objects.bulk_create([Visit(appointment=a, status='completed') for a in appointments[::2]])
+    return appointments
+
+
+@pytest.mark.django_db
+class TestAppointmentList:
+    """Test keyset pagination and sparse fieldsets"""
+
+    def test_keyset_pages(self, authenticated_client, organization, branch, patient):
+        # Several appointments share a start time: ties are broken by id
+        appointments = make_week(organization, branch, patient, per_day=3)
+
+        seen, url, pages = [], URL + '?page_size=4', 0
+        while url:
+            response = authenticated_client.get(url)
+            assert response.status_code == 200
+            seen.extend(item['id'] for item in response.data['results'])
+            url, pages = response.data['next'], pages + 1
+
+        expected = sorted(appointments, key=lambda a: (a.start_datetime, a.id))
+        assert seen == [a.id for a in expected]
+        assert pages == 6
+
+    def test_fixed_queries_without_count(self, authenticated_client, organization, branch, patient):
+        make_week(organization, branch, patient, per_day=70)
+        params = {'branch': branch.id, 'page_size': 1000}
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = authenticated_client.get(URL, params)
+
+        assert len(response.data['results']) == 490
+        assert sum(item['has_visit'] for item in response.data['results']) == 245
+        assert len(ctx.captured_queries) <= 3
+        assert not any('COUNT(' in q['sql'].upper() for q in ctx.captured_queries)
+
+    def test_sparse_fields(self, authenticated_client, organization, branch, patient):
+        make_week(organization, branch, patient, per_day=1)
+
+        response = authenticated_client.get(URL, {'fields': 'start_datetime,end_datetime,status'})
+
+        assert set(response.data['results'][0]) == {'id', 'start_datetime', 'end_datetime', 'status'}
+
+    def test_invalid_cursor(self, authenticated_client):
+        assert authenticated_client.get(URL, {'cursor': 'garbage'}).status_code == 404
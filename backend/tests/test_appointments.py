@@ -1,5 +1,7 @@
 import pytest
 from datetime import datetime, timedelta
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 from apps.calendar.models import Appointment
 
 
@@ -74,3 +76,128 @@ class TestAppointments:
         
         assert response.status_code == 400
 
+
+
+@pytest.mark.django_db
+class TestAppointmentOverlapConstraint:
+    """Test database-level double booking protection"""
+    
+    @pytest.fixture
+    def booked(self, branch, employee, patient):
+        start = timezone.now() + timedelta(days=1)
+        return Appointment.objects.create(
+            branch=branch,
+            employee=employee,
+            patient=patient,
+            start_datetime=start,
+            end_datetime=start + timedelta(hours=1),
+            status='booked'
+        )
+    
+    def test_overlapping_insert_rejected(self, booked):
+        """Database rejects overlapping active appointment for the same employee"""
+        with pytest.raises(ValidationError) as exc_info:
+            Appointment.objects.create(
+                branch=booked.branch,
+                employee=booked.employee,
+                patient=booked.patient,
+                start_datetime=booked.start_datetime + timedelta(minutes=30),
+                end_datetime=booked.end_datetime + timedelta(minutes=30),
+                status='booked'
+            )
+        
+        assert exc_info.value.code == 'employee_overlap'
+    
+    def test_adjacent_and_inactive_allowed(self, booked):
+        """Back-to-back and canceled appointments do not conflict"""
+        Appointment.objects.create(
+            branch=booked.branch,
+            employee=booked.employee,
+            patient=booked.patient,
+            start_datetime=booked.end_datetime,
+            end_datetime=booked.end_datetime + timedelta(hours=1),
+            status='booked'
+        )
+        Appointment.objects.create(
+            branch=booked.branch,
+            employee=booked.employee,
+            patient=booked.patient,
+            start_datetime=booked.start_datetime,
+            end_datetime=booked.end_datetime,
+            status='canceled'
+        )
+        
+        assert Appointment.objects.count() == 3
+    
+    def test_room_overlap_rejected(self, booked, organization):
+        """Room cannot be double booked by different employees"""
+        from apps.org.models import Room
+        from apps.staff.models import Employee
+        
+        room = Room.objects.create(branch=booked.branch, name='Cabinet 1')
+        booked.room = room
+        booked.save()
+        other = Employee.objects.create(
+            organization=organization, first_name='Other', last_name='Doctor', phone='+77010000000'
+        )
+        
+        with pytest.raises(ValidationError) as exc_info:
+            Appointment.objects.create(
+                branch=booked.branch,
+                employee=other,
+                patient=booked.patient,
+                room=room,
+                start_datetime=booked.start_datetime,
+                end_datetime=booked.end_datetime,
+                status='booked'
+            )
+        
+        assert exc_info.value.code == 'room_overlap'
+    
+    def test_api_create_returns_existing_message(self, authenticated_client, booked):
+        """Constraint violation is reported with the serializer message"""
+        response = authenticated_client.post('/api/v1/calendar/appointments/', {
+            'branch': booked.branch_id,
+            'employee': booked.employee_id,
+            'patient': booked.patient_id,
+            'start_datetime': (booked.start_datetime + timedelta(minutes=15)).isoformat(),
+            'end_datetime': (booked.end_datetime + timedelta(minutes=15)).isoformat(),
+            'status': 'booked'
+        })
+        
+        assert response.status_code == 400
+        assert 'Employee has overlapping appointments at this time' in str(response.data)
+    
+    def test_move_into_conflict(self, authenticated_client, booked):
+        """Moving onto a busy slot returns 400 instead of saving"""
+        other = Appointment.objects.create(
+            branch=booked.branch,
+            employee=booked.employee,
+            patient=booked.patient,
+            start_datetime=booked.end_datetime + timedelta(hours=1),
+            end_datetime=booked.end_datetime + timedelta(hours=2),
+            status='booked'
+        )
+        
+        response = authenticated_client.post(
+            f'/api/v1/calendar/appointments/{other.id}/move/',
+            {'start_datetime': booked.start_datetime.isoformat()}
+        )
+        
+        assert response.status_code == 400
+        assert response.data['error'] == 'Employee has overlapping appointments'
+        other.refresh_from_db()
+        assert other.start_datetime == booked.end_datetime + timedelta(hours=1)
+    
+    def test_patch_end_before_stored_start(self, authenticated_client, booked):
+        """Partial update is checked against the stored start"""
+        response = authenticated_client.patch(
+            f'/api/v1/calendar/appointments/{booked.id}/',
+            {'end_datetime': (booked.start_datetime - timedelta(minutes=30)).isoformat()},
+            format='json'
+        )
+        
+        assert response.status_code == 400
+        assert 'Start time must be before end time' in str(response.data)
+        booked.refresh_from_db()
+        assert booked.end_datetime == booked.start_datetime + timedelta(hours=1)
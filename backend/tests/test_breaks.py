@@ -0,0 +1,144 @@
+import importlib
+import pytest
+from datetime import date, time, timedelta
+from django.apps import apps as django_apps
+from apps.calendar.models import Break
+from apps.calendar.services import breaks
+
+
+MONDAY = date(2030, 1, 7)
+URL = '/api/v1/calendar/breaks/'
+
+recurrence_migration = importlib.import_module('apps.calendar.migrations.0009_break_recurrence_rule')
+
+
+@pytest.fixture
+def lunch(employee):
+    return Break.objects.create(
+        employee=employee, break_type='lunch', date=MONDAY,
+        start_time=time(13), end_time=time(14), is_recurring=True
+    )
+
+
+@pytest.mark.django_db
+class TestRecurringBreaks:
+    """Test recurring breaks stored as one row per series"""
+
+    def test_create_recurring_stores_one_row(self, authenticated_client, employee):
+        response = authenticated_client.post(URL, {
+            'employee': employee.id, 'break_type': 'lunch', 'date': MONDAY.isoformat(),
+            'start_time': '13:00:00', 'end_time': '14:00:00', 'is_recurring': True,
+        }, format='json')
+
+        assert response.status_code == 201
+        assert Break.objects.count() == 1
+
+    def test_list_expands_window(self, authenticated_client, employee, lunch):
+        response = authenticated_client.get(URL, {
+            'employee': employee.id,
+            'date_from': (MONDAY + timedelta(days=365)).isoformat(),
+            'date_to': (MONDAY + timedelta(days=371)).isoformat(),
+        })
+
+        assert response.status_code == 200
+        assert response.data['count'] == 7
+        assert {item['id'] for item in response.data['results']} == {lunch.id}
+        assert response.data['results'][0]['date'] == (MONDAY + timedelta(days=365)).isoformat()
+
+    def test_weekdays_until_and_exceptions(self, lunch):
+        lunch.recurrence_weekdays = [0, 2, 4]
+        lunch.recurrence_until = MONDAY + timedelta(days=13)
+        lunch.recurrence_exceptions = [MONDAY + timedelta(days=2)]
+        lunch.save()
+
+        dates = [b.date for b in breaks.expand([lunch], MONDAY - timedelta(days=7), MONDAY + timedelta(days=30))]
+
+        assert dates == [MONDAY + timedelta(days=d) for d in (0, 4, 7, 9, 11)]
+
+    def test_skip_date(self, authenticated_client, lunch):
+        skipped = MONDAY + timedelta(days=3)
+
+        response = authenticated_client.post(f'{URL}{lunch.id}/skip_date/', {'date': skipped.isoformat()}, format='json')
+
+        assert response.status_code == 200
+        assert not breaks.occurs_on(Break.objects.get(id=lunch.id), skipped)
+
+    def test_overlap_with_series_is_rejected(self, authenticated_client, employee, lunch):
+        response = authenticated_client.post(URL, {
+            'employee': employee.id, 'break_type': 'meeting',
+            'date': (MONDAY + timedelta(days=100)).isoformat(),
+            'start_time': '13:30:00', 'end_time': '14:30:00',
+        }, format='json')
+
+        assert response.status_code == 400
+
+    def test_series_overlapping_later_breaks_is_rejected(self, authenticated_client, employee):
+        wednesday = MONDAY + timedelta(days=2)
+        Break.objects.create(
+            employee=employee, break_type='meeting', date=wednesday + timedelta(days=70),
+            start_time=time(13, 30), end_time=time(14, 30)
+        )
+        Break.objects.create(
+            employee=employee, break_type='lunch', date=MONDAY + timedelta(days=30),
+            start_time=time(12), end_time=time(13, 30), is_recurring=True, recurrence_weekdays=[4]
+        )
+        lunch = {
+            'employee': employee.id, 'break_type': 'lunch', 'date': MONDAY.isoformat(),
+            'start_time': '13:00:00', 'end_time': '14:00:00', 'is_recurring': True,
+            'recurrence_weekdays': [0, 2],
+        }
+
+        response = authenticated_client.post(URL, lunch, format='json')
+        assert response.status_code == 400
+        assert (wednesday + timedelta(days=70)).isoformat() in str(response.data)
+
+        response = authenticated_client.post(URL, {**lunch, 'recurrence_weekdays': [4]}, format='json')
+        assert response.status_code == 400
+        assert (MONDAY + timedelta(days=32)).isoformat() in str(response.data)
+
+        response = authenticated_client.post(URL, {**lunch, 'recurrence_weekdays': [0]}, format='json')
+        assert response.status_code == 201
+
+        # Moving the meeting onto a Monday of the series clashes too
+        meeting = Break.objects.get(break_type='meeting')
+        response = authenticated_client.patch(
+            f'{URL}{meeting.id}/', {'date': (MONDAY + timedelta(days=70)).isoformat()}, format='json'
+        )
+        assert response.status_code == 400
+
+    def test_series_skipping_the_clash_is_allowed(self, employee, lunch):
+        meeting = Break(
+            employee=employee, date=MONDAY + timedelta(days=3), start_time=time(13), end_time=time(13, 30),
+            is_recurring=True, recurrence_weekdays=[3], recurrence_exceptions=[MONDAY + timedelta(days=10)]
+        )
+        assert breaks.overlap_date(meeting, Break.objects.all()) == MONDAY + timedelta(days=3)
+
+        lunch.recurrence_weekdays = [0]
+        lunch.save()
+        assert breaks.overlap_date(meeting, Break.objects.all()) is None
+
+    def test_list_window_and_bad_dates(self, authenticated_client, lunch):
+        response = authenticated_client.get(URL, {
+            'date_from': MONDAY.isoformat(), 'date_to': (MONDAY + timedelta(days=366)).isoformat(),
+        })
+        assert response.status_code == 400
+
+        response = authenticated_client.get(f'{URL}{lunch.id}/', {'date_from': 'x'})
+        assert response.status_code == 400
+
+    def test_migration_collapses_legacy_rows(self, employee):
+        for offset in list(range(0, 31)) + list(range(40, 45)):
+            Break.objects.create(
+                employee=employee, break_type='lunch', date=MONDAY + timedelta(days=offset),
+                start_time=time(13), end_time=time(14), is_recurring=True
+            )
+        Break.objects.create(employee=employee, date=MONDAY, start_time=time(9), end_time=time(10))
+
+        recurrence_migration.collapse_recurring_breaks(django_apps, None)
+
+        series = list(Break.objects.filter(is_recurring=True).order_by('date').values_list('date', 'recurrence_until'))
+        assert series == [
+            (MONDAY, MONDAY + timedelta(days=30)),
+            (MONDAY + timedelta(days=40), MONDAY + timedelta(days=44)),
+        ]
+        assert Break.objects.filter(is_recurring=False).count() == 1
@@ -0,0 +1,154 @@
+import pytest
+from unittest.mock import patch
+from datetime import date, datetime, time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.calendar.models import Appointment, AppointmentChange, AppointmentResource
+from apps.org.models import Resource
+from apps.patients import stats as patient_stats
+from apps.patients.models import PatientStats
+from apps.staff.models import Employee
+from apps.visits.models import Visit
+
+
+MONDAY = date(2030, 1, 7)
+URL = '/api/v1/calendar/appointments/'
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+@pytest.fixture
+def day(branch, employee, patient):
+    return [
+        Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(MONDAY, hour), end_datetime=aware(MONDAY, hour + 1),
+            status='booked'
+        )
+        for hour in (9, 10, 11)
+    ]
+
+
+@pytest.fixture
+def other_employee(organization):
+    return Employee.objects.create(
+        organization=organization, first_name='Пётр', last_name='Петров',
+        position_legacy='Врач', phone='+77017654321'
+    )
+
+
+@pytest.mark.django_db
+class TestBulkAppointments:
+    """Test bulk move / status / cancel"""
+
+    def test_bulk_move_to_other_employee(self, authenticated_client, day, other_employee):
+        response = authenticated_client.post(URL + 'bulk_move/', {
+            'ids': [a.id for a in day], 'employee_id': other_employee.id, 'offset_minutes': 60 * 24,
+        }, format='json')
+
+        assert response.status_code == 200
+        assert response.data['updated'] == 3
+        moved = Appointment.objects.filter(employee=other_employee).order_by('start_datetime')
+        assert [a.start_datetime for a in moved] == [aware(date(2030, 1, 8), h) for h in (9, 10, 11)]
+
+    def test_shift_within_own_day_is_not_a_conflict(self, authenticated_client, day):
+        response = authenticated_client.post(URL + 'bulk_move/', {
+            'ids': [a.id for a in day], 'offset_minutes': 60,
+        }, format='json')
+
+        assert response.status_code == 200
+        assert sorted(timezone.localtime(a.start_datetime).hour for a in Appointment.objects.all()) == [10, 11, 12]
+
+    def test_conflicts_reject_whole_batch(self, authenticated_client, branch, patient, day, other_employee):
+        busy = Appointment.objects.create(
+            branch=branch, employee=other_employee, patient=patient,
+            start_datetime=aware(MONDAY, 10, 30), end_datetime=aware(MONDAY, 11, 30),
+            status='booked'
+        )
+
+        response = authenticated_client.post(URL + 'bulk_move/', {
+            'ids': [a.id for a in day], 'employee_id': other_employee.id,
+        }, format='json')
+
+        assert response.status_code == 400
+        conflicting = {c['appointment'] for c in response.data['details']['conflicts']}
+        assert conflicting == {day[1].id, day[2].id}
+        assert {c['conflicts_with'] for c in response.data['details']['conflicts']} == {busy.id}
+        assert not Appointment.objects.filter(employee=other_employee).exclude(id=busy.id).exists()
+
+    def test_resources_are_not_double_booked(self, authenticated_client, branch, employee, patient, day, other_employee):
+        chair = Resource.objects.create(branch=branch, name='Кресло 1', type='chair')
+        tuesday = date(2030, 1, 8)
+        busy = Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(tuesday, 9, 30), end_datetime=aware(tuesday, 10, 30), status='booked'
+        )
+        for appointment in (busy, day[0], day[2]):
+            AppointmentResource.objects.create(appointment=appointment, resource=chair)
+
+        response = authenticated_client.post(URL + 'bulk_move/', {
+            'ids': [a.id for a in day], 'employee_id': other_employee.id, 'offset_minutes': 60 * 24,
+        }, format='json')
+
+        assert response.status_code == 400
+        assert response.data['details']['conflicts'] == [
+            {'appointment': day[0].id, 'resource': chair.id, 'code': 'resource_overlap'}
+        ]
+        assert not Appointment.objects.filter(employee=other_employee).exists()
+
+        # Moved together, the batch's own allocations do not clash
+        busy.delete()
+        response = authenticated_client.post(URL + 'bulk_move/', {
+            'ids': [a.id for a in day], 'offset_minutes': 60 * 24,
+        }, format='json')
+        assert response.status_code == 200
+
+    def test_bulk_status_refreshes_patient_stats(self, authenticated_client, patient, day, django_capture_on_commit_callbacks):
+        patient_stats.refresh([patient.id])
+        assert PatientStats.objects.get(patient=patient).next_appointment_at == aware(MONDAY, 9)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = authenticated_client.post(URL + 'bulk_status/', {
+                'ids': [a.id for a in day[:2]], 'status': 'done',
+            }, format='json')
+        assert response.status_code == 200
+
+        stats = PatientStats.objects.get(patient=patient)
+        assert (stats.total_visits, stats.next_appointment_at) == (2, aware(MONDAY, 11))
+
+        with patch('apps.calendar.tasks.match_released_slots.delay'), \
+                django_capture_on_commit_callbacks(execute=True):
+            authenticated_client.post(URL + 'bulk_cancel/', {
+                'ids': [day[2].id], 'cancellation_reason': 'Болезнь',
+            }, format='json')
+        assert PatientStats.objects.get(patient=patient).next_appointment_at is None
+
+    def test_bulk_status_creates_visits(self, authenticated_client, day, django_capture_on_commit_callbacks):
+        with CaptureQueriesContext(connection) as ctx:
+            response = authenticated_client.post(URL + 'bulk_status/', {
+                'ids': [a.id for a in day], 'status': 'done',
+            }, format='json')
+
+        assert response.status_code == 200
+        assert Visit.objects.filter(appointment__in=day, status='completed').count() == 3
+        assert all(a['has_visit'] for a in response.data['appointments'])
+        # Constant number of queries regardless of batch size
+        assert len(ctx.captured_queries) < 20
+
+    def test_bulk_cancel_records_one_batch(self, authenticated_client, branch, day):
+        response = authenticated_client.post(URL + 'bulk_cancel/', {
+            'ids': [a.id for a in day], 'cancellation_reason': 'Врач заболел',
+        }, format='json')
+
+        assert response.status_code == 200
+        assert set(Appointment.objects.values_list('status', 'cancellation_reason')) == {('canceled', 'Врач заболел')}
+        assert list(AppointmentChange.objects.values_list('seq', flat=True)) == [1, 2, 3]
+
+    def test_missing_ids(self, authenticated_client, day):
+        response = authenticated_client.post(URL + 'bulk_cancel/', {'ids': [day[0].id, 999999]}, format='json')
+
+        assert response.status_code == 404
+        assert response.data['details']['missing'] == [999999]
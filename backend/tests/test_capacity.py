@@ -0,0 +1,141 @@
+import pytest
+from datetime import date, datetime, time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.calendar.models import Appointment, AppointmentResource
+from apps.calendar.services import capacity
+from apps.org.models import Resource, Room
+
+
+MONDAY = date(2030, 1, 7)
+URL = '/api/v1/calendar/appointments/'
+
+
+def aware(hour, minute=0):
+    return timezone.make_aware(datetime.combine(MONDAY, time(hour, minute)))
+
+
+@pytest.fixture
+def room(branch):
+    return Room.objects.create(branch=branch, name='Кабинет 1')
+
+
+@pytest.fixture
+def chairs(branch):
+    return [Resource.objects.create(branch=branch, name=f'Кресло {i}', type='chair') for i in range(3)]
+
+
+@pytest.fixture
+def other_doctor(organization):
+    from apps.staff.models import Employee
+
+    return Employee.objects.create(organization=organization, first_name='Пётр', last_name='Петров', phone='+77010000002')
+
+
+@pytest.fixture
+def booked(branch, employee, patient, room, chairs):
+    """10:00-11:00 in the room with chair 0 and X-ray on chair 1"""
+    appointment = Appointment.objects.create(
+        branch=branch, employee=employee, patient=patient, room=room,
+        start_datetime=aware(10), end_datetime=aware(11), status='booked'
+    )
+    AppointmentResource.objects.create(appointment=appointment, resource=chairs[0])
+    AppointmentResource.objects.create(appointment=appointment, resource=chairs[1])
+    return appointment
+
+
+class TestTimeline:
+    """Test minute bitmaps"""
+
+    def test_busy_and_conflict_minutes(self):
+        timeline = capacity.Timeline(aware(9), aware(12))
+        key = (capacity.RESOURCE, 1)
+        timeline.add(key, aware(10), aware(11))
+        timeline.add(key, aware(10, 30), aware(11, 15))
+
+        assert timeline.busy_minutes(key) == 75
+        assert timeline.conflict_minutes(key) == 30
+        assert timeline.collides(key, aware(11, 10), aware(11, 20))
+        assert not timeline.collides(key, aware(11, 15), aware(12))
+
+
+@pytest.mark.django_db
+class TestCapacity:
+    """Test capacity planner and resource validation"""
+
+    def test_day_plan(self, authenticated_client, branch, employee, patient, chairs, booked):
+        double = Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(11), end_datetime=aware(11, 30), status='booked'
+        )
+        AppointmentResource.objects.create(appointment=double, resource=chairs[0])
+        other = Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(10, 30), end_datetime=aware(11), status='no_show'
+        )
+        AppointmentResource.objects.create(appointment=other, resource=chairs[2])
+
+        response = authenticated_client.get(URL + 'capacity/', {'branch': branch.id, 'date': MONDAY.isoformat(), 'bucket': 30})
+
+        assert response.status_code == 200
+        # Working hours 09:00-20:00
+        assert response.data['buckets'][:3] == ['09:00', '09:30', '10:00']
+        room_row = response.data['rooms'][0]
+        assert room_row['busy_minutes'][:6] == [0, 0, 30, 30, 0, 0]
+        assert room_row['utilization'] == round(100 * 60 / 660, 1)
+        chair_rows = {row['id']: row for row in response.data['resources']}
+        assert chair_rows[chairs[0].id]['busy_minutes'][2:5] == [30, 30, 30]
+        assert chair_rows[chairs[0].id]['conflict_buckets'] == []
+        # no_show bookings do not occupy
+        assert chair_rows[chairs[2].id]['utilization'] == 0
+
+    def test_conflict_buckets(self, authenticated_client, branch, other_doctor, patient, chairs, booked):
+        overlapping = Appointment.objects.create(
+            branch=branch, employee=other_doctor, patient=patient,
+            start_datetime=aware(10, 45), end_datetime=aware(11, 15), status='booked'
+        )
+        AppointmentResource.objects.create(appointment=overlapping, resource=chairs[1])
+
+        response = authenticated_client.get(URL + 'capacity/', {'branch': branch.id, 'date': MONDAY.isoformat()})
+
+        chair_rows = {row['id']: row for row in response.data['resources']}
+        # 15 min buckets from 09:00, 10:45 is bucket 7
+        assert chair_rows[chairs[1].id]['conflict_buckets'] == [7]
+
+    def test_create_with_busy_resource_rejected(self, authenticated_client, branch, other_doctor, patient, chairs, booked):
+        payload = {
+            'branch': branch.id, 'employee': other_doctor.id, 'patient': patient.id,
+            'start_datetime': aware(10, 30).isoformat(), 'end_datetime': aware(11, 30).isoformat(),
+        }
+
+        rejected = authenticated_client.post(URL, {**payload, 'resource_ids': [chairs[1].id, chairs[2].id]}, format='json')
+        accepted = authenticated_client.post(URL, {**payload, 'resource_ids': [chairs[2].id]}, format='json')
+
+        assert rejected.status_code == 400
+        assert 'resource_ids' in rejected.data
+        assert accepted.status_code == 201
+        assert [r['resource'] for r in accepted.data['allocated_resources']] == [chairs[2].id]
+
+    def test_move_into_busy_resource_rejected(self, authenticated_client, branch, employee, other_doctor, patient, chairs, booked):
+        later = Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(12), end_datetime=aware(13), status='booked'
+        )
+        AppointmentResource.objects.create(appointment=later, resource=chairs[0])
+
+        response = authenticated_client.post(f'{URL}{later.id}/move/', {
+            'start_datetime': aware(10, 30).isoformat(), 'employee_id': other_doctor.id,
+        }, format='json')
+
+        assert response.status_code == 400
+        assert response.data['details']['conflicts'] == [{'kind': 'resource', 'id': chairs[0].id}]
+
+    def test_multi_resource_check_is_one_query(self, chairs, booked):
+        with CaptureQueriesContext(connection) as ctx:
+            conflicts = capacity.booking_conflicts(
+                aware(10, 59), aware(12), resource_ids=[chair.id for chair in chairs]
+            )
+
+        assert conflicts == [{'kind': 'resource', 'id': chairs[0].id}, {'kind': 'resource', 'id': chairs[1].id}]
+        assert len(ctx.captured_queries) == 1
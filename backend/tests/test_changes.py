@@ -0,0 +1,94 @@
+import pytest
+from datetime import date, datetime, time, timedelta
+from unittest.mock import patch
+from django.utils import timezone
+from apps.calendar.models import Appointment, AppointmentChange
+from apps.calendar.services import changelog
+
+
+MONDAY = date(2030, 1, 7)
+URL = '/api/v1/calendar/appointments/'
+CHANGES_URL = URL + 'changes/'
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+@pytest.fixture
+def appointment(branch, employee, patient):
+    return Appointment.objects.create(
+        branch=branch, employee=employee, patient=patient,
+        start_datetime=aware(MONDAY, 10), end_datetime=aware(MONDAY, 11),
+        status='booked'
+    )
+
+
+@pytest.mark.django_db
+class TestChangeLog:
+    """Test per-branch change log and delta sync"""
+
+    def test_mutations_get_contiguous_seq(self, authenticated_client, branch, employee, patient, appointment):
+        created = authenticated_client.post(URL, {
+            'branch': branch.id, 'employee': employee.id, 'patient': patient.id,
+            'start_datetime': aware(MONDAY, 12).isoformat(),
+            'end_datetime': aware(MONDAY, 13).isoformat(),
+        })
+        assert created.status_code == 201
+        moved = authenticated_client.post(f'{URL}{appointment.id}/move/', {
+            'start_datetime': aware(MONDAY, 14).isoformat(),
+            'end_datetime': aware(MONDAY, 15).isoformat(),
+        }, format='json')
+        assert moved.status_code == 200
+        deleted = authenticated_client.delete(f'{URL}{created.data["id"]}/')
+        assert deleted.status_code == 204
+
+        response = authenticated_client.get(CHANGES_URL, {'branch': branch.id})
+
+        assert response.status_code == 200
+        assert response.data['last_seq'] == 3
+        assert response.data['reset'] is False
+        assert [(c['seq'], c['type']) for c in response.data['changes']] == [
+            (1, 'appointment_created'), (2, 'appointment_moved'), (3, 'appointment_deleted'),
+        ]
+        assert response.data['changes'][1]['appointment']['id'] == appointment.id
+        assert response.data['changes'][2]['appointment'] is None
+
+    def test_since_seq_returns_only_gap(self, authenticated_client, branch, appointment):
+        for event_type in ('appointment_created', 'appointment_updated', 'appointment_moved'):
+            changelog.record_change(branch.id, appointment.id, event_type)
+
+        response = authenticated_client.get(CHANGES_URL, {'branch': branch.id, 'since_seq': 1, 'limit': 1})
+
+        assert [c['seq'] for c in response.data['changes']] == [2]
+        assert response.data['has_more'] is True
+        assert response.data['reset'] is False
+
+        up_to_date = authenticated_client.get(CHANGES_URL, {'branch': branch.id, 'since_seq': 3})
+        assert up_to_date.data['changes'] == []
+        assert up_to_date.data['reset'] is False
+
+    def test_reset_after_prune(self, authenticated_client, branch, appointment):
+        changelog.record_change(branch.id, appointment.id, 'appointment_created')
+        changelog.record_change(branch.id, appointment.id, 'appointment_updated')
+        AppointmentChange.objects.filter(seq=1).update(created_at=timezone.now() - timedelta(days=30))
+
+        assert changelog.prune() == 1
+        response = authenticated_client.get(CHANGES_URL, {'branch': branch.id, 'since_seq': 0})
+
+        assert response.data['reset'] is True
+        assert response.data['last_seq'] == 2
+
+    def test_websocket_event_carries_seq(self, authenticated_client, branch, appointment, django_capture_on_commit_callbacks):
+        with patch('apps.calendar.services.events._dispatch') as dispatch, \
+                django_capture_on_commit_callbacks(execute=True):
+            authenticated_client.post(f'{URL}{appointment.id}/change_status/', {'status': 'confirmed'}, format='json')
+
+        [(group, message)] = dispatch.call_args[0][0]
+        assert group == f'calendar_branch_{branch.id}'
+        assert message['data']['seq'] == 1
+        assert message['data']['type'] == 'appointment_status_changed'
+
+    def test_branch_required(self, authenticated_client):
+        response = authenticated_client.get(CHANGES_URL)
+        assert response.status_code == 400
@@ -0,0 +1,133 @@
+import json
+import pytest
+from datetime import date
+from io import StringIO
+from unittest import mock
+from cryptography.fernet import Fernet
+from django.core.management import call_command
+from apps.patients.models import Patient
+from apps.patients.utils.encryption import encrypt_many, hash_iin
+
+
+KEY = Fernet.generate_key().decode()
+OLD_KEY = Fernet.generate_key().decode()
+
+
+@pytest.fixture(autouse=True)
+def iin_key(settings):
+    settings.IIN_ENCRYPTION_KEY = KEY
+    settings.IIN_ENCRYPTION_OLD_KEYS = ''
+
+
+@pytest.fixture
+def plain_patients(db):
+    """Legacy rows: plain IIN only (bulk_create skips Patient.save)"""
+    return Patient.objects.bulk_create([
+        Patient(first_name=f'P{i}', last_name='Legacy', birth_date=date(1990, 1, 1), sex='M',
+                phone='+77010000000', iin=f'9001 0130-{i:04d}')
+        for i in range(10)
+    ])
+
+
+def run(tmp_path, *args, **options):
+    out = StringIO()
+    options.setdefault('checkpoint', str(tmp_path / 'checkpoint.json'))
+    call_command('encrypt_existing_iins', *args, stdout=out, **options)
+    return out.getvalue()
+
+
+@pytest.mark.django_db
+class TestEncryptExistingIins:
+    """Test batched, resumable IIN encryption"""
+
+    def test_encrypts_in_batches(self, tmp_path, plain_patients, django_assert_max_num_queries):
+        with django_assert_max_num_queries(2 + 4 * 2):
+            output = run(tmp_path, batch_size=3)
+
+        patient = Patient.objects.get(first_name='P7')
+        assert Fernet(KEY).decrypt(patient.iin_enc.encode()).decode() == '900101300007'
+        assert patient.iin_hash == hash_iin('900101300007')
+        assert patient.iin_last4 == '0007'
+        assert not Patient.objects.filter(iin_enc='').exists()
+        assert 'Processed 10 patients' in output
+
+    def test_skips_iin_without_digits(self, tmp_path, plain_patients):
+        blank = Patient.objects.bulk_create([
+            Patient(first_name='Blank', last_name='Legacy', birth_date=date(1990, 1, 1), sex='M',
+                    phone='+77010000000', iin='  -  ')
+        ])[0]
+
+        output = run(tmp_path, batch_size=4)
+
+        assert 'Processed 10 patients' in output
+        assert 'Errors: 1 patients' in output
+        assert Patient.objects.filter(iin_enc='').get() == blank
+
+    def test_dry_run(self, tmp_path, plain_patients):
+        output = run(tmp_path, dry_run=True)
+
+        assert 'Would encrypt 10 patients' in output
+        assert Patient.objects.filter(iin_enc='').count() == 10
+
+    def test_resumes_from_checkpoint(self, tmp_path, plain_patients):
+        original = Patient.objects.bulk_update
+        calls = []
+
+        def crash_on_second_batch(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('connection lost')
+            return original(*args, **kwargs)
+
+        with mock.patch.object(Patient.objects, 'bulk_update', side_effect=crash_on_second_batch):
+            with pytest.raises(RuntimeError):
+                run(tmp_path, batch_size=4)
+
+        state = json.loads((tmp_path / 'checkpoint.json').read_text())
+        assert state == {
+            'last_id': plain_patients[3].id, 'processed': 4, 'errors': 0, 'done': False,
+            'shard': {'first_id': plain_patients[0].id, 'last_id': plain_patients[-1].id},
+        }
+
+        # Patients added meanwhile do not move the shard
+        Patient.objects.bulk_create([
+            Patient(first_name='New', last_name='Legacy', birth_date=date(1990, 1, 1), sex='M',
+                    phone='+77010000000', iin='900101301000')
+        ])
+        output = run(tmp_path, batch_size=4)
+        assert f'Resuming after patient #{plain_patients[3].id}' in output
+        assert f'ids {plain_patients[0].id}..{plain_patients[-1].id}' in output
+        assert 'Processed 10 patients (6 in this run' in output
+        assert 'already finished' in run(tmp_path)
+
+    def test_shards(self, tmp_path, plain_patients):
+        first = run(tmp_path, shard=0, shards=2, checkpoint=str(tmp_path / 'a.json'))
+        assert Patient.objects.filter(iin_enc='').count() == 5
+
+        run(tmp_path, shard=1, shards=2, checkpoint=str(tmp_path / 'b.json'))
+        assert not Patient.objects.filter(iin_enc='').exists()
+        assert 'Processed 5 patients' in first
+
+    def test_rotate(self, tmp_path, settings, plain_patients):
+        settings.IIN_ENCRYPTION_KEY = OLD_KEY
+        for patient, token in zip(plain_patients, encrypt_many([p.iin for p in plain_patients])):
+            patient.iin_enc = token
+        Patient.objects.bulk_update(plain_patients, ['iin_enc'])
+        Patient.objects.filter(id=plain_patients[0].id).update(iin_enc='broken')
+
+        settings.IIN_ENCRYPTION_KEY = KEY
+        settings.IIN_ENCRYPTION_OLD_KEYS = OLD_KEY
+        output = run(tmp_path, rotate=True, batch_size=4)
+
+        patient = Patient.objects.get(id=plain_patients[5].id)
+        assert Fernet(KEY).decrypt(patient.iin_enc.encode()).decode() == '900101300005'
+        assert patient.iin_last4 == '0005'
+        assert 'Processed 9 patients' in output
+        assert 'Errors: 1 patients' in output
+
+    def test_max_rate_throttles(self, tmp_path, plain_patients):
+        with mock.patch('apps.patients.management.commands.encrypt_existing_iins.time.sleep') as sleep:
+            run(tmp_path, batch_size=5, max_rate=10)
+
+        assert sleep.call_count == 2
+        assert sleep.call_args_list[-1][0][0] > 0.5
@@ -0,0 +1,102 @@
+import pytest
+from datetime import date, datetime, time
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+from apps.calendar.models import Appointment, AppointmentChange
+from apps.calendar.services import events
+
+
+MONDAY = date(2030, 1, 7)
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+@pytest.fixture
+def appointments(branch, employee, patient):
+    return [
+        Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(MONDAY, hour), end_datetime=aware(MONDAY, hour + 1),
+            status='booked'
+        )
+        for hour in (9, 10, 11)
+    ]
+
+
+@pytest.fixture
+def dispatch():
+    with patch('apps.calendar.services.events._dispatch') as mock:
+        yield mock
+
+
+@pytest.mark.django_db
+class TestEventPublisher:
+    """Test coalesced, commit-deferred calendar events"""
+
+    def test_batch_sends_one_message(self, branch, appointments, dispatch, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            with events.batch():
+                for appointment in appointments:
+                    events.publish(appointment, 'appointment_moved')
+
+        [(group, message)] = dispatch.call_args[0][0]
+        assert dispatch.call_count == 1
+        assert message['type'] == 'appointments_changed'
+        assert [e['seq'] for e in message['events']] == [1, 2, 3]
+        assert [e['appointment']['id'] for e in message['events']] == [a.id for a in appointments]
+
+    def test_coalesces_same_appointment(self, appointments, dispatch, django_capture_on_commit_callbacks):
+        appointment = appointments[0]
+        with django_capture_on_commit_callbacks(execute=True):
+            with events.batch():
+                events.publish(appointment, 'appointment_created')
+                events.publish(appointment, 'appointment_moved')
+                events.publish(appointment, 'appointment_status_changed')
+
+        [(_, message)] = dispatch.call_args[0][0]
+        assert message['data']['type'] == 'appointment_created'
+        assert AppointmentChange.objects.count() == 1
+
+    def test_delete_wins(self, branch, appointments, dispatch, django_capture_on_commit_callbacks):
+        appointment = appointments[0]
+        with django_capture_on_commit_callbacks(execute=True):
+            with events.batch():
+                events.publish(appointment, 'appointment_updated')
+                events.publish_deleted(branch.id, appointment.id)
+
+        [(_, message)] = dispatch.call_args[0][0]
+        assert message['data'] == {'type': 'appointment_deleted', 'seq': 1, 'appointment_id': appointment.id}
+
+    def test_sent_only_after_commit(self, appointments, dispatch, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks() as callbacks:
+            events.publish(appointments[0], 'appointment_updated')
+
+        assert dispatch.call_count == 0
+        assert len(callbacks) == 1
+
+    def test_failed_block_drops_events(self, appointments, dispatch, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            with pytest.raises(RuntimeError):
+                with transaction.atomic(), events.batch():
+                    events.publish(appointments[0], 'appointment_updated')
+                    raise RuntimeError
+
+        assert dispatch.call_count == 0
+        assert AppointmentChange.objects.count() == 0
+
+    def test_send_reaches_group(self, branch, settings):
+        # Changing CHANNEL_LAYERS drops the cached backends, so no Redis is needed
+        settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(events.group_name(branch.id), channel)
+        message = {'type': 'appointments_changed', 'events': [{'type': 'appointment_deleted', 'seq': 1, 'appointment_id': 5}]}
+
+        events._send([(events.group_name(branch.id), message)])
+
+        assert async_to_sync(channel_layer.receive)(channel) == message
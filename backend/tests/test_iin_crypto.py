@@ -0,0 +1,108 @@
+import pytest
+import time as timer
+from datetime import date
+from unittest import mock
+from cryptography.fernet import Fernet
+from apps.patients.models import Patient
+from apps.patients.utils import encryption
+from apps.patients.utils.encryption import (
+    decrypt_iin, decrypt_many, encrypt_iin, encrypt_many, get_crypto, hash_iin, hash_many, mask_iin
+)
+
+
+IIN = '900101300123'
+KEY = Fernet.generate_key().decode()
+OLD_KEY = Fernet.generate_key().decode()
+
+
+@pytest.fixture(autouse=True)
+def iin_key(settings):
+    settings.IIN_ENCRYPTION_KEY = KEY
+    settings.IIN_ENCRYPTION_OLD_KEYS = ''
+
+
+class TestCrypto:
+    """Test the cached crypto context and bulk helpers"""
+
+    def test_context_cached_per_key_set(self, settings):
+        crypto = get_crypto()
+        assert get_crypto() is crypto
+
+        with mock.patch.object(encryption, 'Fernet', wraps=Fernet) as fernet:
+            for _ in range(50):
+                assert decrypt_iin(encrypt_iin(IIN)) == IIN
+        assert fernet.call_count == 0
+
+        settings.IIN_ENCRYPTION_KEY = OLD_KEY
+        assert get_crypto() is not crypto
+        assert get_crypto().key_id != crypto.key_id
+
+    def test_rotation(self, settings):
+        settings.IIN_ENCRYPTION_KEY = OLD_KEY
+        old_token = encrypt_iin(IIN)
+
+        settings.IIN_ENCRYPTION_KEY = KEY
+        assert decrypt_iin(old_token) is None
+
+        settings.IIN_ENCRYPTION_OLD_KEYS = f'{OLD_KEY}, '
+        assert decrypt_iin(old_token) == IIN
+        rotated = get_crypto().rotate(old_token)
+        assert Fernet(KEY).decrypt(rotated.encode()).decode() == IIN
+
+    def test_bulk_helpers(self):
+        tokens = encrypt_many([IIN, '', '9001 0130-0124'])
+        assert tokens[1] is None
+        assert decrypt_many(tokens + ['garbage']) == [IIN, None, '900101300124', None]
+        assert hash_many([IIN, None]) == [hash_iin(IIN), None]
+
+
+@pytest.mark.django_db
+class TestIinLast4:
+    """Test masked IIN without decryption"""
+
+    def make_patient(self, iin=IIN):
+        return Patient.objects.create(
+            first_name='Test', last_name='Patient', birth_date=date(1990, 1, 1), sex='M',
+            phone='+77010000000', iin=iin
+        )
+
+    def test_masked_without_decrypt(self):
+        patient = Patient.objects.get(id=self.make_patient().id)
+        assert patient.iin_last4 == '0123'
+
+        with mock.patch.object(encryption.CryptoContext, 'decrypt', side_effect=AssertionError):
+            assert patient.iin_masked == '********0123'
+
+    def test_legacy_rows_fall_back_to_decrypt(self):
+        patient = self.make_patient()
+        Patient.objects.filter(id=patient.id).update(iin_last4='')
+
+        assert Patient.objects.get(id=patient.id).iin_masked == '********0123'
+
+    @pytest.mark.slow
+    def test_benchmark_list_masking(self):
+        """Benchmark: masked IIN for a 500 patient list"""
+        Patient.objects.bulk_create([
+            Patient(first_name=f'P{i}', last_name='Bench', birth_date=date(1990, 1, 1), sex='M',
+                    phone='+77010000000', iin_enc=token, iin_last4=f'{i:04d}')
+            for i, token in enumerate(encrypt_many([f'90010130{i:04d}' for i in range(500)]))
+        ])
+        patients = list(Patient.objects.filter(last_name='Bench'))
+
+        started = timer.perf_counter()
+        # What every row used to do: a new Fernet and a decryption
+        legacy = [mask_iin(Fernet(KEY).decrypt(p.iin_enc.encode()).decode()) for p in patients]
+        legacy_elapsed = timer.perf_counter() - started
+
+        started = timer.perf_counter()
+        masked = [p.iin_masked for p in patients]
+        masked_elapsed = timer.perf_counter() - started
+
+        started = timer.perf_counter()
+        decrypt_many([p.iin_enc for p in patients])
+        bulk_elapsed = timer.perf_counter() - started
+
+        print(f'\nper-row Fernet {legacy_elapsed * 1000:.1f}ms, iin_last4 {masked_elapsed * 1000:.2f}ms, '
+              f'decrypt_many {bulk_elapsed * 1000:.1f}ms')
+        assert masked == legacy
+        assert masked_elapsed * 10 < legacy_elapsed
@@ -0,0 +1,156 @@
+import json
+import time
+import pytest
+from apps.patients import kato_utils
+from apps.patients.kato_utils import KATOHelper, KATOIndex
+from apps.patients.search import name_tokens
+
+
+ITEMS = [
+    {'code': '750000000', 'name': 'г. Алматы', 'name_kk': 'Алматы қ.', 'parent': None, 'level': 1, 'type': 'city'},
+    {'code': '190000000', 'name': 'Алматинская область', 'name_kk': 'Алматы облысы', 'parent': None, 'level': 1, 'type': 'region'},
+    {'code': '750100000', 'name': 'Алмалинский район', 'name_kk': 'Алмалы ауданы', 'parent': '750000000', 'level': 2, 'type': 'district'},
+    {'code': '750600000', 'name': 'Медеуский район', 'name_kk': 'Медеу ауданы', 'parent': '750000000', 'level': 2, 'type': 'district'},
+]
+
+
+def codes(items):
+    return [item['code'] for item in items]
+
+
+class TestKATOIndex:
+    """Test the compiled KATO index"""
+
+    def test_lookups(self):
+        index = KATOIndex(ITEMS)
+
+        assert index.get('750600000')['name'] == 'Медеуский район'
+        assert index.get('000000000') is None
+        assert codes(index.get_children('750000000')) == ['750100000', '750600000']
+        assert index.get_children('750600000') == []
+
+    def test_autocomplete(self):
+        index = KATOIndex(ITEMS)
+
+        # Level 1 first, then by name
+        assert codes(index.autocomplete('алм')) == ['190000000', '750000000', '750100000']
+        # Latin and Kazakh spellings
+        assert codes(index.autocomplete('almaty')) == ['190000000', '750000000']
+        assert codes(index.autocomplete('облысы')) == ['190000000']
+        # Every word must match
+        assert codes(index.autocomplete('район алм')) == ['750100000']
+        assert codes(index.autocomplete('алм', parent='750000000')) == ['750100000']
+        assert codes(index.autocomplete('алм', level=1, limit=1)) == ['190000000']
+        assert index.autocomplete('астана') == []
+        assert index.autocomplete('  ') == []
+
+    def test_compiled_file(self, tmp_path):
+        fixture = tmp_path / 'kato.json'
+        fixture.write_text(json.dumps(ITEMS, ensure_ascii=False), encoding='utf-8')
+        compiled = tmp_path / 'kato.idx'
+
+        kato_utils.compile_index(fixture, compiled)
+        fixture_digest = kato_utils._digest(fixture.read_bytes())
+        assert KATOIndex.load(compiled, fixture_digest) is not None
+        assert codes(kato_utils.load_index(fixture, compiled).autocomplete('медеу')) == ['750600000']
+
+        # A changed fixture makes the compiled file stale
+        fixture.write_text(json.dumps(ITEMS[:1], ensure_ascii=False), encoding='utf-8')
+        assert KATOIndex.load(compiled, kato_utils._digest(fixture.read_bytes())) is None
+        assert len(kato_utils.load_index(fixture, compiled).items) == 1
+
+        compiled.write_bytes(b'garbage')
+        assert KATOIndex.load(compiled, fixture_digest) is None
+
+
+class TestKATOHelper:
+    """Test KATOHelper on the shipped fixture"""
+
+    def test_fixture(self):
+        assert len(KATOHelper.get_regions()) == 18
+        assert len(KATOHelper.get_districts('750000000')) == 8
+        assert KATOHelper.get_by_code('710000000')['name'] == 'г. Астана'
+        assert codes(KATOHelper.autocomplete('астан')) == ['710000000']
+
+
+@pytest.mark.django_db
+class TestKATOApi:
+    """Test KATO directory endpoints"""
+
+    def test_autocomplete(self, authenticated_client):
+        response = authenticated_client.get('/api/v1/patients/kato/autocomplete/', {'q': 'медеу'})
+        assert response.status_code == 200
+        assert codes(response.data['results']) == ['750600000']
+
+        response = authenticated_client.get('/api/v1/patients/kato/autocomplete/', {'q': ''})
+        assert response.status_code == 400
+
+    def test_list_and_retrieve(self, authenticated_client):
+        response = authenticated_client.get('/api/v1/patients/kato/', {'parent': '710000000'})
+        assert len(response.data['results']) == 4
+
+        assert authenticated_client.get('/api/v1/patients/kato/750100000/').data['name'] == 'Алмалинский район'
+        assert authenticated_client.get('/api/v1/patients/kato/123/').status_code == 404
+
+
+@pytest.mark.slow
+def test_kato_benchmark(tmp_path):
+    """Linear scans against the compiled index on a full-size directory"""
+    words = ['Алма', 'Бай', 'Есиль', 'Жана', 'Кара', 'Сары', 'Тал', 'Шу', 'Ак', 'Кок']
+    items = []
+    for region in range(20):
+        region_code = f'{11 + region * 4:02d}0000000'
+        items.append({'code': region_code, 'name': f'{words[region % 10]}ская область {region}', 'parent': None, 'level': 1})
+        for district in range(750):
+            items.append({
+                'code': f'{region_code[:2]}{district:03d}0000',
+                'name': f'{words[district % 10]}{words[(district // 10) % 10].lower()} {district}',
+                'parent': region_code, 'level': 2,
+            })
+    fixture = tmp_path / 'kato.json'
+    fixture.write_text(json.dumps(items, ensure_ascii=False), encoding='utf-8')
+    compiled = tmp_path / 'kato.idx'
+    kato_utils.compile_index(fixture, compiled)
+    lookups = [item['code'] for item in items[::150]]
+
+    def scan_code(code):
+        return next((item for item in items if item.get('code') == code), None)
+
+    def scan_autocomplete(query):
+        prefix = name_tokens(query)[0]
+        found = [item for item in items if any(token.startswith(prefix) for token in name_tokens(item['name']))]
+        return found[:20]
+
+    def timed(func):
+        started = time.perf_counter()
+        func()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    parsed = KATOIndex(json.loads(fixture.read_bytes()))
+    build = time.perf_counter() - started
+    started = time.perf_counter()
+    index = kato_utils.load_index(fixture, compiled)
+    load = time.perf_counter() - started
+
+    linear = {
+        'get_by_code': timed(lambda: [scan_code(code) for code in lookups]),
+        'get_districts': timed(lambda: [[i for i in items if i.get('parent') == code] for code in lookups]),
+        'autocomplete': timed(lambda: [scan_autocomplete(query) for query in ('алмаб', 'karas', 'шу')]),
+    }
+    indexed = {
+        'get_by_code': timed(lambda: [index.get(code) for code in lookups]),
+        'get_districts': timed(lambda: [index.get_children(code) for code in lookups]),
+        'autocomplete': timed(lambda: [index.autocomplete(query) for query in ('алмаб', 'karas', 'шу')]),
+    }
+
+    print(f'\n{len(items)} items: JSON + build {build * 1000:.0f}ms, compiled load {load * 1000:.0f}ms')
+    for name in linear:
+        print(f'{name}: linear {linear[name] * 1000:.2f}ms, indexed {indexed[name] * 1000:.3f}ms')
+        assert indexed[name] < linear[name]
+    assert len(parsed.items) == len(index.items)
+    expected = sorted(
+        (item for item in items if any(token.startswith('shu') for token in name_tokens(item['name']))),
+        key=lambda item: (item['level'], item['name'])
+    )
+    assert codes(index.autocomplete('шу', limit=100)) == codes(expected[:100])
@@ -0,0 +1,177 @@
+import pytest
+import time as timer
+from datetime import date, datetime, time, timedelta
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.calendar.models import Appointment, Availability
+from apps.calendar.services import occupancy, schedule_cache
+from apps.org.models import Room
+from apps.staff.models import Employee, EmployeeBranch
+
+
+MONDAY = date(2024, 3, 4)
+URL = '/api/v1/calendar/appointments/occupancy/'
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def room(branch):
+    return Room.objects.create(branch=branch, name='Cabinet 1')
+
+
+@pytest.fixture
+def booked_monday(branch, employee, patient, room):
+    """Mon 9-13 availability: 60 min done, 30 min no-show, 60 min canceled"""
+    Availability.objects.create(employee=employee, room=room, weekday=0, time_from=time(9), time_to=time(13))
+    return Appointment.objects.bulk_create([
+        Appointment(branch=branch, employee=employee, patient=patient, room=room,
+                    start_datetime=aware(MONDAY, 9), end_datetime=aware(MONDAY, 10), status='done'),
+        Appointment(branch=branch, employee=employee, patient=patient,
+                    start_datetime=aware(MONDAY, 10), end_datetime=aware(MONDAY, 10, 30), status='no_show'),
+        Appointment(branch=branch, employee=employee, patient=patient, room=room,
+                    start_datetime=aware(MONDAY, 11), end_datetime=aware(MONDAY, 12), status='canceled'),
+    ])
+
+
+@pytest.mark.django_db
+class TestOccupancy:
+    """Test the occupancy heatmap aggregates"""
+
+    def test_employee_minutes(self, authenticated_client, branch, employee, booked_monday):
+        response = authenticated_client.get(URL, {
+            'branch': branch.id, 'date_from': MONDAY.isoformat(), 'date_to': (MONDAY + timedelta(days=1)).isoformat()
+        })
+
+        assert response.status_code == 200
+        assert response.data['days'] == ['2024-03-04', '2024-03-05']
+        row, = response.data['rows']
+        assert row['id'] == employee.id
+        assert row['booked'] == [60, 0]
+        assert row['no_show'] == [30, 0]
+        assert row['capacity'] == [240, 0]
+        assert row['available'] == [180, 0]
+        assert row['totals']['utilization'] == 25.0
+
+    def test_room_rows(self, authenticated_client, branch, room, booked_monday):
+        Room.objects.create(branch=branch, name='Cabinet 2')
+
+        response = authenticated_client.get(URL, {
+            'branch': branch.id, 'date_from': MONDAY.isoformat(), 'date_to': MONDAY.isoformat(), 'group_by': 'room'
+        })
+
+        rows = {row['name']: row for row in response.data['rows']}
+        assert rows['Cabinet 1']['booked'] == [60]
+        assert rows['Cabinet 2']['booked'] == [0]
+
+    def test_assigned_employees_and_ids_filter(self, branch, employee, organization, booked_monday):
+        idle = Employee.objects.create(organization=organization, first_name='Idle', last_name='Doctor', phone='+77010000000')
+        EmployeeBranch.objects.create(employee=idle, branch=branch)
+
+        result = occupancy.heatmap(branch.id, MONDAY, MONDAY)
+        assert {row['id'] for row in result['rows']} == {employee.id, idle.id}
+
+        result = occupancy.heatmap(branch.id, MONDAY, MONDAY, ids={idle.id})
+        assert [row['booked'] for row in result['rows']] == [[0]]
+
+    def test_closed_days_cached_until_invalidated(self, branch, employee, patient, booked_monday):
+        occupancy.heatmap(branch.id, MONDAY, MONDAY)
+        late = Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(MONDAY, 15), end_datetime=aware(MONDAY, 16), status='done'
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            row, = occupancy.heatmap(branch.id, MONDAY, MONDAY)['rows']
+        assert row['booked'] == [60]
+        assert not any('SUM(' in q['sql'] for q in ctx.captured_queries)
+
+        schedule_cache.invalidate_appointment(late)
+        row, = occupancy.heatmap(branch.id, MONDAY, MONDAY)['rows']
+        assert row['booked'] == [120]
+
+    def test_open_days_not_cached(self, branch, employee, patient):
+        today = timezone.localdate()
+        occupancy.heatmap(branch.id, today, today)
+        Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(today, 9), end_datetime=aware(today, 10), status='booked'
+        )
+
+        row, = occupancy.heatmap(branch.id, today, today)['rows']
+        assert row['booked'] == [60]
+
+    def test_invalid_params(self, authenticated_client, branch):
+        assert authenticated_client.get(URL).status_code == 400
+        assert authenticated_client.get(URL, {'branch': branch.id, 'group_by': 'patient'}).status_code == 400
+        assert authenticated_client.get(URL, {
+            'branch': branch.id, 'date_from': '2024-01-01', 'date_to': '2025-12-31'
+        }).status_code == 400
+
+    @pytest.mark.slow
+    def test_benchmark_year_50_doctors_1m_rows(self, settings, organization, branch, patient):
+        """Benchmark: 12 months x 50 doctors over ~1M appointments"""
+        # The default local memory cache keeps only 300 keys, a year needs 365
+        settings.CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'OPTIONS': {'MAX_ENTRIES': 10000},
+            }
+        }
+        doctors = Employee.objects.bulk_create([
+            Employee(organization=organization, first_name=f'D{i}', last_name='Doctor', phone='+77010000000')
+            for i in range(50)
+        ])
+        Availability.objects.bulk_create([
+            Availability(employee=doctor, weekday=weekday, time_from=time(8), time_to=time(18))
+            for doctor in doctors for weekday in range(5)
+        ])
+        first_day = date(2023, 1, 1)
+        last_day = date(2023, 12, 31)
+        with connection.cursor() as cursor:
+            # 55 ten-minute appointments per doctor and day
+            cursor.execute(
+                """
+                INSERT INTO appointments (
+                    branch_id, employee_id, patient_id, start_datetime, end_datetime, status,
+                    is_primary, is_urgent, note, cancellation_reason, created_at, updated_at
+                )
+                SELECT %s, e.id, %s,
+                       d + make_interval(mins => 480 + s * 10),
+                       d + make_interval(mins => 490 + s * 10),
+                       (ARRAY['done', 'done', 'done', 'booked', 'no_show', 'canceled'])[1 + (s + e.id) %% 6],
+                       false, false, '', '', now(), now()
+                FROM unnest(%s::int[]) AS e(id),
+                     generate_series(%s::timestamptz, %s::timestamptz, interval '1 day') AS d,
+                     generate_series(0, 54) AS s
+                """,
+                [branch.id, patient.id, [doctor.id for doctor in doctors],
+                 aware(first_day, 0), aware(last_day, 0)]
+            )
+            cursor.execute('ANALYZE appointments')
+
+        started = timer.perf_counter()
+        cold = occupancy.heatmap(branch.id, first_day, last_day)
+        cold_elapsed = timer.perf_counter() - started
+
+        started = timer.perf_counter()
+        warm = occupancy.heatmap(branch.id, first_day, last_day)
+        warm_elapsed = timer.perf_counter() - started
+
+        assert len(cold['rows']) == 50
+        assert cold == warm
+        assert sum(row['totals']['booked'] for row in cold['rows']) > 0
+        print(f'\ncold {cold_elapsed:.3f}s, warm {warm_elapsed:.3f}s')
+        assert cold_elapsed < 5
+        assert warm_elapsed < 0.2
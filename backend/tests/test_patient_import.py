@@ -0,0 +1,201 @@
+import csv
+import io
+import time
+import pytest
+from datetime import date
+from io import StringIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from apps.patients import importer
+from apps.patients.models import Patient, PatientImport
+from apps.patients.utils.encryption import decrypt_iin, hash_iin
+from apps.patients.validators import calculate_iin_checksum, validate_iin
+from config.celery import app as celery_app
+
+
+CSV = (
+    'Фамилия;Имя;Отчество;Дата рождения;Пол;Телефон;ИИН;Email\n'
+    'Нурланова;Асель;;;;8 701 123 45 67;900515400123;\n'
+    'Ахметов;Ержан;Саматович;02.03.1985;м;+7 702 000 00 01;;erzhan@example.com\n'
+    'Ахметов;Ержан;;02.03.1985;М;87020000001;;\n'
+    'Иванов;Иван;;1980-01-01;M;;;\n'
+    ';Пустой;;01.01.1990;F;+77030000000;;\n'
+    'Смирнова;Ольга;;;F;+77040000000;123;\n'
+    '\n'
+    'Ким;Виктория;;10.10.2000;ж;+77050000000;;not-an-email\n'
+)
+
+
+@pytest.fixture(autouse=True)
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+def run(organization, content, filename='patients.csv', **options):
+    report = StringIO()
+    counts = importer.import_file(io.BytesIO(content), filename, organization, report=report, **options)
+    report.seek(0)
+    return counts, list(csv.reader(report))
+
+
+def xlsx(rows):
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.mark.django_db
+class TestImporter:
+    """Test the streaming patient importer"""
+
+    def test_csv(self, organization):
+        counts, report = run(organization, CSV.encode('utf-8-sig'))
+
+        assert counts == {'total': 7, 'created': 2, 'existing': 0, 'duplicates': 1, 'errors': 4}
+        assert report[0][:3] == ['line', 'error', 'Фамилия']
+        reasons = {int(row[0]): row[1] for row in report[1:]}
+        assert reasons[4] == 'Повтор строки 3'
+        assert reasons[5] == 'Нужен телефон или ИИН'
+        assert 'Не заполнено поле last_name' in reasons[6]
+        assert reasons[7].startswith('ИИН: ')
+        # IINs in the report are masked
+        assert {row[0]: row[8] for row in report[1:]}['7'] == '***'
+        assert importer.mask_iin('9005 1540-0123') == '********0123'
+        assert reasons[9] == 'Неверный email: not-an-email'
+
+        patient = Patient.objects.get(last_name='Нурланова')
+        # Birth date and sex come from the IIN
+        assert patient.birth_date == date(1990, 5, 15)
+        assert patient.sex == 'F'
+        assert patient.phone_normalized == '+77011234567'
+        assert patient.iin_hash == hash_iin('900515400123')
+        assert decrypt_iin(patient.iin_enc) == '900515400123'
+        assert patient.iin_last4 == '0123'
+        assert 'nurlanova' in patient.search_text
+        assert list(patient.organizations.all()) == [organization]
+
+        erzhan = Patient.objects.get(last_name='Ахметов')
+        assert erzhan.middle_name == 'Саматович'
+        assert erzhan.email == 'erzhan@example.com'
+
+    def test_reimport_skips_existing(self, organization):
+        run(organization, CSV.encode())
+        counts, report = run(organization, CSV.encode())
+
+        assert counts['created'] == 0
+        # The repeated row matches the existing patient too
+        assert counts['existing'] == 3
+        assert sum(row[1].startswith('Пациент уже есть в организации') for row in report) == 3
+        assert Patient.objects.count() == 2
+
+    def test_dry_run(self, organization):
+        counts, _ = run(organization, CSV.encode(), dry_run=True)
+
+        assert counts['created'] == 2
+        assert not Patient.objects.exists()
+
+    def test_xlsx(self, organization):
+        content = xlsx([
+            ['last_name', 'first_name', 'birth_date', 'sex', 'phone', 'iin'],
+            ['Ким', 'Виктория', date(2000, 10, 10), 'F', 77050000000, None],
+            # Numeric IIN cell without the leading zero
+            ['Ли', 'Марат', None, None, None, 50101500010],
+        ])
+
+        counts, _ = run(organization, content, filename='patients.xlsx', chunk_size=1)
+
+        assert counts['created'] == 2
+        assert Patient.objects.get(last_name='Ким').phone == '77050000000'
+        marat = Patient.objects.get(last_name='Ли')
+        assert marat.iin == '050101500010'
+        assert (marat.birth_date, marat.sex) == (date(2005, 1, 1), 'M')
+
+    def test_file_errors(self, organization):
+        with pytest.raises(importer.ImportFileError):
+            run(organization, b'name,phone\n', filename='patients.txt')
+        with pytest.raises(importer.ImportFileError, match='last_name'):
+            run(organization, b'first_name,phone\n')
+        with pytest.raises(importer.ImportFileError, match='UTF-8'):
+            run(organization, 'Фамилия;Имя\n'.encode('cp1251'))
+
+    def test_command(self, organization, tmp_path):
+        path = tmp_path / 'patients.csv'
+        path.write_bytes(CSV.encode())
+        report = tmp_path / 'errors.csv'
+
+        out = StringIO()
+        call_command('import_patients', str(path), organization=organization.id, report=str(report), stdout=out)
+
+        assert 'Imported 2 of 7 rows' in out.getvalue()
+        assert len(report.read_text(encoding='utf-8-sig').splitlines()) == 6
+
+
+@pytest.mark.django_db
+class TestImportApi:
+    """Test the asynchronous import endpoint"""
+
+    def test_upload_and_poll(self, authenticated_client, organization, settings, django_capture_on_commit_callbacks):
+        celery_app.conf.task_always_eager = True
+        try:
+            with django_capture_on_commit_callbacks(execute=True):
+                response = authenticated_client.post(
+                    '/api/v1/patients/imports/',
+                    {'file': SimpleUploadedFile('patients.csv', CSV.encode(), content_type='text/csv')},
+                    format='multipart'
+                )
+        finally:
+            celery_app.conf.task_always_eager = False
+
+        assert response.status_code == 201
+        assert response.data['status'] == 'pending'
+
+        response = authenticated_client.get(f'/api/v1/patients/imports/{response.data["id"]}/')
+        assert response.data['status'] == 'done'
+        assert response.data['created_count'] == 2
+        assert response.data['error_count'] == 4
+        assert response.data['report'].endswith('.csv')
+        assert Patient.objects.filter(organizations=organization).count() == 2
+        # The uploaded file with plain IINs is gone
+        assert response.data['file'] is None
+        assert not list((settings.MEDIA_ROOT / 'imports').rglob('patients*.csv'))
+
+    def test_rejects_other_files_and_non_admins(self, authenticated_client, api_client, doctor_user):
+        response = authenticated_client.post(
+            '/api/v1/patients/imports/',
+            {'file': SimpleUploadedFile('patients.pdf', b'%PDF')},
+            format='multipart'
+        )
+        assert response.status_code == 400
+        assert not PatientImport.objects.exists()
+
+        api_client.force_authenticate(user=doctor_user)
+        assert api_client.get('/api/v1/patients/imports/').status_code == 403
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+def test_import_benchmark(organization):
+    """Import 100k rows, every one with a phone and an IIN"""
+    rows = 100000
+    lines = ['last_name;first_name;birth_date;sex;phone;iin']
+    for n in range(rows):
+        # Birth date, century digit and a sequence unique per row
+        base = f'9001{10 + n // 10000:02d}3{n % 10000:04d}'
+        iin = f'{base}{calculate_iin_checksum(base + "0")}'
+        if not validate_iin(iin)['valid']:
+            iin = ''
+        lines.append(f'Bench;P{n};01.01.1990;M;+7700{n:07d};{iin}')
+    content = '\n'.join(lines).encode()
+
+    started = time.monotonic()
+    counts, _ = run(organization, content)
+    elapsed = time.monotonic() - started
+
+    print(f'\n{rows} rows: {elapsed:.1f}s, {counts}')
+    assert counts['created'] == rows
+    assert Patient.objects.filter(last_name='Bench').count() == counts['created']
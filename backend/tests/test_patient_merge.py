@@ -0,0 +1,265 @@
+import time as timer
+import pytest
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from apps.billing.models import Invoice
+from apps.calendar.models import Appointment
+from apps.comms.models import Reminder, ReminderJob
+from apps.consent.models import AuditLog
+from apps.org.models import Organization
+from apps.patients import merge
+from apps.patients.models import Patient, PatientFile, PatientStats
+from apps.patients.utils.encryption import hash_iin
+from apps.telegram_bot.models import PatientTelegramLink
+from apps.visits.models import Visit
+
+
+def aware(day, hour):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+@pytest.fixture
+def make_patient(organization):
+    def make_patient(first_name='Асель', phone='+77011234567', birth_date=date(1990, 5, 15), **fields):
+        patient = Patient.objects.create(
+            first_name=first_name, last_name='Нурланова', birth_date=birth_date, sex='F', phone=phone, **fields
+        )
+        patient.organizations.add(organization)
+        return patient
+    return make_patient
+
+
+@pytest.mark.django_db
+class TestFindClusters:
+    """Test bulk duplicate detection"""
+
+    def test_iin_and_phone_groups(self, make_patient):
+        original = make_patient(iin='900515400123', iin_verified=True)
+        same_iin = make_patient(phone='+77020000000', iin='900515400123')
+        same_phone = make_patient(phone='8 (701) 123-45-67')
+        # Family members sharing the phone are not duplicates
+        make_patient(first_name='Айгерим', birth_date=date(2015, 1, 1))
+        other = make_patient(phone='+77779999999')
+
+        clusters = merge.find_clusters()
+
+        assert clusters == [[original.id, same_iin.id, same_phone.id]]
+        assert merge.find_clusters(criteria=[merge.BY_IIN]) == [[original.id, same_iin.id]]
+        assert other.id not in clusters[0]
+
+    def test_survivor_prefers_iin(self, make_patient):
+        oldest = make_patient()
+        with_iin = make_patient(iin='900515400123')
+
+        assert merge.find_clusters() == [[with_iin.id, oldest.id]]
+
+
+@pytest.mark.django_db
+class TestMerge:
+    """Test merging duplicate patients"""
+
+    def test_moves_rows_and_deletes_duplicates(self, make_patient, organization, branch, employee, admin_user, django_capture_on_commit_callbacks):
+        survivor = make_patient(balance=Decimal('1000'), allergies='Пенициллин')
+        duplicate = make_patient(
+            middle_name='Ержановна', iin='900515400123', balance=Decimal('-300'), allergies='Латекс', tags=['vip']
+        )
+        other_organization = Organization.objects.create(name='Other Clinic')
+        duplicate.organizations.add(other_organization)
+
+        appointment = Appointment.objects.create(
+            branch=branch, employee=employee, patient=duplicate,
+            start_datetime=aware(date(2024, 3, 1), 10), end_datetime=aware(date(2024, 3, 1), 11), status='done'
+        )
+        visit = Visit.objects.create(appointment=appointment, status='completed')
+        Invoice.objects.create(visit=visit, number='INV-1', amount=5000, paid_amount=5000, status='paid')
+        PatientFile.objects.create(patient=duplicate, title='Снимок', file='patients/x.png')
+        PatientTelegramLink.objects.create(patient=duplicate, telegram_user_id=555)
+
+        preview = merge.preview([[survivor.id, duplicate.id]])[0]
+        assert preview['moves'] == {'appointments': 1, 'files': 1, 'telegram_link': 1}
+
+        with django_capture_on_commit_callbacks(execute=True):
+            result = merge.merge([[survivor.id, duplicate.id]], user=admin_user)
+
+        assert result['merged'] == 1
+        assert result['moved']['appointments'] == 1
+        assert not Patient.objects.filter(id=duplicate.id).exists()
+
+        survivor.refresh_from_db()
+        assert survivor.balance == Decimal('700')
+        assert survivor.middle_name == 'Ержановна'
+        assert survivor.iin_hash == hash_iin('900515400123')
+        assert survivor.allergies == 'Пенициллин\nЛатекс'
+        assert survivor.tags == ['vip']
+        assert 'erzhanovna' in survivor.search_text
+        assert set(survivor.organizations.all()) == {organization, other_organization}
+
+        appointment.refresh_from_db()
+        assert appointment.patient_id == survivor.id
+        assert appointment.visit.invoices.count() == 1
+        assert survivor.files.count() == 1
+        assert PatientTelegramLink.objects.get(telegram_user_id=555).patient_id == survivor.id
+        assert AuditLog.objects.get(patient=survivor).details == {'merged_patient_ids': [duplicate.id]}
+        assert PatientStats.objects.get(patient=survivor).total_revenue == Decimal('5000')
+
+    def test_keeps_survivor_telegram_link(self, make_patient):
+        survivor, duplicate = make_patient(), make_patient()
+        PatientTelegramLink.objects.create(patient=survivor, telegram_user_id=1)
+        PatientTelegramLink.objects.create(patient=duplicate, telegram_user_id=2)
+
+        merge.merge([[survivor.id, duplicate.id]])
+
+        assert list(PatientTelegramLink.objects.values_list('patient_id', 'telegram_user_id')) == [(survivor.id, 1)]
+
+    def test_drops_clashing_reminder_jobs(self, make_patient, organization):
+        survivor, duplicate, third = make_patient(), make_patient(), make_patient()
+        birthday = Reminder.objects.create(organization=organization, name='ДР', type='BIRTHDAY', body='С днём рождения')
+        job = {'reminder': birthday, 'event_date': date(2024, 5, 15), 'scheduled_at': aware(date(2024, 5, 15), 9)}
+        kept = ReminderJob.objects.create(patient=survivor, **job)
+        ReminderJob.objects.create(patient=duplicate, **job)
+        ReminderJob.objects.create(patient=third, **job)
+        older = ReminderJob.objects.create(patient=duplicate, **{**job, 'event_date': date(2023, 5, 15)})
+
+        result = merge.merge([[survivor.id, duplicate.id, third.id]])
+
+        assert result['merged'] == 2
+        assert set(ReminderJob.objects.values_list('id', flat=True)) == {kept.id, older.id}
+        assert set(ReminderJob.objects.values_list('patient_id', flat=True)) == {survivor.id}
+
+    def test_different_iins_are_not_merged(self, make_patient, authenticated_client):
+        first = make_patient(iin='900515400123')
+        second = make_patient(iin='900515400234')
+
+        clusters = merge.find_clusters()
+        assert clusters == [[first.id, second.id]]
+        assert merge.preview(clusters)[0]['iin_conflict'] is True
+
+        result = merge.merge(clusters)
+        assert (result['merged'], result['conflicts']) == (0, [first.id])
+        assert Patient.objects.count() == 2
+
+        response = authenticated_client.post(
+            f'/api/v1/patients/patients/{first.id}/merge/', {'duplicates': [second.id]}, format='json'
+        )
+        assert response.status_code == 400
+
+        out = StringIO()
+        call_command('merge_duplicate_patients', stdout=out)
+        assert 'Skipping 1 clusters with different IINs' in out.getvalue()
+        assert Patient.objects.count() == 2
+
+    def test_failed_batch_does_not_stop_the_run(self, make_patient, monkeypatch):
+        clusters = [[make_patient(phone=f'+7701000000{i}').id, make_patient(phone=f'+7701000000{i}').id] for i in range(3)]
+        real_merge = merge.merge
+
+        def flaky_merge(batch, user=None):
+            if batch[0] == clusters[0]:
+                raise RuntimeError('lock timeout')
+            return real_merge(batch, user=user)
+
+        monkeypatch.setattr(merge, 'merge', flaky_merge)
+        result = merge.merge_all(clusters, batch_size=1)
+
+        assert (result['failed'], result['merged']) == (1, 2)
+        assert Patient.objects.count() == 4
+
+    def test_command(self, make_patient):
+        for i in range(3):
+            make_patient(phone=f'+7701000000{i}')
+            make_patient(phone=f'+7701000000{i}')
+
+        out = StringIO()
+        call_command('merge_duplicate_patients', '--dry-run', stdout=out)
+        assert 'Found 3 clusters with 3 duplicates' in out.getvalue()
+        assert Patient.objects.count() == 6
+
+        out = StringIO()
+        call_command('merge_duplicate_patients', batch_size=2, stdout=out)
+        assert 'Merged 3 duplicates into 3 patients' in out.getvalue()
+        assert Patient.objects.count() == 3
+
+
+@pytest.mark.django_db
+class TestMergeApi:
+    """Test duplicate and merge endpoints"""
+
+    def test_duplicates_and_merge(self, authenticated_client, make_patient):
+        survivor, duplicate = make_patient(), make_patient()
+
+        response = authenticated_client.get('/api/v1/patients/patients/duplicates/')
+        assert response.status_code == 200
+        assert response.data['count'] == 1
+        assert response.data['results'][0]['duplicates'] == [duplicate.id]
+
+        url = f'/api/v1/patients/patients/{survivor.id}/merge/'
+        response = authenticated_client.post(url, {'duplicates': [duplicate.id], 'dry_run': True}, format='json')
+        assert response.status_code == 200
+        assert Patient.objects.filter(id=duplicate.id).exists()
+
+        response = authenticated_client.post(url, {'duplicates': [survivor.id]}, format='json')
+        assert response.status_code == 400
+
+        response = authenticated_client.post(url, {'duplicates': [duplicate.id]}, format='json')
+        assert response.status_code == 200
+        assert response.data['merged'] == 1
+        assert not Patient.objects.filter(id=duplicate.id).exists()
+
+    def test_merge_requires_admin(self, api_client, doctor_user, make_patient):
+        survivor, duplicate = make_patient(), make_patient()
+        api_client.force_authenticate(user=doctor_user)
+
+        response = api_client.post(
+            f'/api/v1/patients/patients/{survivor.id}/merge/', {'duplicates': [duplicate.id]}, format='json'
+        )
+        assert response.status_code == 403
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+def test_merge_benchmark(organization, branch, employee):
+    """Merge 20k duplicate pairs with an appointment each"""
+    pairs = 20000
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO patients (
+                first_name, last_name, middle_name, birth_date, sex, phone, phone_normalized, email, address,
+                iin, iin_enc, iin_hash, iin_last4, iin_verified, documents, kato_address, osms_status,
+                osms_category, consents, tags, is_marketing_opt_in, balance, discount_percent, notes,
+                allergies, medical_history, search_text, is_active, created_at, updated_at
+            )
+            SELECT 'P' || (n / 2), 'Bench', '', DATE '1990-01-01', 'F', '+7700' || lpad((n / 2)::text, 7, '0'),
+                   '+7700' || lpad((n / 2)::text, 7, '0'), '', '', '', '', '', '', false, '{}', '{}', '', '',
+                   '{}', '[]', false, 0, 0, '', '', '', '', true, now(), now()
+            FROM generate_series(0, %s - 1) AS n
+            """,
+            [pairs * 2]
+        )
+        cursor.execute(
+            """
+            INSERT INTO appointments (
+                branch_id, employee_id, patient_id, start_datetime, end_datetime, status,
+                is_primary, is_urgent, note, cancellation_reason, created_at, updated_at
+            )
+            SELECT %s, %s, id, TIMESTAMPTZ '2020-01-01' + id * INTERVAL '1 hour',
+                   TIMESTAMPTZ '2020-01-01' + id * INTERVAL '1 hour' + INTERVAL '30 minutes',
+                   'done', false, false, '', '', now(), now()
+            FROM patients WHERE last_name = 'Bench'
+            """,
+            [branch.id, employee.id]
+        )
+
+    started = timer.monotonic()
+    clusters = merge.find_clusters()
+    found = timer.monotonic() - started
+    result = merge.merge_all(clusters, batch_size=1000)
+    elapsed = timer.monotonic() - started
+
+    print(f'\n{pairs} duplicates: clusters {found:.1f}s, total {elapsed:.1f}s')
+    assert result['merged'] == pairs
+    assert result['moved']['appointments'] == pairs
+    assert Patient.objects.filter(last_name='Bench').count() == pairs
@@ -0,0 +1,75 @@
+import pytest
+from datetime import date
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from apps.core import querysets
+from apps.patients import views  # noqa: F401 (registers the patient shapes)
+from apps.patients.models import Patient, PatientPhone
+
+
+def create_patients(organization, count):
+    for i in range(count):
+        patient = Patient.objects.create(
+            first_name=f'Name{i}',
+            last_name='Shape',
+            birth_date=date(1990, 1, 1),
+            sex='F',
+            phone=f'+7701000{i:04d}'
+        )
+        patient.organizations.add(organization)
+        PatientPhone.objects.create(patient=patient, phone=f'+7702000{i:04d}')
+
+
+def count_queries(client, url):
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(ctx.captured_queries), response
+
+
+@pytest.mark.django_db
+class TestPatientQuerysetShapes:
+    """Test action-aware patient querysets"""
+
+    def test_list_has_no_prefetches(self, authenticated_client, organization):
+        create_patients(organization, 3)
+        few, _ = count_queries(authenticated_client, '/api/v1/patients/patients/')
+
+        create_patients(organization, 10)
+        many, response = count_queries(authenticated_client, '/api/v1/patients/patients/')
+
+        # COUNT(*) and the page, whatever the page size
+        assert few == many == 2
+        assert {'full_name', 'age', 'phone'} <= set(response.data['results'][0])
+
+    def test_list_loads_only_list_columns(self, authenticated_client, organization):
+        create_patients(organization, 1)
+        with CaptureQueriesContext(connection) as ctx:
+            authenticated_client.get('/api/v1/patients/patients/')
+
+        page_sql = ctx.captured_queries[-1]['sql']
+        assert '"search_text"' not in page_sql
+        assert '"iin_enc"' not in page_sql
+
+    def test_retrieve_uses_full_prefetch(self, authenticated_client, patient):
+        PatientPhone.objects.create(patient=patient, phone='+77770001122')
+        queries, response = count_queries(authenticated_client, f'/api/v1/patients/patients/{patient.id}/')
+
+        # The patient, the access check and one query per prefetched relation
+        assert queries == 11
+        assert len(response.data['additional_phones']) == 1
+
+    def test_quick_search_uses_list_shape(self, authenticated_client, organization):
+        create_patients(organization, 5)
+        with CaptureQueriesContext(connection) as ctx:
+            response = authenticated_client.get('/api/v1/patients/patients/quick-search/', {'q': 'shape'})
+
+        assert response.status_code == 200
+        assert len(response.data['results']) == 5
+        assert not any('patient_phones' in query['sql'] for query in ctx.captured_queries)
+
+
+def test_unregistered_action_falls_back_to_default():
+    assert querysets.get_shape(Patient, 'export') == querysets.get_shape(Patient, None)
+    assert querysets.get_shape(Patient, 'list').only
+    assert not querysets.get_shape(Patient, 'list').prefetch
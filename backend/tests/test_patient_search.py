@@ -0,0 +1,153 @@
+import pytest
+import random
+import time as timer
+from datetime import date
+from django.db import connection
+from django.db.models import Q
+from apps.org.models import Organization
+from apps.patients import search
+from apps.patients.models import Patient
+
+
+URL = '/api/v1/patients/patients/quick-search/'
+
+
+def make_patient(organization, last_name, first_name, phone='+77010000000', **kwargs):
+    patient = Patient.objects.create(
+        last_name=last_name, first_name=first_name, phone=phone,
+        birth_date=date(1990, 1, 1), sex='M', **kwargs
+    )
+    patient.organizations.add(organization)
+    return patient
+
+
+def p95(samples):
+    return sorted(samples)[int(len(samples) * 0.95) - 1]
+
+
+@pytest.mark.django_db
+class TestPatientSearch:
+    """Test trigram patient search"""
+
+    def test_search_text_maintained_on_save(self, organization):
+        patient = make_patient(organization, 'Әбілқасымов', 'Жанна', phone='8 (701) 123-45-67', middle_name='Ёрлановна')
+        assert patient.search_text == 'abilkasymov zhanna erlanovna 77011234567'
+
+        patient.last_name = 'Иванова'
+        patient.save(update_fields=['last_name'])
+        patient.refresh_from_db()
+        assert patient.search_text.startswith('ivanova zhanna')
+
+    def test_cyrillic_latin_and_typos(self, authenticated_client, organization):
+        ivanov = make_patient(organization, 'Иванов', 'Сергей')
+        make_patient(organization, 'Петров', 'Сергей')
+
+        for query in ['иванов', 'Ivanov', 'Ivonov', 'иван', 'Сергей Иванов']:
+            response = authenticated_client.get(URL, {'q': query})
+            assert response.status_code == 200
+            assert response.data['results'][0]['id'] == ivanov.id, query
+
+        response = authenticated_client.get(URL, {'q': 'Sergei'})
+        assert len(response.data['results']) == 2
+
+    def test_phone_and_iin(self, authenticated_client, organization, patient):
+        other = make_patient(organization, 'Other', 'Patient', phone='+77775554433', iin='900101300123')
+
+        response = authenticated_client.get(URL, {'q': '765 43'})
+        assert [item['id'] for item in response.data['results']] == [patient.id]
+
+        response = authenticated_client.get(URL, {'q': '87775554433'})
+        assert [item['id'] for item in response.data['results']] == [other.id]
+
+        response = authenticated_client.get(URL, {'q': '900101300123'})
+        assert [item['id'] for item in response.data['results']] == [other.id]
+
+    def test_list_search_ignores_partial_iin(self, authenticated_client, organization):
+        make_patient(organization, 'Other', 'Patient', iin='900101300123')
+
+        response = authenticated_client.get('/api/v1/patients/patients/', {'search': '0101300'})
+        assert response.data['results'] == []
+
+        response = authenticated_client.get('/api/v1/patients/patients/', {'search': 'other'})
+        assert len(response.data['results']) == 1
+
+    def test_scoped_to_organization(self, authenticated_client, organization):
+        stranger = Organization.objects.create(name='Other Clinic', sms_sender='Other')
+        make_patient(stranger, 'Иванов', 'Сергей')
+
+        response = authenticated_client.get(URL, {'q': 'иванов'})
+        assert response.data['results'] == []
+
+    def test_query_required(self, authenticated_client):
+        assert authenticated_client.get(URL).status_code == 400
+
+    @pytest.mark.slow
+    def test_benchmark_1m_patients(self, organization):
+        """Benchmark: p95 of trigram search vs. the icontains filter on 1M patients"""
+        random.seed(13)
+        # ~1500 surnames built from syllables, 20 first names
+        last_names = [
+            f'{head}{tail}{ending}'
+            for head in ['Ах', 'Бек', 'Жу', 'Ива', 'Кар', 'Нур', 'Ос', 'Пет', 'Сей', 'Ту', 'Ер', 'Сма', 'Да', 'Ку', 'Ал']
+            for tail in ['мет', 'ба', 'лан', 'раз', 'сыл', 'тай', 'мур', 'кен', 'ган', 'зне']
+            for ending in ['ов', 'ова', 'ев', 'ин', 'улы', 'кызы', 'ский', 'енко', 'ян', 'бай']
+        ]
+        first_names = ['Алихан', 'Айгерим', 'Дамир', 'Жанна', 'Сергей', 'Ольга', 'Нурсултан', 'Мария',
+                       'Ерлан', 'Асель', 'Тимур', 'Дана', 'Арман', 'Светлана', 'Болат', 'Камила',
+                       'Ирина', 'Данияр', 'Мадина', 'Руслан']
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO patients (
+                    first_name, last_name, middle_name, birth_date, sex, phone, email, address,
+                    iin, iin_enc, iin_hash, iin_verified, documents, kato_address, osms_status,
+                    osms_category, consents, tags, is_marketing_opt_in, balance, discount_percent,
+                    notes, allergies, medical_history, is_active, created_at, updated_at, search_text
+                )
+                SELECT f.name, l.name, '', '1990-01-01', 'M', '+7' || p.phone, '', '',
+                       '', '', '', false, '{}', '{}', '', '', '{}', '[]', false, 0, 0,
+                       '', '', '', true, now(), now(),
+                       l.latin || ' ' || f.latin || ' 7' || p.phone
+                FROM generate_series(1, 1000000) AS i
+                CROSS JOIN LATERAL (
+                    SELECT (7000000000::bigint + (i::bigint * 7919) %% 1000000000)::text AS phone,
+                           1 + (i * 31) %% %s AS l_idx, 1 + (i * 17) %% %s AS f_idx
+                ) AS p
+                JOIN unnest(%s::text[], %s::text[]) WITH ORDINALITY AS l(name, latin, idx) ON l.idx = p.l_idx
+                JOIN unnest(%s::text[], %s::text[]) WITH ORDINALITY AS f(name, latin, idx) ON f.idx = p.f_idx
+                """,
+                [
+                    len(last_names), len(first_names),
+                    last_names, [' '.join(search.name_tokens(name)) for name in last_names],
+                    first_names, [' '.join(search.name_tokens(name)) for name in first_names],
+                ]
+            )
+            cursor.execute('ANALYZE patients')
+
+        queries = [
+            random.choice(last_names)[:random.randint(4, 8)] for _ in range(15)
+        ] + [
+            f'{random.choice(first_names)} {random.choice(last_names)}' for _ in range(15)
+        ] + [
+            str(random.randint(100000, 999999)) for _ in range(15)
+        ]
+        queryset = Patient.objects.all()
+
+        def legacy(query):
+            return list(queryset.filter(
+                Q(first_name__icontains=query) | Q(last_name__icontains=query) |
+                Q(phone__icontains=query) | Q(iin__icontains=query)
+            )[:20])
+
+        timings = {'legacy': [], 'trigram': []}
+        for query in queries:
+            started = timer.perf_counter()
+            legacy(query)
+            timings['legacy'].append(timer.perf_counter() - started)
+
+            started = timer.perf_counter()
+            search.ranked(queryset, query)
+            timings['trigram'].append(timer.perf_counter() - started)
+
+        print(f"\np95 legacy {p95(timings['legacy']):.3f}s, trigram {p95(timings['trigram']):.3f}s")
+        assert p95(timings['trigram']) < p95(timings['legacy'])
@@ -0,0 +1,149 @@
+import pytest
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.billing.models import Invoice, Payment
+from apps.calendar.models import Appointment
+from apps.patients.models import Patient, PatientStats
+from apps.visits.models import Visit
+
+
+def aware(day, hour):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+@pytest.fixture
+def book(branch, employee):
+    def book(patient, day, hour, status='done'):
+        return Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(day, hour), end_datetime=aware(day, hour) + timedelta(minutes=30),
+            status=status
+        )
+    return book
+
+
+def pay(appointment, amount, number):
+    visit = Visit.objects.create(appointment=appointment, status='completed')
+    return Invoice.objects.create(visit=visit, number=number, amount=amount, paid_amount=amount, status='paid')
+
+
+@pytest.mark.django_db
+class TestPatientStats:
+    """Test the patient statistics rollup"""
+
+    def test_maintained_by_signals(self, patient, book, django_capture_on_commit_callbacks):
+        past = date(2024, 3, 1)
+        future = timezone.localdate() + timedelta(days=10)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            first = book(patient, past, 10)
+            second = book(patient, past + timedelta(days=7), 10)
+            book(patient, future, 12, status='booked')
+        with django_capture_on_commit_callbacks(execute=True):
+            invoice = pay(first, Decimal('10000'), 'INV-1')
+            pay(second, Decimal('5000'), 'INV-2')
+
+        stats = PatientStats.objects.get(patient=patient)
+        assert stats.total_visits == 2
+        assert stats.total_revenue == Decimal('15000')
+        assert stats.average_check == Decimal('7500')
+        assert stats.last_visit_at == aware(past + timedelta(days=7), 10)
+        assert stats.next_appointment_at == aware(future, 12)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Payment.objects.create(invoice=invoice, method='cash', amount=Decimal('2000'))
+            Invoice.objects.filter(id=invoice.id).update(paid_amount=Decimal('12000'))
+        with django_capture_on_commit_callbacks(execute=True):
+            second.status = 'canceled'
+            second.save()
+
+        stats.refresh_from_db()
+        assert stats.total_visits == 1
+        assert stats.total_revenue == Decimal('17000')
+        assert stats.last_visit_at == aware(past, 10)
+
+    def test_appointment_moved_to_other_patient(self, organization, patient, book, django_capture_on_commit_callbacks):
+        other = Patient.objects.create(first_name='Other', last_name='Stats', birth_date=date(1990, 1, 1), sex='F')
+        with django_capture_on_commit_callbacks(execute=True):
+            appointment = book(patient, date(2024, 3, 1), 10)
+            pay(appointment, Decimal('4000'), 'INV-1')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            appointment.patient = other
+            appointment.save()
+
+        stats = PatientStats.objects.get(patient=patient)
+        assert stats.total_visits == 0
+        assert stats.total_revenue == Decimal('0')
+        other_stats = PatientStats.objects.get(patient=other)
+        assert other_stats.total_visits == 1
+        assert other_stats.total_revenue == Decimal('4000')
+
+    def test_statistics_endpoint_reads_one_row(self, authenticated_client, patient, book):
+        pay(book(patient, date(2024, 3, 1), 10), Decimal('8000'), 'INV-1')
+        call_command('rebuild_patient_stats', stdout=StringIO())
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = authenticated_client.get(f'/api/v1/patients/patients/{patient.id}/statistics/')
+
+        assert response.status_code == 200
+        assert response.data['total_visits'] == 1
+        assert response.data['total_revenue'] == 8000.0
+        assert response.data['last_visit_date'] == '2024-03-01'
+        assert response.data['next_appointment'] is None
+        # The patient joined with its stats row
+        assert len(ctx.captured_queries) == 1
+
+    def test_statistics_without_row(self, authenticated_client, patient):
+        response = authenticated_client.get(f'/api/v1/patients/patients/{patient.id}/statistics/')
+
+        assert response.status_code == 200
+        assert response.data['total_visits'] == 0
+        assert PatientStats.objects.filter(patient=patient).exists()
+
+    def test_rebuild_command(self, organization, book):
+        patients = [
+            Patient.objects.create(first_name=f'P{i}', last_name='Stats', birth_date=date(1990, 1, 1), sex='F')
+            for i in range(5)
+        ]
+        for i, patient in enumerate(patients):
+            pay(book(patient, date(2024, 3, 1), 8 + i), Decimal(1000 * (i + 1)), f'INV-{i}')
+
+        out = StringIO()
+        call_command('rebuild_patient_stats', batch_size=2, stdout=out)
+
+        assert 'Rebuilt stats of 5 patients' in out.getvalue()
+        assert list(
+            PatientStats.objects.filter(patient__in=patients).order_by('total_revenue').values_list('total_revenue', flat=True)
+        ) == [Decimal(1000 * (i + 1)) for i in range(5)]
+
+    def test_list_sort_and_filter_by_lifetime_value(self, authenticated_client, organization, book):
+        patients = []
+        for i, amount in enumerate([3000, 9000, 1000]):
+            patient = Patient.objects.create(first_name=f'P{i}', last_name='Ltv', birth_date=date(1990, 1, 1), sex='F')
+            patient.organizations.add(organization)
+            pay(book(patient, date(2024, 3, 1 + i), 10), Decimal(amount), f'INV-{i}')
+            patients.append(patient)
+        idle = Patient.objects.create(first_name='Idle', last_name='Ltv', birth_date=date(1990, 1, 1), sex='F')
+        idle.organizations.add(organization)
+        call_command('rebuild_patient_stats', stdout=StringIO())
+        PatientStats.objects.filter(patient=idle).delete()
+
+        response = authenticated_client.get('/api/v1/patients/patients/', {'ordering': '-lifetime_value'})
+        assert response.status_code == 200
+        assert [row['id'] for row in response.data['results']] == [patients[1].id, patients[0].id, patients[2].id, idle.id]
+        assert response.data['results'][0]['lifetime_value'] == '9000.00'
+        assert response.data['results'][3]['lifetime_value'] is None
+
+        response = authenticated_client.get('/api/v1/patients/patients/', {
+            'min_lifetime_value': '2000', 'last_visit_before': '2024-03-01', 'ordering': 'last_visit'
+        })
+        assert [row['id'] for row in response.data['results']] == [patients[0].id]
+
+        response = authenticated_client.get('/api/v1/patients/patients/', {'last_visit_after': 'yesterday'})
+        assert response.status_code == 400
@@ -0,0 +1,80 @@
+import pytest
+from datetime import date
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from apps.patients.models import Patient, PatientPhone
+from apps.patients.utils.phone import normalize_phone
+
+
+@pytest.mark.parametrize('phone, expected', [
+    ('+7 (701) 765-43-21', '+77017654321'),
+    ('8 701 765 43 21', '+77017654321'),
+    ('7017654321', '+77017654321'),
+    ('+49 30 1234567', '+49301234567'),
+    ('765-43-21', ''),
+    ('', ''),
+])
+def test_normalize_phone(phone, expected):
+    assert normalize_phone(phone) == expected
+
+
+@pytest.mark.django_db
+class TestPhoneNormalized:
+    """Test phone_normalized maintenance and exact duplicate lookups"""
+
+    def test_maintained_on_save(self, patient):
+        assert patient.phone_normalized == '+77017654321'
+
+        patient.phone = '8 (702) 000-11-22'
+        patient.save(update_fields=['phone'])
+        patient.refresh_from_db()
+        assert patient.phone_normalized == '+77020001122'
+
+        extra = PatientPhone.objects.create(patient=patient, phone='8 777 111 22 33')
+        assert extra.phone_normalized == '+77771112233'
+
+    def test_shared_phone_is_accepted(self, authenticated_client, organization, patient, caplog):
+        PatientPhone.objects.create(patient=patient, phone='+7 777 111 22 33')
+        data = {
+            'organizations': [organization.id],
+            'first_name': 'New',
+            'last_name': 'Patient',
+            'birth_date': '1995-05-15',
+            'sex': 'F',
+        }
+
+        # A family member sharing the main or an additional phone; duplicates
+        # are left to the merge engine and no phone number is logged
+        for phone in ['8 (701) 765-43-21', '87771112233']:
+            response = authenticated_client.post('/api/v1/patients/patients/', {**data, 'phone': phone}, format='json')
+            assert response.status_code == 201
+        assert '765-43-21' not in caplog.text and '87771112233' not in caplog.text
+
+    def test_search_uses_exact_match(self, authenticated_client, patient):
+        PatientPhone.objects.create(patient=patient, phone='+7 777 111 22 33')
+
+        for phone in ['8 701 765 43 21', '7771112233']:
+            with CaptureQueriesContext(connection) as ctx:
+                response = authenticated_client.post('/api/v1/patients/patients/search/', {'phone': phone})
+            assert response.data['found'] is True
+            assert [item['id'] for item in response.data['patients']] == [patient.id]
+            assert not any('~*' in q['sql'] for q in ctx.captured_queries)
+
+    def test_backfill_command(self, organization):
+        Patient.objects.bulk_create([
+            Patient(first_name=f'P{i}', last_name='Backfill', birth_date=date(1990, 1, 1), sex='F',
+                    phone=f'8 701 000 00 {i:02d}')
+            for i in range(7)
+        ] + [
+            Patient(first_name='Short', last_name='Backfill', birth_date=date(1990, 1, 1), sex='F', phone='123')
+        ])
+        assert Patient.objects.filter(phone_normalized='').count() == 8
+
+        out = StringIO()
+        call_command('backfill_phone_normalized', batch_size=3, stdout=out)
+
+        assert Patient.objects.get(first_name='P5').phone_normalized == '+77010000005'
+        assert list(Patient.objects.filter(phone_normalized='').values_list('first_name', flat=True)) == ['Short']
+        assert '7 updated, 1 not full numbers' in out.getvalue()
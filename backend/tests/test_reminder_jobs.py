@@ -0,0 +1,183 @@
+import time as timer
+import pytest
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.calendar.models import Appointment
+from apps.comms import reminder_jobs
+from apps.comms.models import Reminder, ReminderJob
+from apps.org.models import Branch, Organization
+from apps.patients.models import Patient
+from apps.staff.models import Employee
+from apps.visits.models import Visit
+
+
+TODAY = date(2024, 3, 10)
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+@pytest.fixture
+def make_patient(organization):
+    def make_patient(name, opt_in=True, birth_date=date(1990, 1, 1), org=None):
+        patient = Patient.objects.create(
+            first_name=name, last_name='Reminder', birth_date=birth_date, sex='F',
+            phone='+77010000000', is_marketing_opt_in=opt_in
+        )
+        patient.organizations.add(org or organization)
+        return patient
+    return make_patient
+
+
+@pytest.fixture
+def visit_on(branch, employee):
+    def visit_on(patient, day, hour, status='completed', visit_branch=None):
+        appointment = Appointment.objects.create(
+            branch=visit_branch or branch, employee=employee, patient=patient,
+            start_datetime=aware(day, hour), end_datetime=aware(day, hour, 30), status='done'
+        )
+        return Visit.objects.create(appointment=appointment, status=status)
+    return visit_on
+
+
+def reminder(organization, reminder_type, offset_days=0, offset_hours=0):
+    return Reminder.objects.create(
+        organization=organization, name=reminder_type, type=reminder_type,
+        offset_days=offset_days, offset_hours=offset_hours, body='Здравствуйте, _ИМЯ_ПАЦИЕНТА_'
+    )
+
+
+@pytest.mark.django_db
+class TestReminderJobs:
+    """Test the set-based reminder job generator"""
+
+    def test_after_visit(self, organization, make_patient, visit_on):
+        after_visit = reminder(organization, 'AFTER_VISIT', offset_days=1, offset_hours=2)
+        yesterday = TODAY - timedelta(days=1)
+        asel = make_patient('Асель')
+        first = visit_on(asel, yesterday, 10)
+        visit_on(asel, yesterday, 15)
+        visit_on(make_patient('Отменил'), yesterday, 11, status='canceled')
+        visit_on(make_patient('Без согласия', opt_in=False), yesterday, 12)
+        visit_on(make_patient('Позавчера'), yesterday - timedelta(days=1), 11)
+        other_organization = Organization.objects.create(name='Other Clinic')
+        other_branch = Branch.objects.create(organization=other_organization, name='Other')
+        visit_on(make_patient('Чужой', org=other_organization), yesterday, 13, visit_branch=other_branch)
+
+        counts = reminder_jobs.generate(now=aware(TODAY, 12))
+
+        assert counts == {'AFTER_VISIT': 1, 'BIRTHDAY': 0}
+        job = ReminderJob.objects.get()
+        assert (job.reminder, job.patient, job.visit) == (after_visit, asel, first)
+        assert job.event_date == yesterday
+        assert job.scheduled_at == aware(TODAY, 14)
+        assert job.status == 'queued'
+
+        # Nothing is generated twice
+        assert reminder_jobs.generate(now=aware(TODAY, 12)) == {'AFTER_VISIT': 0, 'BIRTHDAY': 0}
+        assert ReminderJob.objects.count() == 1
+
+    def test_birthday_and_quiet_hours(self, organization, make_patient):
+        reminder(organization, 'BIRTHDAY', offset_days=1)
+        tomorrow = make_patient('Завтра', birth_date=date(1985, 3, 11))
+        make_patient('Сегодня', birth_date=date(1985, 3, 10))
+        make_patient('Без согласия', opt_in=False, birth_date=date(1985, 3, 11))
+
+        reminder_jobs.generate(now=aware(TODAY, 23))
+
+        job = ReminderJob.objects.get()
+        assert job.patient == tomorrow
+        assert job.event_date == date(2024, 3, 11)
+        assert job.visit is None
+        # 23:00 is in quiet hours, moved to 09:00 next morning
+        assert job.scheduled_at == aware(TODAY + timedelta(days=1), 9)
+
+    def test_leap_day_birthday(self, organization, make_patient):
+        reminder(organization, 'BIRTHDAY')
+        leap = make_patient('Високосный', birth_date=date(2000, 2, 29))
+
+        assert reminder_jobs.generate(now=aware(date(2023, 2, 28), 12))['BIRTHDAY'] == 1
+        assert ReminderJob.objects.get().patient == leap
+        assert reminder_jobs.generate(now=aware(date(2024, 2, 28), 12))['BIRTHDAY'] == 0
+
+    def test_quiet_hours(self):
+        assert reminder_jobs.after_quiet_hours(aware(TODAY, 12)) == aware(TODAY, 12)
+        assert reminder_jobs.after_quiet_hours(aware(TODAY, 6, 30)) == aware(TODAY, 8)
+        assert reminder_jobs.after_quiet_hours(aware(TODAY, 22), hour=9) == aware(TODAY + timedelta(days=1), 9)
+
+    def test_dry_run_and_command(self, organization, make_patient, visit_on):
+        reminder(organization, 'AFTER_VISIT')
+        visit_on(make_patient('Асель'), TODAY, 10)
+
+        assert reminder_jobs.generate(now=aware(TODAY, 20), dry_run=True) == {'AFTER_VISIT': 1, 'BIRTHDAY': 0}
+        assert not ReminderJob.objects.exists()
+
+        out = StringIO()
+        call_command('generate_reminder_jobs', dry_run=True, stdout=out)
+        assert 'Would create' in out.getvalue()
+        assert not ReminderJob.objects.exists()
+
+    def test_unique_event(self, organization, patient):
+        birthday = reminder(organization, 'BIRTHDAY')
+        job = {'reminder': birthday, 'patient': patient, 'event_date': TODAY, 'scheduled_at': aware(TODAY, 9)}
+
+        ReminderJob.objects.bulk_create([ReminderJob(**job), ReminderJob(**job)], ignore_conflicts=True)
+
+        assert ReminderJob.objects.count() == 1
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+def test_reminder_jobs_benchmark(organization, branch):
+    """AFTER_VISIT jobs for 100k visits of one day"""
+    visits = 100000
+    per_doctor = 100
+    yesterday = TODAY - timedelta(days=1)
+    doctors = Employee.objects.bulk_create([
+        Employee(organization=organization, first_name=f'D{i}', last_name='Doctor', phone='+77010000000')
+        for i in range(visits // per_doctor)
+    ])
+    patients = Patient.objects.bulk_create([
+        Patient(first_name=f'P{n}', last_name='Bench', birth_date=date(1990, 1, 1), sex='M',
+                phone='+77010000000', is_marketing_opt_in=n % 10 != 0)
+        for n in range(visits)
+    ], batch_size=5000)
+    Patient.organizations.through.objects.bulk_create([
+        Patient.organizations.through(patient_id=p.id, organization_id=organization.id) for p in patients
+    ], batch_size=5000)
+    # 10 minute appointments from 06:00, per_doctor a day for each doctor
+    appointments = Appointment.objects.bulk_create([
+        Appointment(
+            branch=branch, employee=doctors[n // per_doctor], patient=p,
+            start_datetime=aware(yesterday, 6) + timedelta(minutes=10 * (n % per_doctor)),
+            end_datetime=aware(yesterday, 6) + timedelta(minutes=10 * (n % per_doctor) + 10),
+            status='done'
+        )
+        for n, p in enumerate(patients)
+    ], batch_size=5000)
+    Visit.objects.bulk_create([Visit(appointment=a, status='completed') for a in appointments], batch_size=5000)
+    reminder(organization, 'AFTER_VISIT', offset_days=1)
+    reminder(organization, 'BIRTHDAY')
+
+    started = timer.monotonic()
+    assert reminder_jobs.generate(now=aware(TODAY, 12), dry_run=True)['AFTER_VISIT'] == visits * 9 // 10
+    print(f'\nDry run: {timer.monotonic() - started:.1f}s')
+
+    started = timer.monotonic()
+    with CaptureQueriesContext(connection) as queries:
+        counts = reminder_jobs.generate(now=aware(TODAY, 12))
+    elapsed = timer.monotonic() - started
+
+    print(f'{visits} visits: {elapsed:.1f}s, {len(queries)} queries, {counts}')
+    assert counts['AFTER_VISIT'] == ReminderJob.objects.count() == visits * 9 // 10
+    # A query per reminder, not per visit
+    assert len(queries) < 10
+
+    started = timer.monotonic()
+    assert reminder_jobs.generate(now=aware(TODAY, 12)) == {'AFTER_VISIT': 0, 'BIRTHDAY': 0}
+    print(f'Second run: {timer.monotonic() - started:.1f}s')
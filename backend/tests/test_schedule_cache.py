@@ -0,0 +1,174 @@
+import time as timer
+import pytest
+from datetime import date, datetime, time, timedelta
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.calendar.models import Appointment
+from apps.calendar.services import schedule_cache
+
+
+MONDAY = date(2030, 1, 7)
+URL = '/api/v1/calendar/appointments/schedule/'
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def appointment(branch, employee, patient):
+    return Appointment.objects.create(
+        branch=branch, employee=employee, patient=patient,
+        start_datetime=aware(MONDAY, 10), end_datetime=aware(MONDAY, 11),
+        status='booked'
+    )
+
+
+@pytest.mark.django_db
+class TestScheduleCache:
+    """Test cached per-day calendar snapshots"""
+
+    def test_miss_then_hit(self, authenticated_client, branch, appointment):
+        params = {'branch': branch.id, 'date_from': MONDAY.isoformat(), 'date_to': (MONDAY + timedelta(days=6)).isoformat()}
+
+        first = authenticated_client.get(URL, params)
+        with CaptureQueriesContext(connection) as ctx:
+            second = authenticated_client.get(URL, params)
+
+        assert first.status_code == second.status_code == 200
+        assert first.data == second.data
+        assert [a['id'] for a in first.data['days'][MONDAY.isoformat()]] == [appointment.id]
+        assert len(ctx.captured_queries) == 0
+        assert schedule_cache.stats() == {'hits': 7, 'misses': 7}
+
+    def test_not_modified(self, authenticated_client, branch, appointment):
+        params = {'branch': branch.id, 'date_from': MONDAY.isoformat()}
+        etag = authenticated_client.get(URL, params)['ETag']
+
+        response = authenticated_client.get(URL, params, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+
+    def test_create_invalidates_day(self, authenticated_client, branch, employee, patient, appointment):
+        params = {'branch': branch.id, 'date_from': MONDAY.isoformat()}
+        etag = authenticated_client.get(URL, params)['ETag']
+
+        response = authenticated_client.post('/api/v1/calendar/appointments/', {
+            'branch': branch.id, 'employee': employee.id, 'patient': patient.id,
+            'start_datetime': aware(MONDAY, 12).isoformat(),
+            'end_datetime': aware(MONDAY, 13).isoformat(),
+        })
+        assert response.status_code == 201
+
+        refreshed = authenticated_client.get(URL, params, HTTP_IF_NONE_MATCH=etag)
+        assert refreshed.status_code == 200
+        assert len(refreshed.data['days'][MONDAY.isoformat()]) == 2
+
+    def test_move_invalidates_both_days(self, authenticated_client, branch, appointment):
+        tuesday = MONDAY + timedelta(days=1)
+        params = {'branch': branch.id, 'date_from': MONDAY.isoformat(), 'date_to': tuesday.isoformat()}
+        authenticated_client.get(URL, params)
+
+        authenticated_client.post(
+            f'/api/v1/calendar/appointments/{appointment.id}/move/',
+            {'start_datetime': aware(tuesday, 10).isoformat()}
+        )
+        response = authenticated_client.get(URL, params)
+
+        assert response.data['days'][MONDAY.isoformat()] == []
+        assert [a['id'] for a in response.data['days'][tuesday.isoformat()]] == [appointment.id]
+
+    def test_visit_change_invalidates_day(self, authenticated_client, branch, appointment):
+        from apps.visits.models import Visit
+
+        params = {'branch': branch.id, 'date_from': MONDAY.isoformat()}
+        authenticated_client.get(URL, params)
+        Visit.objects.create(appointment=appointment, status='in_progress')
+
+        response = authenticated_client.get(URL, params)
+
+        assert response.data['days'][MONDAY.isoformat()][0]['visit_status'] == 'in_progress'
+
+    def test_patient_edit_invalidates_days(self, authenticated_client, branch, patient, appointment):
+        params = {'branch': branch.id, 'date_from': MONDAY.isoformat()}
+        etag = authenticated_client.get(URL, params)['ETag']
+
+        patient.notes = 'Не влияет на расписание'
+        patient.save()
+        assert authenticated_client.get(URL, params, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        patient.phone = '+77015556677'
+        patient.save(update_fields=['phone'])
+        response = authenticated_client.get(URL, params)
+
+        assert response.data['days'][MONDAY.isoformat()][0]['patient_phone'] == '+77015556677'
+
+    def test_snapshot_built_before_invalidation_is_not_served(self, branch, appointment, monkeypatch):
+        build = schedule_cache._build
+
+        def build_then_move(branch_id, days):
+            snapshots = build(branch_id, days)
+            # Changed and invalidated while the snapshot was being built
+            Appointment.objects.filter(id=appointment.id).update(end_datetime=aware(MONDAY, 12))
+            schedule_cache.invalidate_appointment(appointment)
+            return snapshots
+
+        monkeypatch.setattr(schedule_cache, '_build', build_then_move)
+        stale = schedule_cache.get_snapshots(branch.id, [MONDAY])
+        monkeypatch.setattr(schedule_cache, '_build', build)
+
+        fresh = schedule_cache.get_snapshots(branch.id, [MONDAY])
+        assert fresh[MONDAY]['etag'] != stale[MONDAY]['etag']
+        assert fresh[MONDAY]['appointments'][0]['end_datetime'].startswith('2030-01-07T12:00')
+
+    @pytest.mark.slow
+    def test_benchmark_week_view_30_chairs(self, authenticated_client, organization, branch, patient):
+        """Benchmark: 30-chair branch, 7 days, 16 appointments per chair per day"""
+        from apps.staff.models import Employee
+
+        employees = [
+            Employee(organization=organization, first_name=f'Chair{i}', last_name='Doctor', phone='+77010000000')
+            for i in range(30)
+        ]
+        Employee.objects.bulk_create(employees)
+        Appointment.objects.bulk_create([
+            Appointment(
+                branch=branch, employee=employee, patient=patient,
+                start_datetime=aware(MONDAY + timedelta(days=day), 8) + timedelta(minutes=30 * slot),
+                end_datetime=aware(MONDAY + timedelta(days=day), 8) + timedelta(minutes=30 * (slot + 1)),
+                status='booked'
+            )
+            for employee in employees for day in range(7) for slot in range(16)
+        ])
+        week = {'branch': branch.id, 'date_from': MONDAY.isoformat(), 'date_to': (MONDAY + timedelta(days=6)).isoformat()}
+
+        def measure(url, params, **headers):
+            with CaptureQueriesContext(connection) as ctx:
+                started = timer.perf_counter()
+                response = authenticated_client.get(url, params, **headers)
+                elapsed = timer.perf_counter() - started
+            return response, elapsed, len(ctx.captured_queries)
+
+        cold, cold_time, cold_queries = measure(URL, week)
+        warm, warm_time, warm_queries = measure(URL, week)
+        not_modified, etag_time, etag_queries = measure(URL, week, HTTP_IF_NONE_MATCH=cold['ETag'])
+
+        print(
+            f'\ncold: {cold_time * 1000:.1f} ms / {cold_queries} queries; '
+            f'warm: {warm_time * 1000:.1f} ms / {warm_queries}; '
+            f'304: {etag_time * 1000:.1f} ms / {etag_queries}'
+        )
+        assert sum(len(day) for day in cold.data['days'].values()) == 30 * 7 * 16
+        assert cold_queries == 1
+        assert warm_queries == etag_queries == 0
+        assert not_modified.status_code == 304
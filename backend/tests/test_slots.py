@@ -0,0 +1,258 @@
+import pytest
+from datetime import date, datetime, time, timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.calendar.models import Appointment, Availability, Break
+from apps.calendar.services.slots import SlotEngine
+
+
+# Monday
+TARGET_DATE = date(2030, 1, 7)
+
+
+def aware(hour, minute=0, day=TARGET_DATE):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+def legacy_slots(employee, target_date):
+    """Reference implementation: one EXISTS query per candidate slot"""
+    step = timedelta(minutes=employee.online_slot_step_minutes or 30)
+    slots = []
+    availabilities = Availability.objects.filter(
+        employee=employee, weekday=target_date.weekday(), is_active=True
+    )
+    for availability in availabilities:
+        current = datetime.combine(target_date, availability.time_from)
+        end_time = datetime.combine(target_date, availability.time_to)
+        while current < end_time:
+            slot_end = current + step
+            conflicts = Appointment.objects.filter(
+                employee=employee,
+                start_datetime__lt=timezone.make_aware(slot_end),
+                end_datetime__gt=timezone.make_aware(current)
+            ).exclude(status__in=['canceled', 'no_show']).exists()
+            if not conflicts:
+                slots.append((current, slot_end))
+            current = slot_end
+    return slots
+
+
+@pytest.fixture
+def working_day(branch, employee, patient):
+    """Employee working 09:00-13:00 and 14:00-20:00 with a few appointments"""
+    Availability.objects.create(employee=employee, weekday=0, time_from=time(9), time_to=time(13))
+    Availability.objects.create(employee=employee, weekday=0, time_from=time(14), time_to=time(20))
+    for start, end, status in [
+        ((9, 0), (9, 40), 'booked'),
+        ((10, 15), (11, 0), 'confirmed'),
+        ((11, 0), (11, 30), 'canceled'),
+        ((15, 5), (16, 0), 'done'),
+        ((17, 0), (17, 20), 'no_show'),
+        ((19, 50), (20, 30), 'booked'),
+    ]:
+        Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(*start), end_datetime=aware(*end), status=status
+        )
+    return employee
+
+
+@pytest.mark.django_db
+class TestSlotEngine:
+    """Test bulk slot computation"""
+
+    @pytest.mark.parametrize('step', [5, 10, 15, 20, 30, 60])
+    def test_matches_legacy_slots(self, working_day, step):
+        """Engine returns the same slots as the per-slot query loop"""
+        working_day.online_slot_step_minutes = step
+        working_day.save()
+
+        engine = SlotEngine([working_day], TARGET_DATE)
+
+        assert engine.free_slots(working_day.id, TARGET_DATE) == legacy_slots(working_day, TARGET_DATE)
+
+    def test_breaks_are_excluded(self, working_day):
+        """Slots overlapping a break are not offered"""
+        Break.objects.create(
+            employee=working_day, date=TARGET_DATE,
+            start_time=time(12, 0), end_time=time(12, 30), break_type='lunch'
+        )
+
+        slots = SlotEngine([working_day], TARGET_DATE).free_slots(working_day.id, TARGET_DATE)
+        starts = [slot_start.time() for slot_start, _ in slots]
+
+        assert time(12, 0) not in starts
+        assert time(12, 30) in starts
+
+    def test_recurring_breaks_are_expanded(self, working_day):
+        """A recurring lunch started weeks ago blocks the target date"""
+        Break.objects.create(
+            employee=working_day, date=TARGET_DATE - timedelta(days=60),
+            start_time=time(12, 0), end_time=time(12, 30), break_type='lunch',
+            is_recurring=True, recurrence_weekdays=[0, 2]
+        )
+
+        slots = SlotEngine([working_day], TARGET_DATE).free_slots(working_day.id, TARGET_DATE)
+        starts = [slot_start.time() for slot_start, _ in slots]
+
+        assert time(12, 0) not in starts
+
+    def test_min_gap_between_visits(self, working_day):
+        """Gap around appointments blocks neighbouring slots"""
+        working_day.online_slot_step_minutes = 15
+        working_day.min_gap_between_visits_minutes = 15
+        working_day.save()
+
+        slots = SlotEngine([working_day], TARGET_DATE).free_slots(working_day.id, TARGET_DATE)
+        starts = [slot_start.time() for slot_start, _ in slots]
+
+        # 09:00-09:40 and 10:15-11:00 with 15 min gap leave no room in between
+        assert time(9, 45) not in starts
+        assert time(10, 0) not in starts
+        assert time(11, 0) not in starts
+        assert time(11, 15) in starts
+
+    def test_service_duration_ends_within_hours(self, employee):
+        """A 60 min service is not offered at 19:30 when work ends at 20:00"""
+        Availability.objects.create(employee=employee, weekday=0, time_from=time(18), time_to=time(20))
+
+        slots = SlotEngine([employee], TARGET_DATE, duration_minutes=60).free_slots(employee.id, TARGET_DATE)
+
+        assert [(start.time(), end.time()) for start, end in slots] == [
+            (time(18, 0), time(19, 0)),
+            (time(18, 30), time(19, 30)),
+            (time(19, 0), time(20, 0)),
+        ]
+
+    def test_step_slots_keep_trailing_slot(self, employee):
+        """Without a duration a step not dividing the window matches the legacy output"""
+        employee.online_slot_step_minutes = 45
+        employee.save()
+        Availability.objects.create(employee=employee, weekday=0, time_from=time(18), time_to=time(20))
+
+        slots = SlotEngine([employee], TARGET_DATE).free_slots(employee.id, TARGET_DATE)
+
+        assert slots == legacy_slots(employee, TARGET_DATE)
+        assert [(start.time(), end.time()) for start, end in slots] == [
+            (time(18, 0), time(18, 45)),
+            (time(18, 45), time(19, 30)),
+            (time(19, 30), time(20, 15)),
+        ]
+
+    def test_query_count_independent_of_step(self, working_day):
+        """Benchmark: the number of queries does not grow with slot count"""
+        counts = {}
+        for step in [5, 60]:
+            working_day.online_slot_step_minutes = step
+            working_day.save()
+            with CaptureQueriesContext(connection) as ctx:
+                SlotEngine([working_day], TARGET_DATE).free_slots(working_day.id, TARGET_DATE)
+            counts[step] = len(ctx.captured_queries)
+
+        assert counts[5] == counts[60] == 3
+
+    def test_endpoint(self, authenticated_client, working_day):
+        """Online booking endpoint serializes engine slots"""
+        response = authenticated_client.get(
+            '/api/v1/calendar/appointments/online_booking_slots/',
+            {'employee': working_day.id, 'date': TARGET_DATE.isoformat()}
+        )
+
+        assert response.status_code == 200
+        expected = [
+            {'start': start.isoformat(), 'end': end.isoformat(), 'available': True}
+            for start, end in legacy_slots(working_day, TARGET_DATE)
+        ]
+        assert response.data['slots'] == expected
+
+
+@pytest.mark.django_db
+class TestAvailableSlots:
+    """Test multi-employee, multi-day slot search"""
+
+    URL = '/api/v1/calendar/appointments/available_slots/'
+
+    def make_doctors(self, organization, branch, count):
+        from apps.staff.models import Employee, EmployeeBranch
+
+        doctors = []
+        for i in range(count):
+            doctor = Employee.objects.create(
+                organization=organization,
+                first_name=f'Doctor{i}',
+                last_name='Test',
+                phone=f'+7701000000{i}',
+                online_slot_step_minutes=30
+            )
+            EmployeeBranch.objects.create(employee=doctor, branch=branch)
+            for weekday in range(5):
+                Availability.objects.create(
+                    employee=doctor, weekday=weekday,
+                    time_from=time(9 + i), time_to=time(18)
+                )
+            doctors.append(doctor)
+        return doctors
+
+    def test_returns_earliest_slots_across_doctors(self, authenticated_client, organization, branch, patient):
+        """Slots are merged across doctors in chronological order"""
+        first, second = self.make_doctors(organization, branch, 2)
+        # First doctor is busy all Monday morning
+        Appointment.objects.create(
+            branch=branch, employee=first, patient=patient,
+            start_datetime=aware(9), end_datetime=aware(12), status='booked'
+        )
+
+        response = authenticated_client.get(self.URL, {
+            'branch': branch.id, 'date_from': TARGET_DATE.isoformat(), 'limit': 3
+        })
+
+        assert response.status_code == 200
+        assert [(slot['employee'], slot['start']) for slot in response.data['results']] == [
+            (second.id, '2030-01-07T10:00:00'),
+            (second.id, '2030-01-07T10:30:00'),
+            (second.id, '2030-01-07T11:00:00'),
+        ]
+        assert response.data['next_offset'] == 3
+
+    def test_pagination(self, authenticated_client, organization, branch):
+        """offset continues where the previous page stopped"""
+        self.make_doctors(organization, branch, 2)
+        params = {'branch': branch.id, 'date_from': TARGET_DATE.isoformat(), 'limit': 4}
+
+        first_page = authenticated_client.get(self.URL, params).data
+        second_page = authenticated_client.get(self.URL, {**params, 'offset': 2}).data
+
+        assert first_page['results'][2:] == second_page['results'][:2]
+
+    def test_requires_branch(self, authenticated_client):
+        response = authenticated_client.get(self.URL)
+
+        assert response.status_code == 400
+
+    def test_rejects_limit_below_one(self, authenticated_client, branch):
+        for limit in [0, -1]:
+            response = authenticated_client.get(self.URL, {'branch': branch.id, 'limit': limit})
+
+            assert response.status_code == 400
+
+    def test_query_count_independent_of_doctors_and_days(
+        self, authenticated_client, organization, branch, django_assert_max_num_queries
+    ):
+        """Regression: query count is bounded regardless of fan-out"""
+        self.make_doctors(organization, branch, 5)
+
+        def run(date_to):
+            with CaptureQueriesContext(connection) as ctx:
+                response = authenticated_client.get(self.URL, {
+                    'branch': branch.id,
+                    'date_from': TARGET_DATE.isoformat(),
+                    'date_to': date_to.isoformat(),
+                    'limit': 100
+                })
+            assert response.status_code == 200
+            return len(ctx.captured_queries)
+
+        assert run(TARGET_DATE) == run(TARGET_DATE + timedelta(days=13))
+        with django_assert_max_num_queries(4):
+            authenticated_client.get(self.URL, {'branch': branch.id, 'date_from': TARGET_DATE.isoformat()})
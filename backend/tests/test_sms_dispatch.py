@@ -0,0 +1,222 @@
+import threading
+import time as timer
+import pytest
+from datetime import date, timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from apps.comms import dispatch
+from apps.comms.models import (
+    Campaign, CampaignMessageTemplate, CampaignRecipient, ContactLog, Message, Reminder, ReminderJob
+)
+from apps.comms.tasks import send_campaign_batch
+from apps.patients.models import Patient
+
+
+@pytest.fixture(autouse=True)
+def mock_provider(settings):
+    settings.SMS_PROVIDER = 'mock'
+    settings.SMS_MOCK_FAILURE_RATE = 0
+    settings.SMS_MOCK_LATENCY = 0
+    settings.SMS_RATE_LIMIT_PER_MIN = 100000
+    cache.clear()
+
+
+def make_patients(organization, count, opt_in=True):
+    patients = Patient.objects.bulk_create([
+        Patient(first_name=f'Пациент{n}', last_name='Рассылка', birth_date=date(1990, 1, 1), sex='F',
+                phone=f'+7701{n:07d}', is_marketing_opt_in=opt_in)
+        for n in range(count)
+    ])
+    Patient.organizations.through.objects.bulk_create([
+        Patient.organizations.through(patient_id=p.id, organization_id=organization.id) for p in patients
+    ])
+    return patients
+
+
+def queue_jobs(organization, patients, body='_ИМЯ_ПАЦИЕНТА_, ждём вас на осмотр', **fields):
+    reminder = Reminder.objects.create(organization=organization, name='Осмотр', type='AFTER_VISIT', body=body)
+    scheduled_at = timezone.now() - timedelta(minutes=1)
+    ReminderJob.objects.bulk_create([
+        ReminderJob(reminder=reminder, patient=p, scheduled_at=scheduled_at, **fields) for p in patients
+    ])
+    return reminder
+
+
+@pytest.mark.django_db
+class TestReminderDispatch:
+    """Test claiming and sending queued reminder jobs"""
+
+    def test_send_batch(self, organization):
+        asel, opted_out = make_patients(organization, 2)
+        opted_out.is_marketing_opt_in = False
+        opted_out.save()
+        reminder = queue_jobs(organization, [asel, opted_out])
+        # The same message twice in a batch is sent once
+        ReminderJob.objects.create(reminder=reminder, patient=asel, scheduled_at=timezone.now())
+        ReminderJob.objects.create(reminder=reminder, patient=asel, scheduled_at=timezone.now() + timedelta(hours=1))
+
+        counts = dispatch.dispatch_reminders()
+
+        assert counts == {'claimed': 3, 'sent': 1, 'failed': 0, 'skipped': 2, 'deferred': 0}
+        assert ReminderJob.objects.filter(status='queued').count() == 1
+        sent = ReminderJob.objects.get(status='sent')
+        assert sent.attempts == 1
+        assert sent.provider_msg_id.startswith('mock_')
+        message = Message.objects.get()
+        assert message.body == f'{asel.first_name}, ждём вас на осмотр'
+        assert message.sender == organization.name[:20]
+        assert message.context['job_id'] == str(sent.id)
+        assert ContactLog.objects.get().message == message
+        assert set(ReminderJob.objects.filter(status='skipped').values_list('error', flat=True)) == {
+            'Patient opted out', dispatch.ANTISPAM_ERROR
+        }
+        reminder.refresh_from_db()
+        assert reminder.sent_count == 1
+
+        # Sent in the last 24 hours
+        ReminderJob.objects.filter(status='queued').update(scheduled_at=timezone.now())
+        assert dispatch.dispatch_reminders()['skipped'] == 1
+
+    def test_stale_claims(self, organization):
+        fresh, stale = make_patients(organization, 2)
+        queue_jobs(organization, [fresh], status='sending')
+        queue_jobs(organization, [stale], status='sending')
+        ReminderJob.objects.filter(patient=stale).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        assert dispatch.dispatch_reminders()['sent'] == 1
+
+        assert ReminderJob.objects.get(patient=stale).status == 'sent'
+        assert ReminderJob.objects.get(patient=fresh).status == 'sending'
+
+    def test_deferred_past_deadline(self, organization, settings):
+        settings.SMS_RATE_LIMIT_PER_MIN = 1
+        queue_jobs(organization, make_patients(organization, 3))
+
+        counts = dispatch.dispatch_reminders(seconds=0.1)
+
+        # One token a minute: the rest go back to the queue unsent
+        assert counts['sent'] == 1
+        assert counts['deferred'] == 2
+        assert ReminderJob.objects.filter(status='queued', attempts=0).count() == 2
+
+    def test_metrics(self, organization, admin_user, authenticated_client, settings):
+        settings.SMS_MOCK_FAILURE_RATE = 1
+        queue_jobs(organization, make_patients(organization, 3))
+
+        counts = dispatch.dispatch_reminders()
+
+        assert counts['failed'] == 3
+        assert ReminderJob.objects.filter(status='failed').count() == 3
+        response = authenticated_client.get('/api/v1/comms/marketing/providers/metrics/?minutes=2')
+        assert response.status_code == 200
+        assert response.data['provider'] == 'MockSMSProvider'
+        assert (response.data['sent'], response.data['failed']) == (0, 3)
+        assert len(response.data['minutes']) == 2
+        response = authenticated_client.get('/api/v1/comms/marketing/providers/metrics/?minutes=x')
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db(transaction=True)
+def test_workers_never_send_twice(organization):
+    """Workers claiming side by side with SKIP LOCKED"""
+    queue_jobs(organization, make_patients(organization, 60))
+    errors = []
+
+    def worker():
+        try:
+            dispatch.drain_reminders(limit=5, concurrency=4)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert ReminderJob.objects.filter(status='sent').count() == 60
+    job_ids = [message.context['job_id'] for message in Message.objects.all()]
+    assert len(job_ids) == len(set(job_ids)) == 60
+
+
+def test_rate_limiter():
+    cache.clear()
+    limiter = dispatch.RateLimiter('test', 120)
+    assert (limiter.capacity, limiter.tick) == (2, 1)
+
+    assert limiter.reserve(now=100.25) == 0
+    assert limiter.reserve(now=100.25) == 0
+    assert limiter.reserve(now=100.25, max_wait=0.5) is None
+    assert limiter.reserve(now=100.25) == 0.75
+    # Another worker sharing the account starts from the next free tick
+    assert dispatch.RateLimiter('test', 120).reserve(now=100.25) == 0.75
+    assert dispatch.RateLimiter('test', 120).reserve(now=100.25) == 1.75
+
+    limiter = dispatch.RateLimiter('slow', 90)
+    assert limiter.capacity == 2
+    assert limiter.tick == pytest.approx(60 / 45)
+
+
+@pytest.mark.django_db
+class TestCampaignDispatch:
+    """Test sending a campaign from send_campaign_batch"""
+
+    def test_campaign(self, organization):
+        patients = make_patients(organization, 4)
+        patients[0].is_marketing_opt_in = False
+        patients[0].save()
+        campaign = Campaign.objects.create(
+            organization=organization, title='Акция', sender_name='Clinic', status='running'
+        )
+        CampaignMessageTemplate.objects.create(campaign=campaign, body='_ИМЯ_ПАЦИЕНТА_, скидка 10%')
+        CampaignRecipient.objects.bulk_create([
+            CampaignRecipient(campaign=campaign, patient=p, phone=p.phone) for p in patients
+        ])
+
+        counts = send_campaign_batch(str(campaign.id))
+
+        assert counts['sent'] == 3
+        assert counts['remaining'] == 0
+        campaign.refresh_from_db()
+        assert campaign.status == 'finished'
+        assert (campaign.sent_count, campaign.failed_count) == (3, 0)
+        assert campaign.total_cost == Decimal('45.00')
+        assert CampaignRecipient.objects.filter(status='sent', sent_at__isnull=False).count() == 3
+        assert CampaignRecipient.objects.get(patient=patients[0]).status == 'opted_out'
+        assert Message.objects.filter(context__source='campaign').count() == 3
+
+    def test_paused_campaign(self, organization):
+        campaign = Campaign.objects.create(
+            organization=organization, title='Акция', sender_name='Clinic', status='paused'
+        )
+        patient = make_patients(organization, 1)[0]
+        CampaignRecipient.objects.create(campaign=campaign, patient=patient, phone=patient.phone)
+
+        assert send_campaign_batch(str(campaign.id)) is None
+        assert CampaignRecipient.objects.get().status == 'pending'
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+def test_dispatch_benchmark(organization, settings):
+    """Messages/second through a provider with 50 ms latency"""
+    settings.SMS_MOCK_LATENCY = 0.05
+    jobs = 400
+    queue_jobs(organization, make_patients(organization, jobs))
+
+    started = timer.monotonic()
+    sequential = dispatch.dispatch_reminders(limit=40, concurrency=1)
+    sequential_rate = sequential['sent'] / (timer.monotonic() - started)
+
+    started = timer.monotonic()
+    pooled = dispatch.drain_reminders(limit=200, concurrency=50)
+    pooled_rate = pooled['sent'] / (timer.monotonic() - started)
+
+    print(f'\nSequential: {sequential_rate:.0f} msg/s, pool of 50: {pooled_rate:.0f} msg/s')
+    assert sequential['sent'] + pooled['sent'] == jobs
+    assert pooled_rate > 5 * sequential_rate
@@ -0,0 +1,189 @@
+import hashlib
+import io
+import os
+import pytest
+from datetime import timedelta
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.calendar.models import Appointment
+from apps.core import uploads
+from apps.core.models import Blob, UploadSession
+from apps.patients.models import PatientFile
+from apps.visits.models import Visit, VisitFile
+from config.celery import app as celery_app
+
+
+URL = '/api/v1/patients/files/uploads/'
+
+
+@pytest.fixture(autouse=True)
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path / 'media'
+    settings.CHUNKED_UPLOAD_DIR = str(tmp_path / 'staging')
+    settings.CHUNKED_UPLOAD_CHUNK_SIZE = 1024
+    uploads._hashers.clear()
+
+
+def png(size=(800, 600)):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def put(client, upload_id, content, start, url=URL, **headers):
+    return client.put(
+        f'{url}{upload_id}/', content[start:start + 1024], content_type='application/octet-stream',
+        HTTP_CONTENT_RANGE=f'bytes {start}-{min(start + 1024, len(content)) - 1}/{len(content)}', **headers
+    )
+
+
+def upload(client, content, filename='scan.png', url=URL, **fields):
+    response = client.post(url, {'filename': filename, 'size': len(content)}, format='json')
+    assert response.status_code == 201
+    upload_id = response.data['id']
+    for start in range(0, len(content), 1024):
+        assert put(client, upload_id, content, start, url=url).status_code == 200
+    return client.post(f'{url}{upload_id}/complete/', fields, format='json')
+
+
+@pytest.mark.django_db
+class TestChunkedUpload:
+    """Test resumable chunked uploads of patient and visit files"""
+
+    def test_upload_and_deduplicate(self, authenticated_client, patient, django_capture_on_commit_callbacks):
+        content = png()
+        celery_app.conf.task_always_eager = True
+        try:
+            with django_capture_on_commit_callbacks(execute=True):
+                response = upload(authenticated_client, content, patient=patient.id, title='Снимок', file_type='xray')
+        finally:
+            celery_app.conf.task_always_eager = False
+
+        assert response.status_code == 201
+        assert response.data['deduplicated'] is False
+        blob = Blob.objects.get()
+        assert blob.sha256 == hashlib.sha256(content).hexdigest()
+        assert blob.size == len(content)
+        assert blob.content_type == 'image/png'
+        assert blob.file.read() == content
+        assert blob.thumbnail.name == f'blobs/thumbnails/{blob.sha256}.jpg'
+        patient_file = PatientFile.objects.get(id=response.data['id'])
+        assert patient_file.file.name == blob.file.name
+        assert patient_file.blob == blob
+        # The staging file was moved into the storage
+        assert os.listdir(uploads.settings.CHUNKED_UPLOAD_DIR) == []
+
+        response = upload(authenticated_client, content, filename='copy.png', patient=patient.id, title='Копия')
+        assert response.data['deduplicated'] is True
+        assert Blob.objects.count() == 1
+        assert PatientFile.objects.filter(blob=blob).count() == 2
+
+        response = authenticated_client.get(f'/api/v1/patients/files/{patient_file.id}/')
+        assert response.data['thumbnail'].endswith(f'{blob.sha256}.jpg')
+
+    def test_resume_and_retry(self, authenticated_client, patient):
+        content = os.urandom(3000)
+        upload_id = authenticated_client.post(URL, {'filename': 'scan.dcm', 'size': 3000}, format='json').data['id']
+
+        assert put(authenticated_client, upload_id, content, 0).status_code == 200
+        # Retry of a received chunk is accepted, a gap is refused
+        assert put(authenticated_client, upload_id, content, 0).data['received'] == 1024
+        assert put(authenticated_client, upload_id, content, 2048).status_code == 409
+        response = put(authenticated_client, upload_id, content, 1024, HTTP_X_CHUNK_SHA256='0' * 64)
+        assert response.status_code == 400
+
+        # Another worker process without the running hash
+        uploads._hashers.clear()
+        assert authenticated_client.get(f'{URL}{upload_id}/').data['received'] == 1024
+        response = authenticated_client.post(f'{URL}{upload_id}/complete/', {'patient': patient.id, 'title': 'КТ'}, format='json')
+        assert response.status_code == 409
+
+        put(authenticated_client, upload_id, content, 1024)
+        put(authenticated_client, upload_id, content, 2048)
+        response = authenticated_client.post(
+            f'{URL}{upload_id}/complete/',
+            {'patient': patient.id, 'title': 'КТ', 'sha256': hashlib.sha256(content).hexdigest()},
+            format='json'
+        )
+        assert response.status_code == 201
+        assert Blob.objects.get().file.read() == content
+
+        response = authenticated_client.post(f'{URL}{upload_id}/complete/', {'patient': patient.id, 'title': 'КТ'}, format='json')
+        assert response.status_code == 409
+
+    def test_retry_after_failed_link(self, authenticated_client, patient, monkeypatch):
+        from apps.patients.views import PatientFileViewSet
+
+        content = os.urandom(2000)
+        original = PatientFileViewSet.perform_upload_complete
+
+        def fail_once(self, serializer, blob):
+            monkeypatch.setattr(PatientFileViewSet, 'perform_upload_complete', original)
+            raise uploads.UploadError('Сбой при сохранении')
+
+        monkeypatch.setattr(PatientFileViewSet, 'perform_upload_complete', fail_once)
+        response = upload(authenticated_client, content, filename='scan.bin', patient=patient.id, title='КТ')
+        assert response.status_code == 400
+        session = UploadSession.objects.get()
+        assert session.status == 'uploading'
+        assert session.blob == Blob.objects.get()
+
+        response = authenticated_client.post(
+            f'{URL}{session.id}/complete/',
+            {'patient': patient.id, 'title': 'КТ', 'sha256': hashlib.sha256(content).hexdigest()},
+            format='json'
+        )
+        assert response.status_code == 201
+        assert PatientFile.objects.get().blob.file.read() == content
+        assert UploadSession.objects.get().status == 'complete'
+
+    def test_rejects_bad_requests(self, authenticated_client, doctor_user, settings):
+        assert authenticated_client.post(URL, {'filename': 'a.png', 'size': 'big'}, format='json').status_code == 400
+        settings.CHUNKED_UPLOAD_MAX_SIZE = 100
+        assert authenticated_client.post(URL, {'filename': 'a.png', 'size': 101}, format='json').status_code == 413
+
+        upload_id = authenticated_client.post(URL, {'filename': 'a.png', 'size': 10}, format='json').data['id']
+        response = authenticated_client.put(f'{URL}{upload_id}/', b'0123456789', content_type='application/octet-stream')
+        assert response.status_code == 400
+        # A declared range longer than the body
+        response = authenticated_client.put(
+            f'{URL}{upload_id}/', b'0123', content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-9/10'
+        )
+        assert response.status_code == 400
+        assert UploadSession.objects.get().received == 0
+
+        # Sessions belong to their user
+        other_client = APIClient()
+        other_client.force_authenticate(user=doctor_user)
+        assert other_client.get(f'/api/v1/visits/files/uploads/{upload_id}/').status_code == 404
+
+        assert authenticated_client.delete(f'{URL}{upload_id}/').status_code == 204
+        assert UploadSession.objects.get().status == 'aborted'
+        assert os.listdir(settings.CHUNKED_UPLOAD_DIR) == []
+
+    def test_visit_file(self, authenticated_client, branch, employee, patient):
+        appointment = Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=timezone.now(), end_datetime=timezone.now() + timedelta(minutes=30)
+        )
+        visit = Visit.objects.create(appointment=appointment)
+
+        response = upload(authenticated_client, b'%PDF-1.4 report', filename='report.pdf', url='/api/v1/visits/files/uploads/', visit=visit.id)
+
+        assert response.status_code == 201
+        visit_file = VisitFile.objects.get()
+        assert visit_file.blob.content_type == 'application/pdf'
+        assert visit_file.uploaded_by.role == 'owner'
+        assert response.data['thumbnail'] is None
+
+    def test_cleanup_expired(self, admin_user):
+        session = uploads.start(admin_user, 'scan.png', 100)
+        UploadSession.objects.filter(id=session.id).update(updated_at=timezone.now() - timedelta(days=2))
+        fresh = uploads.start(admin_user, 'other.png', 100)
+
+        assert uploads.cleanup_expired() == 1
+        assert not os.path.exists(uploads.staging_path(session))
+        assert os.path.exists(uploads.staging_path(fresh))
+        assert UploadSession.objects.get(id=session.id).status == 'aborted'
@@ -0,0 +1,155 @@
+import random
+import time as timer
+import pytest
+from datetime import date, datetime, time, timedelta
+from unittest.mock import patch
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.calendar.models import Appointment, Waitlist, WaitlistOffer
+from apps.calendar.services import waitlist
+from apps.org.models import Organization
+from apps.patients.models import Patient
+from apps.staff.models import Employee
+
+
+MONDAY = date(2030, 1, 7)
+URL = '/api/v1/calendar/appointments/'
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+def make_patients(organization, count):
+    patients = Patient.objects.bulk_create([
+        Patient(first_name=f'P{i}', last_name='Waiting', birth_date=date(1990, 1, 1), sex='F', phone=f'+7701{i:07d}')
+        for i in range(count)
+    ])
+    Patient.organizations.through.objects.bulk_create([
+        Patient.organizations.through(patient_id=p.id, organization_id=organization.id) for p in patients
+    ])
+    return patients
+
+
+@pytest.fixture
+def appointment(branch, employee, patient):
+    return Appointment.objects.create(
+        branch=branch, employee=employee, patient=patient,
+        start_datetime=aware(MONDAY, 10), end_datetime=aware(MONDAY, 11),
+        status='booked'
+    )
+
+
+@pytest.fixture
+def patients(organization):
+    return make_patients(organization, 6)
+
+
+@pytest.mark.django_db
+class TestWaitlistMatching:
+    """Test matching released slots to waitlist entries"""
+
+    def test_ranks_fitting_entries(self, organization, employee, appointment, patients):
+        other_doctor = Employee.objects.create(organization=organization, first_name='O', last_name='Ther', phone='+77010000001')
+        old = Waitlist.objects.create(patient=patients[0], employee=employee, preferred_date=MONDAY)
+        urgent = Waitlist.objects.create(patient=patients[1], priority=5, time_window='morning')
+        in_period = Waitlist.objects.create(
+            patient=patients[2], preferred_period_start=MONDAY - timedelta(days=3), preferred_period_end=MONDAY
+        )
+        # Not fitting: another doctor, another day, evening, already contacted
+        Waitlist.objects.create(patient=patients[3], employee=other_doctor)
+        Waitlist.objects.create(patient=patients[4], preferred_date=MONDAY + timedelta(days=1))
+        Waitlist.objects.create(patient=patients[5], time_window='evening')
+        Waitlist.objects.create(patient=patients[5], status='contacted')
+
+        offers = waitlist.match_slots([waitlist.released_slot(appointment)])
+
+        assert [(o.waitlist_id, o.rank) for o in offers] == [(urgent.id, 0), (old.id, 1), (in_period.id, 2)]
+        assert all(o.released_appointment_id == appointment.id for o in offers)
+
+    def test_other_organization_and_same_patient_excluded(self, employee, appointment, patient):
+        stranger = make_patients(Organization.objects.create(name='Other'), 1)[0]
+        Waitlist.objects.create(patient=stranger)
+        Waitlist.objects.create(patient=patient)
+
+        assert waitlist.match_slots([waitlist.released_slot(appointment)]) == []
+
+    def test_burst_spreads_offers(self, branch, employee, patient, appointment, patients):
+        second = Appointment.objects.create(
+            branch=branch, employee=employee, patient=patient,
+            start_datetime=aware(MONDAY, 11), end_datetime=aware(MONDAY, 12), status='booked'
+        )
+        entries = [Waitlist.objects.create(patient=p) for p in patients[:2]]
+
+        offers = waitlist.match_slots([waitlist.released_slot(a) for a in (appointment, second)], per_slot=1)
+
+        assert sorted(o.waitlist_id for o in offers) == sorted(e.id for e in entries)
+        # Rerun offers the slot to the next entry instead of repeating the offer
+        rerun = waitlist.match_slots([waitlist.released_slot(appointment)], per_slot=1)
+        assert [o.waitlist_id for o in rerun] == [entries[1].id]
+
+    def test_cancel_schedules_matching(self, authenticated_client, appointment, django_capture_on_commit_callbacks):
+        with patch('apps.calendar.tasks.match_released_slots.delay') as delay, \
+                django_capture_on_commit_callbacks(execute=True):
+            authenticated_client.post(f'{URL}{appointment.id}/change_status/', {'status': 'canceled'}, format='json')
+            authenticated_client.post(f'{URL}{appointment.id}/change_status/', {'status': 'no_show'}, format='json')
+
+        # Second change does not free anything new
+        [slots] = delay.call_args_list[0][0]
+        assert delay.call_count == 1
+        assert slots[0]['appointment_id'] == appointment.id
+
+    def test_delete_schedules_matching(self, authenticated_client, appointment, django_capture_on_commit_callbacks):
+        with patch('apps.calendar.tasks.match_released_slots.delay') as delay, \
+                django_capture_on_commit_callbacks(execute=True):
+            authenticated_client.delete(f'{URL}{appointment.id}/')
+
+        assert delay.call_args[0][0][0]['appointment_id'] == appointment.id
+
+    @pytest.mark.slow
+    def test_benchmark_50k_waitlist(self, organization, branch, patient):
+        """Benchmark: 200 cancellations against 50k waitlist rows"""
+        random.seed(7)
+        doctors = Employee.objects.bulk_create([
+            Employee(organization=organization, first_name=f'D{i}', last_name='Doctor', phone='+77010000000')
+            for i in range(40)
+        ])
+        waiting = make_patients(organization, 1000)
+        statuses = ['waiting'] * 7 + ['contacted', 'scheduled', 'cancelled']
+        Waitlist.objects.bulk_create([
+            Waitlist(
+                patient=random.choice(waiting),
+                employee=random.choice(doctors + [None] * 10),
+                preferred_date=MONDAY + timedelta(days=random.randrange(60)) if i % 3 else None,
+                time_window=random.choice(['morning', 'afternoon', 'evening', 'any']),
+                priority=random.choice([0, 0, 0, 1, 5]),
+                status=random.choice(statuses)
+            )
+            for i in range(50000)
+        ], batch_size=5000)
+        # Fresh statistics let the planner walk the ranked partial index
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        released = Appointment.objects.bulk_create([
+            Appointment(
+                branch=branch, employee=doctors[i % 40], patient=patient,
+                start_datetime=aware(MONDAY + timedelta(days=i % 20), 9 + i % 10),
+                end_datetime=aware(MONDAY + timedelta(days=i % 20), 10 + i % 10),
+                status='canceled'
+            )
+            for i in range(200)
+        ])
+        slots = [waitlist.released_slot(a) for a in Appointment.objects.filter(id__in=[a.id for a in released]).select_related('branch')]
+
+        with CaptureQueriesContext(connection) as ctx:
+            started = timer.perf_counter()
+            offers = waitlist.match_slots(slots)
+            elapsed = timer.perf_counter() - started
+
+        print(f'\n200 slots / 50k waitlist: {elapsed * 1000:.0f} ms, {len(ctx.captured_queries)} queries, {len(offers)} offers')
+        # One ranked query per slot plus one bulk insert
+        assert len(ctx.captured_queries) == len(slots) + 1
+        assert elapsed < 5
+        assert WaitlistOffer.objects.count() == len(offers) > 0
@@ -113,4 +113,5 @@ export const deleteTreatmentPlanTemplate = (id) => apiClient.delete(`/patients/t
 
 // AI Analysis
 export const getPatientAIAnalysis = (patientId) => apiClient.post(`/patients/patients/${patientId}/ai-analysis/`)
+export const getPatientAIAnalysisJob = (patientId, jobId) => apiClient.get(`/patients/patients/${patientId}/ai-analysis/${jobId}/`)
 